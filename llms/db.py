@@ -1,30 +1,45 @@
 import asyncio
 import contextlib
+import functools
+import html
 import json
 import os
 import re
 import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from queue import Empty, Queue
-from threading import Event, Thread
+from threading import Condition, Event, Thread, current_thread
 
 sqlite3.register_adapter(datetime, lambda val: val.isoformat(" "))
 sqlite3.register_converter("timestamp", lambda val: datetime.fromisoformat(val.decode()))
 
-POOL = os.getenv("LLMS_POOL", "0") == "1"
+# Reader connections are pooled by default, LLMS_POOL=0 opens a new connection per query
+POOL = os.getenv("LLMS_POOL", "1") == "1"
+POOL_MIN_SIZE = int(os.getenv("LLMS_POOL_MIN", "1"))  # idle connections kept open however long unused
+POOL_MAX_SIZE = int(os.getenv("LLMS_POOL_MAX", "8"))
+POOL_IDLE_SECONDS = float(os.getenv("LLMS_POOL_IDLE", "300"))
+STATEMENT_CACHE_SIZE = int(os.getenv("LLMS_STATEMENT_CACHE", "256"))  # prepared statements per connection
+# Threads the *_async reads run on, so a slow query never blocks the event loop
+READ_THREADS = int(os.getenv("LLMS_READ_THREADS", str(POOL_MAX_SIZE)))
+# Group commit budget for the writer thread: at most this many queued writes, or this long
+# spent executing them, share one transaction. LLMS_WRITE_BATCH=1 commits every write on its own.
+WRITE_BATCH_SIZE = int(os.getenv("LLMS_WRITE_BATCH", "256"))
+WRITE_BATCH_SECONDS = float(os.getenv("LLMS_WRITE_BATCH_MS", "50")) / 1000
 
 
 def create_reader_connection(db_path):
     # isolation_level=None leaves the connection in autocommit mode
     conn = sqlite3.connect(
-        db_path, timeout=1.0, check_same_thread=False, isolation_level=None
+        db_path, timeout=1.0, check_same_thread=False, isolation_level=None, cached_statements=STATEMENT_CACHE_SIZE
     )  # Lower - reads should be fast
     conn.execute("PRAGMA query_only=1")  # Read-only optimization
     return conn
 
 
 def create_writer_connection(db_path):
-    conn = sqlite3.connect(db_path)
+    conn = sqlite3.connect(db_path, cached_statements=STATEMENT_CACHE_SIZE)
     conn.execute("PRAGMA busy_timeout=5000")  # Reasonable timeout for busy connections
     # WAL is a persistent property of the database, so losing the race to another
     # connection setting it on a new file is not worth aborting startup for
@@ -35,38 +50,112 @@ def create_writer_connection(db_path):
     return conn
 
 
-def writer_thread(ctx, db_path, task_queue, stop_event):
+# open databases by path, for reporting their stats
+DB_MANAGERS = {}
+
+
+def db_stats():
+    return {os.path.basename(path): db.stats() for path, db in list(DB_MANAGERS.items())}
+
+
+def run_task(ctx, conn, task):
+    """
+    Run one queued write inside its own savepoint, so a failing statement only rolls
+    back itself and not the other writes sharing the batch's transaction.
+    """
+    sql, args, callback = task
+    conn.execute("SAVEPOINT task")
+    try:
+        if callable(sql):
+            result = (sql(conn), None)
+        else:
+            if ctx.debug:
+                ctx.dbg("SQL>" + ("\n" if "\n" in sql else " ") + sql + ("\n" if args else " ") + str(args))
+            cursor = conn.execute(sql, args or ())
+            result = (cursor.lastrowid, cursor.rowcount)
+        conn.execute("RELEASE task")
+        return result, None
+    except Exception as e:
+        conn.execute("ROLLBACK TO task")
+        conn.execute("RELEASE task")
+        ctx.err("writer_thread", e)
+        return (None, None), e
+
+
+def writer_thread(ctx, db_path, task_queue, stop_event, batch_size=None, batch_seconds=None):
+    """
+    Group commit: drain whatever writes are already queued (up to batch_size, or until
+    batch_seconds has been spent executing them) into a single transaction, then commit
+    once and only then run their callbacks. Concurrent streams each checkpointing a few
+    times a second share one fsync instead of paying for one each.
+    """
+    batch_size = max(1, batch_size or WRITE_BATCH_SIZE)
+    batch_seconds = WRITE_BATCH_SECONDS if batch_seconds is None else batch_seconds
     conn = create_writer_connection(db_path)
+    conn.isolation_level = None  # transactions are managed explicitly per batch
+    stopped = False
     try:
-        while not stop_event.is_set():
+        while not stopped:
             try:
                 # Use timeout to check stop_event periodically
                 task = task_queue.get(timeout=0.1)
-
-                if task is None:  # Poison pill for clean shutdown
+            except Empty:
+                if stop_event.is_set():
                     break
+                continue
 
-                sql, args, callback = task  # Optional callback for results
+            if task is None:  # Poison pill for clean shutdown
+                task_queue.task_done()
+                break
 
+            batch = [task]
+            results = []
+            started_at = time.perf_counter()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                results.append(run_task(ctx, conn, task))
+                while len(batch) < batch_size and time.perf_counter() - started_at < batch_seconds:
+                    try:
+                        task = task_queue.get_nowait()
+                    except Empty:
+                        break
+                    if task is None:
+                        task_queue.task_done()
+                        stopped = True
+                        break
+                    batch.append(task)
+                    results.append(run_task(ctx, conn, task))
+                conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                ctx.err("writer_thread", e)
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                results = [((None, None), e)] * len(batch)
+
+            if ctx.debug and len(batch) > 1:
+                ctx.dbg(f"committed {len(batch)} writes in {(time.perf_counter() - started_at) * 1000:.1f}ms")
+            for (_, _, callback), ((lastrowid, rowcount), error) in zip(batch, results):
                 try:
-                    ctx.dbg("SQL>" + ("\n" if "\n" in sql else " ") + sql + ("\n" if args else " ") + str(args))
-                    cursor = conn.execute(sql, args)
-                    conn.commit()
-                    ctx.dbg(f"lastrowid {cursor.lastrowid}, rowcount {cursor.rowcount}")
-                    if callback:
-                        callback(cursor.lastrowid, cursor.rowcount)
-                except sqlite3.Error as e:
-                    ctx.err("writer_thread", e)
                     if callback:
-                        callback(None, None, error=e)
+                        if error:
+                            callback(None, None, error=error)
+                        else:
+                            callback(lastrowid, rowcount)
+                except Exception as e:
+                    ctx.err("writer_thread callback", e)
                 finally:
                     task_queue.task_done()
-
-            except Empty:
-                continue
-
     finally:
         conn.close()
+        # fail anything queued after shutdown instead of leaving its caller waiting
+        while True:
+            try:
+                task = task_queue.get_nowait()
+            except Empty:
+                break
+            if task and task[2]:
+                task[2](None, None, error=sqlite3.ProgrammingError("database writer is closed"))
+            task_queue.task_done()
 
 
 def to_dto(ctx, row, json_columns):
@@ -125,6 +214,46 @@ def order_by(all_columns, sort):
     return f"ORDER BY {', '.join(cols)} " if len(cols) > 0 else ""
 
 
+def fts_query(text):
+    """
+    Search box input as an FTS5 MATCH expression: every word must match, the last one
+    as a prefix so results update while typing. Quoting each word keeps FTS5 syntax
+    characters in the input from being parsed. Returns None when there is nothing to search.
+    """
+    words = re.findall(r"\w+", text or "")
+    if not words:
+        return None
+    return " ".join(f'"{word}"' for word in words) + "*"
+
+
+# snippet() markers, swapped for <mark> once the rest of the snippet has been escaped
+SNIPPET_START, SNIPPET_END = "\x02", "\x03"
+SNIPPET_SQL = "snippet({table}, -1, char(2), char(3), '…', 16)"
+
+
+def fts_snippet(snippet):
+    """An FTS5 snippet as HTML safe to render, with its matched terms in <mark>."""
+    if not snippet:
+        return snippet
+    return html.escape(snippet).replace(SNIPPET_START, "<mark>").replace(SNIPPET_END, "</mark>")
+
+
+def create_fts_table(ctx, conn, table, columns):
+    """
+    Create an FTS5 table if it doesn't exist. Returns True when it was created (and needs
+    populating), False when it already existed and None when SQLite was built without
+    FTS5, in which case callers fall back to LIKE.
+    """
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone():
+        return False
+    try:
+        conn.execute(f"CREATE VIRTUAL TABLE {table} USING fts5({columns}, tokenize='unicode61 remove_diacritics 2')")
+        return True
+    except sqlite3.OperationalError as e:
+        ctx.err(f"Creating {table}, search falls back to LIKE", e)
+        return None
+
+
 def count_tokens_approx(messages: list[dict]) -> int:
     """
     Approximate token count for chat completion messages without external libraries.
@@ -211,23 +340,149 @@ def count_tokens_approx(messages: list[dict]) -> int:
     return total
 
 
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of reader connections. Connections are opened (and their
+    PRAGMAs run) once and reused, so repeated queries also hit each connection's
+    prepared statement cache. Idle connections above min_size are closed after
+    idle_seconds, and one that has sat idle for a while is checked before it's reused.
+    """
+
+    def __init__(
+        self,
+        factory,
+        min_size=POOL_MIN_SIZE,
+        max_size=POOL_MAX_SIZE,
+        idle_seconds=POOL_IDLE_SECONDS,
+        timeout=5.0,
+        health_check_seconds=30.0,
+    ):
+        self.factory = factory
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size, self.min_size)
+        self.idle_seconds = idle_seconds
+        self.timeout = timeout
+        self.health_check_seconds = health_check_seconds
+        self.idle = []  # (conn, released_at), most recently used last
+        self.size = 0
+        self.closed = False
+        self.lock = Condition()
+        self.counters = {"opened": 0, "closed": 0, "acquired": 0, "waits": 0, "timeouts": 0, "unhealthy": 0}
+        self.peak_in_use = 0
+
+    def healthy(self, conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        with self.lock:
+            while True:
+                if self.closed:
+                    raise sqlite3.ProgrammingError("connection pool is closed")
+                if self.idle:
+                    conn, released_at = self.idle.pop()
+                    if time.monotonic() - released_at > self.health_check_seconds and not self.healthy(conn):
+                        self.counters["unhealthy"] += 1
+                        self.discard(conn)
+                        continue
+                    break
+                if self.size < self.max_size:
+                    self.size += 1
+                    try:
+                        conn = self.factory()
+                    except Exception:
+                        self.size -= 1
+                        raise
+                    self.counters["opened"] += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.counters["timeouts"] += 1
+                    raise sqlite3.OperationalError(f"no reader connection available after {self.timeout}s")
+                self.counters["waits"] += 1
+                self.lock.wait(remaining)
+            self.counters["acquired"] += 1
+            self.peak_in_use = max(self.peak_in_use, self.size - len(self.idle))
+            return conn
+
+    def release(self, conn):
+        conn.row_factory = None
+        with self.lock:
+            if self.closed or (conn.in_transaction and not self.reset(conn)):
+                self.discard(conn)
+            else:
+                now = time.monotonic()
+                self.idle.append((conn, now))
+                self.prune(now)
+            self.lock.notify()
+
+    def reset(self, conn):
+        try:
+            conn.rollback()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def prune(self, now):
+        # oldest idle connections are at the front
+        while len(self.idle) > self.min_size and now - self.idle[0][1] > self.idle_seconds:
+            conn, _ = self.idle.pop(0)
+            self.discard(conn)
+
+    def discard(self, conn):
+        self.size -= 1
+        self.counters["closed"] += 1
+        with contextlib.suppress(sqlite3.Error):
+            conn.close()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": self.size,
+                "idle": len(self.idle),
+                "inUse": self.size - len(self.idle),
+                "peakInUse": self.peak_in_use,
+                "minSize": self.min_size,
+                "maxSize": self.max_size,
+                "idleSeconds": self.idle_seconds,
+                "cachedStatements": STATEMENT_CACHE_SIZE,
+                **self.counters,
+            }
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            while self.idle:
+                conn, _ = self.idle.pop()
+                self.discard(conn)
+            self.lock.notify_all()
+
+
 class DbManager:
     def __init__(self, ctx, db_path, clone=None):
         if db_path is None:
             raise ValueError("db_path is required")
         self.ctx = ctx
         self.db_path = db_path
-        self.read_only_pool = Queue()
         if not clone:
+            self.pool = ConnectionPool(self.create_reader_connection) if POOL else None
+            self.reader_executor = ThreadPoolExecutor(max_workers=READ_THREADS, thread_name_prefix="llms-db-read")
             self.task_queue = Queue()
             self.stop_event = Event()
             self.writer_thread = Thread(target=writer_thread, args=(ctx, db_path, self.task_queue, self.stop_event))
             self.writer_thread.start()
         else:
-            # share singleton writer thread in clones
+            # share singleton writer thread and reader pool in clones
+            self.pool = clone.pool
+            self.reader_executor = clone.reader_executor
             self.task_queue = clone.task_queue
             self.stop_event = clone.stop_event
             self.writer_thread = clone.writer_thread
+        DB_MANAGERS[db_path] = self
 
     def create_reader_connection(self):
         return create_reader_connection(self.db_path)
@@ -236,36 +491,69 @@ class DbManager:
         return create_writer_connection(self.db_path)
 
     def resolve_connection(self):
-        if POOL:
-            try:
-                return self.read_only_pool.get_nowait()
-            except Empty:
-                return self.create_reader_connection()
-        else:
-            return self.create_reader_connection()
+        if self.pool:
+            return self.pool.acquire()
+        return self.create_reader_connection()
 
     def release_connection(self, conn):
-        if POOL:
-            conn.rollback()
-            self.read_only_pool.put(conn)
+        if self.pool:
+            self.pool.release(conn)
         else:
             conn.close()
 
+    def stats(self):
+        return {
+            "path": self.db_path,
+            "pool": self.pool.stats() if self.pool else None,
+            "pendingWrites": self.task_queue.qsize(),
+        }
+
     def write(self, query, args=None, callback=None):
         """
         Execute a write operation asynchronously.
 
         Args:
-            query (str): The SQL query to execute.
+            query (str | callable): The SQL query to execute, or fn(conn) to run against the
+                writer connection inside the current batch's transaction (it must not commit).
             args (tuple, optional): Arguments for the query.
             callback (callable, optional): A function called after execution with signature:
                 callback(lastrowid, rowcount, error=None)
-                - lastrowid (int): output of cursor.lastrowid
+                - lastrowid (int): output of cursor.lastrowid, or the return value of fn(conn)
                 - rowcount (int): output of cursor.rowcount
                 - error (Exception): exception if operation failed, else None
         """
         self.task_queue.put((query, args, callback))
 
+    def run(self, fn):
+        """
+        Run fn(conn) on the writer thread and block until its batch commits, returning fn's result.
+        Only for callers off the event loop (startup, shutdown, maintenance and tests), code
+        running on the loop awaits run_async() instead so a batch can't stall every stream.
+        """
+        if current_thread() is self.writer_thread:
+            raise RuntimeError("DbManager.run() called from the writer thread")
+        if not self.writer_thread.is_alive():
+            raise sqlite3.ProgrammingError("database writer is closed")
+        done = Event()
+        outcome = {}
+
+        def cb(result, rowcount, error=None):
+            outcome["result"] = result
+            outcome["error"] = error
+            done.set()
+
+        self.write(fn, None, cb)
+        done.wait()
+        if outcome["error"]:
+            raise outcome["error"]
+        return outcome["result"]
+
+    async def run_async(self, fn):
+        """
+        Run fn(conn) on the writer thread and resolve with its result once its batch commits.
+        """
+        return await self._await_write(lambda cb: self.write(fn, None, cb), 0)
+
     def log_sql(self, sql, parameters=None):
         if self.ctx.debug:
             self.ctx.dbg(
@@ -276,6 +564,12 @@ class DbManager:
         self.log_sql(sql, parameters)
         return connection.execute(sql, parameters or ())
 
+    def exec_many(self, connection, sql, seq_of_parameters):
+        """Run `sql` once per parameter set in a single executemany() call."""
+        seq_of_parameters = list(seq_of_parameters)
+        self.log_sql(sql, f"[{len(seq_of_parameters)} rows]")
+        return connection.executemany(sql, seq_of_parameters)
+
     def all(self, sql, parameters=None, connection=None):
         """
         Execute a query and return all rows as a list of dictionaries.
@@ -358,6 +652,29 @@ class DbManager:
                 conn.row_factory = None
                 self.release_connection(conn)
 
+    async def read_async(self, fn, *args, **kwargs):
+        """
+        Run a blocking fn(*args, **kwargs) on the reader threads and await its result,
+        so the event loop keeps serving streams while SQLite does the work.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.reader_executor, functools.partial(fn, *args, **kwargs))
+
+    async def all_async(self, sql, parameters=None):
+        return await self.read_async(self.all, sql, parameters)
+
+    async def one_async(self, sql, parameters=None):
+        return await self.read_async(self.one, sql, parameters)
+
+    async def scalar_async(self, sql, parameters=None):
+        return await self.read_async(self.scalar, sql, parameters)
+
+    async def column_async(self, sql, parameters=None):
+        return await self.read_async(self.column, sql, parameters)
+
+    async def dict_async(self, sql, parameters=None):
+        return await self.read_async(self.dict, sql, parameters)
+
     # Helper to safely dump JSON if value exists
     def value(self, val):
         if val is None or val == "":
@@ -366,7 +683,7 @@ class DbManager:
             return json.dumps(val)
         return val
 
-    def insert(self, table, columns, info, callback=None):
+    def insert_sql(self, table, columns, info):
         if not info:
             raise Exception("info is required")
 
@@ -381,8 +698,11 @@ class DbManager:
         insert_values = ", ".join(["?" for _ in insert_keys])
 
         sql = f"INSERT INTO {table} ({insert_body}) VALUES ({insert_values})"
+        return sql, tuple(args[k] for k in insert_keys)
 
-        self.write(sql, tuple(args[k] for k in insert_keys), callback)
+    def insert(self, table, columns, info, callback=None):
+        sql, args = self.insert_sql(table, columns, info)
+        self.write(sql, args, callback)
 
     def _await_write(self, write, result_index):
         """
@@ -411,7 +731,7 @@ class DbManager:
     async def insert_async(self, table, columns, info):
         return await self._await_write(lambda cb: self.insert(table, columns, info, cb), 0)
 
-    def update(self, table, columns, info, callback=None):
+    def update_sql(self, table, columns, info):
         if not info:
             raise Exception("info is required")
 
@@ -426,7 +746,10 @@ class DbManager:
 
         args["id"] = info["id"]
         sql = f"UPDATE {table} SET {update_body} WHERE id = :id"
+        return sql, args
 
+    def update(self, table, columns, info, callback=None):
+        sql, args = self.update_sql(table, columns, info)
         self.write(sql, args, callback)
 
     async def update_async(self, table, columns, info):
@@ -434,13 +757,12 @@ class DbManager:
 
     def close(self):
         self.ctx.dbg("Closing database")
+        # reads still running may queue writes, so let them finish before stopping the writer
+        self.reader_executor.shutdown(wait=True, cancel_futures=True)
         self.stop_event.set()
         self.task_queue.put(None)  # Poison pill to signal shutdown
         self.writer_thread.join()
-
-        while not self.read_only_pool.empty():
-            try:
-                conn = self.read_only_pool.get_nowait()
-                conn.close()
-            except Empty:
-                break
+        if self.pool:
+            self.pool.close()
+        if DB_MANAGERS.get(self.db_path) is self:
+            del DB_MANAGERS[self.db_path]
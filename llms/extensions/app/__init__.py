@@ -1,21 +1,21 @@
 from typing import Dict
 import _collections_abc
 import asyncio
-import hashlib
 import io
 import json
 import mimetypes
 import os
 import time
 import uuid
+from collections import deque
 from contextlib import suppress
 from datetime import datetime
 from typing import Any
 
 from aiohttp import web
 
-from llms.db import count_tokens_approx
-from llms.main import AgentSliceYield, remove_avatar_files
+from llms.db import count_tokens_approx, db_stats
+from llms.main import AgentSliceYield, StreamCheckpointWriter, apply_stream_delta, remove_avatar_files
 
 from .db import AppDB
 
@@ -58,7 +58,6 @@ class AgentScheduler:
         if self.running:
             return
         self._stopping = False
-        self.db.requeue_interrupted_agent_runs()
         self._coordinator = asyncio.create_task(self._run(), name="agent-scheduler")
 
     def wake(self):
@@ -91,17 +90,17 @@ class AgentScheduler:
         try:
             await self.execute_slice(run)
         except asyncio.CancelledError:
-            current = self.db.get_agent_run(run_id, user="all")
+            current = await self.db.read_async(self.db.get_agent_run, run_id, user="all")
             if current and current.get("status") == "running":
-                self.db.update_agent_run(run_id, {
+                await self.db.update_agent_run_async(run_id, {
                     "status": "queued", "leaseOwner": None, "leaseExpiresAt": None,
                 })
             raise
         except Exception as ex:
-            current = self.db.get_agent_run(run_id, user="all")
+            current = await self.db.read_async(self.db.get_agent_run, run_id, user="all")
             if current and current.get("status") == "running":
                 error = self.format_error(ex)
-                self.db.update_agent_run(run_id, {
+                await self.db.update_agent_run_async(run_id, {
                     "status": "failed", "error": error, "completedAt": datetime.now(),
                     "leaseOwner": None, "leaseExpiresAt": None,
                 })
@@ -120,10 +119,11 @@ class AgentScheduler:
     async def _renew_lease(self, run_id):
         while True:
             await asyncio.sleep(max(10, self.lease_seconds / 3))
-            if not self.db.renew_agent_run_lease(run_id, self.owner, self.lease_seconds):
+            if not await self.db.renew_agent_run_lease_async(run_id, self.owner, self.lease_seconds):
                 return
 
     async def _run(self):
+        await self.db.requeue_interrupted_agent_runs_async()
         while not self._stopping:
             # Consume the wake that caused this pass before querying. A wake arriving
             # during or after the query remains set, so enqueue/query races are not lost.
@@ -136,7 +136,7 @@ class AgentScheduler:
 
             capacity = self.max_concurrency - len(self._active)
             if capacity > 0:
-                for run in self.db.claim_agent_runs(self.owner, capacity, self.lease_seconds):
+                for run in await self.db.claim_agent_runs_async(self.owner, capacity, self.lease_seconds):
                     run_id = int(run["id"])
                     self._active[run_id] = asyncio.create_task(
                         self._run_claimed(run), name=f"agent-run-{run_id}"
@@ -176,10 +176,207 @@ def resolve_events_config(config):
     return events
 
 
-def notify_thread_update(thread_id):
+def format_sse(name, data, event_id=None, retry_ms=None):
+    lines = []
+    if retry_ms:
+        lines.append(f"retry: {retry_ms}")
+    if event_id:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {name}")
+    payload = json.dumps(data, separators=(",", ":"))
+    lines.extend(f"data: {line}" for line in payload.splitlines() or [""])
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+
+class ThreadEventSubscriber:
+    def __init__(self, max_pending):
+        self.pending = deque()
+        self.max_pending = max_pending
+        self.overflowed = False
+        self.ready = asyncio.Event()
+
+    def push(self, name, payload):
+        if len(self.pending) >= self.max_pending:
+            # A client this far behind gets a fresh snapshot rather than a backlog.
+            self.pending.clear()
+            self.overflowed = True
+        else:
+            self.pending.append((name, payload))
+        self.ready.set()
+
+    def drain(self):
+        self.ready.clear()
+        events = list(self.pending)
+        self.pending.clear()
+        return events
+
+
+class ThreadEventChannel:
+    """
+    A thread's recent events, each serialized once as an SSE frame with an id. Every
+    subscriber is handed the same bytes, and the last `capacity` frames are retained so a
+    reconnecting client can resume from its `Last-Event-ID`.
+    """
+
+    def __init__(self, epoch, capacity=512, max_pending=1024):
+        self.epoch = epoch
+        self.events = deque(maxlen=capacity)  # (sequence, name, payload)
+        self.sequence = 0
+        self.max_pending = max_pending
+        self.subscribers = set()
+        self.idle_since = time.monotonic()
+        self.publishing = None  # task publishing events that wait on a snapshot, in order
+
+    @property
+    def last_event_id(self):
+        return f"{self.epoch}-{self.sequence}"
+
+    def publish(self, name, data):
+        self.sequence += 1
+        payload = format_sse(name, data, self.last_event_id)
+        self.events.append((self.sequence, name, payload))
+        for subscriber in self.subscribers:
+            subscriber.push(name, payload)
+        return payload
+
+    def subscribe(self):
+        subscriber = ThreadEventSubscriber(self.max_pending)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+        if not self.subscribers:
+            self.idle_since = time.monotonic()
+
+    def since(self, last_event_id):
+        """Frames published after `last_event_id`, or None if they're no longer all retained."""
+        epoch, _, sequence = str(last_event_id or "").rpartition("-")
+        if epoch != self.epoch or not sequence.isdigit():
+            return None
+        sequence = int(sequence)
+        if sequence > self.sequence:
+            return None
+        if sequence == self.sequence:
+            return []
+        if not self.events or self.events[0][0] > sequence + 1:
+            return None
+        return [(name, payload) for seq, name, payload in self.events if seq > sequence]
+
+
+class ThreadEvents:
+    """
+    In-process event bus for thread updates. Changes are published as typed delta events
+    to a thread's channel, which only exists while the thread is being watched (or was
+    recently), so threads nobody is watching pay nothing for them:
+
+    - `streaming-chunk`: text appended to the in-flight message, or its replacement
+    - `message-appended`: messages committed to the thread's history
+    - `status-changed`: thread fields the UI displays, e.g. `status` and `title`
+    - `completed`: the finished thread, rendered once for every subscriber
+    - `thread`: the whole thread window, when history was rewritten
+    """
+
+    STATUS_FIELDS = ("status", "title", "model", "provider", "startedAt", "completedAt", "error")
+
+    def __init__(self, idle_seconds=300):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.channels: Dict[str, ThreadEventChannel] = {}
+        self.idle_seconds = idle_seconds
+        self.snapshot = None  # async thread_id -> thread window dto, assigned by install()
+
+    def get(self, thread_id):
+        return self.channels.get(str(thread_id))
+
+    def channel(self, thread_id):
+        self.prune()
+        key = str(thread_id)
+        channel = self.channels.get(key)
+        if channel is None:
+            channel = self.channels[key] = ThreadEventChannel(self.epoch)
+        return channel
+
+    def prune(self):
+        expired = time.monotonic() - self.idle_seconds
+        for key, channel in list(self.channels.items()):
+            if not channel.subscribers and channel.idle_since < expired:
+                del self.channels[key]
+
+    def publish(self, thread_id, name, data):
+        channel = self.get(thread_id)
+        return channel.publish(name, data) if channel else None
+
+    def publish_changes(self, thread_id, changes, appended=None, rewritten=False):
+        """
+        Translate a write to a thread into the events its watchers need. Events carrying
+        the thread window read it off the event loop, so they're published from a task,
+        and any events that follow them queue behind it to keep the channel in order.
+        """
+        channel = self.get(thread_id)
+        if channel is None:
+            return
+        events = []  # (name, data), data None for the thread window snapshot
+        if rewritten:
+            events.append(("thread", None))
+        else:
+            if "streamingMessage" in changes:
+                message = changes["streamingMessage"]
+                events.append(("streaming-chunk", {
+                    "message": {**message, "streaming": True} if isinstance(message, dict) else None,
+                }))
+            if appended:
+                events.append(("message-appended", {"messages": appended}))
+            if changes.get("completedAt") or changes.get("error"):
+                events.append(("completed", None))
+            elif any(k in changes for k in self.STATUS_FIELDS):
+                status = {k: changes[k] for k in self.STATUS_FIELDS if k in changes}
+                for k, v in status.items():
+                    if isinstance(v, datetime):
+                        status[k] = v.isoformat(" ")
+                events.append(("status-changed", to_wire_dates(status)))
+
+        if channel.publishing is None and all(data is not None for _, data in events):
+            for name, data in events:
+                channel.publish(name, data)
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # written off the loop (startup, shutdown), there's no watcher to send it to
+            return
+        channel.publishing = asyncio.ensure_future(
+            self.publish_in_order(thread_id, channel, channel.publishing, events)
+        )
+
+    async def publish_in_order(self, thread_id, channel, previous, events):
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            for name, data in events:
+                if data is None:
+                    data = await self.snapshot(thread_id) if self.snapshot else None
+                    if not data:
+                        continue
+                channel.publish(name, data)
+        finally:
+            if channel.publishing is asyncio.current_task():
+                channel.publishing = None
+
+
+thread_events = ThreadEvents()
+
+
+def notify_thread_update(thread_id, changes=None, appended=None, rewritten=False):
+    """
+    Wake long-poll watchers of a thread and, when the write that changed it is given,
+    publish it as events to SSE watchers. `appended` are the messages it added to the
+    thread's history, `rewritten` whether it replaced that history instead.
+    """
     event = thread_update_events.get(str(thread_id))
     if event:
         event.set()
+    if changes is not None:
+        thread_events.publish_changes(thread_id, changes, appended=appended, rewritten=rewritten)
 
 
 # Timestamps are stored naive (that is what `datetime.now()` writes), which names a wall clock
@@ -233,26 +430,16 @@ def merge_streaming_message(messages, streaming):
     return messages if already_committed else messages + [{**streaming, "streaming": True}]
 
 
-def get_thread_signature(thread: Dict[str, Any]):
-    if not thread:
-        return ""
-    messages = thread.get("messages")
-    if isinstance(messages, str):
-        msg_str = messages
-    elif isinstance(messages, list):
-        msg_str = json.dumps(messages, separators=(',', ':'))
-    else:
-        msg_str = str(messages or "")
+def thread_etag(row: Dict[str, Any]):
+    """A thread's ETag, its version changes with every write to the thread, see AppDB.init_versions."""
+    return f'W/"{row["id"]}.{row.get("version") or 0}"'
 
-    msg_len = len(msg_str)
-    msg_tail = msg_str[-100:] if msg_len > 100 else msg_str
-    status = str(thread.get("status") or "")
-    completed = str(thread.get("completedAt") or "")
-    error = str(thread.get("error") or "")
 
-    raw = f"{msg_len}:{msg_tail}:{status}:{completed}:{error}"
-    h = hashlib.md5(raw.encode("utf-8")).hexdigest()[:12]
-    return f"{msg_len}:{h}"
+def not_modified(request, etag):
+    """A 304 when the client already has the representation tagged `etag`."""
+    if etag in [x.strip() for x in request.headers.get("If-None-Match", "").split(",")]:
+        return web.Response(status=304, headers={"ETag": etag})
+    return None
 
 
 def install(ctx):
@@ -263,7 +450,9 @@ def install(ctx):
         if g_db is None and AppDB:
             try:
                 db_path = os.path.join(ctx.get_user_path(), "app", "app.sqlite")
-                g_db = AppDB(ctx, db_path)
+                g_db = AppDB(
+                    ctx, db_path, normalized_messages=(ctx.config.get("defaults") or {}).get("normalizedMessages", False)
+                )
                 ctx.register_shutdown_handler(g_db.close)
 
             except Exception as e:
@@ -300,9 +489,21 @@ def install(ctx):
         "parentId",
         "publishedAt",
         "publishedUrl",
+        "version",
     ]
 
-    def thread_dto(row):
+    def streaming_message(thread_id, streaming):
+        """The stored in-flight message plus the chunks appended since it was written whole."""
+        if not isinstance(streaming, dict) or not streaming.get("streamId"):
+            return streaming
+        for chunk in g_db.get_stream_chunks(thread_id, streaming["streamId"], streaming.get("streamOffset") or 0):
+            if chunk["offset"] != streaming.get("streamOffset"):
+                break
+            streaming = apply_stream_delta(streaming, chunk["delta"])
+            streaming["streamOffset"] = chunk["offset"] + StreamCheckpointWriter.payload_len(chunk["delta"])
+        return streaming
+
+    def thread_dto(row, materialize=True, runs=None):
         if not row:
             return None
         dto = g_db.to_dto(
@@ -322,17 +523,23 @@ def install(ctx):
         )
         if dto:
             to_wire_dates(dto)
+            # A normalized thread's conversation only lives in its chat_message rows, read
+            # them when the row was selected for its messages. context_for_run reads them itself.
+            if materialize and "messages" in dto and dto["messages"] is None and dto.get("normalized"):
+                dto["messages"] = g_db.get_thread_messages(dto["id"])
             # The in-flight message is stored separately so a failed stream can't damage
             # `messages`, but clients read one list, so present it merged on the way out.
             # `streamingMessage` is popped either way: a projected query (the sidebar) selects it
             # without selecting `messages`, and it must not reach the client as its own field.
             streaming = dto.pop("streamingMessage", None)
             if isinstance(dto.get("messages"), list):
-                dto["messages"] = merge_streaming_message(dto["messages"], streaming)
-            dto["sig"] = get_thread_signature(dto)
+                dto["messages"] = merge_streaming_message(dto["messages"], streaming_message(dto.get("id"), streaming))
+            # what /updates compares against the thread's current version
+            dto["sig"] = str(dto.get("version") or 0)
             # Ownership was enforced by the thread query; include its active run even
-            # when a projected thread query omitted the user column.
-            run = g_db.get_active_agent_run(dto["id"], user="all")
+            # when a projected thread query omitted the user column. Listings pass the
+            # active runs of the whole page in `runs`.
+            run = runs.get(dto["id"]) if runs is not None else g_db.get_active_agent_run(dto["id"], user="all")
             if run:
                 dto["run"] = to_wire_dates(run)
         return dto
@@ -426,68 +633,88 @@ def install(ctx):
         if "fields" not in query:
             query["fields"] = thread_fields
         user = get_target_user(request)
-        rows = g_db.query_threads(query, user=user)
+        try:
+            rows = await g_db.query_threads_async(query, user=user)
+        except ValueError as e:
+            return web.json_response(ctx.create_error_response(str(e), "ArgumentException"), status=400)
         if len(rows) == 0 and ctx.is_admin(request) and "id" in query and "user" not in query:
-            rows = g_db.query_threads(query, user="all")
-        dtos = []
-        for row in rows:
-            dto = thread_dto(row)
-            if dto:
-                bounds = g_db.get_chat_message_bounds(dto["id"])
-                latest = g_db.get_chat_message_page(
-                    dto["id"], before=(bounds.get("lastSequence") or 0) + 1, take=1
-                ) if bounds.get("messageCount") else []
-                dto["messageCount"] = bounds.get("messageCount") or 0
-                # Sidebar/recents only need a preview; retain the legacy property
-                # shape without returning the complete history for every thread.
-                dto["messages"] = latest
-            dtos.append(dto)
-        return web.json_response(dtos)
+            rows = await g_db.query_threads_async(query, user="all")
+
+        def sidebar_dtos():
+            # A few set-based queries for the whole page rather than several per thread
+            ids = [row["id"] for row in rows if isinstance(row, dict) and row.get("id") is not None]
+            runs = g_db.get_active_agent_runs(ids)
+            previews = g_db.get_thread_previews(ids)
+            dtos = []
+            for row in rows:
+                dto = thread_dto(row, runs=runs)
+                if dto:
+                    preview = previews.get(dto["id"]) or {}
+                    dto["messageCount"] = preview.get("messageCount") or 0
+                    # Sidebar/recents only need a preview; retain the legacy property
+                    # shape without returning the complete history for every thread.
+                    dto["messages"] = preview.get("messages") or []
+                dtos.append(dto)
+            return dtos
+
+        return web.json_response(await g_db.read_async(sidebar_dtos))
 
     ctx.add_get("threads", query_threads)
 
     async def create_thread(request):
         thread = await request.json()
         id = await g_db.create_thread_async(thread, user=ctx.get_username(request))
-        row = g_db.get_thread(id, user=ctx.get_username(request))
-        return web.json_response(thread_window_dto(row) if row else "")
+        row = await g_db.get_thread_async(id, user=ctx.get_username(request))
+        return web.json_response(await g_db.read_async(thread_window_dto, row) if row else "")
 
     ctx.add_post("threads", create_thread)
 
     async def get_thread(request):
         id = request.match_info["id"]
-        row = g_db.get_thread(id, user=ctx.get_username(request))
+        row = await g_db.get_thread_async(id, user=ctx.get_username(request))
         if not row and ctx.is_admin(request):
-            row = g_db.get_thread(id, user="all")
-        dto = (thread_dto(row) if request.query.get("allMessages") == "true"
-               else thread_window_dto(row)) if row else None
+            row = await g_db.get_thread_async(id, user="all")
+        if not row:
+            return web.json_response("")
+        etag = thread_etag(row)
+        unchanged = not_modified(request, etag)
+        if unchanged:
+            return unchanged
+        dto = (await g_db.read_async(thread_dto, row) if request.query.get("allMessages") == "true"
+               else await g_db.read_async(thread_window_dto, row))
         if dto and dto.get("run") and dto["run"].get("status") in ("queued", "running"):
             scheduler.wake()
-        return web.json_response(dto or "")
+        return web.json_response(dto or "", headers={"ETag": etag})
 
     ctx.add_get("threads/{id}", get_thread)
 
     async def get_thread_messages(request):
         id = request.match_info["id"]
         user = ctx.get_username(request)
-        row = g_db.get_thread(id, user=user)
+        row = await g_db.get_thread_async(id, user=user)
         if not row and ctx.is_admin(request):
-            row = g_db.get_thread(id, user="all")
+            row = await g_db.get_thread_async(id, user="all")
         if not row:
             raise web.HTTPNotFound(text="Thread not found")
+        etag = thread_etag(row)
+        unchanged = not_modified(request, etag)
+        if unchanged:
+            return unchanged
         take = min(200, max(1, int(request.query.get("take", "100"))))
         max_bytes = min(2 * 1024 * 1024, max(64 * 1024, int(request.query.get("maxBytes", str(512 * 1024)))))
         before = request.query.get("before")
         after = request.query.get("after")
-        rows = g_db.get_chat_message_page(
-            id,
-            before=int(before) if before is not None else None,
-            after=int(after) if after is not None else 0,
-            take=take,
-        )
-        return web.json_response(message_page_dto(
-            id, rows, max_bytes=max_bytes, from_end=before is not None
-        ))
+
+        def message_page():
+            rows = g_db.get_chat_message_page(
+                id,
+                before=int(before) if before is not None else None,
+                after=int(after) if after is not None else 0,
+                take=take,
+            )
+            return message_page_dto(id, rows, max_bytes=max_bytes, from_end=before is not None)
+
+        return web.json_response(await g_db.read_async(message_page), headers={"ETag": etag})
 
     ctx.add_get("threads/{id}/messages", get_thread_messages)
 
@@ -495,16 +722,16 @@ def install(ctx):
         thread = await request.json()
         id = request.match_info["id"]
         user = ctx.get_username(request)
-        row = g_db.get_thread(id, user=user)
+        row = await g_db.get_thread_async(id, user=user)
         if not row and ctx.is_admin(request):
-            row = g_db.get_thread(id, user="all")
+            row = await g_db.get_thread_async(id, user="all")
             if row:
                 user = row.get("user") or "all"
         update_count = await g_db.update_thread_async(id, thread, user=user)
         if update_count == 0:
             raise Exception("Thread not found")
-        row = g_db.get_thread(id, user=user)
-        return web.json_response(thread_window_dto(row) if row else "")
+        row = await g_db.get_thread_async(id, user=user)
+        return web.json_response(await g_db.read_async(thread_window_dto, row) if row else "")
 
     ctx.add_patch("threads/{id}", update_thread)
 
@@ -589,7 +816,7 @@ def install(ctx):
             user_message["content"] = content.replace("{messages_json}", json.dumps(batch), 1)
             response = await ctx.chat_completion(compact_chat, context={
                 "chat": compact_chat, "tools": "none", "user": user,
-                "nohistory": True, "nostore": True,
+                "nohistory": True, "nostore": True, "priority": "background",
             })
             last_response = response
             answer = response.get("choices", [{}])[0].get("message", {}).get("content", "")
@@ -638,7 +865,6 @@ def install(ctx):
 
     async def context_for_run(thread, run_id, user):
         """Return a bounded provider context while retaining full canonical history."""
-        messages = thread.get("messages") or []
         metadata = thread.get("metadata") or {}
         model_info = thread.get("modelInfo") or {}
         context_limit = ((model_info.get("limit") or {}).get("context")
@@ -649,11 +875,17 @@ def install(ctx):
         )
         chunk_tokens = max(8000, int(metadata.get("compactChunkTokens", 60000)))
         recent_count = max(4, int(metadata.get("compactRecentMessages", 12)))
-        snapshot = g_db.get_latest_context_snapshot(thread["id"])
-        tail_rows = None
+        snapshot = await g_db.read_async(g_db.get_latest_context_snapshot, thread["id"])
+        tail_rows = rows = None
+        messages = thread.get("messages")
+        if messages is None and not snapshot:
+            # a normalized thread's conversation is its chat_message rows
+            rows = await g_db.read_async(g_db.get_chat_messages, thread["id"])
+            messages = [x["message"] for x in rows]
+        messages = messages or []
         working_messages = messages
         if snapshot:
-            tail_rows = g_db.get_chat_messages(thread["id"], after=snapshot["toSequence"])
+            tail_rows = await g_db.read_async(g_db.get_chat_messages, thread["id"], after=snapshot["toSequence"])
             snapshot_summary = snapshot.get("summary") or []
             if len(snapshot_summary) > 1:
                 snapshot_summary = [{
@@ -666,13 +898,14 @@ def install(ctx):
                 snapshot_summary[0] = {**snapshot_summary[0], "role": "system"}
             working_messages = snapshot_summary + [x["message"] for x in tail_rows]
         working_tokens = count_tokens_approx(working_messages)
-        g_db.update_agent_run(run_id, {
+        await g_db.update_agent_run_async(run_id, {
             "contextTokens": working_tokens, "contextLimit": context_limit,
         })
         if working_tokens < threshold:
             return working_messages
 
-        rows = g_db.get_chat_messages(thread["id"])
+        if rows is None:
+            rows = await g_db.read_async(g_db.get_chat_messages, thread["id"])
         if not rows and not snapshot:
             # Imported/legacy threads may not have normalized message rows yet.
             # Bound their context instead of returning an oversized provider request.
@@ -701,11 +934,11 @@ def install(ctx):
         )
         summary_count = max(0, len(projected) - retained_count)
         summary, recent = projected[:summary_count], projected[summary_count:]
-        g_db.create_context_snapshot(
+        await g_db.create_context_snapshot_async(
             thread["id"], run_id, snapshot_from, snapshot_to, summary,
             model=((ctx.config.get("defaults") or {}).get("compact") or {}).get("model"),
         )
-        g_db.update_agent_run(run_id, {"contextTokens": count_tokens_approx(projected)})
+        await g_db.update_agent_run_async(run_id, {"contextTokens": count_tokens_approx(projected)})
         await g_db.update_thread_async(
             thread["id"], {"status": f"Continuing · {count_tokens_approx(projected):,} context tokens"}, user=user
         )
@@ -720,7 +953,7 @@ def install(ctx):
         max_steps = run.get("maxSteps") or 250
         if step_count >= max_steps:
             error = f"Agent run reached its maximum step budget ({max_steps})"
-            g_db.update_agent_run(run_id, {
+            await g_db.update_agent_run_async(run_id, {
                 "status": "failed", "error": error, "completedAt": datetime.now(),
                 "leaseOwner": None, "leaseExpiresAt": None,
             })
@@ -730,17 +963,17 @@ def install(ctx):
             notify_thread_update(thread_id)
             return
 
-        row = g_db.get_thread(thread_id, user=user)
+        row = await g_db.get_thread_async(thread_id, user=user)
         if row and row.get("completedAt"):
             terminal_status = "failed" if row.get("error") else "completed"
-            g_db.update_agent_run(run_id, {
+            await g_db.update_agent_run_async(run_id, {
                 "status": terminal_status, "error": row.get("error"),
                 "completedAt": row.get("completedAt"), "leaseOwner": None, "leaseExpiresAt": None,
             })
             return
-        thread = thread_dto(row)
+        thread = await g_db.read_async(thread_dto, row, materialize=False)
         if not thread:
-            g_db.update_agent_run(run_id, {
+            await g_db.update_agent_run_async(run_id, {
                 "status": "failed", "error": "Thread not found", "completedAt": datetime.now(),
                 "leaseOwner": None, "leaseExpiresAt": None,
             })
@@ -756,11 +989,11 @@ def install(ctx):
             if k in ctx.request_args:
                 chat[k] = v
         sequence = step_count + 1
-        step_id = g_db.create_agent_step(
+        step_id = await g_db.create_agent_step_async(
             run_id, sequence, "model", idempotencyKey=f"run:{run_id}:step:{sequence}",
             input={"messageCount": len(chat["messages"])}
         )
-        g_db.update_agent_run(run_id, {
+        await g_db.update_agent_run_async(run_id, {
             "nextAction": "model", "stepCount": sequence,
             "sliceCount": (run.get("sliceCount") or 0) + 1,
         })
@@ -771,21 +1004,21 @@ def install(ctx):
         }
         try:
             response = await ctx.chat_completion(chat, context=context)
-            g_db.update_agent_step(step_id, {
+            await g_db.update_agent_step_async(step_id, {
                 "status": "completed", "output": {"responseId": response and response.get("id")},
                 "completedAt": datetime.now(),
             })
-            g_db.update_agent_run(run_id, {
+            await g_db.update_agent_run_async(run_id, {
                 "status": "completed", "nextAction": None, "completedAt": datetime.now(),
                 "leaseOwner": None, "leaseExpiresAt": None,
             })
             notify_thread_update(thread_id)
         except AgentSliceYield as yielded:
-            g_db.update_agent_step(step_id, {
+            await g_db.update_agent_step_async(step_id, {
                 "status": "completed", "output": {"yielded": True, "iterations": yielded.iterations},
                 "completedAt": datetime.now(),
             })
-            g_db.update_agent_run(run_id, {
+            await g_db.update_agent_run_async(run_id, {
                 "status": "queued", "nextAction": "model", "leaseOwner": None, "leaseExpiresAt": None,
             })
             await g_db.update_thread_async(
@@ -796,10 +1029,10 @@ def install(ctx):
             raise
         except Exception as ex:
             error = ctx.error_message(ex)
-            g_db.update_agent_step(step_id, {
+            await g_db.update_agent_step_async(step_id, {
                 "status": "failed", "error": error, "completedAt": datetime.now()
             })
-            g_db.update_agent_run(run_id, {
+            await g_db.update_agent_run_async(run_id, {
                 "status": "failed", "error": error, "completedAt": datetime.now(),
                 "leaseOwner": None, "leaseExpiresAt": None,
             })
@@ -830,12 +1063,12 @@ def install(ctx):
     async def delete_thread(request):
         id = request.match_info["id"]
         user = ctx.get_username(request)
-        row = g_db.get_thread(id, user=user)
+        row = await g_db.get_thread_async(id, user=user)
         if not row and ctx.is_admin(request):
-            row = g_db.get_thread(id, user="all")
+            row = await g_db.get_thread_async(id, user="all")
             if row:
                 user = row.get("user") or "all"
-        g_db.delete_thread(id, user=user)
+        await g_db.delete_thread_async(id, user=user)
         return web.json_response({})
 
     ctx.add_delete("threads/{id}", delete_thread)
@@ -857,15 +1090,15 @@ def install(ctx):
 
         id = request.match_info["id"]
         user = ctx.get_username(request)
-        row = g_db.get_thread(id, user=user)
+        row = await g_db.get_thread_async(id, user=user)
         if not row and ctx.is_admin(request):
-            row = g_db.get_thread(id, user="all")
+            row = await g_db.get_thread_async(id, user="all")
             if row:
                 user = row.get("user") or "all"
-        thread = thread_dto(row)
+        thread = await g_db.read_async(thread_dto, row)
         if not thread:
             raise Exception("Thread not found")
-        active_run = g_db.get_active_agent_run(id, user=user)
+        active_run = await g_db.read_async(g_db.get_active_agent_run, id, user=user)
         if active_run:
             raise web.HTTPConflict(text="An agent run is already active for this thread")
 
@@ -916,7 +1149,7 @@ def install(ctx):
             update_thread,
             user=user,
         )
-        thread = thread_dto(g_db.get_thread(id, user=user))
+        thread = await g_db.read_async(lambda: thread_dto(g_db.get_thread(id, user=user)))
         if not thread:
             raise Exception("Thread not found")
 
@@ -943,13 +1176,13 @@ def install(ctx):
             "tools": metadata.get("tools", "all"),  # only tools: all|none|<tool1>,<tool2>,...
         }
 
-        run_id = g_db.create_agent_run(
+        run_id = await g_db.create_agent_run_async(
             id, user, thread.get("model"), max_steps=int(metadata.get("maxSteps", 250))
         )
         scheduler.wake()
-        thread["run"] = g_db.get_agent_run(run_id, user=user)
+        thread["run"] = await g_db.read_async(g_db.get_agent_run, run_id, user=user)
 
-        return web.json_response(thread_window_dto(g_db.get_thread(id, user=user)))
+        return web.json_response(await g_db.read_async(lambda: thread_window_dto(g_db.get_thread(id, user=user))))
 
     ctx.add_post("threads/{id}/chat", queue_chat_handler)
 
@@ -958,18 +1191,15 @@ def install(ctx):
         user = ctx.get_username(request)
         client_sig = request.query.get("sig", "")
 
-        thread = g_db.get_thread(id, user=user)
+        thread = await g_db.get_thread_async(id, user=user)
         if not thread:
             raise Exception("Thread not found")
 
-        dto = thread_window_dto(thread)
-        if not dto:
-            raise Exception("Thread not found")
-
-        if dto.get("completedAt") or dto.get("error"):
-            return web.json_response(dto)
-
-        if client_sig and dto.get("sig") != client_sig:
+        # Waking only reads the thread's version, the window is built once it has moved on
+        if thread.get("completedAt") or thread.get("error") or (client_sig and str(thread.get("version") or 0) != client_sig):
+            dto = await g_db.read_async(thread_window_dto, thread)
+            if not dto:
+                raise Exception("Thread not found")
             return web.json_response(dto)
 
         event = thread_update_events.setdefault(str(id), asyncio.Event())
@@ -985,18 +1215,14 @@ def install(ctx):
             finally:
                 event.clear()
 
-            updated_thread = g_db.get_thread(id, user=user)
-            if not updated_thread:
-                break
-
-            updated_dto = thread_window_dto(updated_thread)
-            if not updated_dto:
-                break
-
-            if updated_dto.get("completedAt") or updated_dto.get("error") or updated_dto.get("sig") != client_sig:
-                dto = updated_dto
+            if str(await g_db.get_thread_version_async(id, user=user)) != client_sig:
                 break
 
+        # completion bumps the version too, so this is the latest state either way
+        thread = await g_db.get_thread_async(id, user=user)
+        dto = await g_db.read_async(thread_window_dto, thread) if thread else None
+        if not dto:
+            raise Exception("Thread not found")
         return web.json_response(dto)
 
     ctx.add_get("threads/{id}/updates", get_thread_updates)
@@ -1007,97 +1233,107 @@ def install(ctx):
 
         id = request.match_info["id"]
         user = ctx.get_username(request)
-        client_sig = request.query.get("sig", "")
-        thread = g_db.get_thread(id, user=user)
-        dto = thread_window_dto(thread) if thread else None
-        if not dto:
+        thread = await g_db.get_thread_async(id, user=user)
+        if not thread:
             raise web.HTTPNotFound(text="Thread not found")
 
-        response = web.StreamResponse(
-            headers={
-                "Content-Type": "text/event-stream",
-                "Cache-Control": "no-cache, no-transform",
-                "Connection": "keep-alive",
-                "X-Accel-Buffering": "no",
-            }
-        )
-        await response.prepare(request)
-
-        async def send_event(name, data, event_id=None, retry_ms=None):
-            lines = []
-            if retry_ms:
-                lines.append(f"retry: {retry_ms}")
-            if event_id:
-                lines.append(f"id: {event_id}")
-            lines.append(f"event: {name}")
-            payload = json.dumps(data, separators=(",", ":"))
-            lines.extend(f"data: {line}" for line in payload.splitlines() or [""])
-            await response.write(("\n".join(lines) + "\n\n").encode("utf-8"))
-
+        # Subscribe before rendering so nothing published meanwhile is missed. Clients
+        # drop what the snapshot already contains (by sequence and stream offset).
+        channel = thread_events.channel(id)
+        subscriber = channel.subscribe()
         try:
-            await send_event(
-                "connected", dto, dto.get("sig"),
-                events_config["sseRetryDelaySeconds"] * 1000,
+            last_event_id = request.headers.get("Last-Event-ID") or request.query.get("lastEventId")
+            missed = channel.since(last_event_id) if last_event_id else None
+            if missed is None and request.query.get("sig") == str(thread.get("version") or 0) and not (
+                thread.get("completedAt") or thread.get("error")
+            ):
+                # the client already has this version of the thread, only what follows is new
+                missed = []
+            dto = None
+            if missed is None:
+                dto = await g_db.read_async(thread_window_dto, thread)
+                if not dto:
+                    raise web.HTTPNotFound(text="Thread not found")
+
+            response = web.StreamResponse(
+                headers={
+                    "Content-Type": "text/event-stream",
+                    "Cache-Control": "no-cache, no-transform",
+                    "Connection": "keep-alive",
+                    "X-Accel-Buffering": "no",
+                }
             )
-            if dto.get("completedAt") or dto.get("error"):
-                return response
-
-            event = thread_update_events.setdefault(str(id), asyncio.Event())
-            heartbeat = float(events_config["sseHeartbeatSeconds"])
-            current_sig = dto.get("sig") or client_sig
-
-            while True:
-                try:
-                    await asyncio.wait_for(event.wait(), timeout=heartbeat)
-                    event.clear()
-                except asyncio.TimeoutError:
-                    await send_event("heartbeat", {"sig": current_sig})
-                    continue
-
-                updated = g_db.get_thread(id, user=user)
-                updated_dto = thread_window_dto(updated) if updated else None
-                if not updated_dto:
-                    break
-                updated_sig = updated_dto.get("sig") or ""
-                if updated_sig != current_sig:
-                    current_sig = updated_sig
-                    await send_event("thread", updated_dto, current_sig)
-                if updated_dto.get("completedAt") or updated_dto.get("error"):
-                    break
-        except (ConnectionResetError, BrokenPipeError):
-            pass
-        except asyncio.CancelledError:
-            raise
+            await response.prepare(request)
+
+            try:
+                retry_ms = events_config["sseRetryDelaySeconds"] * 1000
+                if dto is not None:
+                    await response.write(format_sse("connected", dto, channel.last_event_id, retry_ms))
+                    if dto.get("completedAt") or dto.get("error"):
+                        return response
+                else:
+                    await response.write(format_sse("resumed", {}, channel.last_event_id, retry_ms))
+                    subscriber.pending.extendleft(reversed(missed))
+                    subscriber.ready.set()
+
+                heartbeat = float(events_config["sseHeartbeatSeconds"])
+                while True:
+                    try:
+                        await asyncio.wait_for(subscriber.ready.wait(), timeout=heartbeat)
+                    except asyncio.TimeoutError:
+                        await response.write(format_sse("heartbeat", {}))
+                        continue
+
+                    completed = False
+                    for name, payload in subscriber.drain():
+                        await response.write(payload)
+                        completed = completed or name == "completed"
+                    if subscriber.overflowed:
+                        subscriber.overflowed = False
+                        row = await g_db.get_thread_async(id, user=user)
+                        # unchanged since the last snapshot sent, nothing was actually lost
+                        if not row or str(row.get("version") or 0) != (dto or {}).get("sig"):
+                            dto = await g_db.read_async(thread_window_dto, row)
+                            if not dto:
+                                break
+                            await response.write(format_sse("thread", dto, channel.last_event_id))
+                            completed = bool(dto.get("completedAt") or dto.get("error"))
+                    if completed:
+                        break
+            except (ConnectionResetError, BrokenPipeError):
+                pass
+            finally:
+                with suppress(ConnectionResetError, RuntimeError):
+                    await response.write_eof()
+            return response
         finally:
-            with suppress(ConnectionResetError, RuntimeError):
-                await response.write_eof()
-        return response
+            channel.unsubscribe(subscriber)
 
     ctx.add_get("threads/{id}/updates/stream", stream_thread_updates)
 
     async def cancel_thread(request):
         id = request.match_info["id"]
         user = ctx.get_username(request)
-        run = g_db.get_active_agent_run(id, user=user)
+        run = await g_db.read_async(g_db.get_active_agent_run, id, user=user)
         if run:
-            g_db.update_agent_run(run["id"], {"status": "cancelled", "completedAt": datetime.now()})
+            await g_db.update_agent_run_async(run["id"], {"status": "cancelled", "completedAt": datetime.now()})
             scheduler.cancel(run["id"])
         await g_db.update_thread_async(
             id, {"completedAt": datetime.now(), "error": "Request was canceled"}, user=user
         )
-        thread = g_db.get_thread(id, user=user)
+        thread = await g_db.get_thread_async(id, user=user)
         ctx.dbg(f"cancel_thread: {id} / {thread.get('error')} / {thread.get('completedAt')}")
-        return web.json_response(thread_window_dto(thread))
+        return web.json_response(await g_db.read_async(thread_window_dto, thread))
 
     ctx.add_post("threads/{id}/cancel", cancel_thread)
 
     async def get_run(request):
         run_id = request.match_info["id"]
-        run = g_db.get_agent_run(run_id, user=ctx.get_username(request))
+        run = await g_db.read_async(g_db.get_agent_run, run_id, user=ctx.get_username(request))
         if not run:
             raise web.HTTPNotFound(text="Run not found")
         run["steps"] = [to_wire_dates(step)
-                        for step in g_db.get_agent_steps(run_id, after=int(request.query.get("after", 0)))]
+                        for step in await g_db.read_async(g_db.get_agent_steps, run_id, after=int(request.query.get("after", 0)))]
         return web.json_response(to_wire_dates(run))
 
     ctx.add_get("runs/{id}", get_run)
@@ -1109,7 +1345,7 @@ def install(ctx):
         return ctx.get_username(request)
 
     async def query_requests(request):
-        rows = g_db.query_requests(request.query, user=get_target_user(request))
+        rows = await g_db.query_requests_async(request.query, user=get_target_user(request))
         dtos = [request_dto(row) for row in rows]
         return web.json_response(dtos)
 
@@ -1123,7 +1359,7 @@ def install(ctx):
     ctx.add_delete("requests/{id}", delete_request)
 
     async def requests_summary(request):
-        rows = g_db.get_request_summary(user=get_target_user(request))
+        rows = await g_db.get_request_summary_async(user=get_target_user(request))
         stats = {
             "dailyData": {},
             "years": [],
@@ -1155,7 +1391,7 @@ def install(ctx):
 
     async def daily_requests_summary(request):
         day = request.match_info["day"]
-        summary = g_db.get_daily_request_summary(day, user=get_target_user(request))
+        summary = await g_db.get_daily_request_summary_async(day, user=get_target_user(request))
         return web.json_response(summary)
 
     ctx.add_get("requests/summary/{day}", daily_requests_summary)
@@ -1163,7 +1399,7 @@ def install(ctx):
     async def admin_users_summary(request):
         if not ctx.is_admin(request):
             return web.json_response(ctx.create_error_response("Admin role required", "Forbidden"), status=403)
-        summary = g_db.get_users_summary()
+        summary = await g_db.get_users_summary_async()
         return web.json_response(summary)
 
     ctx.add_get("requests/users", admin_users_summary)
@@ -1171,7 +1407,7 @@ def install(ctx):
     async def admin_users_list(request):
         if not ctx.is_admin(request):
             return web.json_response(ctx.create_error_response("Admin role required", "Forbidden"), status=403)
-        db_users = set(g_db.get_users_list())
+        db_users = set(await g_db.get_users_list_async())
         users_file = os.path.join(ctx.get_user_path(), "users.json")
         if os.path.exists(users_file):
             try:
@@ -1185,15 +1421,23 @@ def install(ctx):
 
     ctx.add_get("requests/users/list", admin_users_list)
 
+    async def admin_db_stats(request):
+        if not ctx.is_admin(request):
+            return web.json_response(ctx.create_error_response("Admin role required", "Forbidden"), status=403)
+        return web.json_response(db_stats())
+
+    ctx.add_get("db/stats", admin_db_stats)
+
     async def sync_thread(request):
         user = ctx.get_username(request)
         take = min(int(request.query.get("take", "200")), 1000)
 
-        threads = g_db.query_threads({"null": "contextTokens", "take": take}, user=user)
+        threads = await g_db.query_threads_async({"null": "contextTokens", "take": take}, user=user)
         updated = 0
         for thread in threads:
             id = thread["id"]
-            messages = json.loads(thread["messages"])
+            messages = (json.loads(thread["messages"]) if thread.get("messages")
+                        else await g_db.read_async(g_db.get_thread_messages, id))
             context_tokens = count_tokens_approx(messages)
             await g_db.update_thread_async(id, {"contextTokens": context_tokens}, user=user)
             updated += 1
@@ -1205,11 +1449,12 @@ def install(ctx):
     async def compact_thread(request):
         id = request.match_info["id"]
         user = ctx.get_username(request)
-        thread = g_db.get_thread(id, user=user)
+        thread = await g_db.get_thread_async(id, user=user)
         if not thread:
             raise Exception("Thread not found")
 
-        thread_messages = json.loads(thread["messages"])
+        thread_messages = (json.loads(thread["messages"]) if thread.get("messages")
+                           else await g_db.read_async(g_db.get_thread_messages, id))
         token_count = count_tokens_approx(thread_messages)
         metadata = thread.get("metadata") or {}
         if isinstance(metadata, str):
@@ -1644,7 +1889,7 @@ def install(ctx):
             }
             await g_db.update_thread_async(thread_id, update_thread, user=user)
 
-        completed_at = g_db.get_thread_column(thread_id, "completedAt", user=user)
+        completed_at = await g_db.get_thread_column_async(thread_id, "completedAt", user=user)
         if completed_at:
             context["completed"] = True
 
@@ -1679,21 +1924,18 @@ def install(ctx):
                 context["projectedPersistedCount"] = len(messages)
             if not new_messages:
                 return
-            stored = thread_dto(g_db.get_thread(thread_id, user=user)) or {}
-            canonical = [m for m in (stored.get("messages") or []) if not m.get("streaming")]
-            await g_db.update_thread_async(
+            await g_db.append_messages_async(
                 thread_id,
+                new_messages,
                 {
-                    "messages": canonical + new_messages,
                     "status": ctx.next_loading_message(),
                     # the turn that produced these messages has finished streaming and is
                     # now durable, so its checkpoint is a stale duplicate of it
                     "streamingMessage": None,
                 },
                 user=user,
-            )
-            g_db.annotate_chat_messages(
-                thread_id, new_messages, run_id=context.get("runId"), step_id=context.get("stepId")
+                run_id=context.get("runId"),
+                step_id=context.get("stepId"),
             )
             return
         await g_db.update_thread_async(
@@ -1705,11 +1947,11 @@ def install(ctx):
             },
             user=user,
         )
-        g_db.annotate_chat_messages(
+        await g_db.annotate_chat_messages_async(
             thread_id, messages, run_id=context.get("runId"), step_id=context.get("stepId")
         )
 
-        completed_at = g_db.get_thread_column(thread_id, "completedAt", user=user)
+        completed_at = await g_db.get_thread_column_async(thread_id, "completedAt", user=user)
         if completed_at:
             context["completed"] = True
 
@@ -1783,7 +2025,11 @@ def install(ctx):
             "cost", ((input_price * input_tokens) + (output_price * output_tokens)) / 1000000
         )
         is_per_request = model_cost.get("type") == "request"
-        if is_per_request:
+        # a response from the response cache was free, only earlier steps of its tool loop cost anything
+        cached = bool(metadata.get("cached"))
+        if cached:
+            cost = o.get("cost") or 0
+        elif is_per_request:
             cost = usage.get("cost") or output_price or cost
 
         request = {
@@ -1815,33 +2061,37 @@ def install(ctx):
             # Append to the conversation the thread already has rather than rebuilding it
             # from the request: the request's copy is missing anything appended while it
             # was in flight (tool call/result messages) and has been rewritten for the
-            # provider, so writing it back would drop messages.
-            stored = thread_dto(g_db.get_thread(thread_id, user=user)) or {}
-            messages = stored.get("messages")
-            if not isinstance(messages, list) or not messages:
-                messages = chat.get("messages", [])
-            messages = [m for m in messages if not m.get("streaming")]
-            last_role = messages[-1].get("role", None) if len(messages) > 0 else None
+            # provider, so writing it back would drop messages. Only its last message is
+            # needed, to record the usage of the prompt that produced this response.
+            patches = {}
+            last_message = await g_db.read_async(g_db.get_last_message, thread_id)
+            messages = [] if last_message else [m for m in chat.get("messages", []) if not m.get("streaming")]
+            if not last_message and messages:
+                last_message = messages[-1]
+            last_role = last_message.get("role", None) if last_message else None
             input_cost = (input_price * input_tokens) / 1000000 if not is_per_request else cost
 
             if last_role == "user" or last_role == "tool":
-                user_message = messages[-1]
-                user_message["model"] = model
-                if not input_tokens and user_message.get("content"):
+                user_message = last_message
+                if not input_tokens and not cached and user_message.get("content"):
                     input_tokens = count_tokens_approx(user_message.get("content"))
                     input_cost = (input_price * input_tokens) / 1000000 if not is_per_request else cost
-                user_message["usage"] = {
-                    "tokens": input_tokens,
-                    "price": input_price,
-                    "cost": input_cost,
+                usage_fields = {
+                    "model": model,
+                    "usage": {
+                        "tokens": input_tokens,
+                        "price": input_price,
+                        "cost": input_cost,
+                    },
                 }
+                user_message.update(usage_fields)
+                if user_message.get("timestamp") is not None:
+                    patches[user_message["timestamp"]] = usage_fields
             else:
-                ctx.dbg(
-                    f"Missing user message for thread {thread_id}, {len(messages)} messages, last role: {last_role}"
-                )
+                ctx.dbg(f"Missing user message for thread {thread_id}, last role: {last_role}")
             assistant_message = ctx.chat_response_to_message(o)
             assistant_message["model"] = model
-            if not output_tokens and assistant_message:
+            if not output_tokens and not cached and assistant_message:
                 content_text = assistant_message.get("content") or ""
                 reasoning_text = assistant_message.get("reasoning") or ""
                 output_tokens = count_tokens_approx(content_text) + count_tokens_approx(reasoning_text)
@@ -1864,7 +2114,6 @@ def install(ctx):
                 "provider": provider,
                 "providerModel": o.get("model"),
                 "modelInfo": model_info,
-                "messages": messages,
                 "tools": tools,
                 "completedAt": completed_at,
                 "status": None,
@@ -1878,49 +2127,20 @@ def install(ctx):
             provider_response = context.get("providerResponse", None)
             if provider_response:
                 update_thread["providerResponse"] = truncate_long_strings(provider_response)
-            tasks.append(g_db.update_thread_async(thread_id, update_thread, user=user))
+            tasks.append(g_db.append_messages_async(
+                thread_id, messages, update_thread, patches, user=user,
+                run_id=context.get("runId"), step_id=context.get("stepId"),
+            ))
         elif not thread_id:
             ctx.dbg("Missing thread_id")
 
         await asyncio.gather(*tasks)
 
         if thread_id and not nohistory:
-            g_db.annotate_chat_messages(
-                thread_id, messages, run_id=context.get("runId"), step_id=context.get("stepId")
-            )
-
-        if thread_id and not nohistory:
-            # Update thread costs from all thread requests
-            thread_requests = g_db.query_requests({"threadId": thread_id}, user=user)
-            total_costs = 0
-            total_input = 0
-            total_output = 0
-            for request in thread_requests:
-                total_costs += request.get("cost", 0) or 0
-                total_input += request.get("inputTokens", 0) or 0
-                total_output += request.get("outputTokens", 0) or 0
-            stats = {
-                "inputTokens": total_input,
-                "outputTokens": total_output,
-                "cost": total_costs,
-                "duration": duration,
-                "requests": len(thread_requests),
-            }
-
+            # the thread's cost, token and request totals were added with its request
             if is_per_request:
-                stats["type"] = "request"
-
-            g_db.update_thread(
-                thread_id,
-                {
-                    "inputTokens": total_input,
-                    "outputTokens": total_output,
-                    "cost": total_costs,
-                    "stats": stats,
-                    "status": ctx.next_loading_message(),
-                },
-                user=user,
-            )
+                await g_db.merge_thread_stats_async(thread_id, {"type": "request"})
+            await g_db.update_thread_async(thread_id, {"status": ctx.next_loading_message()}, user=user)
 
     ctx.register_chat_response_filter(chat_response)
 
@@ -2011,11 +2231,32 @@ def install(ctx):
             notify_thread_update(id)
             return ret
 
+        async def append_stream_async(self, id, stream_id, offset, delta: Dict[str, Any], user=None):
+            """
+            Append what streamed since the last checkpoint to the in-flight message, as a
+            `stream_chunk` row rather than a rewrite of `streamingMessage`.
+            """
+            ret = await self.db.append_stream_chunk_async(id, stream_id, offset, delta)
+            thread_events.publish(id, "streaming-chunk", {
+                "streamId": stream_id, "offset": offset,
+                "length": StreamCheckpointWriter.payload_len(delta), "delta": delta,
+            })
+            notify_thread_update(id)
+            return ret
+
         def get_request(self, request_id, user):
             return request_dto(self.db.get_request(request_id, user=user))
 
 
     ctx.threads = ThreadApi(ctx, g_db)
+    async def thread_snapshot(thread_id):
+        try:
+            return await g_db.read_async(lambda: thread_window_dto(g_db.get_thread(thread_id, user="all")))
+        except Exception as e:
+            ctx.err(f"thread_snapshot({thread_id})", e)
+            return None
+
+    thread_events.snapshot = thread_snapshot
 
 
 __install__ = install
@@ -5,7 +5,27 @@ from contextlib import suppress
 from datetime import datetime, timedelta
 from typing import Any, Dict
 
-from llms.db import DbManager, count_tokens_approx, order_by, select_columns, to_dto, valid_columns
+from llms.db import (
+    SNIPPET_SQL,
+    DbManager,
+    count_tokens_approx,
+    create_fts_table,
+    fts_query,
+    fts_snippet,
+    order_by,
+    select_columns,
+    to_dto,
+    valid_columns,
+)
+
+# Searchable text of a chat_message's `message` JSON: its content, or the text parts of
+# multi-part content
+MESSAGE_TEXT_SQL = """CASE json_type({message}, '$.content')
+    WHEN 'text' THEN json_extract({message}, '$.content')
+    WHEN 'array' THEN (
+        SELECT group_concat(CASE type WHEN 'object' THEN json_extract(value, '$.text') WHEN 'text' THEN value END, ' ')
+        FROM json_each({message}, '$.content'))
+    END"""
 
 
 def with_user(data, user):
@@ -19,12 +39,14 @@ def with_user(data, user):
 
 
 class AppDB:
-    def __init__(self, ctx, db_path):
+    def __init__(self, ctx, db_path, normalized_messages=False):
         if db_path is None:
             raise ValueError("db_path is required")
 
         self.ctx = ctx
         self.db_path = str(db_path)
+        # new threads keep their conversation only in chat_message rows, see append_messages
+        self.normalized_messages = normalized_messages
         self._closed = False
 
         dirname = os.path.dirname(self.db_path)
@@ -44,6 +66,8 @@ class AppDB:
                 "modelInfo": "JSON",
                 "modalities": "JSON",
                 "messages": "JSON",
+                # 1 when chat_message rows are the conversation and `messages` is NULL
+                "normalized": "INTEGER",
                 # in-flight assistant message while streaming, kept out of `messages`
                 # so a failed stream can never damage the durable conversation
                 "streamingMessage": "JSON",
@@ -67,6 +91,9 @@ class AppDB:
                 "parentId": "INTEGER",
                 "publishedAt": "TIMESTAMP",
                 "publishedUrl": "TEXT",
+                # bumped by triggers on every write to the thread, its messages, stream
+                # chunks and runs, see init_versions
+                "version": "INTEGER",
             },
             "request": {
                 "id": "INTEGER",
@@ -145,6 +172,16 @@ class AppDB:
                 "active": "INTEGER",
                 "createdAt": "TIMESTAMP",
             },
+            # text appended to a thread's `streamingMessage` since it was last written
+            # whole, so a checkpoint writes only what streamed since the previous one
+            "stream_chunk": {
+                "id": "INTEGER",
+                "threadId": "INTEGER",
+                "streamId": "TEXT",
+                "offset": "INTEGER",
+                "delta": "JSON",
+                "createdAt": "TIMESTAMP",
+            },
             "context_snapshot": {
                 "id": "INTEGER",
                 "threadId": "INTEGER",
@@ -158,8 +195,7 @@ class AppDB:
                 "createdAt": "TIMESTAMP",
             },
         }
-        with self.create_writer_connection() as conn:
-            self.init_db(conn)
+        self.db.run(self.init_db)
 
     def get_connection(self):
         return self.create_reader_connection()
@@ -220,8 +256,9 @@ class AppDB:
         self.db.exec(conn, "CREATE INDEX IF NOT EXISTS idx_request_createdat ON request(createdAt)")
         self.db.exec(conn, "CREATE INDEX IF NOT EXISTS idx_request_cost ON request(cost)")
         self.db.exec(conn, "CREATE INDEX IF NOT EXISTS idx_request_threadid ON request(threadId)")
+        self.db.exec(conn, "CREATE INDEX IF NOT EXISTS idx_request_user_createdat ON request(user, createdAt)")
 
-        for table in ("agent_run", "agent_step", "chat_message", "context_snapshot"):
+        for table in ("agent_run", "agent_step", "chat_message", "context_snapshot", "stream_chunk"):
             sql_columns = ",".join(
                 f"{col} {overrides.get(col, dtype)}" for col, dtype in self.columns[table].items()
             )
@@ -234,23 +271,296 @@ class AppDB:
         self.db.exec(conn, "CREATE UNIQUE INDEX IF NOT EXISTS idx_chat_message_seq ON chat_message(threadId, sequence)")
         self.db.exec(conn, "CREATE INDEX IF NOT EXISTS idx_chat_message_active_seq ON chat_message(threadId, active, sequence)")
         self.db.exec(conn, "CREATE INDEX IF NOT EXISTS idx_chat_message_run ON chat_message(runId, sequence)")
+        self.db.exec(conn, "CREATE INDEX IF NOT EXISTS idx_chat_message_timestamp ON chat_message(threadId, active, timestamp)")
         self.db.exec(conn, "CREATE INDEX IF NOT EXISTS idx_context_snapshot_thread ON context_snapshot(threadId, version)")
+        self.db.exec(conn, "CREATE INDEX IF NOT EXISTS idx_stream_chunk_stream ON stream_chunk(threadId, streamId, offset)")
         self.db.exec(conn, "UPDATE chat_message SET active=1 WHERE active IS NULL")
+        self.init_versions(conn)
+        self.init_usage(conn)
+        self.init_thread_totals(conn)
+        self.search = self.init_search(conn)
+
+    def init_versions(self, conn):
+        """
+        thread.version changes whenever anything a thread DTO is built from is written, so
+        clients and watchers can tell a thread is unchanged from one integer instead of
+        rebuilding and hashing its history. Triggers bump it in the writing transaction,
+        which covers every write path, including ones outside this class.
+        """
+        bump = "UPDATE thread SET version=COALESCE(version, 0)+1 WHERE id={id};"
+        for sql in [
+            # writes that set `version` themselves (the bump below) don't bump again
+            f"""CREATE TRIGGER IF NOT EXISTS thread_version_update AFTER UPDATE ON thread
+                WHEN new.version IS old.version BEGIN {bump.format(id="new.id")} END""",
+            f"""CREATE TRIGGER IF NOT EXISTS chat_message_version_insert AFTER INSERT ON chat_message
+                BEGIN {bump.format(id="new.threadId")} END""",
+            f"""CREATE TRIGGER IF NOT EXISTS chat_message_version_update
+                AFTER UPDATE OF message, active, sequence ON chat_message
+                BEGIN {bump.format(id="new.threadId")} END""",
+            f"""CREATE TRIGGER IF NOT EXISTS stream_chunk_version_insert AFTER INSERT ON stream_chunk
+                BEGIN {bump.format(id="new.threadId")} END""",
+            f"""CREATE TRIGGER IF NOT EXISTS agent_run_version_insert AFTER INSERT ON agent_run
+                BEGIN {bump.format(id="new.threadId")} END""",
+            # lease renewals don't change what clients see of a run
+            f"""CREATE TRIGGER IF NOT EXISTS agent_run_version_update
+                AFTER UPDATE OF status, nextAction, stepCount, error, completedAt ON agent_run
+                BEGIN {bump.format(id="new.threadId")} END""",
+        ]:
+            self.db.exec(conn, sql)
+
+    def init_usage(self, conn):
+        """
+        request_usage rolls requests up per user x day x model x provider, so the analytics
+        summaries read a few rows per day instead of grouping every request by strftime().
+        Triggers keep it in step with inserts, edits and deletes of requests. NULL keys
+        are stored as '' so they can be part of the primary key.
+        """
+        exists = self.db.exec(conn, "SELECT 1 FROM sqlite_master WHERE type='table' AND name='request_usage'").fetchone()
+        self.db.exec(conn, """CREATE TABLE IF NOT EXISTS request_usage (
+            user TEXT NOT NULL, day TEXT NOT NULL, model TEXT NOT NULL, provider TEXT NOT NULL,
+            requests INTEGER NOT NULL, cost REAL NOT NULL, inputTokens INTEGER NOT NULL,
+            outputTokens INTEGER NOT NULL, duration INTEGER NOT NULL, lastActive TIMESTAMP,
+            PRIMARY KEY (user, day, model, provider))""")
+        self.db.exec(conn, "CREATE INDEX IF NOT EXISTS idx_request_usage_day ON request_usage(day)")
+
+        def add(row):
+            return f"""INSERT INTO request_usage
+                (user, day, model, provider, requests, cost, inputTokens, outputTokens, duration, lastActive)
+                VALUES (COALESCE({row}.user, ''), strftime('%Y-%m-%d', {row}.createdAt), COALESCE({row}.model, ''),
+                        COALESCE({row}.provider, ''), 1, COALESCE({row}.cost, 0), COALESCE({row}.inputTokens, 0),
+                        COALESCE({row}.outputTokens, 0), COALESCE({row}.duration, 0), {row}.createdAt)
+                ON CONFLICT (user, day, model, provider) DO UPDATE SET
+                    requests=requests+1, cost=cost+excluded.cost, inputTokens=inputTokens+excluded.inputTokens,
+                    outputTokens=outputTokens+excluded.outputTokens, duration=duration+excluded.duration,
+                    lastActive=max(lastActive, excluded.lastActive);"""
+
+        def subtract(row):
+            key = (f"user=COALESCE({row}.user, '') AND day=strftime('%Y-%m-%d', {row}.createdAt)"
+                   f" AND model=COALESCE({row}.model, '') AND provider=COALESCE({row}.provider, '')")
+            return f"""UPDATE request_usage SET
+                    requests=requests-1, cost=cost-COALESCE({row}.cost, 0),
+                    inputTokens=inputTokens-COALESCE({row}.inputTokens, 0),
+                    outputTokens=outputTokens-COALESCE({row}.outputTokens, 0),
+                    duration=duration-COALESCE({row}.duration, 0)
+                WHERE {key};
+                DELETE FROM request_usage WHERE {key} AND requests<=0;"""
+
+        self.db.exec(conn, f"CREATE TRIGGER IF NOT EXISTS request_usage_insert AFTER INSERT ON request BEGIN {add('new')} END")
+        self.db.exec(conn, f"""CREATE TRIGGER IF NOT EXISTS request_usage_update
+            AFTER UPDATE OF user, createdAt, model, provider, cost, inputTokens, outputTokens, duration ON request
+            BEGIN {subtract('old')} {add('new')} END""")
+        self.db.exec(conn, f"CREATE TRIGGER IF NOT EXISTS request_usage_delete AFTER DELETE ON request BEGIN {subtract('old')} END")
+        if not exists:
+            self._rebuild_usage(conn)
+
+    def _rebuild_usage(self, conn):
+        self.db.exec(conn, "DELETE FROM request_usage")
+        self.db.exec(conn, """INSERT INTO request_usage
+            (user, day, model, provider, requests, cost, inputTokens, outputTokens, duration, lastActive)
+            SELECT COALESCE(user, ''), strftime('%Y-%m-%d', createdAt) AS day, COALESCE(model, ''), COALESCE(provider, ''),
+                   count(*), COALESCE(sum(cost), 0), COALESCE(sum(inputTokens), 0), COALESCE(sum(outputTokens), 0),
+                   COALESCE(sum(duration), 0), max(createdAt)
+            FROM request GROUP BY 1, 2, 3, 4""")
+
+    def rebuild_usage(self):
+        """Recompute request_usage from the request table."""
+        self.db.run(self._rebuild_usage)
+
+    def init_thread_totals(self, conn):
+        """
+        A thread's cost and token columns and its `stats` total the requests made for it.
+        Triggers add each request as it's written, in the same transaction, instead of
+        re-summing every request of the thread after each completion.
+        """
+        exists = self.db.exec(
+            conn, "SELECT 1 FROM sqlite_master WHERE type='trigger' AND name='request_thread_insert'"
+        ).fetchone()
+
+        def apply(row, op):
+            return f"""UPDATE thread SET
+                cost=COALESCE(cost, 0){op}COALESCE({row}.cost, 0),
+                inputTokens=COALESCE(inputTokens, 0){op}COALESCE({row}.inputTokens, 0),
+                outputTokens=COALESCE(outputTokens, 0){op}COALESCE({row}.outputTokens, 0),
+                stats=json_set(COALESCE(stats, '{{}}'),
+                    '$.cost', COALESCE(cost, 0){op}COALESCE({row}.cost, 0),
+                    '$.inputTokens', COALESCE(inputTokens, 0){op}COALESCE({row}.inputTokens, 0),
+                    '$.outputTokens', COALESCE(outputTokens, 0){op}COALESCE({row}.outputTokens, 0),
+                    '$.requests', COALESCE(json_extract(stats, '$.requests'), 0){op}1,
+                    '$.duration', COALESCE(json_extract(stats, '$.duration'), 0){op}COALESCE({row}.duration, 0))
+                WHERE id={row}.threadId;"""
+
+        self.db.exec(conn, f"""CREATE TRIGGER IF NOT EXISTS request_thread_insert AFTER INSERT ON request
+            WHEN new.threadId IS NOT NULL BEGIN {apply('new', '+')} END""")
+        self.db.exec(conn, f"""CREATE TRIGGER IF NOT EXISTS request_thread_update
+            AFTER UPDATE OF threadId, cost, inputTokens, outputTokens, duration ON request
+            BEGIN {apply('old', '-')} {apply('new', '+')} END""")
+        self.db.exec(conn, f"""CREATE TRIGGER IF NOT EXISTS request_thread_delete AFTER DELETE ON request
+            WHEN old.threadId IS NOT NULL BEGIN {apply('old', '-')} END""")
+        if not exists:
+            self._rebuild_thread_totals(conn)
+
+    def _rebuild_thread_totals(self, conn):
+        self.db.exec(conn, "DROP TABLE IF EXISTS temp.thread_totals")
+        self.db.exec(conn, """CREATE TEMP TABLE thread_totals AS
+            SELECT threadId, COALESCE(sum(cost), 0) AS cost, COALESCE(sum(inputTokens), 0) AS inputTokens,
+                   COALESCE(sum(outputTokens), 0) AS outputTokens, count(*) AS requests,
+                   COALESCE(sum(duration), 0) AS duration
+            FROM request WHERE threadId IS NOT NULL GROUP BY threadId""")
+        self.db.exec(conn, "CREATE UNIQUE INDEX temp.idx_thread_totals ON thread_totals(threadId)")
+        # threads without requests keep what they have, e.g. the stats of imported threads
+        updated = self.db.exec(conn, """UPDATE thread SET
+            cost=(SELECT cost FROM thread_totals WHERE threadId=thread.id),
+            inputTokens=(SELECT inputTokens FROM thread_totals WHERE threadId=thread.id),
+            outputTokens=(SELECT outputTokens FROM thread_totals WHERE threadId=thread.id),
+            stats=(SELECT json_set(COALESCE(thread.stats, '{}'), '$.cost', cost, '$.inputTokens', inputTokens,
+                          '$.outputTokens', outputTokens, '$.requests', requests, '$.duration', duration)
+                   FROM thread_totals WHERE threadId=thread.id)
+            WHERE id IN (SELECT threadId FROM thread_totals)""").rowcount
+        self.db.exec(conn, "DROP TABLE temp.thread_totals")
+        return updated
+
+    def rebuild_thread_totals(self):
+        """Recompute every thread's cost, tokens and stats from its requests, returns the threads updated."""
+        return self.db.run(self._rebuild_thread_totals)
+
+    async def merge_thread_stats_async(self, id, stats):
+        """Merge `stats` into the thread's stats without touching the totals kept by triggers."""
+        await self.db.run_async(lambda conn: self.db.exec(
+            conn, "UPDATE thread SET stats=json_patch(COALESCE(stats, '{}'), :stats) WHERE id=:id",
+            {"id": id, "stats": json.dumps(stats)},
+        ))
+
+    def init_search(self, conn):
+        """
+        thread_fts indexes thread titles (rowid -thread.id) and the text of active
+        chat_message rows (rowid chat_message.id), request_fts request titles. Triggers
+        keep them in step with every write path, legacy or normalized. Returns False
+        when SQLite lacks FTS5.
+        """
+        created = create_fts_table(self.ctx, conn, "thread_fts", "title, content, threadId UNINDEXED, sequence UNINDEXED")
+        if created is None:
+            return False
+        requests_created = create_fts_table(self.ctx, conn, "request_fts", "title, content='request', content_rowid='id'")
+        message_text = MESSAGE_TEXT_SQL.format(message="new.message")
+        for sql in [
+            f"""CREATE TRIGGER IF NOT EXISTS chat_message_fts_insert AFTER INSERT ON chat_message WHEN new.active=1 BEGIN
+                INSERT INTO thread_fts(rowid, content, threadId, sequence)
+                VALUES (new.id, {message_text}, new.threadId, new.sequence);
+            END""",
+            f"""CREATE TRIGGER IF NOT EXISTS chat_message_fts_update AFTER UPDATE OF message, active ON chat_message BEGIN
+                DELETE FROM thread_fts WHERE rowid=old.id;
+                INSERT INTO thread_fts(rowid, content, threadId, sequence)
+                SELECT new.id, {message_text}, new.threadId, new.sequence WHERE new.active=1;
+            END""",
+            """CREATE TRIGGER IF NOT EXISTS chat_message_fts_delete AFTER DELETE ON chat_message BEGIN
+                DELETE FROM thread_fts WHERE rowid=old.id;
+            END""",
+            """CREATE TRIGGER IF NOT EXISTS thread_fts_insert AFTER INSERT ON thread WHEN new.title IS NOT NULL BEGIN
+                INSERT INTO thread_fts(rowid, title, threadId, sequence) VALUES (-new.id, new.title, new.id, 0);
+            END""",
+            """CREATE TRIGGER IF NOT EXISTS thread_fts_update AFTER UPDATE OF title ON thread BEGIN
+                DELETE FROM thread_fts WHERE rowid=-old.id;
+                INSERT INTO thread_fts(rowid, title, threadId, sequence)
+                SELECT -new.id, new.title, new.id, 0 WHERE new.title IS NOT NULL;
+            END""",
+            """CREATE TRIGGER IF NOT EXISTS thread_fts_delete AFTER DELETE ON thread BEGIN
+                DELETE FROM thread_fts WHERE rowid=-old.id;
+            END""",
+            """CREATE TRIGGER IF NOT EXISTS request_fts_insert AFTER INSERT ON request BEGIN
+                INSERT INTO request_fts(rowid, title) VALUES (new.id, new.title);
+            END""",
+            """CREATE TRIGGER IF NOT EXISTS request_fts_update AFTER UPDATE OF title ON request BEGIN
+                INSERT INTO request_fts(request_fts, rowid, title) VALUES ('delete', old.id, old.title);
+                INSERT INTO request_fts(rowid, title) VALUES (new.id, new.title);
+            END""",
+            """CREATE TRIGGER IF NOT EXISTS request_fts_delete AFTER DELETE ON request BEGIN
+                INSERT INTO request_fts(request_fts, rowid, title) VALUES ('delete', old.id, old.title);
+            END""",
+        ]:
+            self.db.exec(conn, sql)
+        if created or requests_created:
+            self._rebuild_search_index(conn)
+        return True
+
+    def _rebuild_search_index(self, conn):
+        self.db.exec(conn, "DELETE FROM thread_fts")
+        self.db.exec(
+            conn,
+            "INSERT INTO thread_fts(rowid, title, threadId, sequence) SELECT -id, title, id, 0 FROM thread WHERE title IS NOT NULL",
+        )
+        self.db.exec(
+            conn,
+            f"""INSERT INTO thread_fts(rowid, content, threadId, sequence)
+                SELECT id, {MESSAGE_TEXT_SQL.format(message="message")}, threadId, sequence
+                FROM chat_message WHERE active=1""",
+        )
+        self.db.exec(conn, "INSERT INTO thread_fts(thread_fts) VALUES ('optimize')")
+        self.db.exec(conn, "INSERT INTO request_fts(request_fts) VALUES ('rebuild')")
+
+    def rebuild_search_index(self):
+        """Re-index every thread title and active message, e.g. after restoring a database."""
+        if self.search:
+            self.db.run(self._rebuild_search_index)
+        return self.search
 
     def import_db(self, threads, requests):
         self.ctx.log("import threads and requests")
-        with self.create_writer_connection() as conn:
+
+        def import_all(conn):
             conn.execute("DROP TABLE IF EXISTS thread")
             conn.execute("DROP TABLE IF EXISTS request")
             self.init_db(conn)
-            thread_id_map = {}
-            for thread in threads:
-                thread_id = self.import_thread(conn, thread)
-                thread_id_map[thread["id"]] = thread_id
+            # the imported threads reuse the ids of the ones they replace
+            for table in ("chat_message", "stream_chunk", "context_snapshot", "agent_step", "agent_run"):
+                conn.execute(f"DELETE FROM {table}")
+            # the versions, usage rollup and search index are rebuilt once at the end rather
+            # than by triggers firing for every imported row
+            for (name,) in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type='trigger' AND tbl_name IN ('thread','chat_message','request')"
+            ).fetchall():
+                conn.execute(f"DROP TRIGGER {name}")
+
+            # The new tables are empty, so ids are assigned up front and every table is
+            # written with one executemany() instead of a statement per thread and message
+            rows = [self.import_thread(thread, id) for id, thread in enumerate(threads, 1)]
+            thread_id_map = {thread["id"]: row["id"] for thread, (row, _) in zip(threads, rows)}
+            self.import_rows(conn, "thread", [row for row, _ in rows])
+            now = datetime.now()
+            self.db.exec_many(
+                conn,
+                """INSERT INTO chat_message
+                   (threadId,sequence,runId,stepId,role,message,timestamp,toolCallId,toolName,tokenCount,active,createdAt)
+                   VALUES (?,?,?,?,?,?,?,?,?,?,1,?)""",
+                (self._chat_message_row(row["id"], m, None, None, now) for row, messages in rows for m in messages),
+            )
             self.ctx.log(f"imported {len(threads)} threads")
-            for request in requests:
-                self.import_request(conn, request, thread_id_map)
+            self.import_rows(conn, "request", [self.import_request(request, thread_id_map) for request in requests])
             self.ctx.log(f"imported {len(requests)} requests")
+            self.init_versions(conn)
+            self.init_usage(conn)
+            self._rebuild_usage(conn)
+            self.init_thread_totals(conn)
+            self.search = self.init_search(conn)
+            if self.search:
+                self._rebuild_search_index(conn)
+
+        self.db.run(import_all)
+
+    def import_rows(self, conn, table, records):
+        """Insert `records` (dicts of column values, JSON columns not yet encoded) into `table`."""
+        columns = self.columns[table]
+        names = [col for col in columns if col != "id" or (records and "id" in records[0])]
+        self.db.exec_many(
+            conn,
+            f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join(['?'] * len(names))})",
+            (
+                tuple(
+                    json.dumps(record[col]) if columns[col] == "JSON" and record.get(col) is not None else record.get(col)
+                    for col in names
+                )
+                for record in records
+            ),
+        )
 
     def import_date(self, date):
         # "1765794035" or "2025-12-31T05:41:46.686Z" or "2026-01-02 05:00:16"
@@ -271,10 +581,11 @@ class AppDB:
             else datetime.strptime(str, "%Y-%m-%d %H:%M:%S")
         )
 
-    def import_thread(self, conn, orig):
+    def import_thread(self, orig, id):
+        """The thread row to import `orig` as `id`, and the messages to store as its chat_message rows."""
         thread = orig.copy()
         thread["refId"] = thread["id"]
-        del thread["id"]
+        thread["id"] = id
 
         info = thread.get("modelInfo", thread.get("info", {}))
         created_at = self.import_date(thread.get("createdAt"))
@@ -308,25 +619,20 @@ class AppDB:
         if "completedAt" not in thread:
             thread["completedAt"] = created_at + timedelta(milliseconds=stats.get("duration", 0))
 
-        sql_columns = []
-        sql_params = []
-        columns = self.columns["thread"]
-        for col in columns:
-            if col == "id":
-                continue
-            sql_columns.append(col)
-            val = thread.get(col, None)
-            if columns[col] == "JSON" and val is not None:
-                val = json.dumps(val)
-            sql_params.append(val)
-
-        return conn.execute(
-            f"INSERT INTO thread ({', '.join(sql_columns)}) VALUES ({', '.join(['?'] * len(sql_params))})",
-            sql_params,
-        ).lastrowid
+        # timestamps are the identity of chat_message rows, give older exports that lack them one
+        initial_timestamp = int(created_at.timestamp() * 1000)
+        messages = [
+            {"timestamp": initial_timestamp + sequence, **m, "_sequence": sequence}
+            for sequence, m in enumerate((m for m in thread.get("messages") or [] if isinstance(m, dict)), 1)
+        ]
+        thread["messages"] = [{k: v for k, v in m.items() if k != "_sequence"} for m in messages]
+        if self.normalized_messages:
+            thread["messages"], thread["normalized"] = None, 1
+        return thread, messages
 
     # run on startup
-    def import_request(self, conn, orig, id_map):
+    def import_request(self, orig, id_map):
+        """The request row to import `orig` as, with its threadId mapped to the imported thread."""
         request = orig.copy()
         del request["id"]
         thread_id = request.get("threadId")
@@ -340,22 +646,7 @@ class AppDB:
         if "completedAt" not in request:
             request["completedAt"] = created_at + timedelta(milliseconds=request.get("duration", 0))
 
-        sql_columns = []
-        sql_params = []
-        columns = self.columns["request"]
-        for col in columns:
-            if col == "id":
-                continue
-            sql_columns.append(col)
-            val = request.get(col, None)
-            if columns[col] == "JSON" and val is not None:
-                val = json.dumps(val)
-            sql_params.append(val)
-
-        return conn.execute(
-            f"INSERT INTO request ({', '.join(sql_columns)}) VALUES ({', '.join(['?'] * len(sql_params))})",
-            sql_params,
-        ).lastrowid
+        return request
 
     def to_dto(self, row, json_columns):
         return to_dto(self.ctx, row, json_columns)
@@ -372,7 +663,11 @@ class AppDB:
 
     def get_thread(self, id, user=None):
         sql_where, params = self.get_user_filter(user, {"id": id})
-        return self.db.one(f"SELECT * FROM thread {sql_where} AND id = :id", params)
+        joiner = " AND " if sql_where else " WHERE "
+        return self.db.one(f"SELECT * FROM thread {sql_where}{joiner}id = :id", params)
+
+    async def get_thread_async(self, id, user=None):
+        return await self.db.read_async(self.get_thread, id, user=user)
 
     def get_thread_column(self, id, column, user=None):
         if column not in self.columns["thread"]:
@@ -381,19 +676,66 @@ class AppDB:
 
         try:
             sql_where, params = self.get_user_filter(user, {"id": id})
-            return self.db.scalar(f"SELECT {column} FROM thread {sql_where} AND id = :id", params)
+            joiner = " AND " if sql_where else " WHERE "
+            return self.db.scalar(f"SELECT {column} FROM thread {sql_where}{joiner}id = :id", params)
         except Exception as e:
             self.ctx.err(f"get_thread_column ({id}, {column}, {user})", e)
             return None
 
+    async def get_thread_column_async(self, id, column, user=None):
+        return await self.db.read_async(self.get_thread_column, id, column, user=user)
+
+    def get_thread_version(self, id, user=None):
+        return self.get_thread_column(id, "version", user=user) or 0
+
+    async def get_thread_version_async(self, id, user=None):
+        return await self.db.read_async(self.get_thread_version, id, user=user)
+
+    async def read_async(self, fn, *args, **kwargs):
+        """Run a blocking read, or a helper making several of them, off the event loop."""
+        return await self.db.read_async(fn, *args, **kwargs)
+
+    def thread_keyset(self, query: Dict[str, Any], sort: str):
+        """
+        Keyset pagination for query_threads, to scroll deep into a long list without OFFSET.
+        The `before`/`after` cursor is the id of the last thread on the previous page, which
+        threads are compared to on the sort column, then id. Returns the sort with id added to
+        break ties, and the WHERE conditions with their params. Raises ValueError for a cursor
+        on an order it can't follow (several sort columns, or search rank).
+        """
+        all_columns = self.columns["thread"].keys()
+        keys = [k.strip() for k in sort.split(",") if k.strip().lstrip("-") in all_columns]
+        key = keys[0].lstrip("-") if len(keys) == 1 else None
+        if key and key != "id":
+            # so every thread has one place in the order
+            sort = f"{keys[0]},{'-' if keys[0].startswith('-') else ''}id"
+        conds, params = [], {}
+        for name, op in (("before", "<"), ("after", ">")):
+            if not query.get(name):
+                continue
+            params[name] = int(query[name])
+            if key == "id":
+                conds.append(f"id {op} :{name}")
+                continue
+            if key is None or ("search" in query and self.search):
+                raise ValueError(f"`{name}` can only page threads sorted by a single column")
+            # NULLs come first, as SQLite sorts them
+            value = f"(SELECT {key} FROM thread WHERE id = :{name})"
+            if op == "<":
+                null_first = f"{key} IS NULL AND {value} IS NOT NULL"
+            else:
+                null_first = f"{key} IS NOT NULL AND {value} IS NULL"
+            conds.append(f"({key} {op} {value} OR ({key} IS {value} AND id {op} :{name}) OR ({null_first}))")
+        return sort, conds, params
+
     def query_threads(self, query: Dict[str, Any], user=None):
+        sort, keyset_conds, keyset_params = self.thread_keyset(query, query.get("sort", "-id"))
         try:
             columns = self.columns["thread"]
             all_columns = columns.keys()
 
             take = min(int(query.get("take", "50")), 1000)
             skip = int(query.get("skip", "0"))
-            sort = query.get("sort", "-id")
 
             # always filter by user
             sql_where, params = self.get_user_filter(user, {"take": take, "skip": skip})
@@ -421,12 +763,24 @@ class AppDB:
                 if len(cols) > 0:
                     where_conds.extend([f"{k} IS NOT NULL" for k in cols])
 
+            where_conds.extend(keyset_conds)
+            params.update(keyset_params)
+
+            if "search" in query and not self.search:
+                query = {"q": query["search"], **query}
+
             if "q" in query:
-                where_conds.append("(title LIKE :q OR messages LIKE :q)")
+                where_conds.append(
+                    "(title LIKE :q OR messages LIKE :q OR (normalized=1 AND id IN "
+                    "(SELECT threadId FROM chat_message WHERE active=1 AND message LIKE :q)))"
+                )
                 params["q"] = f"%{query['q']}%"
 
             full_where = ("WHERE " + " AND ".join(where_conds)) if where_conds else ""
 
+            if "search" in query and self.search:
+                return self.search_threads(query, full_where, params)
+
             sql = f"{select_columns(all_columns, query.get('fields'), select=query.get('select'))} FROM thread {full_where} {order_by(all_columns, sort)} LIMIT :take OFFSET :skip"
 
             if query.get("as") == "column":
@@ -438,6 +792,77 @@ class AppDB:
             self.ctx.err(f"query_threads ({take}, {skip})", e)
             return []
 
+    def search_threads(self, query, sql_where, params):
+        """
+        Threads matching `search` in thread_fts, best match first. Each row also has the
+        match's `snippet` (HTML with <mark>ed terms), `searchRank` and the `matchSequence`
+        of the message it's in (0 for the title).
+        """
+        params["search"] = fts_query(query["search"])
+        if not params["search"]:
+            return []
+        fields = valid_columns(self.columns["thread"].keys(), query.get("fields")) or self.columns["thread"].keys()
+        columns = ", ".join(f"thread.{k}" for k in fields)
+        rows = self.db.all(
+            # the LIMIT keeps SQLite from flattening the FTS query into the GROUP BY,
+            # where bm25() and snippet() can't run
+            f"""SELECT {columns}, min(hits.rank) AS searchRank, hits.snippet AS snippet, hits.sequence AS matchSequence
+                FROM (
+                    SELECT threadId, sequence, bm25(thread_fts, 4.0, 1.0) AS rank,
+                           {SNIPPET_SQL.format(table="thread_fts")} AS snippet
+                    FROM thread_fts WHERE thread_fts MATCH :search LIMIT -1) hits
+                JOIN thread ON thread.id = hits.threadId {sql_where}
+                GROUP BY thread.id ORDER BY searchRank, thread.id DESC LIMIT :take OFFSET :skip""",
+            params,
+        )
+        for row in rows:
+            row["snippet"] = fts_snippet(row["snippet"])
+        return rows
+
+    async def query_threads_async(self, query: Dict[str, Any], user=None):
+        return await self.db.read_async(self.query_threads, query, user=user)
+
+    def _all_in(self, sql, ids, params=None):
+        """Run `sql` with its `{ids}` placeholder bound to chunks of `ids` and concatenate the rows."""
+        ids = list(ids)
+        rows = []
+        for i in range(0, len(ids), 500):
+            chunk = ids[i : i + 500]
+            args = {**(params or {}), **{f"id{n}": id for n, id in enumerate(chunk)}}
+            rows += self.db.all(sql.format(ids=",".join(f":id{n}" for n in range(len(chunk)))), args)
+        return rows
+
+    def get_thread_previews(self, thread_ids):
+        """
+        {threadId: {"messageCount", "messages"}} for a page of threads in one query, where
+        `messages` is the latest message (with the tool call it answers, if it's a result).
+        """
+        rows = self._all_in(
+            """SELECT c.threadId, c.sequence, c.message, latest.messageCount
+               FROM (SELECT threadId, count(*) AS messageCount, max(sequence) AS lastSequence
+                     FROM chat_message WHERE threadId IN ({ids}) AND active=1 GROUP BY threadId) latest
+               JOIN chat_message c ON c.threadId = latest.threadId AND c.sequence = latest.lastSequence""",
+            thread_ids,
+        )
+        previews = {}
+        for row in rows:
+            messages = [self._chat_message_dto(row)]
+            if messages[0].get("role") == "tool":
+                messages = self._expand_tool_message_boundaries(row["threadId"], messages)
+            previews[row["threadId"]] = {"messageCount": row["messageCount"], "messages": messages}
+        return previews
+
+    def get_active_agent_runs(self, thread_ids):
+        """{threadId: active run} for many threads at once, see get_active_agent_run."""
+        rows = self._all_in(
+            """SELECT * FROM agent_run WHERE id IN (
+                   SELECT max(id) FROM agent_run
+                   WHERE threadId IN ({ids}) AND status IN ('queued','running','waiting_approval')
+                   GROUP BY threadId)""",
+            thread_ids,
+        )
+        return {row["threadId"]: row for row in rows}
+
     def stored_message_count(self, id):
         """Message count without shipping the (potentially MBs of) messages to Python."""
         try:
@@ -498,6 +923,9 @@ class AppDB:
         # Filtered before guard_messages so the guard compares the final list.
         if isinstance(thread.get("messages"), list):
             thread["messages"] = [m for m in thread["messages"] if not (isinstance(m, dict) and m.get("streaming"))]
+        # only the version triggers write `version`, a client echoing a stale one back
+        # would otherwise move it backwards
+        thread.pop("version", None)
         if id:
             thread["id"] = id
             self.guard_messages(id, thread)
@@ -505,111 +933,295 @@ class AppDB:
             thread.pop("truncate", None)
             thread["createdAt"] = now
         thread["updatedAt"] = now
-        initial_timestamp = int(time.time() * 1000) + 1
         if "messages" in thread:
-            context = {}
-            if user:
-                context["user"] = user
-            for idx, m in enumerate(thread["messages"]):
-                self.ctx.cache_message_inline_data(m, context=context)
-                if "timestamp" not in m:
-                    m["timestamp"] = initial_timestamp + idx
-                # remove reasoning_details from all messages (can get huge)
-                if "reasoning_details" in m:
-                    del m["reasoning_details"]
+            self.prepare_messages(thread["messages"], user=user)
             thread["contextTokens"] = count_tokens_approx(thread["messages"])
         return with_user(thread, user=user)
 
+    def prepare_messages(self, messages, user=None):
+        initial_timestamp = int(time.time() * 1000) + 1
+        context = {}
+        if user:
+            context["user"] = user
+        for idx, m in enumerate(messages):
+            self.ctx.cache_message_inline_data(m, context=context)
+            if "timestamp" not in m:
+                m["timestamp"] = initial_timestamp + idx
+            # remove reasoning_details from all messages (can get huge)
+            if "reasoning_details" in m:
+                del m["reasoning_details"]
+            # the chat_message row position clients are given, not part of the message
+            m.pop("_sequence", None)
+        return messages
+
+    def is_normalized(self, conn, id):
+        row = self.db.exec(conn, "SELECT normalized FROM thread WHERE id=:id", {"id": id}).fetchone()
+        return bool(row and row[0])
+
+    def _insert_thread(self, conn, prepared):
+        messages = prepared.get("messages", [])
+        if self.normalized_messages:
+            prepared = {**prepared, "messages": None, "normalized": 1}
+        sql, args = self.db.insert_sql("thread", self.columns["thread"], prepared)
+        thread_id = self.db.exec(conn, sql, args).lastrowid
+        self._sync_chat_messages(conn, thread_id, messages)
+        return thread_id
+
     def create_thread(self, thread: Dict[str, Any], user=None):
         prepared = self.prepare_thread(thread, user=user)
-        keys = [k for k in self.columns["thread"] if k != "id" and k in prepared]
-        params = {k: self.db.value(prepared[k]) for k in keys}
-        with self.create_writer_connection() as conn:
-            cur = self.db.exec(
-                conn, f"INSERT INTO thread ({','.join(keys)}) VALUES ({','.join(':'+k for k in keys)})", params
-            )
-            conn.commit()
-            thread_id = cur.lastrowid
-        self.sync_chat_messages(thread_id, prepared.get("messages", []))
-        return thread_id
+        return self.db.run(lambda conn: self._insert_thread(conn, prepared))
 
     async def create_thread_async(self, thread: Dict[str, Any], user=None):
         prepared = self.prepare_thread(thread, user=user)
-        thread_id = await self.db.insert_async("thread", self.columns["thread"], prepared)
-        self.sync_chat_messages(thread_id, prepared.get("messages", []))
-        return thread_id
+        return await self.db.run_async(lambda conn: self._insert_thread(conn, prepared))
+
+    def _update_thread(self, conn, id, prepared, truncate):
+        """
+        The thread row, its superseded stream chunks and its chat_message rows are written
+        in the same writer task, so they commit together and readers never see one
+        without the others.
+        """
+        normalized = "messages" in prepared and self.is_normalized(conn, id)
+        columns = {k: v for k, v in prepared.items() if k != "messages"} if normalized else prepared
+        sql, args = self.db.update_sql("thread", self.columns["thread"], columns)
+        rowcount = self.db.exec(conn, sql, args).rowcount
+        if "streamingMessage" in prepared:
+            self._compact_stream_chunks(conn, id)
+        appended = None
+        if "messages" in prepared:
+            if truncate:
+                self._deactivate_chat_messages(conn, id)
+            # a normalized thread has no JSON copy to carry edits to messages it already has
+            appended = self._sync_chat_messages(
+                conn, id, prepared["messages"], update_changed=normalized and not truncate
+            )
+        return rowcount, appended
 
     def update_thread(self, id, thread: Dict[str, Any], user=None):
         truncate = bool(thread.get("truncate"))
         prepared = self.prepare_thread(thread, id, user=user)
-        ret = self.db.update("thread", self.columns["thread"], prepared)
-        if "messages" in prepared:
-            (self.rewrite_chat_messages if truncate else self.sync_chat_messages)(id, prepared["messages"])
-        try:
-            from . import notify_thread_update
-            notify_thread_update(id)
-        except Exception:
-            pass
+        ret, appended = self.db.run(lambda conn: self._update_thread(conn, id, prepared, truncate))
+        self.notify_thread_update(id, prepared, appended, truncate)
         return ret
 
     async def update_thread_async(self, id, thread: Dict[str, Any], user=None):
         truncate = bool(thread.get("truncate"))
         prepared = self.prepare_thread(thread, id, user=user)
-        ret = await self.db.update_async("thread", self.columns["thread"], prepared)
-        if "messages" in prepared:
-            (self.rewrite_chat_messages if truncate else self.sync_chat_messages)(id, prepared["messages"])
+        ret, appended = await self.db.run_async(lambda conn: self._update_thread(conn, id, prepared, truncate))
+        self.notify_thread_update(id, prepared, appended, truncate)
+        return ret
+
+    def notify_thread_update(self, id, changes, appended=None, rewritten=False):
         try:
             from . import notify_thread_update
-            notify_thread_update(id)
-        except Exception:
-            pass
-        return ret
+            notify_thread_update(id, changes, appended=appended, rewritten=rewritten)
+        except Exception as e:
+            self.ctx.err(f"notify_thread_update({id})", e)
+
+    async def append_stream_chunk_async(self, thread_id, stream_id, offset, delta):
+        return await self.db.insert_async(
+            "stream_chunk",
+            self.columns["stream_chunk"],
+            {
+                "threadId": thread_id, "streamId": stream_id, "offset": offset,
+                "delta": delta, "createdAt": datetime.now(),
+            },
+        )
+
+    def get_stream_chunks(self, thread_id, stream_id, offset=0):
+        """Chunks of a stream starting at or after payload `offset`, in the order they were appended."""
+        rows = self.db.all(
+            """SELECT * FROM stream_chunk
+               WHERE threadId=:threadId AND streamId=:streamId AND offset>=:offset
+               ORDER BY id""",
+            {"threadId": thread_id, "streamId": stream_id, "offset": offset},
+        )
+        for row in rows:
+            if isinstance(row.get("delta"), str):
+                row["delta"] = json.loads(row["delta"])
+        return rows
+
+    def _compact_stream_chunks(self, conn, thread_id):
+        """
+        Drop a thread's stream chunks once `streamingMessage` has been written whole, or
+        cleared because its turn was committed. Runs in the same transaction as the write
+        that replaced them, and readers only replay chunks of the stream (and from the
+        offset) the stored message names.
+        """
+        self.db.exec(conn, "DELETE FROM stream_chunk WHERE threadId=:threadId", {"threadId": thread_id})
 
     def sync_chat_messages(self, thread_id, messages, run_id=None, step_id=None):
         """Append new canonical messages without rewriting existing normalized rows.
 
-        The legacy thread.messages JSON remains during the compatibility period. Sequence
-        rows are the durable source used by runs and can be backfilled idempotently.
+        Legacy threads also keep their thread.messages JSON, normalized threads only have
+        these rows. Sequence rows are the durable source used by runs and can be
+        backfilled idempotently.
+        Returns the messages it appended, with their `_sequence`.
         """
+        return self.db.run(lambda conn: self._sync_chat_messages(conn, thread_id, messages, run_id, step_id))
+
+    def _sync_chat_messages(self, conn, thread_id, messages, run_id=None, step_id=None, update_changed=False):
         if not isinstance(messages, list):
-            return
-        with self.create_writer_connection() as conn:
-            existing = self.db.exec(
-                conn, "SELECT sequence, timestamp FROM chat_message WHERE threadId = :threadId AND active=1 ORDER BY sequence",
-                {"threadId": thread_id},
+            return []
+        messages = [m for m in messages if isinstance(m, dict) and not m.get("streaming")]
+        # only look up the timestamps being written (idx_chat_message_timestamp), so appending
+        # to a long thread doesn't read back every message it already has
+        existing = self._active_chat_messages(
+            conn, thread_id, [m["timestamp"] for m in messages if m.get("timestamp") is not None], update_changed
+        )
+        max_sequence = self.db.exec(
+            conn, "SELECT max(sequence) FROM chat_message WHERE threadId=:threadId", {"threadId": thread_id}
+        ).fetchone()[0]
+        appended, changed = [], []
+        for message in messages:
+            timestamp = message.get("timestamp")
+            if timestamp is not None and timestamp in existing:
+                if update_changed and existing[timestamp] != json.dumps(message):
+                    changed.append(message)
+                continue
+            if timestamp is not None:
+                existing[timestamp] = None
+            appended.append({**message, "_sequence": (max_sequence or 0) + len(appended) + 1})
+        self._update_chat_messages(conn, thread_id, changed)
+        self._insert_chat_messages(conn, thread_id, appended, run_id, step_id)
+        return appended
+
+    def _insert_chat_messages(self, conn, thread_id, messages, run_id=None, step_id=None):
+        """Insert `messages` at the `_sequence` each carries, in one executemany() call."""
+        now = datetime.now()
+        self.db.exec_many(
+            conn,
+            """INSERT INTO chat_message
+               (threadId,sequence,runId,stepId,role,message,timestamp,toolCallId,toolName,tokenCount,active,createdAt)
+               VALUES (?,?,?,?,?,?,?,?,?,?,1,?)""",
+            (self._chat_message_row(thread_id, message, run_id, step_id, now) for message in messages),
+        )
+
+    def _chat_message_row(self, thread_id, message, run_id, step_id, created_at):
+        stored = {k: v for k, v in message.items() if k != "_sequence"}
+        calls = message.get("tool_calls") or []
+        tool_name = (calls[0].get("function") or {}).get("name") if calls and isinstance(calls[0], dict) else None
+        return (
+            thread_id, message["_sequence"], run_id, step_id, message.get("role"), json.dumps(stored),
+            message.get("timestamp"), message.get("tool_call_id"), tool_name, count_tokens_approx([stored]), created_at,
+        )
+
+    def _active_chat_messages(self, conn, thread_id, timestamps, with_message=False):
+        """{timestamp: stored message JSON (or None)} of the thread's active rows with these timestamps."""
+        found = {}
+        column = "message" if with_message else "NULL"
+        for i in range(0, len(timestamps), 500):
+            chunk = timestamps[i : i + 500]
+            rows = self.db.exec(
+                conn,
+                f"""SELECT timestamp, {column} FROM chat_message
+                    WHERE threadId=? AND active=1 AND timestamp IN ({",".join("?" * len(chunk))})""",
+                (thread_id, *chunk),
             ).fetchall()
-            known_timestamps = {row[1] for row in existing if row[1] is not None}
-            max_sequence = self.db.exec(
-                conn, "SELECT max(sequence) FROM chat_message WHERE threadId=:threadId", {"threadId": thread_id}
-            ).fetchone()[0]
-            sequence = (max_sequence or 0) + 1
-            for message in messages:
-                if not isinstance(message, dict) or message.get("streaming"):
-                    continue
-                timestamp = message.get("timestamp")
-                if timestamp is not None and timestamp in known_timestamps:
-                    continue
-                tool_call_id = message.get("tool_call_id")
-                tool_name = None
-                calls = message.get("tool_calls") or []
-                if calls and isinstance(calls[0], dict):
-                    tool_name = (calls[0].get("function") or {}).get("name")
+            found.update((row[0], row[1]) for row in rows)
+        return found
+
+    def _update_chat_messages(self, conn, thread_id, messages, run_id=None, step_id=None):
+        """Rewrite the thread's active rows for these messages (matched by timestamp) in one executemany()."""
+        self.db.exec_many(
+            conn,
+            """UPDATE chat_message SET message=?, tokenCount=?, runId=COALESCE(runId,?), stepId=COALESCE(stepId,?)
+               WHERE threadId=? AND active=1 AND timestamp=?""",
+            (
+                (json.dumps(m), count_tokens_approx([m]), run_id, step_id, thread_id, m["timestamp"])
+                for m in messages
+            ),
+        )
+
+    def _patch_chat_messages(self, conn, thread_id, patches, run_id=None, step_id=None):
+        """Merge `patches` ({timestamp: fields}) into the thread's active messages with those timestamps."""
+        if not patches:
+            return
+        stored = self._active_chat_messages(conn, thread_id, list(patches), True)
+        self._update_chat_messages(
+            conn, thread_id, [{**json.loads(message), **patches[ts]} for ts, message in stored.items()], run_id, step_id
+        )
+
+    def _append_messages(self, conn, id, messages, changes, patches, run_id, step_id):
+        if self.is_normalized(conn, id):
+            self._patch_chat_messages(conn, id, patches, run_id, step_id)
+            appended = self._sync_chat_messages(conn, id, messages, run_id, step_id)
+            if appended:
+                # add the tokenCounts the rows were just inserted with rather than counting again
                 self.db.exec(
                     conn,
-                    """INSERT INTO chat_message
-                       (threadId,sequence,runId,stepId,role,message,timestamp,toolCallId,toolName,tokenCount,active,createdAt)
-                       VALUES (:threadId,:sequence,:runId,:stepId,:role,:message,:timestamp,:toolCallId,:toolName,:tokenCount,1,:createdAt)""",
-                    {
-                        "threadId": thread_id, "sequence": sequence, "runId": run_id, "stepId": step_id,
-                        "role": message.get("role"), "message": json.dumps(message), "timestamp": timestamp,
-                        "toolCallId": tool_call_id, "toolName": tool_name,
-                        "tokenCount": count_tokens_approx([message]), "createdAt": datetime.now(),
-                    },
+                    """UPDATE thread SET contextTokens=COALESCE(contextTokens,0)+(
+                           SELECT COALESCE(sum(tokenCount),0) FROM chat_message
+                           WHERE threadId=:id AND sequence>=:sequence AND active=1)
+                       WHERE id=:id""",
+                    {"id": id, "sequence": appended[0]["_sequence"]},
                 )
-                if timestamp is not None:
-                    known_timestamps.add(timestamp)
-                sequence += 1
-            conn.commit()
+        else:
+            # legacy threads still keep the whole conversation in `messages`
+            row = self.db.exec(conn, "SELECT messages FROM thread WHERE id=:id", {"id": id}).fetchone()
+            stored = json.loads(row[0]) if row and row[0] else []
+            for message in stored:
+                if message.get("timestamp") in patches:
+                    message.update(patches[message["timestamp"]])
+            known = {m.get("timestamp") for m in stored}
+            stored += [m for m in messages if m.get("timestamp") not in known]
+            changes = {**changes, "messages": stored, "contextTokens": count_tokens_approx(stored)}
+            self._patch_chat_messages(conn, id, patches, run_id, step_id)
+            appended = self._sync_chat_messages(conn, id, stored)
+            timestamps = [m["timestamp"] for m in messages if m.get("timestamp") is not None]
+            if timestamps and (run_id is not None or step_id is not None):
+                self._annotate_chat_messages(conn, id, timestamps, run_id, step_id)
+        sql, args = self.db.update_sql("thread", self.columns["thread"], changes)
+        rowcount = self.db.exec(conn, sql, args).rowcount
+        if "streamingMessage" in changes:
+            self._compact_stream_chunks(conn, id)
+        return rowcount, appended
+
+    async def append_messages_async(
+        self, id, messages, changes=None, patches=None, user=None, run_id=None, step_id=None
+    ):
+        """
+        Append `messages` to a thread, merge `patches` ({timestamp: fields}) into messages
+        it already has and apply `changes` to its columns, all in one writer task.
+
+        On a normalized thread this only reads and writes the rows involved, so the cost
+        of a step no longer grows with the length of the conversation. Messages whose
+        timestamps the thread already has are skipped.
+        """
+        changes = self.prepare_thread(dict(changes or {}), id, user=user)
+        messages = self.prepare_messages(
+            [m for m in messages if isinstance(m, dict) and not m.get("streaming")], user=user
+        )
+        ret, appended = await self.db.run_async(
+            lambda conn: self._append_messages(conn, id, messages, changes, patches or {}, run_id, step_id)
+        )
+        self.notify_thread_update(id, changes, appended)
+        return ret
+
+    def get_thread_messages(self, thread_id):
+        """The active conversation of a normalized thread, read from its chat_message rows."""
+        rows = self.db.all(
+            "SELECT sequence, message FROM chat_message WHERE threadId=:threadId AND active=1 ORDER BY sequence",
+            {"threadId": thread_id},
+        )
+        return [self._chat_message_dto(row) for row in rows]
+
+    def get_last_message(self, thread_id):
+        """The last message of a thread's conversation, without loading the rest of it."""
+        if self.get_thread_column(thread_id, "normalized", user="all"):
+            row = self.db.one(
+                """SELECT sequence, message FROM chat_message WHERE threadId=:threadId AND active=1
+                   ORDER BY sequence DESC LIMIT 1""",
+                {"threadId": thread_id},
+            )
+            return self._chat_message_dto(row) if row else None
+        count = self.stored_message_count(thread_id)
+        if not count:
+            return None
+        last = self.db.scalar(
+            "SELECT json_extract(messages, :path) FROM thread WHERE id=:id", {"path": f"$[{count - 1}]", "id": thread_id}
+        )
+        return json.loads(last) if last else None
 
     def get_chat_messages(self, thread_id, after=0, take=None):
         limit = " LIMIT :take" if take else ""
@@ -707,40 +1319,99 @@ class AppDB:
                 expanded.append(message)
         return expanded
 
+    def _deactivate_chat_messages(self, conn, thread_id):
+        self.db.exec(conn, "UPDATE chat_message SET active=0 WHERE threadId=:threadId AND active=1", {"threadId": thread_id})
+        self.db.exec(conn, "DELETE FROM context_snapshot WHERE threadId=:threadId", {"threadId": thread_id})
+
     def rewrite_chat_messages(self, thread_id, messages):
         """Start a new active history branch while preserving prior rows for audit."""
-        with self.create_writer_connection() as conn:
-            self.db.exec(conn, "UPDATE chat_message SET active=0 WHERE threadId=:threadId AND active=1", {"threadId": thread_id})
-            self.db.exec(conn, "DELETE FROM context_snapshot WHERE threadId=:threadId", {"threadId": thread_id})
-            conn.commit()
-        self.sync_chat_messages(thread_id, messages)
+
+        def rewrite(conn):
+            self._deactivate_chat_messages(conn, thread_id)
+            return self._sync_chat_messages(conn, thread_id, messages)
+
+        return self.db.run(rewrite)
+
+    def _annotate_chat_messages(self, conn, thread_id, timestamps, run_id, step_id):
+        # each lookup is a seek on idx_chat_message_timestamp
+        self.db.exec_many(conn, """UPDATE chat_message SET
+            runId=COALESCE(runId,?), stepId=COALESCE(stepId,?)
+            WHERE threadId=? AND active=1 AND timestamp=?""",
+            ((run_id, step_id, thread_id, timestamp) for timestamp in timestamps))
 
     def annotate_chat_messages(self, thread_id, messages, run_id=None, step_id=None):
         timestamps = [m.get("timestamp") for m in messages if isinstance(m, dict) and m.get("timestamp") is not None]
         if not timestamps or (run_id is None and step_id is None):
             return
-        with self.create_writer_connection() as conn:
-            for timestamp in timestamps:
-                self.db.exec(conn, """UPDATE chat_message SET
-                    runId=COALESCE(runId,:runId), stepId=COALESCE(stepId,:stepId)
-                    WHERE threadId=:threadId AND timestamp=:timestamp AND active=1""",
-                    {"runId": run_id, "stepId": step_id, "threadId": thread_id, "timestamp": timestamp})
-            conn.commit()
+        self.db.run(lambda conn: self._annotate_chat_messages(conn, thread_id, timestamps, run_id, step_id))
+
+    async def annotate_chat_messages_async(self, thread_id, messages, run_id=None, step_id=None):
+        timestamps = [m.get("timestamp") for m in messages if isinstance(m, dict) and m.get("timestamp") is not None]
+        if not timestamps or (run_id is None and step_id is None):
+            return
+        await self.db.run_async(lambda conn: self._annotate_chat_messages(conn, thread_id, timestamps, run_id, step_id))
 
     def backfill_chat_messages(self, thread_id):
         row = self.db.one("SELECT messages FROM thread WHERE id=:id", {"id": thread_id})
         if row and isinstance(row.get("messages"), str):
             self.sync_chat_messages(thread_id, json.loads(row["messages"]))
 
-    def create_agent_run(self, thread_id, user, model, max_steps=250):
+    def _migrate_thread_messages(self, conn, thread_id, drop_json):
+        row = self.db.exec(conn, "SELECT messages, normalized FROM thread WHERE id=:id", {"id": thread_id}).fetchone()
+        if not row or row[1]:
+            return "skipped"
+        messages = [m for m in (json.loads(row[0]) if row[0] else []) if isinstance(m, dict) and not m.get("streaming")]
+        result = "migrated"
+        # rows were only ever appended, bring edits made to the JSON copy across
+        self._sync_chat_messages(conn, thread_id, messages, update_changed=True)
+        timestamps = [
+            r[0] for r in self.db.exec(
+                conn, "SELECT timestamp FROM chat_message WHERE threadId=:threadId AND active=1 ORDER BY sequence",
+                {"threadId": thread_id},
+            ).fetchall()
+        ]
+        if timestamps != [m.get("timestamp") for m in messages]:
+            # rows that don't line up with the JSON (missing timestamps, reordered or
+            # dropped messages) start a new active branch copied from it
+            self._deactivate_chat_messages(conn, thread_id)
+            self._sync_chat_messages(conn, thread_id, messages)
+            result = "rewritten"
+        if drop_json:
+            self.db.exec(conn, "UPDATE thread SET normalized=1, messages=NULL WHERE id=:id", {"id": thread_id})
+        return result
+
+    def migrate_thread_messages(self, thread_id, drop_json=True):
+        """
+        Make a legacy thread's chat_message rows match its `messages` JSON and, unless
+        `drop_json` is False, mark it normalized and drop the JSON copy.
+        Returns "migrated", "rewritten" (rows had to be rebuilt) or "skipped".
+        """
+        return self.db.run(lambda conn: self._migrate_thread_messages(conn, thread_id, drop_json))
+
+    def migrate_messages(self, drop_json=True):
+        """Migrate every legacy thread, see migrate_thread_messages. Returns counts by result."""
+        results = {}
+        for thread_id in self.db.column("SELECT id FROM thread WHERE normalized IS NULL OR normalized=0 ORDER BY id"):
+            try:
+                result = self.migrate_thread_messages(thread_id, drop_json=drop_json)
+            except Exception as e:
+                self.ctx.err(f"migrate_thread_messages({thread_id})", e)
+                result = "failed"
+            results[result] = results.get(result, 0) + 1
+        return results
+
+    def _insert_agent_run(self, conn, thread_id, user, model, max_steps):
         now = datetime.now()
-        with self.create_writer_connection() as conn:
-            cur = self.db.exec(conn, """INSERT INTO agent_run
-                (threadId,user,status,nextAction,model,stepCount,sliceCount,maxSteps,nextAttemptAt,createdAt,updatedAt)
-                VALUES (:threadId,:user,'queued','model',:model,0,0,:maxSteps,:now,:now,:now)""",
-                {"threadId": thread_id, "user": user, "model": model, "maxSteps": max_steps, "now": now})
-            conn.commit()
-            return cur.lastrowid
+        return self.db.exec(conn, """INSERT INTO agent_run
+            (threadId,user,status,nextAction,model,stepCount,sliceCount,maxSteps,nextAttemptAt,createdAt,updatedAt)
+            VALUES (:threadId,:user,'queued','model',:model,0,0,:maxSteps,:now,:now,:now)""",
+            {"threadId": thread_id, "user": user, "model": model, "maxSteps": max_steps, "now": now}).lastrowid
+
+    def create_agent_run(self, thread_id, user, model, max_steps=250):
+        return self.db.run(lambda conn: self._insert_agent_run(conn, thread_id, user, model, max_steps))
+
+    async def create_agent_run_async(self, thread_id, user, model, max_steps=250):
+        return await self.db.run_async(lambda conn: self._insert_agent_run(conn, thread_id, user, model, max_steps))
 
     def get_agent_run(self, run_id, user=None):
         sql_where, params = self.get_user_filter(user, {"id": run_id})
@@ -755,28 +1426,29 @@ class AppDB:
             "AND status IN ('queued','running','waiting_approval') ORDER BY id DESC LIMIT 1", params
         )
 
+    def _requeue_interrupted_agent_runs(self):
+        now = datetime.now()
+        return lambda conn: self.db.exec(
+            conn,
+            """UPDATE agent_run
+               SET status='queued', leaseOwner=NULL, leaseExpiresAt=NULL, updatedAt=:now
+               WHERE status='running'""",
+            {"now": now},
+        ).rowcount
+
     def requeue_interrupted_agent_runs(self):
         """Recover work left running when the previous in-process scheduler stopped."""
-        now = datetime.now()
-        with self.create_writer_connection() as conn:
-            cur = self.db.exec(
-                conn,
-                """UPDATE agent_run
-                   SET status='queued', leaseOwner=NULL, leaseExpiresAt=NULL, updatedAt=:now
-                   WHERE status='running'""",
-                {"now": now},
-            )
-            conn.commit()
-            return cur.rowcount
+        return self.db.run(self._requeue_interrupted_agent_runs())
 
-    def claim_agent_runs(self, owner, limit=1, lease_seconds=300):
-        """Atomically claim eligible queued runs for one bounded in-process worker."""
-        if limit <= 0:
-            return []
+    async def requeue_interrupted_agent_runs_async(self):
+        return await self.db.run_async(self._requeue_interrupted_agent_runs())
+
+    def _claim_agent_runs(self, owner, limit, lease_seconds):
         now = datetime.now()
         lease_expires = now + timedelta(seconds=max(30, lease_seconds))
-        claimed = []
-        with self.create_writer_connection() as conn:
+
+        def claim(conn):
+            claimed = []
             rows = self.db.exec(
                 conn,
                 """SELECT id FROM agent_run
@@ -795,32 +1467,55 @@ class AppDB:
                 )
                 if cur.rowcount:
                     claimed.append(run_id)
-            conn.commit()
-        return [self.get_agent_run(run_id, user="all") for run_id in claimed]
+            return claimed
 
-    def renew_agent_run_lease(self, run_id, owner, lease_seconds=300):
+        return claim
+
+    def get_agent_runs(self, run_ids):
+        return [self.get_agent_run(run_id, user="all") for run_id in run_ids]
+
+    def claim_agent_runs(self, owner, limit=1, lease_seconds=300):
+        """Atomically claim eligible queued runs for one bounded in-process worker."""
+        if limit <= 0:
+            return []
+        return self.get_agent_runs(self.db.run(self._claim_agent_runs(owner, limit, lease_seconds)))
+
+    async def claim_agent_runs_async(self, owner, limit=1, lease_seconds=300):
+        if limit <= 0:
+            return []
+        run_ids = await self.db.run_async(self._claim_agent_runs(owner, limit, lease_seconds))
+        return await self.db.read_async(self.get_agent_runs, run_ids) if run_ids else []
+
+    def _renew_agent_run_lease(self, run_id, owner, lease_seconds):
         now = datetime.now()
-        with self.create_writer_connection() as conn:
-            cur = self.db.exec(
-                conn,
-                """UPDATE agent_run
-                   SET leaseExpiresAt=:leaseExpiresAt, updatedAt=:now
-                   WHERE id=:id AND status='running' AND leaseOwner=:owner""",
-                {
-                    "id": run_id,
-                    "owner": owner,
-                    "leaseExpiresAt": now + timedelta(seconds=max(30, lease_seconds)),
-                    "now": now,
-                },
-            )
-            conn.commit()
-            return cur.rowcount
+        return lambda conn: self.db.exec(
+            conn,
+            """UPDATE agent_run
+               SET leaseExpiresAt=:leaseExpiresAt, updatedAt=:now
+               WHERE id=:id AND status='running' AND leaseOwner=:owner""",
+            {
+                "id": run_id,
+                "owner": owner,
+                "leaseExpiresAt": now + timedelta(seconds=max(30, lease_seconds)),
+                "now": now,
+            },
+        ).rowcount
+
+    def renew_agent_run_lease(self, run_id, owner, lease_seconds=300):
+        return self.db.run(self._renew_agent_run_lease(run_id, owner, lease_seconds))
+
+    async def renew_agent_run_lease_async(self, run_id, owner, lease_seconds=300):
+        return await self.db.run_async(self._renew_agent_run_lease(run_id, owner, lease_seconds))
 
     def update_agent_run(self, run_id, values):
         values = {**values, "id": run_id, "updatedAt": datetime.now()}
         return self._update_durable_row("agent_run", run_id, values)
 
-    def create_agent_step(self, run_id, sequence, step_type, status="running", **values):
+    async def update_agent_run_async(self, run_id, values):
+        values = {**values, "id": run_id, "updatedAt": datetime.now()}
+        return await self._update_durable_row_async("agent_run", run_id, values)
+
+    def _insert_agent_step(self, run_id, sequence, step_type, status, values):
         now = datetime.now()
         data = {
             "runId": run_id, "sequence": sequence, "type": step_type, "status": status,
@@ -828,31 +1523,42 @@ class AppDB:
         }
         keys = [k for k in self.columns["agent_step"] if k != "id" and k in data]
         params = {k: self.db.value(data[k]) for k in keys}
-        with self.create_writer_connection() as conn:
-            cur = self.db.exec(
-                conn,
-                f"INSERT INTO agent_step ({','.join(keys)}) VALUES ({','.join(':'+k for k in keys)})",
-                params,
-            )
-            conn.commit()
-            return cur.lastrowid
+        return lambda conn: self.db.exec(
+            conn,
+            f"INSERT INTO agent_step ({','.join(keys)}) VALUES ({','.join(':'+k for k in keys)})",
+            params,
+        ).lastrowid
+
+    def create_agent_step(self, run_id, sequence, step_type, status="running", **values):
+        return self.db.run(self._insert_agent_step(run_id, sequence, step_type, status, values))
+
+    async def create_agent_step_async(self, run_id, sequence, step_type, status="running", **values):
+        return await self.db.run_async(self._insert_agent_step(run_id, sequence, step_type, status, values))
 
     def update_agent_step(self, step_id, values):
         return self._update_durable_row("agent_step", step_id, values)
 
-    def _update_durable_row(self, table, row_id, values):
+    async def update_agent_step_async(self, step_id, values):
+        return await self._update_durable_row_async("agent_step", step_id, values)
+
+    def _durable_row_update(self, table, row_id, values):
         columns = self.columns[table]
         keys = [k for k in values if k in columns and k != "id"]
         if not keys:
-            return 0
+            return None
         params = {k: self.db.value(values[k]) for k in keys}
         params["id"] = row_id
-        with self.create_writer_connection() as conn:
-            cur = self.db.exec(
-                conn, f"UPDATE {table} SET {','.join(k+'=:'+k for k in keys)} WHERE id=:id", params
-            )
-            conn.commit()
-            return cur.rowcount
+        return lambda conn: self.db.exec(
+            conn, f"UPDATE {table} SET {','.join(k+'=:'+k for k in keys)} WHERE id=:id", params
+        ).rowcount
+
+    def _update_durable_row(self, table, row_id, values):
+        update = self._durable_row_update(table, row_id, values)
+        return self.db.run(update) if update else 0
+
+    async def _update_durable_row_async(self, table, row_id, values):
+        update = self._durable_row_update(table, row_id, values)
+        return await self.db.run_async(update) if update else 0
 
     def get_agent_steps(self, run_id, after=0):
         rows = self.db.all(
@@ -861,21 +1567,28 @@ class AppDB:
         )
         return [self.to_dto(row, ["input", "output"]) for row in rows]
 
-    def create_context_snapshot(self, thread_id, run_id, from_sequence, to_sequence, summary, model=None):
-        previous = self.db.scalar(
-            "SELECT max(version) FROM context_snapshot WHERE threadId=:threadId", {"threadId": thread_id}
-        ) or 0
+    def _insert_context_snapshot(self, thread_id, run_id, from_sequence, to_sequence, summary, model):
         now = datetime.now()
-        with self.create_writer_connection() as conn:
-            cur = self.db.exec(conn, """INSERT INTO context_snapshot
-                (threadId,runId,version,fromSequence,toSequence,summary,tokenCount,model,createdAt)
-                VALUES (:threadId,:runId,:version,:fromSequence,:toSequence,:summary,:tokenCount,:model,:createdAt)""",
-                {"threadId": thread_id, "runId": run_id, "version": previous + 1,
-                 "fromSequence": from_sequence, "toSequence": to_sequence,
-                 "summary": json.dumps(summary), "tokenCount": count_tokens_approx(summary),
-                 "model": model, "createdAt": now})
-            conn.commit()
-            return cur.lastrowid
+        # version is assigned inside the writer task so concurrent snapshots can't collide
+        return lambda conn: self.db.exec(conn, """INSERT INTO context_snapshot
+            (threadId,runId,version,fromSequence,toSequence,summary,tokenCount,model,createdAt)
+            VALUES (:threadId,:runId,
+                (SELECT COALESCE(max(version),0)+1 FROM context_snapshot WHERE threadId=:threadId),
+                :fromSequence,:toSequence,:summary,:tokenCount,:model,:createdAt)""",
+            {"threadId": thread_id, "runId": run_id,
+             "fromSequence": from_sequence, "toSequence": to_sequence,
+             "summary": json.dumps(summary), "tokenCount": count_tokens_approx(summary),
+             "model": model, "createdAt": now}).lastrowid
+
+    def create_context_snapshot(self, thread_id, run_id, from_sequence, to_sequence, summary, model=None):
+        return self.db.run(
+            self._insert_context_snapshot(thread_id, run_id, from_sequence, to_sequence, summary, model)
+        )
+
+    async def create_context_snapshot_async(self, thread_id, run_id, from_sequence, to_sequence, summary, model=None):
+        return await self.db.run_async(
+            self._insert_context_snapshot(thread_id, run_id, from_sequence, to_sequence, summary, model)
+        )
 
     def get_latest_context_snapshot(self, thread_id):
         row = self.db.one(
@@ -884,10 +1597,11 @@ class AppDB:
         )
         return self.to_dto(row, ["summary"]) if row else None
 
-    def delete_thread(self, id, user=None, callback=None):
+    def _thread_delete(self, id, user=None):
         sql_where, params = self.get_user_filter(user, {"id": id})
         joiner = " AND " if sql_where else " WHERE "
-        with self.create_writer_connection() as conn:
+
+        def delete(conn):
             allowed = self.db.exec(conn, f"SELECT id FROM thread {sql_where}{joiner}id=:id", params).fetchone()
             if not allowed:
                 return 0
@@ -895,11 +1609,19 @@ class AppDB:
             self.db.exec(conn, "DELETE FROM agent_run WHERE threadId=:id", {"id": id})
             self.db.exec(conn, "DELETE FROM context_snapshot WHERE threadId=:id", {"id": id})
             self.db.exec(conn, "DELETE FROM chat_message WHERE threadId=:id", {"id": id})
-            cur = self.db.exec(conn, "DELETE FROM thread WHERE id=:id", {"id": id})
-            conn.commit()
-            if callback:
-                callback(None, cur.rowcount)
-            return cur.rowcount
+            self.db.exec(conn, "DELETE FROM stream_chunk WHERE threadId=:id", {"id": id})
+            return self.db.exec(conn, "DELETE FROM thread WHERE id=:id", {"id": id}).rowcount
+
+        return delete
+
+    def delete_thread(self, id, user=None, callback=None):
+        rowcount = self.db.run(self._thread_delete(id, user))
+        if rowcount and callback:
+            callback(None, rowcount)
+        return rowcount
+
+    async def delete_thread_async(self, id, user=None):
+        return await self.db.run_async(self._thread_delete(id, user))
 
     def query_requests(self, query: Dict[str, Any], user=None):
         try:
@@ -940,9 +1662,20 @@ class AppDB:
                 where_conds.append("(title LIKE :q)")
                 params["q"] = f"%{query['q']}%"
 
+            if "search" in query:
+                if self.search:
+                    where_conds.append("id IN (SELECT rowid FROM request_fts WHERE request_fts MATCH :search)")
+                    params["search"] = fts_query(query["search"]) or '""'
+                else:
+                    where_conds.append("(title LIKE :search)")
+                    params["search"] = f"%{query['search']}%"
+
             if "month" in query:
-                where_conds.append("strftime('%Y-%m', createdAt) = :month")
-                params["month"] = query["month"]
+                # a createdAt range rather than strftime() so it's a seek on (user, createdAt)
+                year, month = (int(x) for x in query["month"].split("-"))
+                where_conds.append("createdAt >= :monthStart AND createdAt < :monthEnd")
+                params["monthStart"] = f"{year:04d}-{month:02d}-01"
+                params["monthEnd"] = f"{year + month // 12:04d}-{month % 12 + 1:02d}-01"
 
             full_where = ("WHERE " + " AND ".join(where_conds)) if where_conds else ""
 
@@ -956,104 +1689,89 @@ class AppDB:
             self.ctx.err(f"query_requests ({take}, {skip})", e)
             return []
 
+    async def query_requests_async(self, query: Dict[str, Any], user=None):
+        return await self.db.read_async(self.query_requests, query, user=user)
+
     def get_request_summary(self, user=None):
         try:
             sql_where, params = self.get_user_filter(user)
-            # Use strftime to format date as YYYY-MM-DD
             sql = f"""
                 SELECT
-                    strftime('%Y-%m-%d', createdAt) as date,
-                    count(id) as requests,
+                    day as date,
+                    sum(requests) as requests,
                     sum(cost) as cost,
                     sum(inputTokens) as inputTokens,
                     sum(outputTokens) as outputTokens
-                FROM request
+                FROM request_usage
                 {sql_where}
-                GROUP BY date
-                ORDER BY date
+                GROUP BY day
+                ORDER BY day
             """
             return self.db.all(sql, params)
         except Exception as e:
             self.ctx.err(f"get_request_summary ({user})", e)
             return []
 
+    async def get_request_summary_async(self, user=None):
+        return await self.db.read_async(self.get_request_summary, user=user)
+
     def get_daily_request_summary(self, day, user=None):
         try:
             sql_where, params = self.get_user_filter(user)
             # Add date filter
             if sql_where:
-                sql_where += " AND strftime('%Y-%m-%d', createdAt) = :day"
+                sql_where += " AND day = :day"
             else:
-                sql_where = "WHERE strftime('%Y-%m-%d', createdAt) = :day"
+                sql_where = "WHERE day = :day"
             params["day"] = day
 
-            # Model aggregation
-            sql_model = f"""
-                SELECT
-                    model,
-                    count(id) as count,
-                    sum(cost) as cost,
-                    sum(duration) as duration,
-                    sum(inputTokens + outputTokens) as tokens,
-                    sum(inputTokens) as inputTokens,
-                    sum(outputTokens) as outputTokens
-                FROM request
-                {sql_where}
-                GROUP BY model
-            """
-            model_data = {}
-            for row in self.db.all(sql_model, params):
-                model_data[row["model"]] = {
-                    "cost": row["cost"] or 0,
-                    "count": row["count"],
-                    "duration": row["duration"] or 0,
-                    "tokens": row["tokens"] or 0,
-                    "inputTokens": row["inputTokens"] or 0,
-                    "outputTokens": row["outputTokens"] or 0,
-                }
-
-            # Provider aggregation
-            sql_provider = f"""
-                SELECT
-                    provider,
-                    count(id) as count,
-                    sum(cost) as cost,
-                    sum(duration) as duration,
-                    sum(inputTokens + outputTokens) as tokens,
-                    sum(inputTokens) as inputTokens,
-                    sum(outputTokens) as outputTokens
-                FROM request
-                {sql_where}
-                AND provider IS NOT NULL
-                GROUP BY provider
-            """
-            provider_data = {}
-            for row in self.db.all(sql_provider, params):
-                provider_data[row["provider"]] = {
-                    "cost": row["cost"] or 0,
-                    "count": row["count"],
-                    "duration": row["duration"] or 0,
-                    "tokens": row["tokens"] or 0,
-                    "inputTokens": row["inputTokens"] or 0,
-                    "outputTokens": row["outputTokens"] or 0,
+            def aggregate(column):
+                sql = f"""
+                    SELECT
+                        NULLIF({column}, '') as {column},
+                        sum(requests) as count,
+                        sum(cost) as cost,
+                        sum(duration) as duration,
+                        sum(inputTokens + outputTokens) as tokens,
+                        sum(inputTokens) as inputTokens,
+                        sum(outputTokens) as outputTokens
+                    FROM request_usage
+                    {sql_where}
+                    GROUP BY {column}
+                """
+                return {
+                    row[column]: {
+                        "cost": row["cost"] or 0,
+                        "count": row["count"],
+                        "duration": row["duration"] or 0,
+                        "tokens": row["tokens"] or 0,
+                        "inputTokens": row["inputTokens"] or 0,
+                        "outputTokens": row["outputTokens"] or 0,
+                    }
+                    for row in self.db.all(sql, params)
                 }
 
-            return {"modelData": model_data, "providerData": provider_data}
+            provider_data = aggregate("provider")
+            provider_data.pop(None, None)
+            return {"modelData": aggregate("model"), "providerData": provider_data}
         except Exception as e:
             self.ctx.err(f"get_daily_request_summary ({day}, {user})", e)
             return {"modelData": {}, "providerData": {}}
 
+    async def get_daily_request_summary_async(self, day, user=None):
+        return await self.db.read_async(self.get_daily_request_summary, day, user=user)
+
     def get_users_summary(self):
         try:
             sql = """
                 SELECT
                     COALESCE(NULLIF(user, ''), 'Anonymous') as user,
-                    count(id) as requests,
+                    sum(requests) as requests,
                     sum(cost) as cost,
                     sum(inputTokens) as inputTokens,
                     sum(outputTokens) as outputTokens,
-                    max(createdAt) as lastActive
-                FROM request
+                    max(lastActive) as lastActive
+                FROM request_usage
                 GROUP BY COALESCE(NULLIF(user, ''), 'Anonymous')
                 ORDER BY requests DESC
             """
@@ -1073,15 +1791,21 @@ class AppDB:
             self.ctx.err("get_users_summary", e)
             return []
 
+    async def get_users_summary_async(self):
+        return await self.db.read_async(self.get_users_summary)
+
     def get_users_list(self):
         try:
-            sql = "SELECT DISTINCT COALESCE(NULLIF(user, ''), 'Anonymous') as user FROM request ORDER BY user"
+            sql = "SELECT DISTINCT COALESCE(NULLIF(user, ''), 'Anonymous') as user FROM request_usage ORDER BY user"
             rows = self.db.all(sql)
             return [r["user"] for r in rows if r.get("user")]
         except Exception as e:
             self.ctx.err("get_users_list", e)
             return []
 
+    async def get_users_list_async(self):
+        return await self.db.read_async(self.get_users_list)
+
     def create_request(self, request: Dict[str, Any], user=None):
         request["createdAt"] = request["updatedAt"] = datetime.now()
         return self.db.insert("request", self.columns["request"], with_user(request, user=user))
@@ -1108,11 +1832,10 @@ class AppDB:
         if self._closed:
             return
         self._closed = True
-        self.db.close()
 
         # Durable agent runs were requeued by AgentScheduler.stop(). Keep their
         # threads resumable; only legacy/non-durable unfinished work is terminal.
-        with self.db.create_writer_connection() as conn:
+        def shutdown(conn):
             conn.execute(
                 """UPDATE thread
                    SET completedAt=NULL, error=NULL, streamingMessage=NULL,
@@ -1144,7 +1867,16 @@ class AppDB:
                    )""",
                 {"completedAt": datetime.now().isoformat(" "), "error": "Server Shutdown"},
             )
+            conn.execute(
+                "DELETE FROM stream_chunk WHERE threadId IN (SELECT id FROM thread WHERE streamingMessage IS NULL)"
+            )
             conn.execute(
                 "UPDATE request SET completedAt=:completedAt, error=:error WHERE completedAt IS NULL",
                 {"completedAt": datetime.now().isoformat(" "), "error": "Server Shutdown"},
             )
+
+        # queued behind any writes still pending, then the writer thread is stopped
+        try:
+            self.db.run(shutdown)
+        finally:
+            self.db.close()
@@ -80,10 +80,11 @@ const RecentResults = {
 
             loading.value = true
             try {
+                // newest-first listings page on the last id seen; ranked search results by offset
+                const last = threads.value[threads.value.length - 1]
                 const query = {
                     take,
-                    skip,
-                    ...(props.q ? { q: props.q } : {})
+                    ...(props.q ? { search: props.q, skip } : last ? { before: last.id } : {})
                 }
 
                 const results = await ctx.threads.query(query)
@@ -128,6 +129,8 @@ const RecentResults = {
         const snippet = (t) => {
             const highlight = (s) => clean(s).replace(new RegExp(`(${query.replace(/[.*+?^${}()|[\]\\]/g, '\\$&')})`, 'gi'), `<mark>$1</mark>`)
             const query = normalized(props.q)
+            // ranked search results come with their match highlighted by the server
+            if (query && t.snippet) return t.snippet
             if (!query) return (t.messages && t.messages.length) ? highlight(t.messages[t.messages.length - 1].content) : ''
 
             // Check title
@@ -116,6 +116,32 @@ function mergeWindowMessages(existing, incoming, preserve = 'auto') {
     return [...messages, ...streaming]
 }
 
+// Mirrors apply_stream_delta() in llms/main.py: text fields are appended to and
+// tool calls are addressed by position, extending an existing call or adding a new one.
+function applyStreamDelta(message, delta, length) {
+    const next = { ...message, streamOffset: (message.streamOffset || 0) + length }
+    for (const [key, value] of Object.entries(delta || {})) {
+        if (key !== 'tool_calls') {
+            next[key] = (next[key] || '') + value
+            continue
+        }
+        const toolCalls = [...(next.tool_calls || [])]
+        for (const { index, ...tc } of value) {
+            if (index >= toolCalls.length) {
+                toolCalls.push(tc)
+                continue
+            }
+            const fn = { ...(toolCalls[index].function || {}) }
+            for (const k of ['name', 'arguments']) {
+                if (tc.function?.[k]) fn[k] = (fn[k] || '') + tc.function[k]
+            }
+            toolCalls[index] = { ...toolCalls[index], function: fn }
+        }
+        next.tool_calls = toolCalls
+    }
+    return next
+}
+
 async function loadMessageRange({ after = null, before = null, take = 100 } = {}) {
     const thread = currentThread.value
     if (!thread?.id) return null
@@ -239,12 +265,77 @@ function startSse(generation, config) {
         }
     }
 
+    const updateCurrent = (event, update) => {
+        if (generation !== watchGeneration) return
+        markHealthy()
+        const current = currentThread.value
+        if (!current?.id) return
+        try {
+            const next = update(current, JSON.parse(event.data))
+            if (next) currentThread.value = next
+        } catch (e) {
+            console.warn(`Ignoring invalid ${event.type} event`, e)
+        }
+    }
+
+    const applyStreamingChunk = event => updateCurrent(event, (current, chunk) => {
+        const messages = current.messages || []
+        const last = messages[messages.length - 1]
+        const committed = last?.streaming ? messages.slice(0, -1) : messages
+        if (chunk.delta === undefined) {
+            // the in-flight message was written whole, or cleared once its turn committed
+            return { ...current, messages: chunk.message ? [...committed, chunk.message] : committed }
+        }
+        if (!last?.streaming || last.streamId !== chunk.streamId || last.streamOffset > chunk.offset) return null
+        if (last.streamOffset !== chunk.offset) {
+            // missed part of the stream, resync with the whole thread
+            fetchThread(current.id)
+            return null
+        }
+        return { ...current, messages: [...committed, applyStreamDelta(last, chunk.delta, chunk.length)] }
+    })
+
+    const applyMessagesAppended = event => updateCurrent(event, (current, { messages: appended }) => {
+        const streaming = (current.messages || []).filter(x => x.streaming)
+        const messages = mergeWindowMessages(current.messages, [...appended, ...streaming])
+        const lastSequence = Math.max(current.messageWindow?.lastSequence || 0, ...appended.map(x => x._sequence || 0))
+        return {
+            ...current,
+            messages,
+            messageCount: (current.messageCount || 0) + appended.length,
+            messageWindow: current.messageWindow
+                ? {
+                    ...current.messageWindow,
+                    messageCount: (current.messageWindow.messageCount || 0) + appended.length,
+                    lastSequence,
+                    ranges: rangesFor(messages),
+                }
+                : current.messageWindow,
+        }
+    })
+
+    const applyStatusChanged = event => updateCurrent(event, (current, changes) => {
+        const next = { ...current, ...changes }
+        const index = threads.value.findIndex(t => t.id === current.id)
+        if (index !== -1) threads.value[index] = { ...threads.value[index], ...changes }
+        return next
+    })
+
     source.addEventListener('connected', event => {
         connected = true
         clearTimeout(sseConnectTimer)
         applyEvent(event)
     })
+    source.addEventListener('resumed', () => {
+        connected = true
+        clearTimeout(sseConnectTimer)
+        markHealthy()
+    })
     source.addEventListener('thread', applyEvent)
+    source.addEventListener('completed', applyEvent)
+    source.addEventListener('streaming-chunk', applyStreamingChunk)
+    source.addEventListener('message-appended', applyMessagesAppended)
+    source.addEventListener('status-changed', applyStatusChanged)
     source.addEventListener('heartbeat', markHealthy)
     source.onerror = () => {
         if (!connected) {
@@ -1,9 +1,16 @@
+import bisect
+import contextlib
+import mmap
+import os
+import re
+import shutil
 from collections import defaultdict
+from dataclasses import dataclass
 from pathlib import Path
 from typing import Annotated, Any, List, Literal, get_args
 
 from .base import BaseTool, CLIResult, ToolError, ToolResult
-from .run import maybe_truncate, run
+from .run import MAX_RESPONSE_LEN, maybe_truncate, run
 
 Command_20250124 = Literal[
     "view",
@@ -21,6 +28,174 @@ Command_20250728 = Literal[
 ]
 SNIPPET_LINES: int = 4
 
+# Files larger than this are viewed and edited through mmap instead of being read whole
+LARGE_FILE_BYTES: int = 1024 * 1024
+LINE_INDEX_BLOCK: int = 1024 * 1024
+# Enough bytes to fill a response, a UTF-8 character takes at most 4
+VIEW_READ_BYTES: int = (MAX_RESPONSE_LEN + 1) * 4
+COPY_CHUNK_BYTES: int = 4 * 1024 * 1024
+
+
+class LineIndex:
+    """
+    Where the lines of a large file start, so a range of lines can be read without reading
+    the lines before it. Keeps the number of newlines before a checkpoint every
+    LINE_INDEX_BLOCK bytes and finds lines between checkpoints on demand.
+    """
+
+    def __init__(self, offsets: list[int], lines: list[int], newlines: int):
+        self.offsets = offsets  # checkpoint byte offsets, starting at 0
+        self.lines = lines  # newlines before each checkpoint
+        self.newlines = newlines
+
+    @classmethod
+    def build(cls, data: mmap.mmap):
+        offsets, lines, newlines = [], [], 0
+        for offset in range(0, max(len(data), 1), LINE_INDEX_BLOCK):
+            offsets.append(offset)
+            lines.append(newlines)
+            newlines += data[offset : offset + LINE_INDEX_BLOCK].count(b"\n")
+        return cls(offsets, lines, newlines)
+
+    @property
+    def line_count(self) -> int:
+        return self.newlines + 1
+
+    def offset(self, data: mmap.mmap, line: int) -> int:
+        """Byte offset where (0-based) line starts."""
+        if line <= 0:
+            return 0
+        # the last checkpoint before the line-th newline
+        i = bisect.bisect_left(self.lines, line) - 1
+        pos = self.offsets[i]
+        for _ in range(line - self.lines[i]):
+            pos = data.find(b"\n", pos) + 1
+        return pos
+
+    def line_at(self, data: mmap.mmap, offset: int) -> int:
+        """The (0-based) line the byte at offset is on."""
+        i = bisect.bisect_right(self.offsets, offset) - 1
+        return self.lines[i] + data[self.offsets[i] : offset].count(b"\n")
+
+    def spliced(self, start: int, old: bytes, new: bytes):
+        """The index after the bytes `old` at start were replaced with `new`."""
+        end = start + len(old)
+        shift, line_shift = len(new) - len(old), new.count(b"\n") - old.count(b"\n")
+        offsets, lines = [], []
+        for offset, line in zip(self.offsets, self.lines):
+            if offset <= start:
+                offsets.append(offset)
+                lines.append(line)
+            elif offset >= end:
+                offsets.append(offset + shift)
+                lines.append(line + line_shift)
+        return LineIndex(offsets, lines, self.newlines + line_shift)
+
+
+# {path: (mtime_ns, size, LineIndex)} of recently used large files
+_line_indexes: dict[Path, tuple[int, int, LineIndex]] = {}
+
+
+def line_index(path: Path, data: mmap.mmap) -> LineIndex:
+    """The LineIndex of path, built the first time it's needed for its current mtime and size."""
+    stat = path.stat()
+    cached = _line_indexes.get(path)
+    if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+    index = LineIndex.build(data)
+    remember_line_index(path, index)
+    return index
+
+
+def remember_line_index(path: Path, index: LineIndex):
+    stat = path.stat()
+    _line_indexes.pop(path, None)
+    _line_indexes[path] = (stat.st_mtime_ns, stat.st_size, index)
+    while len(_line_indexes) > 16:
+        _line_indexes.pop(next(iter(_line_indexes)))
+
+
+@contextlib.contextmanager
+def map_file(path: Path):
+    """A read-only mmap of path, or no bytes for an empty file, which can't be mapped."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+
+
+def decode(data: bytes) -> str:
+    return data.decode(errors="replace").replace("\r\n", "\n")
+
+
+def find_occurrences(data: mmap.mmap, text: str, limit: int = 100) -> list[tuple[int, int, str]]:
+    """
+    Up to limit occurrences of text in data as (start, end, indent): the bytes start:end
+    hold it. Views show tabs expanded, so text that isn't there verbatim also matches where
+    the file's tabs expand to it. When it starts part way into a tab, indent is the spaces
+    the tab expands to before it, which a replacement has to keep.
+    """
+    old = text.encode()
+    found, pos = [], data.find(old)
+    while pos != -1 and len(found) < limit:
+        found.append((pos, pos + len(old), ""))
+        pos = data.find(old, pos + max(len(old), 1))
+    expanded = text.expandtabs()
+    if found or " " not in expanded:
+        return found
+    # each run of spaces may be tabs (or tabs and spaces) in the file
+    pattern = re.compile(
+        b"".join(b"[ \t]+" if part.startswith(" ") else re.escape(part.encode()) for part in re.split("( +)", expanded))
+    )
+    for match in pattern.finditer(data):
+        # a tab's width depends on its column, so expand from the start of the line
+        line_start = data.rfind(b"\n", 0, match.start()) + 1
+        prefix = decode(data[line_start : match.start()]).expandtabs()
+        viewed = decode(data[line_start : match.end()]).expandtabs()
+        if viewed.endswith(expanded) and len(viewed) - len(expanded) >= len(prefix):
+            found.append((match.start(), match.end(), viewed[len(prefix) : len(viewed) - len(expanded)]))
+            if len(found) >= limit:
+                break
+    return found
+
+
+def splice_file(path: Path, start: int, end: int, data: bytes):
+    """Replace the bytes start:end of a file with data, streaming the rest of the file."""
+    if end - start == len(data):
+        with open(path, "r+b") as f:
+            f.seek(start)
+            f.write(data)
+        return
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with map_file(path) as mm, open(tmp_path, "wb") as dst:
+            for pos in range(0, start, COPY_CHUNK_BYTES):
+                dst.write(mm[pos : min(pos + COPY_CHUNK_BYTES, start)])
+            dst.write(data)
+            for pos in range(end, len(mm), COPY_CHUNK_BYTES):
+                dst.write(mm[pos : pos + COPY_CHUNK_BYTES])
+        shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+@dataclass
+class FileEdit:
+    """
+    How to undo an edit: `start:end` of the file after the edit replaced `old`. Offsets are
+    into the text for small files (str) and into the raw bytes for large ones (bytes).
+    """
+
+    start: int
+    end: int
+    old: str | bytes
+    mtime_ns: int
+    size: int
+
 
 class EditTool20250124(BaseTool):
     """
@@ -31,7 +206,7 @@ class EditTool20250124(BaseTool):
     api_type: Literal["text_editor_20250124"] = "text_editor_20250124"
     name: Literal["str_replace_editor"] = "str_replace_editor"
 
-    _file_history: dict[Path, list[str]]
+    _file_history: dict[Path, list[FileEdit]]
 
     def __init__(self):
         self._file_history = defaultdict(list)
@@ -63,7 +238,7 @@ class EditTool20250124(BaseTool):
             if file_text is None:
                 raise ToolError("Parameter `file_text` is required for command: create")
             self.write_file(_path, file_text)
-            self._file_history[_path].append(file_text)
+            self.add_history(_path, 0, 0, "")
             return ToolResult(output=f"File created successfully at: {_path}")
         elif command == "str_replace":
             if old_str is None:
@@ -114,26 +289,15 @@ class EditTool20250124(BaseTool):
                 stdout = f"Here's the files and directories up to 2 levels deep in {path}, excluding hidden items:\n{stdout}\n"
             return CLIResult(output=stdout, error=stderr)
 
+        if path.stat().st_size > LARGE_FILE_BYTES:
+            file_content, init_line = self.view_large(path, view_range)
+            return CLIResult(output=self._make_output(file_content, str(path), init_line=init_line))
+
         file_content = self.read_file(path)
         init_line = 1
         if view_range:
-            if len(view_range) != 2 or not all(isinstance(i, int) for i in view_range):
-                raise ToolError("Invalid `view_range`. It should be a list of two integers.")
             file_lines = file_content.split("\n")
-            n_lines_file = len(file_lines)
-            init_line, final_line = view_range
-            if init_line < 1 or init_line > n_lines_file:
-                raise ToolError(
-                    f"Invalid `view_range`: {view_range}. Its first element `{init_line}` should be within the range of lines of the file: {[1, n_lines_file]}"
-                )
-            if final_line > n_lines_file:
-                raise ToolError(
-                    f"Invalid `view_range`: {view_range}. Its second element `{final_line}` should be smaller than the number of lines in the file: `{n_lines_file}`"
-                )
-            if final_line != -1 and final_line < init_line:
-                raise ToolError(
-                    f"Invalid `view_range`: {view_range}. Its second element `{final_line}` should be larger or equal than its first `{init_line}`"
-                )
+            init_line, final_line = self.check_view_range(view_range, len(file_lines))
 
             if final_line == -1:
                 file_content = "\n".join(file_lines[init_line - 1 :])
@@ -142,8 +306,41 @@ class EditTool20250124(BaseTool):
 
         return CLIResult(output=self._make_output(file_content, str(path), init_line=init_line))
 
+    def check_view_range(self, view_range: list[int], n_lines_file: int):
+        if len(view_range) != 2 or not all(isinstance(i, int) for i in view_range):
+            raise ToolError("Invalid `view_range`. It should be a list of two integers.")
+        init_line, final_line = view_range
+        if init_line < 1 or init_line > n_lines_file:
+            raise ToolError(
+                f"Invalid `view_range`: {view_range}. Its first element `{init_line}` should be within the range of lines of the file: {[1, n_lines_file]}"
+            )
+        if final_line > n_lines_file:
+            raise ToolError(
+                f"Invalid `view_range`: {view_range}. Its second element `{final_line}` should be smaller than the number of lines in the file: `{n_lines_file}`"
+            )
+        if final_line != -1 and final_line < init_line:
+            raise ToolError(
+                f"Invalid `view_range`: {view_range}. Its second element `{final_line}` should be larger or equal than its first `{init_line}`"
+            )
+        return init_line, final_line
+
+    def view_large(self, path: Path, view_range: list[int] | None):
+        """Read only the viewed lines of a large file, and no more than fits in the response."""
+        with map_file(path) as data:
+            init_line, start, end = 1, 0, len(data)
+            if view_range:
+                index = line_index(path, data)
+                init_line, final_line = self.check_view_range(view_range, index.line_count)
+                start = index.offset(data, init_line - 1)
+                if final_line != -1 and final_line < index.line_count:
+                    end = index.offset(data, final_line) - 1
+            return decode(data[start : min(end, start + VIEW_READ_BYTES)]), init_line
+
     def str_replace(self, path: Path, old_str: str, new_str: str | None):
         """Implement the str_replace command, which replaces old_str with new_str in the file content"""
+        if path.stat().st_size > LARGE_FILE_BYTES:
+            return self.str_replace_large(path, old_str, new_str)
+
         # Read the file content
         file_content = self.read_file(path).expandtabs()
         old_str = old_str.expandtabs()
@@ -166,11 +363,12 @@ class EditTool20250124(BaseTool):
         # Write the new content to the file
         self.write_file(path, new_file_content)
 
-        # Save the content to history
-        self._file_history[path].append(file_content)
+        # Save the replaced text to history
+        start = file_content.index(old_str)
+        self.add_history(path, start, start + len(new_str), old_str)
 
         # Create a snippet of the edited section
-        replacement_line = file_content.split(old_str)[0].count("\n")
+        replacement_line = file_content.count("\n", 0, start)
         start_line = max(0, replacement_line - SNIPPET_LINES)
         end_line = replacement_line + SNIPPET_LINES + new_str.count("\n")
         snippet = "\n".join(new_file_content.split("\n")[start_line : end_line + 1])
@@ -184,6 +382,9 @@ class EditTool20250124(BaseTool):
 
     def insert(self, path: Path, insert_line: int, new_str: str):
         """Implement the insert command, which inserts new_str at the specified line in the file content."""
+        if path.stat().st_size > LARGE_FILE_BYTES:
+            return self.insert_large(path, insert_line, new_str)
+
         file_text = self.read_file(path).expandtabs()
         new_str = new_str.expandtabs()
         file_text_lines = file_text.split("\n")
@@ -206,7 +407,11 @@ class EditTool20250124(BaseTool):
         snippet = "\n".join(snippet_lines)
 
         self.write_file(path, new_file_text)
-        self._file_history[path].append(file_text)
+        if insert_line == n_lines_file:
+            self.add_history(path, len(file_text), len(file_text) + 1 + len(new_str), "")
+        else:
+            start = sum(len(line) + 1 for line in file_text_lines[:insert_line])
+            self.add_history(path, start, start + len(new_str) + 1, "")
 
         success_msg = f"The file {path} has been edited. "
         success_msg += self._make_output(
@@ -222,11 +427,102 @@ class EditTool20250124(BaseTool):
         if not self._file_history[path]:
             raise ToolError(f"No edit history found for {path}.")
 
-        old_text = self._file_history[path].pop()
+        edit = self._file_history[path][-1]
+        stat = path.stat()
+        if (stat.st_mtime_ns, stat.st_size) != (edit.mtime_ns, edit.size):
+            raise ToolError(f"{path} has changed since its last edit, so the edit can't be undone.")
+        self._file_history[path].pop()
+
+        if isinstance(edit.old, bytes):
+            with map_file(path) as data:
+                new = data[edit.start : edit.end]
+                index = line_index(path, data)
+                line = index.line_at(data, edit.start)
+            splice_file(path, edit.start, edit.end, edit.old)
+            remember_line_index(path, index.spliced(edit.start, new, edit.old))
+            snippet, start_line = self.large_snippet(path, line, line + edit.old.count(b"\n"))
+            return CLIResult(
+                output=f"Last edit to {path} undone successfully. {self._make_output(snippet, f'a snippet of {path}', start_line + 1)}"
+            )
+
+        file_text = self.read_file(path)
+        old_text = file_text[: edit.start] + edit.old + file_text[edit.end :]
         self.write_file(path, old_text)
 
         return CLIResult(output=f"Last edit to {path} undone successfully. {self._make_output(old_text, str(path))}")
 
+    def add_history(self, path: Path, start: int, end: int, old: str | bytes):
+        """Remember how to undo the edit just written to path."""
+        stat = path.stat()
+        self._file_history[path].append(FileEdit(start, end, old, stat.st_mtime_ns, stat.st_size))
+
+    def large_snippet(self, path: Path, first_line: int, last_line: int):
+        """The (0-based) lines first_line..last_line of a large file with SNIPPET_LINES around them."""
+        with map_file(path) as data:
+            index = line_index(path, data)
+            start_line = max(0, first_line - SNIPPET_LINES)
+            end_line = min(index.line_count, last_line + SNIPPET_LINES + 1)
+            start = index.offset(data, start_line)
+            end = index.offset(data, end_line) - 1 if end_line < index.line_count else len(data)
+            return decode(data[start : min(end, start + VIEW_READ_BYTES)]), start_line
+
+    def str_replace_large(self, path: Path, old_str: str, new_str: str | None):
+        """str_replace for a large file: find old_str in an mmap of the file and splice new_str into it."""
+        new = new_str.expandtabs().encode() if new_str is not None else b""
+        with map_file(path) as data:
+            occurrences = find_occurrences(data, old_str)
+            if not occurrences:
+                raise ToolError(f"No replacement was performed, old_str `{old_str}` did not appear verbatim in {path}.")
+            if len(occurrences) > 1:
+                lines, line, counted = [], 0, 0
+                for pos, _, _ in occurrences:
+                    line += data[counted:pos].count(b"\n")
+                    counted = pos
+                    if "\n" not in old_str and (not lines or lines[-1] != line + 1):
+                        lines.append(line + 1)
+                raise ToolError(
+                    f"No replacement was performed. Multiple occurrences of old_str `{old_str}` in lines {lines}. Please ensure it is unique"
+                )
+            start, end, indent = occurrences[0]
+            old, new = data[start:end], indent.encode() + new
+            index = line_index(path, data)
+            replacement_line = index.line_at(data, start)
+
+        splice_file(path, start, start + len(old), new)
+        remember_line_index(path, index.spliced(start, old, new))
+        self.add_history(path, start, start + len(new), old)
+
+        snippet, start_line = self.large_snippet(path, replacement_line, replacement_line + new.count(b"\n"))
+        success_msg = f"The file {path} has been edited. "
+        success_msg += self._make_output(snippet, f"a snippet of {path}", start_line + 1)
+        success_msg += "Review the changes and make sure they are as expected. Edit the file again if necessary."
+        return CLIResult(output=success_msg)
+
+    def insert_large(self, path: Path, insert_line: int, new_str: str):
+        """insert for a large file: splice new_str in at the offset of insert_line."""
+        new = new_str.expandtabs().encode()
+        with map_file(path) as data:
+            index = line_index(path, data)
+            n_lines_file = index.line_count
+            if insert_line < 0 or insert_line > n_lines_file:
+                raise ToolError(
+                    f"Invalid `insert_line` parameter: {insert_line}. It should be within the range of lines of the file: {[0, n_lines_file]}"
+                )
+            if insert_line == n_lines_file:
+                start, new = len(data), b"\n" + new
+            else:
+                start, new = index.offset(data, insert_line), new + b"\n"
+
+        splice_file(path, start, start, new)
+        remember_line_index(path, index.spliced(start, b"", new))
+        self.add_history(path, start, start + len(new), b"")
+
+        snippet, start_line = self.large_snippet(path, insert_line, insert_line + new_str.count("\n"))
+        success_msg = f"The file {path} has been edited. "
+        success_msg += self._make_output(snippet, "a snippet of the edited file", start_line + 1)
+        success_msg += "Review the changes and make sure they are as expected (correct indentation, no duplicate lines, etc). Edit the file again if necessary."
+        return CLIResult(output=success_msg)
+
     def read_file(self, path: Path):
         """Read the content of a file from a given path; raise a ToolError if an error occurs."""
         try:
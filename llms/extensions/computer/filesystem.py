@@ -24,6 +24,8 @@ import shutil
 import time
 from typing import Annotated, Any, Dict, List, Literal, Optional
 
+from llms.filesearch import g_file_index
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
@@ -33,6 +35,7 @@ g_ctx = None
 def filesystem_init(ctx):
     global g_ctx
     g_ctx = ctx
+    g_file_index.path = ctx.get_cache_path("file-index")
 
 
 def get_app():
@@ -393,77 +396,48 @@ def directory_tree(
 ) -> str:
     """
     Get a recursive tree view of files and directories as a JSON structure. Each entry includes 'name', 'type' (file/directory), and 'children' for directories.
-    Files have no children array, while directories always have a children array (which may be empty). Respects any .gitignore rules from the root directory together with any exclude_patterns.
+    Files have no children array, while directories always have a children array (which may be empty). Respects any .gitignore rules in the tree together with any exclude_patterns.
     The output is formatted with 2-space indentation for readability. Only works within allowed directories.
     """
     import json
 
     valid_path = _validate_path(path, user=user)
-    root_path_len = len(valid_path.rstrip(os.sep)) + 1
     if exclude_patterns is None:
         exclude_patterns = []
 
-    def _parse_gitignore(directory: str) -> List[str]:
-        gitignore_path = os.path.join(directory, ".gitignore")
-        patterns = []
-        if os.path.exists(gitignore_path) and os.path.isfile(gitignore_path):
-            try:
-                with open(gitignore_path, encoding="utf-8") as f:
-                    for line in f:
-                        line = line.strip()
-                        if line and not line.startswith("#"):
-                            patterns.append(line)
-            except Exception as e:
-                logger.warning(f"Error reading .gitignore in {directory}: {e}")
-        return patterns
-
-    # Parse .gitignore only in the root directory (Simple Global Mappings)
-    gitignore_patterns = _parse_gitignore(valid_path)
-    all_exclude_patterns = exclude_patterns + gitignore_patterns
-
-    def _build_tree(current_path: str) -> List[Dict[str, Any]]:
-        entries = []
-        try:
-            with os.scandir(current_path) as it:
-                items = sorted(it, key=lambda x: x.name)
-
-            for entry in items:
-                # 1. Check exclusion patterns
-                rel_path_from_root = entry.path[root_path_len:]
-
-                should_exclude = False
-                for pattern in all_exclude_patterns:
-                    # Match against relative path or name
-                    # Support ending with / for directory matching
-                    is_dir_pattern = pattern.endswith("/")
-                    norm_pattern = pattern.rstrip("/")
-
-                    if fnmatch.fnmatch(rel_path_from_root, pattern) or fnmatch.fnmatch(entry.name, pattern):
-                        should_exclude = True
-                        break
-
-                    # Handle patterns like "node_modules/" matching "node_modules" directory
-                    if fnmatch.fnmatch(entry.name, norm_pattern):
-                        if is_dir_pattern and not entry.is_dir():
-                            continue
-                        should_exclude = True
-                        break
-
-                if should_exclude:
-                    continue
+    def _is_excluded(name: str, rel_path: str, is_dir: bool) -> bool:
+        for pattern in exclude_patterns:
+            # Match against relative path or name
+            # Support ending with / for directory matching
+            is_dir_pattern = pattern.endswith("/")
+            norm_pattern = pattern.rstrip("/")
 
-                entry_data = {"name": entry.name, "type": "directory" if entry.is_dir() else "file"}
+            if fnmatch.fnmatch(rel_path, pattern) or fnmatch.fnmatch(name, pattern):
+                return True
 
-                if entry.is_dir():
-                    entry_data["children"] = _build_tree(entry.path)
+            # Handle patterns like "node_modules/" matching "node_modules" directory
+            if fnmatch.fnmatch(name, norm_pattern) and (is_dir or not is_dir_pattern):
+                return True
+        return False
 
-                entries.append(entry_data)
-        except OSError as e:
-            logger.warning(f"Error scanning {current_path}: {e}")
+    # .gitignore rules (including nested ones) are applied by the index
+    tree = g_file_index.tree(valid_path, ignored_dirs={".git"}, hidden=True)
 
+    def _build_tree(rel_dir: str) -> List[Dict[str, Any]]:
+        entry = tree.get(rel_dir, {"dirs": [], "files": []})
+        items = [(name, True) for name in entry["dirs"]] + [(file[0], False) for file in entry["files"]]
+        entries = []
+        for name, is_dir in sorted(items):
+            rel_path = f"{rel_dir}/{name}" if rel_dir else name
+            if _is_excluded(name, rel_path.replace("/", os.sep), is_dir):
+                continue
+            entry_data = {"name": name, "type": "directory" if is_dir else "file"}
+            if is_dir:
+                entry_data["children"] = _build_tree(rel_path)
+            entries.append(entry_data)
         return entries
 
-    tree_data = _build_tree(valid_path)
+    tree_data = _build_tree("")
     return json.dumps(tree_data, indent=2)
 
 
@@ -495,7 +469,7 @@ def search_files(
     """
     Recursively search for files and directories matching a pattern. The patterns should be glob-style patterns that match paths relative to the working directory.
     Use pattern like '.ext' to match files in current directory, and '**/.ext' to match files in all subdirectories.
-    Returns full paths to all matching items. Great for finding files when you don't know their exact location. Only searches within allowed directories.
+    Returns full paths to all matching items, skipping files ignored by .gitignore. Great for finding files when you don't know their exact location. Only searches within allowed directories.
     If no path is provided, searches in the first allowed directory.
     """
     if not path:
@@ -506,22 +480,28 @@ def search_files(
         exclude_patterns = []
 
     try:
-        for root, dirs, files in os.walk(valid_path):
+        # .gitignore rules (including nested ones) are applied by the index
+        tree = g_file_index.tree(valid_path, ignored_dirs={".git"}, hidden=True)
+        pending = [""]
+        while pending:
+            rel_dir = pending.pop()
+            entry = tree.get(rel_dir)
+            if entry is None:
+                continue
             # Check exclusions for directories to prune traversal
-            dirs[:] = [d for d in dirs if not any(fnmatch.fnmatch(d, pat) for pat in exclude_patterns)]
+            dirs = [d for d in entry["dirs"] if not any(fnmatch.fnmatch(d, pat) for pat in exclude_patterns)]
+            pending.extend(f"{rel_dir}/{d}" if rel_dir else d for d in dirs)
 
             # Check all files and directories
-            all_entries = dirs + files
-
-            for entry in all_entries:
-                full_path = os.path.join(root, entry)
-                rel_path = os.path.relpath(full_path, valid_path)
+            for name in dirs + [file[0] for file in entry["files"]]:
+                rel_path = os.path.normpath(f"{rel_dir}/{name}" if rel_dir else name)
+                full_path = os.path.join(valid_path, rel_path)
 
                 # Check if matches search pattern
-                if fnmatch.fnmatch(entry, pattern) or fnmatch.fnmatch(rel_path, pattern):  # noqa: SIM102
+                if fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(rel_path, pattern):  # noqa: SIM102
                     # Double check exclusions (redundant for dirs but safe)
                     if not any(
-                        fnmatch.fnmatch(rel_path, pat) or fnmatch.fnmatch(entry, pat) for pat in exclude_patterns
+                        fnmatch.fnmatch(rel_path, pat) or fnmatch.fnmatch(name, pat) for pat in exclude_patterns
                     ):
                         results.append(full_path)
 
@@ -3,26 +3,38 @@ Core System Tools providing essential search, web fetching, time, math expressio
 """
 
 import ast
+import asyncio
+import codecs
 import contextlib
 import fnmatch
+import functools
+import hashlib
 from html.parser import HTMLParser
 import json
 import math
 import operator
 import os
 import re
+import shlex
 import shutil
+import signal
 import subprocess
 import sys
 import tempfile
+import threading
+import time
 import urllib.parse
-import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from statistics import mean, median, stdev, variance
 from typing import Annotated, Any, Dict, List, Optional, Union
 
+import aiohttp
 from aiohttp import web
 
+from llms.filesearch import compile_pattern, g_file_index, grep_file, grep_files, tree_files
+
 g_ctx = None
 
 # -----------------------------
@@ -178,40 +190,188 @@ cpu_time_limit = 5  # Max CPU time 5 seconds
 resource_limits = f"ulimit -t {cpu_time_limit}; ulimit -v {mem_limit};"
 
 
-def run_python(code: str) -> Dict[str, Any]:
-    """
-    Execute Python code in a temporary sandboxed environment.
-    Uses ulimit for resource restriction and runs in a temporary directory.
-    """
-    with tempfile.TemporaryDirectory() as temp_dir:
-        script_path = os.path.join(temp_dir, "script.py")
+# Read the snippet from stdin, save it where the old one-shot runs wrote their script and run
+# it as __main__. The interpreter has already started by the time the code arrives.
+PYTHON_BOOTSTRAP = """import sys
+source = sys.stdin.read()
+with open("script.py", "w", encoding="utf-8") as f:
+    f.write(source)
+sys.argv = ["script.py"]
+del sys
+exec(compile(source, "script.py", "exec"), {"__name__": "__main__", "__file__": "script.py"})
+"""
+
+JS_BOOTSTRAP = """const fs = require("fs"), path = require("path"), { pathToFileURL } = require("url");
+const file = path.resolve("script.{ext}");
+fs.writeFileSync(file, fs.readFileSync(0, "utf8"));
+import(pathToFileURL(file).href).catch(e => { console.error(e); process.exitCode = 1; });
+"""
 
-        with open(script_path, "w", encoding="utf-8") as f:
-            f.write(code)
 
-        cmd = f"{resource_limits} {sys.executable} script.py"
+def js_runtime():
+    return shutil.which("bun") or shutil.which("node")
 
+
+# language: (runtime, bootstrap passed to `runtime -e/-c`)
+SANDBOX_LANGUAGES = {
+    "python": (lambda: sys.executable, "-c", PYTHON_BOOTSTRAP),
+    "javascript": (js_runtime, "-e", JS_BOOTSTRAP.replace("{ext}", "js")),
+    "typescript": (js_runtime, "-e", JS_BOOTSTRAP.replace("{ext}", "ts")),
+}
+
+
+class SandboxPool:
+    """
+    Sandbox processes started ahead of time, so a run doesn't wait for an interpreter to
+    start. Each one is already running under the ulimits (and LLMS_RUN_AS user) in its own
+    temp dir, blocked reading its code from stdin. A process runs one snippet and exits,
+    keeping runs as isolated from each other as spawning them on demand, and the pool
+    starts a replacement on a background thread after one is used.
+    """
+
+    def __init__(self, size=2):
+        self.size = size
+        self.lock = threading.Condition()
+        self.idle = {}  # {language: [(process, temp_dir)]}
+        self.starting = {}  # {language: sandboxes being started in the background}
+        self.latency = {}  # {language: {calls, warm, timeouts, totalMs, maxMs}}
+        self.executor = None
+
+    def spawn(self, language):
+        runtime, flag, bootstrap = SANDBOX_LANGUAGES[language]
+        temp_dir = tempfile.mkdtemp()
+        cmd = f"{resource_limits} exec {runtime()} {flag} {shlex.quote(bootstrap)}"
         run_as = os.environ.get("LLMS_RUN_AS")
         if run_as:
             # Grant access to temp_dir
             with contextlib.suppress(Exception):
                 os.chmod(temp_dir, 0o777)
-            cmd = f"sudo -u {run_as} bash -c '{cmd}'"
-
+            cmd = f"sudo -u {run_as} bash -c {shlex.quote(cmd)}"
+        # Restricted environment, we keep PATH to find basic tools but remove sensitive vars
+        clean_env = {"PATH": os.environ.get("PATH", "")}
+        process = subprocess.Popen(
+            ["bash", "-c", cmd],
+            cwd=temp_dir,
+            env=clean_env,
+            text=True,
+            start_new_session=True,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        return process, temp_dir
+
+    def take(self, language):
+        """A started sandbox for `language` and whether it was warm (already waiting in the pool)."""
+        with self.lock:
+            idle = self.idle.setdefault(language, [])
+            while idle or self.starting.get(language):
+                if not idle:
+                    # one is already booting, it'll be ready sooner than one started now
+                    self.lock.wait()
+                    continue
+                sandbox = idle.pop(0)
+                if sandbox[0].poll() is None:
+                    return sandbox, True
+                self.discard(sandbox)
+        return self.spawn(language), False
+
+    def refill(self, language, size=None):
+        """Start sandboxes in the background until `size` (the pool's size) are idle or starting."""
+        # after a run rather than when taking one, so booting replacements don't compete
+        # with the snippet being run for CPU
+        with self.lock:
+            count = (size or self.size) - len(self.idle.get(language, [])) - self.starting.get(language, 0)
+            if count <= 0:
+                return
+            self.starting[language] = self.starting.get(language, 0) + count
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llms-sandbox")
+            executor = self.executor
+        for _ in range(count):
+            executor.submit(self.start, language)
+
+    def start(self, language):
+        sandbox = None
         try:
-            # Run with restricted environment
-            # We keep PATH to find basic tools if needed, but remove sensitive vars
-            clean_env = {"PATH": os.environ.get("PATH", "")}
-
-            g_ctx.dbg(f"run_python ({temp_dir}): {cmd}\n{code}")
-            result = subprocess.run(
-                ["bash", "-c", cmd], cwd=temp_dir, env=clean_env, capture_output=True, text=True, timeout=10
-            )
-            return {"stdout": result.stdout, "stderr": result.stderr, "returncode": result.returncode}
+            sandbox = self.spawn(language)
+        finally:
+            with self.lock:
+                self.starting[language] -= 1
+                if sandbox:
+                    self.idle.setdefault(language, []).append(sandbox)
+                self.lock.notify_all()
+
+    def discard(self, sandbox):
+        process, temp_dir = sandbox
+        if process.poll() is None:
+            with contextlib.suppress(Exception):
+                os.killpg(process.pid, signal.SIGKILL)
+        with contextlib.suppress(Exception):
+            process.communicate(timeout=5)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def run(self, language, code, timeout=10):
+        started = time.perf_counter()
+        sandbox, warm = self.take(language)
+        timed_out = False
+        try:
+            if g_ctx:
+                g_ctx.dbg(f"run_{language} ({sandbox[1]}, {'warm' if warm else 'cold'}):\n{code}")
+            stdout, stderr = sandbox[0].communicate(input=code, timeout=timeout)
+            return {"stdout": stdout, "stderr": stderr, "returncode": sandbox[0].returncode}
         except subprocess.TimeoutExpired:
+            timed_out = True
             return {"stdout": "", "stderr": "Execution timed out", "returncode": -1}
         except Exception as e:
             return {"stdout": "", "stderr": f"Error: {e}", "returncode": -1}
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            self.discard(sandbox)
+            self.refill(language)
+            with self.lock:
+                stats = self.latency.setdefault(
+                    language, {"calls": 0, "warm": 0, "timeouts": 0, "totalMs": 0.0, "maxMs": 0.0}
+                )
+                stats["calls"] += 1
+                stats["warm"] += int(warm)
+                stats["timeouts"] += int(timed_out)
+                stats["totalMs"] += elapsed
+                stats["maxMs"] = max(stats["maxMs"], elapsed)
+
+    def stats(self):
+        with self.lock:
+            return {
+                language: {
+                    **stats,
+                    "avgMs": round(stats["totalMs"] / stats["calls"], 2),
+                    "idle": len(self.idle.get(language, [])),
+                }
+                for language, stats in self.latency.items()
+            }
+
+    def close(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor:
+            # let the sandboxes being started land in the pool, so they're discarded with it
+            executor.shutdown(wait=True)
+        with self.lock:
+            sandboxes = [sandbox for idle in self.idle.values() for sandbox in idle]
+            self.idle = {}
+        for sandbox in sandboxes:
+            self.discard(sandbox)
+
+
+g_sandboxes = SandboxPool()
+
+
+def run_python(code: str) -> Dict[str, Any]:
+    """
+    Execute Python code in a temporary sandboxed environment.
+    Uses ulimit for resource restriction and runs in a temporary directory.
+    """
+    return g_sandboxes.run("python", code)
 
 
 def run_javascript(code: str) -> Dict[str, Any]:
@@ -219,75 +379,185 @@ def run_javascript(code: str) -> Dict[str, Any]:
     Execute JavaScript code in a temporary sandboxed environment using bun or node.
     """
     # Check for available runtime
-    runtime = shutil.which("bun") or shutil.which("node")
-    if not runtime:
+    if not js_runtime():
         return {"stdout": "", "stderr": "Error: Neither 'bun' nor 'node' is available on the system.", "returncode": -1}
+    return g_sandboxes.run("javascript", code)
 
-    with tempfile.TemporaryDirectory() as temp_dir:
-        script_path = os.path.join(temp_dir, "script.js")
 
-        with open(script_path, "w", encoding="utf-8") as f:
-            f.write(code)
+class CompileCache:
+    """
+    Build artifacts (compiled C# assemblies, transpiled TypeScript) kept under the llms home
+    directory, keyed by a hash of the source and the version of the toolchain that built them,
+    so resubmitting the same code skips compilation. Once the cache grows past max_bytes, the
+    least recently used entries are evicted.
+    """
 
-        cmd = f"{resource_limits} {runtime} script.js"
+    def __init__(self, path=None, max_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.counters = {}  # {language: {hits, misses, evictions}}
 
-        run_as = os.environ.get("LLMS_RUN_AS")
-        if run_as:
-            with contextlib.suppress(Exception):
-                os.chmod(temp_dir, 0o777)
-            cmd = f"sudo -u {run_as} bash -c '{cmd}'"
+    @property
+    def root(self):
+        return self.path or os.path.join(tempfile.gettempdir(), "llms-compile")
 
+    def key(self, language, source, toolchain):
+        return hashlib.sha256(f"{language}\0{toolchain}\0{source}".encode()).hexdigest()
+
+    def count(self, language, counter, n=1):
+        with self.lock:
+            counters = self.counters.setdefault(language, {"hits": 0, "misses": 0, "evictions": 0})
+            counters[counter] += n
+
+    def get(self, language, key):
+        """Directory with the cached artifacts for `key`, or None on a miss."""
+        entry = os.path.join(self.root, language, key)
+        try:
+            # the mtime is the entry's last use
+            os.utime(entry)
+        except OSError:
+            self.count(language, "misses")
+            return None
+        self.count(language, "hits")
+        return entry
+
+    def put(self, language, key, build_dir):
+        """Copy the artifacts in build_dir into the cache and return the cached directory."""
+        entry = os.path.join(self.root, language, key)
+        staging = os.path.join(self.root, language, f".{key}.{os.getpid()}.{threading.get_ident()}")
+        shutil.copytree(build_dir, staging)
         try:
-            # Run with restricted environment
-            clean_env = {"PATH": os.environ.get("PATH", "")}
+            os.replace(staging, entry)
+        except OSError:
+            # built concurrently by another run, keep theirs
+            shutil.rmtree(staging, ignore_errors=True)
+        self.evict(keep=entry)
+        return entry
+
+    def entries(self):
+        """[(last used, bytes, path, language)] of everything in the cache."""
+        entries = []
+        for language in os.listdir(self.root) if os.path.isdir(self.root) else []:
+            language_dir = os.path.join(self.root, language)
+            for key in os.listdir(language_dir):
+                path = os.path.join(language_dir, key)
+                if key.startswith(".") or not os.path.isdir(path):
+                    continue
+                size = 0
+                for dir_path, _, files in os.walk(path):
+                    for file in files:
+                        with contextlib.suppress(OSError):
+                            size += os.path.getsize(os.path.join(dir_path, file))
+                with contextlib.suppress(OSError):
+                    entries.append((os.path.getmtime(path), size, path, language))
+        return entries
+
+    def evict(self, keep=None):
+        entries = self.entries()
+        total = sum(entry[1] for entry in entries)
+        for _, size, path, language in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            self.count(language, "evictions")
+
+    def stats(self):
+        entries = self.entries()
+        with self.lock:
+            counters = {language: dict(counters) for language, counters in self.counters.items()}
+        return {
+            "entries": len(entries),
+            "bytes": sum(entry[1] for entry in entries),
+            "maxBytes": self.max_bytes,
+            "languages": counters,
+        }
 
-            g_ctx.dbg(f"run_javascript ({temp_dir}): {cmd}\n{code}")
-            result = subprocess.run(
-                ["bash", "-c", cmd], cwd=temp_dir, env=clean_env, capture_output=True, text=True, timeout=10
+    def describe(self, language, key, hit):
+        with self.lock:
+            counters = self.counters.get(language, {})
+            return (
+                f"compile cache {'hit' if hit else 'miss'} {key[:12]} "
+                f"(hits={counters.get('hits', 0)}, misses={counters.get('misses', 0)})"
             )
-            return {"stdout": result.stdout, "stderr": result.stderr, "returncode": result.returncode}
-        except subprocess.TimeoutExpired:
-            return {"stdout": "", "stderr": "Execution timed out", "returncode": -1}
-        except Exception as e:
-            return {"stdout": "", "stderr": f"Error: {e}", "returncode": -1}
 
 
-def run_typescript(code: str) -> Dict[str, Any]:
-    """
-    Execute TypeScript code in a temporary sandboxed environment using bun or node.
-    """
-    # Check for available runtime
-    runtime = shutil.which("bun") or shutil.which("node")
-    if not runtime:
-        return {"stdout": "", "stderr": "Error: Neither 'bun' nor 'node' is available on the system.", "returncode": -1}
+g_compile_cache = CompileCache()
 
-    with tempfile.TemporaryDirectory() as temp_dir:
-        script_path = os.path.join(temp_dir, "script.ts")
 
-        with open(script_path, "w", encoding="utf-8") as f:
-            f.write(code)
+@functools.lru_cache(maxsize=None)
+def toolchain_version(runtime):
+    """`runtime --version`, part of the compile cache key so upgrading a toolchain rebuilds."""
+    try:
+        return subprocess.run([runtime, "--version"], capture_output=True, text=True, timeout=30).stdout.strip()
+    except Exception:
+        return ""
+
+
+def run_sandboxed(cmd, temp_dir, timeout=10, dotnet=False):
+    """Run a shell command under the resource limits (and LLMS_RUN_AS user) in temp_dir."""
+    cmd = f"{resource_limits} {cmd}"
+    run_as = os.environ.get("LLMS_RUN_AS")
+    if run_as:
+        with contextlib.suppress(Exception):
+            os.chmod(temp_dir, 0o777)
+        # For dotnet, we need to set HOME and DOTNET_CLI_HOME to temp_dir for write access
+        env = f"env HOME={temp_dir} DOTNET_CLI_HOME={temp_dir} " if dotnet else ""
+        cmd = f"sudo -u {run_as} {env}bash -c {shlex.quote(cmd)}"
+    try:
+        # Run with restricted environment
+        clean_env = {"PATH": os.environ.get("PATH", "")}
+        result = subprocess.run(
+            ["bash", "-c", cmd], cwd=temp_dir, env=clean_env, capture_output=True, text=True, timeout=timeout
+        )
+        return {"stdout": result.stdout, "stderr": result.stderr, "returncode": result.returncode}
+    except subprocess.TimeoutExpired:
+        return {"stdout": "", "stderr": "Execution timed out", "returncode": -1}
+    except Exception as e:
+        return {"stdout": "", "stderr": f"Error: {e}", "returncode": -1}
 
-        cmd = f"{resource_limits} {runtime} script.ts"
 
-        run_as = os.environ.get("LLMS_RUN_AS")
-        if run_as:
-            with contextlib.suppress(Exception):
-                os.chmod(temp_dir, 0o777)
-            cmd = f"sudo -u {run_as} bash -c '{cmd}'"
+def ts_transpiler():
+    """(command transpiling script.ts into out/script.js, version), or None to run the .ts as is."""
+    esbuild = shutil.which("esbuild")
+    if esbuild:
+        return f"{esbuild} script.ts --outfile=out/script.js --format=esm", toolchain_version(esbuild)
+    tsc = shutil.which("tsc")
+    if tsc:
+        return f"{tsc} --target es2022 --module esnext --skipLibCheck --outDir out script.ts", toolchain_version(tsc)
+    return None
 
-        try:
-            # Run with restricted environment
-            clean_env = {"PATH": os.environ.get("PATH", "")}
 
-            g_ctx.dbg(f"run_typescript ({temp_dir}): {cmd}\n{code}")
-            result = subprocess.run(
-                ["bash", "-c", cmd], cwd=temp_dir, env=clean_env, capture_output=True, text=True, timeout=10
-            )
-            return {"stdout": result.stdout, "stderr": result.stderr, "returncode": result.returncode}
-        except subprocess.TimeoutExpired:
-            return {"stdout": "", "stderr": "Execution timed out", "returncode": -1}
-        except Exception as e:
-            return {"stdout": "", "stderr": f"Error: {e}", "returncode": -1}
+def run_typescript(code: str) -> Dict[str, Any]:
+    """
+    Execute TypeScript code in a temporary sandboxed environment using bun or node.
+    """
+    # Check for available runtime
+    if not js_runtime():
+        return {"stdout": "", "stderr": "Error: Neither 'bun' nor 'node' is available on the system.", "returncode": -1}
+    transpiler = ts_transpiler()
+    if not transpiler:
+        return g_sandboxes.run("typescript", code)
+
+    command, version = transpiler
+    key = g_compile_cache.key("typescript", code, version)
+    artifacts = g_compile_cache.get("typescript", key)
+    hit = artifacts is not None
+    if not hit:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with open(os.path.join(temp_dir, "script.ts"), "w", encoding="utf-8") as f:
+                f.write(code)
+            result = run_sandboxed(command, temp_dir)
+            if not os.path.exists(os.path.join(temp_dir, "out", "script.js")):
+                return result
+            artifacts = g_compile_cache.put("typescript", key, os.path.join(temp_dir, "out"))
+    if g_ctx:
+        g_ctx.dbg(f"run_typescript: {g_compile_cache.describe('typescript', key, hit)}")
+    with open(os.path.join(artifacts, "script.js"), encoding="utf-8") as f:
+        return g_sandboxes.run("javascript", f.read())
 
 
 def run_csharp(code: str) -> Dict[str, Any]:
@@ -300,38 +570,22 @@ def run_csharp(code: str) -> Dict[str, Any]:
         return {"stdout": "", "stderr": "Error: 'dotnet' is not available on the system.", "returncode": -1}
 
     with tempfile.TemporaryDirectory() as temp_dir:
-        script_path = os.path.join(temp_dir, "script.cs")
-
-        # Ensure we just have the code, user might pass it without wrapping class if it's top-level statements
-        with open(script_path, "w", encoding="utf-8") as f:
-            f.write(code)
-
-        # Note: 'dotnet run script.cs' is the command as per user request for .NET 10
-        cmd = f"{resource_limits} {runtime} run script.cs"
-
-        run_as = os.environ.get("LLMS_RUN_AS")
-        if run_as:
-            with contextlib.suppress(Exception):
-                os.chmod(temp_dir, 0o777)
-            # For dotnet, we need to set HOME and DOTNET_CLI_HOME to temp_dir for write access
-            cmd = f"sudo -u {run_as} env HOME={temp_dir} DOTNET_CLI_HOME={temp_dir} bash -c '{cmd}'"
-
-        try:
-            # Run with restricted environment
-            clean_env = {"PATH": os.environ.get("PATH", "")}
-
-            # Dotnet might need some ENV vars to work correctly, usually DOTNET_CLI_HOME or similar if strictly sandboxed
-            # But we are keeping PATH, hopefully commonly needed vars are there or default works.
-            # We might want to pass more env vars if it fails.
-            g_ctx.dbg(f"run_csharp ({temp_dir}): {cmd}\n{code}")
-            result = subprocess.run(
-                ["bash", "-c", cmd], cwd=temp_dir, env=clean_env, capture_output=True, text=True, timeout=10
-            )
-            return {"stdout": result.stdout, "stderr": result.stderr, "returncode": result.returncode}
-        except subprocess.TimeoutExpired:
-            return {"stdout": "", "stderr": "Execution timed out", "returncode": -1}
-        except Exception as e:
-            return {"stdout": "", "stderr": f"Error: {e}", "returncode": -1}
+        key = g_compile_cache.key("csharp", code, toolchain_version(runtime))
+        artifacts = g_compile_cache.get("csharp", key)
+        hit = artifacts is not None
+        if not hit:
+            # Ensure we just have the code, user might pass it without wrapping class if it's top-level statements
+            with open(os.path.join(temp_dir, "script.cs"), "w", encoding="utf-8") as f:
+                f.write(code)
+            # .NET 10 file-based app, built once and run from the cached assembly after that
+            result = run_sandboxed(f"{runtime} build script.cs -o build", temp_dir, dotnet=True)
+            if result["returncode"] != 0:
+                return result
+            artifacts = g_compile_cache.put("csharp", key, os.path.join(temp_dir, "build"))
+        # run from a copy, so the sandbox can't touch the cache and eviction can't pull it mid-run
+        shutil.copytree(artifacts, os.path.join(temp_dir, "bin"), dirs_exist_ok=True)
+        g_ctx.dbg(f"run_csharp ({temp_dir}): {g_compile_cache.describe('csharp', key, hit)}\n{code}")
+        return run_sandboxed(f"{runtime} bin/script.dll", temp_dir, dotnet=True)
 
 
 # -----------------------------
@@ -457,7 +711,193 @@ class HTMLToMarkdownParser(HTMLParser):
         return text.strip()
 
 
-def fetch_url(
+FETCH_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+        "AppleWebKit/537.36 (KHTML, like Gecko) "
+        "Chrome/120.0.0.0 Safari/537.36"
+    ),
+    "Accept": "text/html,application/xhtml+xml,application/json,text/plain;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.5",
+}
+FETCH_MAX_BYTES = 2 * 1024 * 1024  # Read at most 2MB
+FETCH_CHUNK_SIZE = 64 * 1024
+
+
+def cache_expires(headers) -> Optional[float]:
+    """
+    When a response stops being fresh according to its Cache-Control/Expires headers
+    (0 = revalidate before every use), or None if it mustn't be stored.
+    """
+    directives = {}
+    for part in headers.get("Cache-Control", "").lower().split(","):
+        name, _, value = part.strip().partition("=")
+        directives[name] = value.strip('"')
+    if "no-store" in directives:
+        return None
+    if "no-cache" in directives:
+        return 0
+    now = time.time()
+    with contextlib.suppress(ValueError):
+        if "max-age" in directives:
+            return now + int(directives["max-age"]) - int(headers.get("Age", 0))
+    with contextlib.suppress(Exception):
+        if headers.get("Expires"):
+            return parsedate_to_datetime(headers["Expires"]).timestamp()
+    return 0
+
+
+class HttpCache:
+    """
+    Responses fetched by fetch_url stored on disk with their validators, so fetching the same
+    page again is a conditional request, or no request at all while Cache-Control says it's
+    still fresh. When fetch_url stops reading a page early, the part it read is stored, and
+    serves later fetches that don't need more of the page than that. Once the cache grows
+    past max_bytes, the least recently used pages are evicted.
+    """
+
+    def __init__(self, path=None, max_bytes=64 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.evictions = 0
+
+    @property
+    def root(self):
+        return self.path or os.path.join(tempfile.gettempdir(), "llms-fetch")
+
+    def paths(self, url):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.root, f"{key}.json"), os.path.join(self.root, f"{key}.body")
+
+    def load(self, url):
+        """(info, body) stored for url, or (None, None)."""
+        info_path, body_path = self.paths(url)
+        try:
+            with open(info_path, encoding="utf-8") as f:
+                info = json.load(f)
+            with open(body_path, "rb") as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None, None
+        if info.get("url") != url:
+            return None, None
+        with contextlib.suppress(OSError):
+            # the mtime of the info file is the page's last use
+            os.utime(info_path)
+        return info, body
+
+    def save(self, url, info, body=None):
+        os.makedirs(self.root, exist_ok=True)
+        info_path, body_path = self.paths(url)
+        # write both files before either replaces the stored ones, so a reader never pairs
+        # the info of one response with the body of another
+        suffix = f".{os.getpid()}.{threading.get_ident()}"
+        if body is not None:
+            with open(body_path + suffix, "wb") as f:
+                f.write(body)
+        with open(info_path + suffix, "w", encoding="utf-8") as f:
+            json.dump({**info, "url": url}, f)
+        if body is not None:
+            os.replace(body_path + suffix, body_path)
+        os.replace(info_path + suffix, info_path)
+        self.evict(keep=info_path)
+
+    def entries(self):
+        """[(last used, bytes, info path, body path)] of every stored page."""
+        entries = []
+        for name in os.listdir(self.root) if os.path.isdir(self.root) else []:
+            if not name.endswith(".json"):
+                continue
+            info_path = os.path.join(self.root, name)
+            body_path = info_path[: -len(".json")] + ".body"
+            with contextlib.suppress(OSError):
+                stat = os.stat(info_path)
+                size = stat.st_size + (os.path.getsize(body_path) if os.path.exists(body_path) else 0)
+                entries.append((stat.st_mtime, size, info_path, body_path))
+        return entries
+
+    def evict(self, keep=None):
+        entries = self.entries()
+        total = sum(entry[1] for entry in entries)
+        for _, size, info_path, body_path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if info_path == keep:
+                continue
+            for path in (info_path, body_path):
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+            total -= size
+            self.evictions += 1
+
+
+g_http_cache = HttpCache()
+
+
+@contextlib.asynccontextmanager
+async def fetch_session():
+    # fetches never carry cookies between calls: the shared pooled session keeps none,
+    # and neither does the one-off session used without an app
+    if g_ctx:
+        # shared keep-alive session, reused by every fetch
+        async with g_ctx.client_session("fetch_url") as session:
+            yield session
+    else:
+        async with aiohttp.ClientSession(cookie_jar=aiohttp.DummyCookieJar()) as session:
+            yield session
+
+
+async def read_content(chunks, url: str, content_type: str, charset: str, max_length: int):
+    """
+    Convert a body to Markdown (or text, if it isn't HTML) as it's read, and stop reading once
+    the output is longer than max_length. Returns (content, body read, whether it was all read).
+    """
+    try:
+        decoder = codecs.getincrementaldecoder(charset)(errors="replace")
+    except LookupError:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    body = bytearray()
+    parser = None
+    text = []
+    html = None
+    async for chunk in chunks:
+        chunk = chunk[: FETCH_MAX_BYTES - len(body)]
+        body += chunk
+        data = decoder.decode(chunk)
+        if html is None:
+            head = data[:500].lower()
+            html = "html" in content_type or "<html" in head or "<!doctype html" in head
+            if html:
+                parser = HTMLToMarkdownParser(base_url=url)
+        if parser:
+            parser.feed(data)
+            # the raw length overcounts collapsed newlines, only build the Markdown once it's long enough
+            if sum(map(len, parser.result)) > max_length and len(parser.get_markdown()) > max_length:
+                return parser.get_markdown(), bytes(body), False
+        else:
+            text.append(data)
+            if sum(map(len, text)) > max_length + 1:
+                return "".join(text).strip(), bytes(body), False
+        if len(body) >= FETCH_MAX_BYTES:
+            break
+    data = decoder.decode(b"", final=True)
+    if parser:
+        parser.feed(data)
+        parser.close()
+        return parser.get_markdown(), bytes(body), True
+    text.append(data)
+    return "".join(text).strip(), bytes(body), True
+
+
+def fetch_result(content: str, max_length: int, complete: bool) -> str:
+    if len(content) > max_length:
+        remaining = len(content) - max_length
+        more = "" if complete else "+"
+        return content[:max_length] + f"\n\n... [Truncated: {remaining}{more} additional characters]"
+    return content or "No content found on page."
+
+
+async def fetch_url(
     url: Annotated[str, "The HTTP/HTTPS URL to fetch content from"],
     max_length: Annotated[int, "Maximum character length of content to return (default: 20000)"] = 20000,
 ) -> str:
@@ -471,36 +911,69 @@ def fetch_url(
     if g_ctx:
         g_ctx.dbg(f"fetch_url ({url})")
 
-    try:
-        req = urllib.request.Request(
-            url,
-            headers={
-                "User-Agent": (
-                    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
-                    "AppleWebKit/537.36 (KHTML, like Gecko) "
-                    "Chrome/120.0.0.0 Safari/537.36"
-                ),
-                "Accept": "text/html,application/xhtml+xml,application/json,text/plain;q=0.9,*/*;q=0.8",
-                "Accept-Language": "en-US,en;q=0.5",
-            },
-        )
-        with urllib.request.urlopen(req, timeout=15) as response:
-            content_type = response.headers.get("Content-Type", "").lower()
-            raw_bytes = response.read(2 * 1024 * 1024)  # Read at most 2MB
-            charset = response.headers.get_content_charset() or "utf-8"
-            raw_text = raw_bytes.decode(charset, errors="replace")
+    async def cached(info, body):
+        """The cached content, if the stored body covers max_length."""
 
-            if "html" in content_type or "<html" in raw_text[:500].lower() or "<!doctype html" in raw_text[:500].lower():
-                parser = HTMLToMarkdownParser(base_url=url)
-                parser.feed(raw_text)
-                content = parser.get_markdown()
-            else:
-                content = raw_text.strip()
+        async def chunks():
+            # in slices, like a response is read, so a large page doesn't hold up the loop
+            for i in range(0, len(body), FETCH_CHUNK_SIZE):
+                yield body[i : i + FETCH_CHUNK_SIZE]
+                await asyncio.sleep(0)
 
-            if len(content) > max_length:
-                remaining = len(content) - max_length
-                return content[:max_length] + f"\n\n... [Truncated: {remaining} additional characters]"
-            return content or "No content found on page."
+        content, _, complete = await read_content(chunks(), url, info["contentType"], info["charset"], max_length)
+        if info["complete"] or len(content) > max_length:
+            return fetch_result(content, max_length, info["complete"] and complete)
+        return None
+
+    try:
+        info, body = await asyncio.to_thread(g_http_cache.load, url)
+        if info and info["expires"] > time.time():
+            result = await cached(info, body)
+            if result is not None:
+                return result
+        headers = dict(FETCH_HEADERS)
+        if info and info.get("etag"):
+            headers["If-None-Match"] = info["etag"]
+        if info and info.get("lastModified"):
+            headers["If-Modified-Since"] = info["lastModified"]
+
+        async with fetch_session() as session:
+            timeout = aiohttp.ClientTimeout(total=15)
+            response = await session.get(url, headers=headers, timeout=timeout)
+            if info and response.status == 304:
+                response.release()
+                expires = cache_expires(response.headers)
+                if expires is not None:
+                    await asyncio.to_thread(g_http_cache.save, url, {**info, "expires": expires})
+                result = await cached(info, body)
+                if result is not None:
+                    return result
+                # the stored part of the page is too short, fetch it again in full
+                response = await session.get(url, headers=FETCH_HEADERS, timeout=timeout)
+            async with response:
+                response.raise_for_status()
+                content_type = response.headers.get("Content-Type", "").lower()
+                charset = response.charset or "utf-8"
+                content, body, complete = await read_content(
+                    response.content.iter_chunked(FETCH_CHUNK_SIZE), url, content_type, charset, max_length
+                )
+                expires = cache_expires(response.headers)
+                etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+                if expires is not None and (expires > time.time() or etag or last_modified):
+                    await asyncio.to_thread(
+                        g_http_cache.save,
+                        url,
+                        {
+                            "contentType": content_type,
+                            "charset": charset,
+                            "etag": etag,
+                            "lastModified": last_modified,
+                            "expires": expires,
+                            "complete": complete,
+                        },
+                        body,
+                    )
+                return fetch_result(content, max_length, complete)
     except Exception as e:
         return f"Error fetching URL '{url}': {e}"
 
@@ -509,26 +982,6 @@ def fetch_url(
 # File search & grep tools
 # -----------------------------
 
-_IGNORED_SEARCH_DIRS = {
-    ".git",
-    ".venv",
-    "venv",
-    ".env",
-    "node_modules",
-    "__pycache__",
-    "dist",
-    "build",
-    "bin",
-    "obj",
-    "target",
-    "vendor",
-    ".next",
-    ".nuxt",
-    ".cache",
-    ".tox",
-}
-
-
 def grep_search(
     query: Annotated[str, "Text or regular expression to search for across files"],
     path: Annotated[Optional[str], "Directory or file path to search (default is current working directory)"] = None,
@@ -538,7 +991,7 @@ def grep_search(
     max_matches: Annotated[int, "Maximum number of matching lines to return (default: 50)"] = 50,
 ) -> str:
     """
-    Search for exact text or regex patterns across files within a directory tree.
+    Search for exact text or regex patterns across files within a directory tree, skipping files ignored by .gitignore.
     Returns matched file paths, line numbers, and matching line content.
     """
     search_dir = path
@@ -553,55 +1006,29 @@ def grep_search(
     if not os.path.exists(search_path):
         return f"Error: Path '{search_dir}' does not exist."
 
-    flags = 0 if case_sensitive else re.IGNORECASE
     try:
-        pattern = re.compile(query if is_regex else re.escape(query), flags)
+        pattern = compile_pattern(query, is_regex=is_regex, case_sensitive=case_sensitive)
     except re.error as e:
         return f"Error: Invalid regular expression '{query}': {e}"
 
     if g_ctx:
         g_ctx.dbg(f"grep_search ('{query}' in {search_path})")
 
-    matches = []
-    base_dir = search_path if os.path.isdir(search_path) else os.path.dirname(search_path)
-
-    def search_file(file_path: str):
-        try:
-            with open(file_path, "rb") as f:
-                header = f.read(1024)
-                if b"\x00" in header:
-                    return  # Skip binary file
-                f.seek(0)
-                line_no = 0
-                for raw_line in f:
-                    line_no += 1
-                    try:
-                        line = raw_line.decode("utf-8", errors="ignore")
-                    except Exception:
-                        continue
-                    if pattern.search(line):
-                        rel_path = os.path.relpath(file_path, base_dir)
-                        matches.append(f"{rel_path}:{line_no}: {line.rstrip()}")
-                        if len(matches) >= max_matches:
-                            return
-        except (OSError, PermissionError):
-            pass
-
     if os.path.isfile(search_path):
-        search_file(search_path)
+        name = os.path.basename(search_path)
+        found = grep_file(search_path, pattern, max_matches)
+        matches = [f"{name}:{line_no}: {line}" for line_no, line in found]
     else:
-        for root, dirs, files in os.walk(search_path):
-            # Prune ignored directories
-            dirs[:] = [d for d in dirs if not d.startswith(".") and d not in _IGNORED_SEARCH_DIRS]
-            for file in sorted(files):
-                if file_pattern and not fnmatch.fnmatch(file, file_pattern):
-                    continue
-                file_path = os.path.join(root, file)
-                search_file(file_path)
-                if len(matches) >= max_matches:
-                    break
-            if len(matches) >= max_matches:
-                break
+        # files come from the index of search_path, refreshed for what changed since the last search
+        files = [
+            rel_path
+            for rel_path, _, _ in tree_files(g_file_index.tree(search_path))
+            if not file_pattern or fnmatch.fnmatch(rel_path.rsplit("/", 1)[-1], file_pattern)
+        ]
+        matches = [
+            f"{os.path.normpath(rel_path)}:{line_no}: {line}"
+            for rel_path, line_no, line in grep_files(search_path, files, pattern, max_matches)
+        ]
 
     if not matches:
         return f"No matches found for '{query}'."
@@ -673,14 +1100,23 @@ def install(ctx):
     g_ctx = ctx
     group = "core_tools"
     # Examples of registering tools using automatic definition generation
-    ctx.register_tool(fetch_url, group=group)
-    ctx.register_tool(grep_search, group=group)
+    # sync tools run on the tool thread pool, the limits keep a burst of calls from one
+    # agent from taking every worker
+    ctx.register_tool(fetch_url, group=group, concurrency=8)
+    ctx.register_tool(grep_search, group=group, concurrency=4, timeout=60)
     ctx.register_tool(get_current_time, group=group)
     ctx.register_tool(calc, group=group)
-    ctx.register_tool(run_python, group=group)
-    ctx.register_tool(run_typescript, group=group)
-    ctx.register_tool(run_javascript, group=group)
-    ctx.register_tool(run_csharp, group=group)
+    ctx.register_tool(run_python, group=group, concurrency=4)
+    ctx.register_tool(run_typescript, group=group, concurrency=4)
+    ctx.register_tool(run_javascript, group=group, concurrency=4)
+    ctx.register_tool(run_csharp, group=group, concurrency=2)
+    g_compile_cache.path = ctx.get_cache_path("compile")
+    g_http_cache.path = ctx.get_cache_path("fetch")
+    g_file_index.path = ctx.get_cache_path("file-index")
+    if ctx.app.limits.get("compile_cache_mb"):
+        g_compile_cache.max_bytes = ctx.app.limits["compile_cache_mb"] * 1024 * 1024
+    if ctx.app.limits.get("fetch_cache_mb"):
+        g_http_cache.max_bytes = ctx.app.limits["fetch_cache_mb"] * 1024 * 1024
 
     def exec_language(language: str, code: str) -> Dict[str, Any]:
         if language == "python":
@@ -697,14 +1133,40 @@ def install(ctx):
     async def run_code(request):
         language = request.match_info["language"]
         code = await request.text()
+        started = time.perf_counter()
         try:
-            result = exec_language(language, code)
+            # on the tool thread pool, within the limits the run_* tools were registered with
+            name = f"run_{language}"
+            result = await ctx.app.tool_executor.run(
+                name, exec_language, {"language": language, "code": code}, ctx.app.tool_options.get(name)
+            )
         except Exception as e:
             result = {"stdout": "", "stderr": str(e), "returncode": -1}
+        result["durationMs"] = round((time.perf_counter() - started) * 1000)
         return web.json_response(result)
 
     ctx.add_post("code/{language}/run", run_code)
 
+    async def code_stats(request):
+        if not ctx.is_admin(request):
+            return web.json_response(ctx.create_error_response("Admin role required", "Forbidden"), status=403)
+        return web.json_response({"sandboxes": g_sandboxes.stats(), "compileCache": g_compile_cache.stats()})
+
+    ctx.add_get("code/stats", code_stats)
+
+    async def warm_sandboxes():
+        # so the first run of each language isn't cold either
+        for language, (runtime, _, _) in SANDBOX_LANGUAGES.items():
+            if runtime():
+                g_sandboxes.refill(language, size=1)
+
+    ctx.register_startup_handler(warm_sandboxes)
+
+    async def close_sandboxes():
+        await asyncio.to_thread(g_sandboxes.close)
+
+    ctx.register_cleanup_handler(close_sandboxes)
+
     async def get_calculator_features(request):
         operators = ["+", "-", "*", "/", "%", "^", "==", "!=", "<", "<=", ">", ">=", "and", "or", "not"]
         operators = [f" {op} " for op in operators]
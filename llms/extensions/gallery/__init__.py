@@ -41,14 +41,14 @@ def install(ctx):
     ctx.register_cache_saved_filter(on_cache_save)
 
     async def query_media(request):
-        rows = g_db.query_media(request.query, user=ctx.get_username(request))
+        rows = await g_db.query_media_async(request.query, user=ctx.get_username(request))
         dtos = [media_dto(row) for row in rows]
         return web.json_response(dtos)
 
     ctx.add_get("media", query_media)
 
     async def media_totals(request):
-        rows = g_db.media_totals(user=ctx.get_username(request))
+        rows = await g_db.media_totals_async(user=ctx.get_username(request))
         return web.json_response(rows)
 
     ctx.add_get("media/totals", media_totals)
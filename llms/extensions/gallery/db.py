@@ -2,7 +2,7 @@ import datetime
 import os
 from typing import Any, Dict
 
-from llms.db import DbManager, order_by, to_dto
+from llms.db import SNIPPET_SQL, DbManager, create_fts_table, fts_query, fts_snippet, order_by, to_dto
 
 
 def with_user(data, user):
@@ -77,8 +77,7 @@ class GalleryDB:
             "landscape": [ratio for ratio in ratios if ratio_format(ratio) == 1],
             "portrait": [ratio for ratio in ratios if ratio_format(ratio) == -1],
         }
-        with self.db.create_writer_connection() as conn:
-            self.init_db(conn)
+        self.db.run(self.init_db)
 
     def closest_aspect_ratio(self, width, height):
         target_ratio = width / height
@@ -127,6 +126,45 @@ class GalleryDB:
                 except Exception as e:
                     self.ctx.err(f"adding column {col}", e)
 
+        self.search = self.init_search(conn)
+
+    def init_search(self, conn):
+        """
+        media_fts indexes the text columns `q` searches with LIKE, kept in step by
+        triggers. Returns False when SQLite lacks FTS5.
+        """
+        created = create_fts_table(
+            self.ctx, conn, "media_fts", "prompt, name, description, caption, content='media', content_rowid='id'"
+        )
+        if created is None:
+            return False
+        for sql in [
+            """CREATE TRIGGER IF NOT EXISTS media_fts_insert AFTER INSERT ON media BEGIN
+                INSERT INTO media_fts(rowid, prompt, name, description, caption)
+                VALUES (new.id, new.prompt, new.name, new.description, new.caption);
+            END""",
+            """CREATE TRIGGER IF NOT EXISTS media_fts_update AFTER UPDATE OF prompt, name, description, caption ON media BEGIN
+                INSERT INTO media_fts(media_fts, rowid, prompt, name, description, caption)
+                VALUES ('delete', old.id, old.prompt, old.name, old.description, old.caption);
+                INSERT INTO media_fts(rowid, prompt, name, description, caption)
+                VALUES (new.id, new.prompt, new.name, new.description, new.caption);
+            END""",
+            """CREATE TRIGGER IF NOT EXISTS media_fts_delete AFTER DELETE ON media BEGIN
+                INSERT INTO media_fts(media_fts, rowid, prompt, name, description, caption)
+                VALUES ('delete', old.id, old.prompt, old.name, old.description, old.caption);
+            END""",
+        ]:
+            self.db.exec(conn, sql)
+        if created:
+            self.db.exec(conn, "INSERT INTO media_fts(media_fts) VALUES ('rebuild')")
+        return True
+
+    def rebuild_search_index(self):
+        """Re-index every media item's prompt, name, description and caption."""
+        if self.search:
+            self.db.run(lambda conn: self.db.exec(conn, "INSERT INTO media_fts(media_fts) VALUES ('rebuild')"))
+        return self.search
+
     def to_dto(self, row, json_columns):
         return to_dto(self.ctx, row, json_columns)
 
@@ -194,6 +232,9 @@ class GalleryDB:
             params,
         )
 
+    async def media_totals_async(self, user=None):
+        return await self.db.read_async(self.media_totals, user=user)
+
     def query_media(self, query: Dict[str, Any], user=None):
         try:
             all_columns = self.columns.keys()
@@ -230,6 +271,13 @@ class GalleryDB:
                 ratios = ", ".join([f"'{ratio}'" for ratio in format_ratios])
                 sql_where += f"aspect_ratio IN ({ratios})"
 
+            if "search" in query:
+                if self.search:
+                    return self.search_media(query, sql_where, params)
+                sql_where += " AND " if sql_where else "WHERE "
+                sql_where += "(prompt LIKE :search OR name LIKE :search OR description LIKE :search OR caption LIKE :search)"
+                params["search"] = f"%{query['search']}%"
+
             return self.db.all(
                 f"SELECT * FROM media {sql_where} {order_by(all_columns, sort)} LIMIT :take OFFSET :skip",
                 params,
@@ -238,6 +286,26 @@ class GalleryDB:
             self.ctx.err(f"query_media ({take}, {skip})", e)
             return []
 
+    def search_media(self, query, sql_where, params):
+        """Media matching `search` in media_fts, best match first, with a `snippet` of the match."""
+        params["search"] = fts_query(query["search"])
+        if not params["search"]:
+            return []
+        rows = self.db.all(
+            f"""SELECT media.*, hits.snippet FROM (
+                    SELECT rowid AS mediaId, rank, {SNIPPET_SQL.format(table="media_fts")} AS snippet
+                    FROM media_fts WHERE media_fts MATCH :search) hits
+                JOIN media ON media.id = hits.mediaId {sql_where}
+                ORDER BY hits.rank, media.id DESC LIMIT :take OFFSET :skip""",
+            params,
+        )
+        for row in rows:
+            row["snippet"] = fts_snippet(row["snippet"])
+        return rows
+
+    async def query_media_async(self, query: Dict[str, Any], user=None):
+        return await self.db.read_async(self.query_media, query, user=user)
+
     def update_media(self, id, media: Dict[str, Any], user=None):
         return self.db.update("media", self.columns, self.prepare_media(media, id, user=user))
 
@@ -308,7 +308,7 @@ const GalleryPage = {
                     take: PAGE_SIZE,
                 })
                 if (ext.prefs.q) {
-                    params.append('q', ext.prefs.q)
+                    params.append('search', ext.prefs.q)
                 }
                 if (ext.prefs.format && ext.prefs.type !== 'audio') {
                     params.append('format', ext.prefs.format)
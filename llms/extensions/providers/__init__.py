@@ -1,3 +1,7 @@
+import asyncio
+
+from aiohttp import web
+
 from .anthropic import install_anthropic
 from .cerebras import install_cerebras
 from .chutes import install_chutes
@@ -24,5 +28,26 @@ def install(ctx):
     install_zai(ctx)
     install_llmspy(ctx)
 
+    async def routes_handler(request):
+        if not ctx.is_admin(request):
+            return web.json_response(ctx.create_error_response("Admin role required", "Forbidden"), status=403)
+        return web.json_response(ctx.provider_routes())
+
+    ctx.add_get("routes", routes_handler)
+
+    async def limits_handler(request):
+        if not ctx.is_admin(request):
+            return web.json_response(ctx.create_error_response("Admin role required", "Forbidden"), status=403)
+        return web.json_response(ctx.provider_limits())
+
+    ctx.add_get("limits", limits_handler)
+
+    async def cache_handler(request):
+        if not ctx.is_admin(request):
+            return web.json_response(ctx.create_error_response("Admin role required", "Forbidden"), status=403)
+        return web.json_response(await asyncio.to_thread(ctx.response_cache_stats))
+
+    ctx.add_get("cache", cache_handler)
+
 
 __install__ = install
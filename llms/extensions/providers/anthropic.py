@@ -4,8 +4,6 @@ import json
 import shutil
 import time
 
-import aiohttp
-
 
 def detect_image_media_type(base64_data, declared_type=None):
     """Detect actual image media type from base64 data magic bytes.
@@ -144,7 +142,7 @@ def to_anthropic_messages(chat, ctx=None):
 
 
 def install_anthropic(ctx):
-    from llms.main import OpenAiCompatible
+    from llms.main import HTTPError, OpenAiCompatible, StreamAccumulator
 
     class AnthropicProvider(OpenAiCompatible):
         """Anthropic Provider using Anthropic API and API Pricing"""
@@ -240,7 +238,7 @@ def install_anthropic(ctx):
             ctx.log(json.dumps(anthropic_request, indent=2))
 
             if not is_stream:
-                async with aiohttp.ClientSession() as session:
+                async with ctx.client_session(self.id) as session:
                     started_at = time.time()
                     async with session.post(
                         self.chat_url,
@@ -253,7 +251,7 @@ def install_anthropic(ctx):
                         )
 
             started_at = time.time()
-            async with aiohttp.ClientSession() as session, session.post(
+            async with ctx.client_session(self.id) as session, session.post(
                 self.chat_url,
                 headers=self.headers,
                 data=json.dumps(anthropic_request),
@@ -264,21 +262,19 @@ def install_anthropic(ctx):
         async def handle_stream_response(self, response, chat, started_at, context=None):
             if response.status >= 300:
                 text = await response.text()
+                message = f"Failed chat completion {response.status}: {text}"
                 try:
                     data = json.loads(text)
                     if "error" in data and "message" in data["error"]:
-                        raise Exception(data["error"]["message"])
+                        message = data["error"]["message"]
                 except json.JSONDecodeError:
                     pass
-                raise Exception(f"Failed chat completion {response.status}: {text}")
+                raise HTTPError(response.status, response.reason, text, dict(response.headers), message=message)
 
             response_id = None
             created_time = None
             model_name = None
-            content_acc = ""
-            reasoning_acc = ""
-            reasoning_field = None
-            tool_calls_dict = {}
+            acc = StreamAccumulator(model=chat.get("model"), reasoning_field="thinking")
             finish_reason = None
             usage_acc = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
             writer = self.stream_writer(context)
@@ -322,41 +318,35 @@ def install_anthropic(ctx):
                             block = chunk.get("content_block", {})
                             block_type = block.get("type")
                             if block_type == "tool_use":
-                                tool_calls_dict[idx] = {
-                                    "id": block.get("id") or "",
-                                    "type": "function",
-                                    "function": {
-                                        "name": block.get("name") or "",
-                                        "arguments": "",
-                                    },
-                                }
+                                arguments = ""
                                 if "input" in block and block["input"] and isinstance(block["input"], dict):
-                                    tool_calls_dict[idx]["function"]["arguments"] = json.dumps(block["input"])
+                                    arguments = json.dumps(block["input"])
+                                acc.add_tool_call(
+                                    idx,
+                                    {
+                                        "id": block.get("id") or "",
+                                        "type": "function",
+                                        "function": {
+                                            "name": block.get("name") or "",
+                                            "arguments": arguments,
+                                        },
+                                    },
+                                )
                             elif block_type == "thinking":
-                                if block.get("thinking"):
-                                    reasoning_acc += block["thinking"]
-                                    reasoning_field = "thinking"
+                                acc.add_reasoning(block.get("thinking"), "thinking")
                             elif block_type == "text":
-                                if block.get("text"):
-                                    content_acc += block["text"]
+                                acc.add_content(block.get("text"))
 
                         elif event_type == "content_block_delta":
                             idx = chunk.get("index", 0)
                             delta = chunk.get("delta", {})
                             delta_type = delta.get("type")
                             if delta_type == "text_delta":
-                                content_acc += delta.get("text", "")
+                                acc.add_content(delta.get("text", ""))
                             elif delta_type == "thinking_delta":
-                                reasoning_acc += delta.get("thinking", "")
-                                reasoning_field = "thinking"
+                                acc.add_reasoning(delta.get("thinking", ""), "thinking")
                             elif delta_type == "input_json_delta":
-                                if idx not in tool_calls_dict:
-                                    tool_calls_dict[idx] = {
-                                        "id": "",
-                                        "type": "function",
-                                        "function": {"name": "", "arguments": ""},
-                                    }
-                                tool_calls_dict[idx]["function"]["arguments"] += delta.get("partial_json", "")
+                                acc.add_tool_arguments(idx, delta.get("partial_json", ""))
 
                         elif event_type == "message_delta":
                             delta = chunk.get("delta", {})
@@ -376,26 +366,14 @@ def install_anthropic(ctx):
                             break
 
                         elif event_type == "error":
-                            raise Exception(
-                                self.stream_error_message(chunk.get("error"), "Anthropic streaming error")
-                            )
+                            raise self.stream_error(chunk.get("error"), "Anthropic streaming error")
 
                         if context and ctx.should_cancel_thread(context):
                             break
 
                         # Hand every chunk to the writer: it keeps the latest in memory
                         # and only reaches the db on its checkpoint interval.
-                        assistant_msg = {
-                            "role": "assistant",
-                            "content": content_acc,
-                            "model": chat.get("model"),
-                        }
-                        if reasoning_acc:
-                            assistant_msg[reasoning_field or "thinking"] = reasoning_acc
-                        if tool_calls_dict:
-                            assistant_msg["tool_calls"] = [tool_calls_dict[i] for i in sorted(tool_calls_dict.keys())]
-
-                        await writer.write(assistant_msg)
+                        await writer.write(acc)
 
             except Exception:
                 # Keep whatever streamed before the failure instead of losing the
@@ -407,26 +385,9 @@ def install_anthropic(ctx):
                 ctx.log(f"Stream cancelled for thread {writer.thread_id}")
                 return None
 
-            assistant_msg = {
-                "role": "assistant",
-                "content": content_acc,
-                "model": chat.get("model"),
-            }
-            if reasoning_acc:
-                assistant_msg[reasoning_field or "thinking"] = reasoning_acc
-            if tool_calls_dict:
-                assistant_msg["tool_calls"] = [tool_calls_dict[i] for i in sorted(tool_calls_dict.keys())]
-
-            await writer.write(assistant_msg, final=True)
+            await writer.write(acc, final=True)
 
-            message_obj = {
-                "role": "assistant",
-                "content": content_acc,
-            }
-            if reasoning_acc:
-                message_obj[reasoning_field or "thinking"] = reasoning_acc
-            if tool_calls_dict:
-                message_obj["tool_calls"] = [tool_calls_dict[i] for i in sorted(tool_calls_dict.keys())]
+            message_obj = acc.message(include_model=False)
 
             choice_obj = {
                 "index": 0,
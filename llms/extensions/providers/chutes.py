@@ -2,8 +2,6 @@ import json
 import mimetypes
 import time
 
-import aiohttp
-
 
 def install_chutes(ctx):
     from llms.main import GeneratorBase
@@ -103,7 +101,7 @@ def install_chutes(ctx):
 
             ctx.log(f"POST {gen_url}")
             ctx.log(json.dumps(payload, indent=2))
-            async with aiohttp.ClientSession() as session, session.post(
+            async with ctx.client_session(self.id) as session, session.post(
                 gen_url, headers=headers, json=payload
             ) as response:
                 if response.status < 300:
@@ -59,7 +59,7 @@ def install_fireworks(ctx):
         async def _chat_sync(self, gen_url, headers, gen_request, chat, context=None):
             """Synchronous text_to_image flow for schnell/dev models."""
             headers["Accept"] = "image/png"
-            async with aiohttp.ClientSession() as session, session.post(
+            async with ctx.client_session(self.id) as session, session.post(
                 gen_url,
                 headers=headers,
                 data=json.dumps(gen_request),
@@ -82,7 +82,7 @@ def install_fireworks(ctx):
             import asyncio
 
             headers["Accept"] = "application/json"
-            async with aiohttp.ClientSession() as session:
+            async with ctx.client_session(self.id) as session:
                 # Step 1: Submit generation request
                 async with session.post(
                     gen_url,
@@ -5,8 +5,6 @@ import json
 import time
 import wave
 
-import aiohttp
-
 # class GoogleOpenAiProvider(OpenAiCompatible):
 #     sdk = "google-openai-compatible"
 
@@ -16,7 +14,7 @@ import aiohttp
 
 
 def install_google(ctx):
-    from llms.main import OpenAiCompatible
+    from llms.main import HTTPError, OpenAiCompatible, StreamAccumulator
 
     def gemini_chat_summary(gemini_chat):
         """Summarize Gemini chat completion request for logging. Replace inline_data with size of content only"""
@@ -244,21 +242,19 @@ def install_google(ctx):
         async def handle_stream_response(self, response, chat, started_at, context=None):
             if response.status >= 300:
                 text = await response.text()
+                message = f"Failed chat completion {response.status}: {text}"
                 try:
                     data = json.loads(text)
                     if "error" in data and "message" in data["error"]:
-                        raise Exception(data["error"]["message"])
+                        message = data["error"]["message"]
                 except json.JSONDecodeError:
                     pass
-                raise Exception(f"Failed chat completion {response.status}: {text}")
+                raise HTTPError(response.status, response.reason, text, dict(response.headers), message=message)
 
             response_id = None
             created_time = None
             model_name = None
-            content_acc = ""
-            reasoning_acc = ""
-            reasoning_field = None
-            tool_calls_dict = {}
+            acc = StreamAccumulator(model=chat.get("model"), reasoning_field="reasoning")
             finish_reason = None
             usage_acc = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
             grounding_acc = None
@@ -281,9 +277,7 @@ def install_google(ctx):
                             continue
 
                         if "error" in chunk:
-                            raise Exception(
-                                self.stream_error_message(chunk["error"], "Google Gemini streaming error")
-                            )
+                            raise self.stream_error(chunk["error"], "Google Gemini streaming error")
 
                         if chunk.get("modelVersion"):
                             model_name = chunk["modelVersion"]
@@ -320,13 +314,12 @@ def install_google(ctx):
                                 if "text" in part:
                                     text_val = part["text"]
                                     if part.get("thought"):
-                                        reasoning_acc += text_val
-                                        reasoning_field = "reasoning"
+                                        acc.add_reasoning(text_val, "reasoning")
                                     else:
-                                        content_acc += text_val
+                                        acc.add_content(text_val)
                                 if "functionCall" in part:
                                     fc = part["functionCall"]
-                                    idx = len(tool_calls_dict)
+                                    idx = len(acc.tool_calls)
                                     fn_name = fc.get("name", "")
                                     fn_args = (
                                         json.dumps(fc.get("args", {}))
@@ -345,24 +338,14 @@ def install_google(ctx):
                                     if signature:
                                         tc["thoughtSignature"] = signature
                                         tc["extra_content"] = {"google": {"thought_signature": signature}}
-                                    tool_calls_dict[idx] = tc
+                                    acc.add_tool_call(idx, tc)
 
                         if context and ctx.should_cancel_thread(context):
                             break
 
                         # Hand every chunk to the writer: it keeps the latest in memory
                         # and only reaches the db on its checkpoint interval.
-                        assistant_msg = {
-                            "role": "assistant",
-                            "content": content_acc,
-                            "model": chat.get("model"),
-                        }
-                        if reasoning_acc:
-                            assistant_msg[reasoning_field or "reasoning"] = reasoning_acc
-                        if tool_calls_dict:
-                            assistant_msg["tool_calls"] = [tool_calls_dict[i] for i in sorted(tool_calls_dict.keys())]
-
-                        await writer.write(assistant_msg)
+                        await writer.write(acc)
 
             except Exception:
                 # Keep whatever streamed before the failure instead of losing the
@@ -374,30 +357,15 @@ def install_google(ctx):
                 ctx.log(f"Stream cancelled for thread {writer.thread_id}")
                 return None
 
-            grounding = finalize_grounding_metadata(grounding_acc, content_acc)
+            grounding = finalize_grounding_metadata(grounding_acc, acc.content)
 
-            assistant_msg = {
-                "role": "assistant",
-                "content": content_acc,
-                "model": chat.get("model"),
-            }
-            if reasoning_acc:
-                assistant_msg[reasoning_field or "reasoning"] = reasoning_acc
-            if tool_calls_dict:
-                assistant_msg["tool_calls"] = [tool_calls_dict[i] for i in sorted(tool_calls_dict.keys())]
+            assistant_msg = acc.message()
             if grounding:
                 assistant_msg["groundingMetadata"] = grounding
 
             await writer.write(assistant_msg, final=True)
 
-            message_obj = {
-                "role": "assistant",
-                "content": content_acc,
-            }
-            if reasoning_acc:
-                message_obj[reasoning_field or "reasoning"] = reasoning_acc
-            if tool_calls_dict:
-                message_obj["tool_calls"] = [tool_calls_dict[i] for i in sorted(tool_calls_dict.keys())]
+            message_obj = acc.message(include_model=False)
             # Carried on the message, not the thread: `providerResponse` holds only the last
             # response, so scrolling back through a conversation would show every answer
             # sourced from the newest one's citations.
@@ -480,7 +448,7 @@ def install_google(ctx):
             # Track tool call IDs to names for response mapping
             tool_id_map = {}
 
-            async with aiohttp.ClientSession() as session:
+            async with ctx.client_session(self.id) as session:
                 for message in chat["messages"]:
                     if message["role"] == "system":
                         content = message["content"]
@@ -6,8 +6,6 @@ import os
 import time
 import wave
 
-import aiohttp
-
 
 def install_llmspy(ctx):
     from llms.main import GeneratorBase, OpenAiCompatible
@@ -168,7 +166,7 @@ def install_llmspy(ctx):
 
             metadata = chat.pop("metadata", None)
 
-            async with aiohttp.ClientSession() as session:
+            async with ctx.client_session(self.id) as session:
                 started_at = time.time()
                 async with session.post(
                     self.chat_url, headers=self.headers, data=json.dumps(chat), timeout=ctx.get_client_timeout()
@@ -34,7 +34,7 @@ def install_mistral(ctx):
     async def get_models(request):
         mistral = ctx.get_registered_provider("mistral")
         url = mistral.api + "/models"
-        async with aiohttp.ClientSession() as session, session.get(
+        async with ctx.client_session(mistral.id) as session, session.get(
             url, headers=mistral.headers, timeout=ctx.get_client_timeout()
         ) as response:
             return aiohttp.web.json_response(await response.json())
@@ -70,7 +70,7 @@ def install_mistral(ctx):
 
             ctx.log(f"POST {self.api_url} model={model} file={filename} ({len(file_bytes)} bytes)")
 
-            async with aiohttp.ClientSession() as session, session.post(
+            async with ctx.client_session(self.id) as session, session.post(
                 self.api_url, headers=headers, data=data
             ) as response:
                 text = await response.text()
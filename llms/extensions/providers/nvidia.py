@@ -1,8 +1,6 @@
 import json
 import time
 
-import aiohttp
-
 
 def install_nvidia(ctx):
     from llms.main import GeneratorBase
@@ -93,7 +91,7 @@ def install_nvidia(ctx):
                 text = ctx.text_from_file(f"{ctx.MOCK_DIR}/nvidia-image.json")
                 return self.to_response(json.loads(text), chat, started_at)
             else:
-                async with aiohttp.ClientSession() as session, session.post(
+                async with ctx.client_session(self.id) as session, session.post(
                     gen_url,
                     headers=headers,
                     data=json.dumps(gen_request),
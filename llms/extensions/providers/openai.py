@@ -3,8 +3,6 @@ import json
 import mimetypes
 import time
 
-import aiohttp
-
 
 def install_openai(ctx):
     from llms.main import GeneratorBase, OpenAiCompatible
@@ -70,7 +68,7 @@ def install_openai(ctx):
                         image_data = base64.b64decode(b64_json)
                     elif image_url:
                         ctx.log(f"GET {image_url}")
-                        async with aiohttp.ClientSession() as session, await session.get(image_url) as res:
+                        async with ctx.client_session("downloads") as session, await session.get(image_url) as res:
                             if res.status == 200:
                                 image_data = await res.read()
                                 content_type = res.headers.get("Content-Type")
@@ -143,7 +141,7 @@ def install_openai(ctx):
                 ctx.log(f"POST {self.api}")
                 # _log(json.dumps(headers, indent=2))
                 ctx.log(json.dumps(payload, indent=2))
-                async with aiohttp.ClientSession() as session, session.post(
+                async with ctx.client_session(self.id) as session, session.post(
                     self.api, headers=headers, json=payload
                 ) as response:
                     text = await response.text()
@@ -54,7 +54,7 @@ def install_openrouter(ctx):
                             image_data = base64.b64decode(b64_json)
                     elif image_url:
                         ctx.log(f"GET {image_url}")
-                        async with aiohttp.ClientSession() as session, await session.get(image_url) as res:
+                        async with ctx.client_session("downloads") as session, await session.get(image_url) as res:
                             if res.status == 200:
                                 image_data = await res.read()
                                 content_type = res.headers.get("Content-Type")
@@ -168,7 +168,7 @@ def install_openrouter(ctx):
 
                 metadata = chat.pop("metadata", None)
 
-                async with aiohttp.ClientSession() as session, session.post(
+                async with ctx.client_session(self.id) as session, session.post(
                     api_url,
                     headers=headers,
                     json=payload,
@@ -321,7 +321,7 @@ def install_openrouter(ctx):
                         audio_data = f.read()
                 return self.to_response(audio_data, chat, started_at, provider=provider, context=context)
             else:
-                async with aiohttp.ClientSession() as session, session.post(
+                async with ctx.client_session(self.id) as session, session.post(
                     api_url,
                     headers=headers,
                     json=payload,
@@ -391,7 +391,7 @@ def install_openrouter(ctx):
             metadata = chat.pop("metadata", None)
 
             if not is_stream:
-                async with aiohttp.ClientSession() as session:
+                async with ctx.client_session(self.id) as session:
                     started_at = time.time()
                     async with session.post(
                         self.chat_url, headers=self.headers, data=json.dumps(chat), timeout=ctx.get_client_timeout()
@@ -405,7 +405,7 @@ def install_openrouter(ctx):
                 chat["stream_options"] = {"include_usage": True}
 
             started_at = time.time()
-            async with aiohttp.ClientSession() as session, session.post(
+            async with ctx.client_session(self.id) as session, session.post(
                 self.chat_url,
                 headers=self.headers,
                 data=json.dumps(chat),
@@ -543,7 +543,7 @@ def install_openrouter(ctx):
                 metadata = chat.pop("metadata", None)
                 # Remove tools as audio output models usually do not support tool calling
                 chat.pop("tools", None)
-                async with aiohttp.ClientSession() as session, session.post(
+                async with ctx.client_session(self.id) as session, session.post(
                     api_url,
                     headers=headers,
                     data=json.dumps(chat),
@@ -91,7 +91,7 @@ def install_zai(ctx):
             ctx.dbg(f"ZaiProvider.chat: {chat_url}")
             ctx.dbg(json.dumps(body, indent=2))
             started_at = time.time()
-            async with aiohttp.ClientSession() as session, session.post(
+            async with ctx.client_session(self.id) as session, session.post(
                 chat_url,
                 headers=headers,
                 data=json.dumps(body),
@@ -64,6 +64,13 @@ def install(ctx):
 
     ctx.add_post("exec/{name}", exec_handler)
 
+    async def tool_stats_handler(request):
+        if not ctx.is_admin(request):
+            return web.json_response(ctx.create_error_response("Admin role required", "Forbidden"), status=403)
+        return web.json_response(ctx.tool_stats())
+
+    ctx.add_get("stats", tool_stats_handler)
+
     async def server_tools_handler(request):
         user = ctx.get_username(request)
         paths = []
@@ -0,0 +1,364 @@
+"""
+File search shared by grep_search and the filesystem tools: a parallel directory walk that
+honours .gitignore files, regex scanning of whole files through mmap, and an index of the
+files under a directory that is refreshed incrementally between searches.
+"""
+
+import contextlib
+import hashlib
+import json
+import mmap
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Directories never worth searching, skipped without reading .gitignore
+IGNORED_DIRS = {
+    ".git",
+    ".venv",
+    "venv",
+    ".env",
+    "node_modules",
+    "__pycache__",
+    "dist",
+    "build",
+    "bin",
+    "obj",
+    "target",
+    "vendor",
+    ".next",
+    ".nuxt",
+    ".cache",
+    ".tox",
+}
+
+SEARCH_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+BINARY_SNIFF_BYTES = 1024
+MMAP_MIN_BYTES = 256 * 1024
+GREP_BATCH_SIZE = 64
+
+
+def _translate_glob(pattern):
+    """Regex for a .gitignore glob, where * and ? don't cross / and ** does."""
+    i, n, out = 0, len(pattern), []
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("/**", i) and i + 3 == n:
+            out.append("/.*")
+            i += 3
+        elif pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+        elif c == "*":
+            out.append("[^/]*")
+            i += 1
+        elif c == "?":
+            out.append("[^/]")
+            i += 1
+        elif c == "[" and "]" in pattern[i + 2 :]:
+            end = pattern.index("]", i + 2)
+            body = pattern[i + 1 : end]
+            negate = body[:1] in ("!", "^")
+            body = (body[1:] if negate else body).replace("\\", "\\\\")
+            out.append(("[^" if negate else "[") + body + "]")
+            i = end + 1
+        elif c == "\\" and i + 1 < n:
+            out.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            out.append(re.escape(c))
+            i += 1
+    return "".join(out)
+
+
+class GitIgnore:
+    """The patterns of one .gitignore, each compiled to a regex once when the file is read."""
+
+    def __init__(self, lines):
+        self.rules = []  # [(regex, negate, dir_only)]
+        for line in lines:
+            line = line.rstrip("\n\r")
+            if not line.endswith("\\ "):
+                line = line.rstrip(" ")
+            if not line or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            if negate or line.startswith("\\"):
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            if not line:
+                continue
+            # a slash anywhere but the end anchors the pattern to the .gitignore's directory
+            anchored = "/" in line
+            regex = _translate_glob(line.lstrip("/"))
+            self.rules.append((re.compile(("^" if anchored else "(?:^|.*/)") + regex + "$"), negate, dir_only))
+
+    @classmethod
+    def load(cls, directory):
+        try:
+            with open(os.path.join(directory, ".gitignore"), encoding="utf-8", errors="replace") as f:
+                return cls(f.readlines())
+        except OSError:
+            return None
+
+    def match(self, rel_path, is_dir):
+        """True if ignored, False if re-included with a ! pattern, None if no pattern matches."""
+        for regex, negate, dir_only in reversed(self.rules):
+            if dir_only and not is_dir:
+                continue
+            if regex.match(rel_path):
+                return not negate
+        return None
+
+
+def is_ignored(stack, rel_path, is_dir):
+    """Whether rel_path (relative to the search root) is ignored by the .gitignore files in stack."""
+    # the deepest .gitignore that has an opinion wins
+    for base, gitignore in reversed(stack):
+        matched = gitignore.match(rel_path[len(base) + 1 :] if base else rel_path, is_dir)
+        if matched is not None:
+            return matched
+    return False
+
+
+def _mtime_ns(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def scan_tree(root, previous=None, ignored_dirs=IGNORED_DIRS, hidden=False, gitignore=True, workers=SEARCH_WORKERS):
+    """
+    Walk root on a pool of threads, returning {rel_dir: {mtime, ignore, dirs, files}} where
+    files are [name, size, mtime] and rel_dir uses / separators ("" is root itself).
+
+    Entries from `previous` are reused for directories whose mtime and .gitignore haven't
+    changed, so refreshing an index costs a stat per directory instead of listing every
+    directory and stating every file. A file edited in place doesn't change its directory's
+    mtime, so its size and mtime are as of the last time its directory changed.
+    """
+    previous = previous or {}
+    tree = {}
+
+    def scan(rel_dir, stack, force):
+        path = os.path.join(root, *rel_dir.split("/")) if rel_dir else root
+        mtime = _mtime_ns(path)
+        if mtime is None:
+            return rel_dir, None, []
+        ignore_mtime = _mtime_ns(os.path.join(path, ".gitignore")) if gitignore else None
+        if ignore_mtime is not None:
+            rules = GitIgnore.load(path)
+            if rules and rules.rules:
+                stack = [*stack, (rel_dir, rules)]
+        entry = previous.get(rel_dir)
+        ignore_changed = entry is not None and entry["ignore"] != ignore_mtime
+        if force or entry is None or ignore_changed or entry["mtime"] != mtime:
+            dirs, files = [], []
+            with contextlib.suppress(OSError), os.scandir(path) as it:
+                for item in it:
+                    rel_path = f"{rel_dir}/{item.name}" if rel_dir else item.name
+                    with contextlib.suppress(OSError):
+                        if item.is_dir(follow_symlinks=False):
+                            if item.name in ignored_dirs or (not hidden and item.name.startswith(".")):
+                                continue
+                            if not is_ignored(stack, rel_path, True):
+                                dirs.append(item.name)
+                        elif item.is_file() and not is_ignored(stack, rel_path, False):
+                            stat = item.stat()
+                            files.append([item.name, stat.st_size, stat.st_mtime])
+            entry = {"mtime": mtime, "ignore": ignore_mtime, "dirs": sorted(dirs), "files": sorted(files)}
+        # a changed .gitignore can change what's ignored anywhere below it
+        force = force or ignore_changed
+        return rel_dir, entry, [(f"{rel_dir}/{name}" if rel_dir else name, stack, force) for name in entry["dirs"]]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(scan, "", [], False)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                rel_dir, entry, children = future.result()
+                if entry is None:
+                    continue
+                tree[rel_dir] = entry
+                pending.update(pool.submit(scan, *child) for child in children)
+    return tree
+
+
+def tree_files(tree):
+    """Sorted [(rel_path, size, mtime)] of every file in a tree from scan_tree."""
+    files = []
+    for rel_dir, entry in tree.items():
+        prefix = f"{rel_dir}/" if rel_dir else ""
+        files.extend((prefix + name, size, mtime) for name, size, mtime in entry["files"])
+    files.sort()
+    return files
+
+
+class FileIndex:
+    """
+    The trees of recently searched directories, kept in memory and (when path is set) on
+    disk, so each search only rescans the directories that changed since the last one.
+    """
+
+    def __init__(self, path=None, max_roots=8):
+        self.path = path
+        self.max_roots = max_roots
+        self.lock = threading.Lock()
+        self.trees = OrderedDict()  # {key: tree}
+
+    def index_path(self, key):
+        return os.path.join(self.path, f"{hashlib.sha256(key.encode()).hexdigest()[:32]}.json")
+
+    def load(self, key):
+        with self.lock:
+            if key in self.trees:
+                self.trees.move_to_end(key)
+                return self.trees[key]
+        if self.path:
+            with contextlib.suppress(OSError, ValueError), open(self.index_path(key), encoding="utf-8") as f:
+                return json.load(f)
+        return None
+
+    def save(self, key, tree):
+        with self.lock:
+            self.trees[key] = tree
+            self.trees.move_to_end(key)
+            while len(self.trees) > self.max_roots:
+                self.trees.popitem(last=False)
+        if self.path:
+            with contextlib.suppress(OSError):
+                os.makedirs(self.path, exist_ok=True)
+                tmp_path = f"{self.index_path(key)}.{os.getpid()}.{threading.get_ident()}"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(tree, f, separators=(",", ":"))
+                os.replace(tmp_path, self.index_path(key))
+
+    def tree(self, root, ignored_dirs=IGNORED_DIRS, hidden=False, gitignore=True):
+        """The up-to-date tree of root, see scan_tree()."""
+        root = os.path.abspath(root)
+        key = json.dumps([root, sorted(ignored_dirs), hidden, gitignore])
+        tree = scan_tree(root, self.load(key), ignored_dirs=ignored_dirs, hidden=hidden, gitignore=gitignore)
+        self.save(key, tree)
+        return tree
+
+
+g_file_index = FileIndex()
+
+
+def compile_pattern(query, is_regex=False, case_sensitive=False):
+    """
+    Compile a search query for grep_file(). ASCII queries compile to a bytes regex that
+    scans the file's mmap without decoding it; others (and regexes using character classes
+    whose meaning depends on Unicode) are matched against the decoded text. Raises re.error.
+    """
+    flags = re.MULTILINE | (0 if case_sensitive else re.IGNORECASE)
+    source = query if is_regex else re.escape(query)
+    if query.isascii() and not (is_regex and re.search(r"\\[wWbBdDsS]", query)):
+        return re.compile(source.encode(), flags)
+    return re.compile(source, flags)
+
+
+def grep_file(path, pattern, max_matches=None):
+    """[(line number, line)] of the lines matching a compile_pattern() regex, [] for binary files."""
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    except OSError:
+        return []
+    try:
+        size = os.fstat(fd).st_size
+        if size == 0:
+            return []
+        # small files are cheaper to read than to map
+        data = os.read(fd, size) if size <= MMAP_MIN_BYTES else mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        try:
+            if b"\x00" in data[:BINARY_SNIFF_BYTES]:
+                return []
+            if isinstance(pattern.pattern, bytes):
+                return _grep_data(data, pattern, b"\n", max_matches)
+            return _grep_data(data[:].decode("utf-8", errors="ignore"), pattern, "\n", max_matches)
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+    except (OSError, ValueError):
+        return []
+    finally:
+        os.close(fd)
+
+
+def _grep_data(data, pattern, newline, max_matches):
+    matches = []
+    line_no, counted, pos, size = 1, 0, 0, len(data)
+    by_line = False
+    while pos < size and (max_matches is None or len(matches) < max_matches):
+        if by_line:
+            start = pos
+            end = data.find(newline, start)
+            if end == -1:
+                end = size
+            pos = end + 1
+            # the line on its own, with its newline as when read by line
+            if not pattern.search(data, start, pos):
+                continue
+        else:
+            m = pattern.search(data, pos)
+            if not m:
+                break
+            start = data.rfind(newline, 0, m.start()) + 1
+            if start == size:
+                # the empty position after the file's last newline isn't a line
+                break
+            end = data.find(newline, start)
+            if end == -1:
+                end = size
+            if m.end() > end + 1:
+                # the pattern can match across lines, e.g. through [^z]* or \s, so searching the
+                # file again from each line would rescan the same span: go a line at a time
+                by_line = True
+                pos = start
+                continue
+            # one match per line, continue from the next
+            pos = end + 1
+        line_no += data[counted:start].count(newline)
+        counted = start
+        line = data[start:end]
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", errors="ignore")
+        matches.append((line_no, line.rstrip()))
+    return matches
+
+
+def grep_files(root, rel_paths, pattern, max_matches, workers=SEARCH_WORKERS):
+    """
+    [(rel_path, line number, line)] matching pattern in rel_paths (in that order), scanning
+    batches of files in parallel and stopping once max_matches are found.
+    """
+    batches = [rel_paths[i : i + GREP_BATCH_SIZE] for i in range(0, len(rel_paths), GREP_BATCH_SIZE)]
+
+    def grep_batch(batch):
+        found = []
+        for rel_path in batch:
+            path = os.path.join(root, rel_path) if os.sep == "/" else os.path.join(root, *rel_path.split("/"))
+            found.extend(
+                (rel_path, line_no, line) for line_no, line in grep_file(path, pattern, max_matches - len(found))
+            )
+            if len(found) >= max_matches:
+                break
+        return found
+
+    matches = []
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for future in [pool.submit(grep_batch, batch) for batch in batches]:
+            matches.extend(future.result())
+            if len(matches) >= max_matches:
+                return matches[:max_matches]
+        return matches
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
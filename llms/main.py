@@ -10,11 +10,14 @@ import argparse
 import asyncio
 import base64
 import contextlib
+import contextvars
 import copy
+import functools
 import hashlib
 import importlib.util
 import inspect
 import json
+import math
 import mimetypes
 import os
 import random
@@ -27,7 +30,11 @@ import sys
 import tempfile
 import time
 import traceback
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import UTC, datetime
+from email.utils import parsedate_to_datetime
 from enum import Enum, IntEnum
 from importlib import resources  # Py≥3.9  (pip install importlib_resources for 3.7/3.8)
 from io import BytesIO
@@ -50,6 +57,7 @@ from typing import (
 from urllib.parse import parse_qs, urljoin
 
 from llms.db import count_tokens_approx
+from llms.responsecache import ResponseCache, is_deterministic, request_key
 import aiohttp
 from aiohttp import web
 
@@ -74,8 +82,35 @@ DEFAULT_LIMITS = {
     "retries": 3,
     # How often an in-flight streamed response is persisted. This is also how often the
     # UI sees it, so it trades smoothness against write volume. Cheap now that a
-    # checkpoint writes one small column instead of rewriting the whole conversation.
+    # checkpoint appends only the text streamed since the last one.
     "stream_checkpoint_interval": 0.25,
+    # Appended stream chunks are folded back into a full checkpoint after this many,
+    # bounding what a reader has to replay to rebuild the in-flight message.
+    "stream_compact_chunks": 120,
+    # Provider requests share long-lived keep-alive connection pools (one per provider)
+    # instead of paying a fresh TCP+TLS handshake for every completion.
+    "connection_limit": 100,
+    "connection_limit_per_host": 0,  # 0 = no per-host cap
+    "keepalive_timeout": 30,
+    "dns_cache_ttl": 300,
+    # Synchronous tools run on a thread pool of this size, off the event loop. Tools
+    # registered with process=True run on a process pool instead.
+    "tool_threads": 16,
+    "tool_processes": 2,
+    # Compiled C# assemblies and transpiled TypeScript are cached under ~/.llms/cache/compile,
+    # evicting the least recently used once it grows past this size.
+    "compile_cache_mb": 256,
+    # Pages fetched by fetch_url are cached under ~/.llms/cache/fetch, evicting the least
+    # recently used once it grows past this size.
+    "fetch_cache_mb": 64,
+    # Providers that fail this many times in a row are skipped for circuit_cooldown seconds
+    # (doubling while they keep failing), then tried again with a single probe request.
+    "circuit_failures": 3,
+    "circuit_cooldown": 30,
+    # Seconds to wait before retrying after every provider failed, doubling each round,
+    # and the longest a provider's Retry-After can hold a retry back.
+    "retry_backoff": 0.5,
+    "retry_after_max": 60,
 }
 DEFAULT_LOADING_MESSAGES = ["Computing", "Cooking", "Crafting", "Creating"]
 g_config_path = None
@@ -521,11 +556,14 @@ def function_to_tool_definition(func):
 
 
 async def download_file(url):
-    async with aiohttp.ClientSession() as session:
+    async with client_session("downloads") as session:
         return await session_download_file(session, url)
 
 
 async def session_download_file(session, url, default_mimetype="application/octet-stream"):
+    if session is None:
+        async with client_session("downloads") as session:
+            return await session_download_file(session, url, default_mimetype=default_mimetype)
     try:
         async with session.get(url, timeout=get_client_timeout()) as response:
             response.raise_for_status()
@@ -855,7 +893,7 @@ async def process_chat(chat, provider_id=None):
             if thinking_val is not None and expected_field:
                 message[expected_field] = thinking_val
 
-    async with aiohttp.ClientSession() as session:
+    async with client_session("downloads") as session:
         for message in chat["messages"]:
             if "content" not in message:
                 continue
@@ -1061,12 +1099,84 @@ def cache_message_inline_data(m, context=None):
 
 
 class HTTPError(Exception):
-    def __init__(self, status, reason, body, headers=None):
+    def __init__(self, status, reason, body, headers=None, message=None):
         self.status = status
         self.reason = reason
         self.body = body
         self.headers = headers
-        super().__init__(f"HTTP {status} {reason}")
+        super().__init__(message or f"HTTP {status} {reason}")
+
+
+def retry_after_seconds(headers):
+    """Seconds to wait from a Retry-After header, given as seconds or an HTTP date."""
+    value = next((v for k, v in (headers or {}).items() if k.lower() == "retry-after"), None)
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_client_error(error):
+    """A 4xx the provider would give again, e.g. a 400 for a context that's too long or a 401."""
+    return isinstance(error, HTTPError) and 400 <= error.status < 500 and error.status not in (408, 429)
+
+
+def is_transient_error(error):
+    """A failure worth retrying that says something about the provider's health."""
+    if isinstance(error, HTTPError):
+        return error.status >= 500 or error.status in (408, 429)
+    # ClientPayloadError: the response (usually a stream) was cut off part way through
+    return isinstance(
+        error,
+        (asyncio.TimeoutError, TimeoutError, ConnectionError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError),
+    )
+
+
+# HTTP status equivalent to the error types (Anthropic) and statuses (Google) providers
+# report in a stream after it has started with a 200
+STREAM_ERROR_STATUS = {
+    "invalid_request_error": 400,
+    "authentication_error": 401,
+    "permission_error": 403,
+    "not_found_error": 404,
+    "request_too_large": 413,
+    "rate_limit_error": 429,
+    "rate_limit_exceeded": 429,
+    "api_error": 500,
+    "server_error": 500,
+    "overloaded_error": 529,
+    "INVALID_ARGUMENT": 400,
+    "FAILED_PRECONDITION": 400,
+    "UNAUTHENTICATED": 401,
+    "PERMISSION_DENIED": 403,
+    "NOT_FOUND": 404,
+    "RESOURCE_EXHAUSTED": 429,
+    "INTERNAL": 500,
+    "UNAVAILABLE": 503,
+    "DEADLINE_EXCEEDED": 504,
+}
+
+
+def stream_error_status(error):
+    """The HTTP status an error chunk amounts to, None if it doesn't say."""
+    if not isinstance(error, dict):
+        return None
+    code = error.get("code")
+    if isinstance(code, int) and not isinstance(code, bool) and 400 <= code < 600:
+        return code
+    if isinstance(code, str) and code.isdigit() and 400 <= int(code) < 600:
+        return int(code)
+    for key in ("type", "status", "code"):
+        status = STREAM_ERROR_STATUS.get(error.get(key)) if isinstance(error.get(key), str) else None
+        if status:
+            return status
+    return None
 
 
 def save_bytes_to_cache(base64_data, filename, file_info=None, ignore_info=False, context=None):
@@ -1217,7 +1327,7 @@ async def response_json(response):
     text = await response.text()
     if response.status >= 400:
         message = http_error_to_message(response, text)
-        raise Exception(message)
+        raise HTTPError(response.status, response.reason, text, dict(response.headers), message=message)
     response.raise_for_status()
     body = json.loads(text)
     return body
@@ -1407,6 +1517,165 @@ class GeneratorBase:
         }
 
 
+class StreamAccumulator:
+    """
+    Accumulates a streaming assistant message in linear time.
+
+    Deltas are appended to lists with a running length, and only joined when the
+    message is read - by the checkpoint writer on its interval, or once at the end.
+    Rebuilding the strings and the message dict on every chunk made long answers
+    quadratic in their size.
+    """
+
+    def __init__(self, model=None, reasoning_field="reasoning_content"):
+        self.model = model
+        self.default_reasoning_field = reasoning_field
+        self.reasoning_field = None
+        self.content_parts = []
+        self.reasoning_parts = []
+        self.tool_calls = {}  # {index: tool_call with `function.arguments` as a list of parts}
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    @staticmethod
+    def join(parts):
+        # collapse to a single part, so the next read only joins what arrived since
+        if len(parts) > 1:
+            parts[:] = ["".join(parts)]
+        return parts[0] if parts else ""
+
+    @property
+    def content(self):
+        return self.join(self.content_parts)
+
+    @property
+    def reasoning(self):
+        return self.join(self.reasoning_parts)
+
+    def add_content(self, text):
+        if text:
+            self.content_parts.append(text)
+            self.length += len(text)
+
+    def add_reasoning(self, text, field=None):
+        if text:
+            self.reasoning_parts.append(text)
+            self.length += len(text)
+            self.reasoning_field = field or self.reasoning_field
+
+    def add_tool_call(self, index, tool_call):
+        """Start (or replace) the tool call at `index`, e.g. a complete Gemini functionCall."""
+        tool_call = dict(tool_call)
+        fn = dict(tool_call.get("function") or {})
+        fn["name"] = fn.get("name") or ""
+        arguments = fn.get("arguments") or ""
+        fn["arguments"] = [arguments] if arguments else []
+        tool_call["function"] = fn
+        previous = self.tool_calls.get(index)
+        if previous is not None:
+            self.length -= self.tool_call_len(previous)
+        self.tool_calls[index] = tool_call
+        self.length += len(fn["name"]) + len(arguments)
+
+    def add_tool_arguments(self, index, text):
+        if index not in self.tool_calls:
+            self.add_tool_call(index, {"id": "", "type": "function", "function": {"name": "", "arguments": ""}})
+        if text:
+            self.tool_calls[index]["function"]["arguments"].append(text)
+            self.length += len(text)
+
+    def add_tool_call_delta(self, tc):
+        """Merge an OpenAI `delta.tool_calls[]` entry."""
+        idx = tc.get("index", 0)
+        fn_delta = tc.get("function") or {}
+        if idx not in self.tool_calls:
+            self.add_tool_call(
+                idx,
+                {
+                    "id": tc.get("id") or "",
+                    "type": tc.get("type") or "function",
+                    "function": {
+                        "name": fn_delta.get("name") or "",
+                        "arguments": fn_delta.get("arguments") or "",
+                    },
+                },
+            )
+            return
+        existing = self.tool_calls[idx]
+        if tc.get("id"):
+            existing["id"] += tc["id"]
+        if tc.get("type"):
+            existing["type"] = tc["type"]
+        if fn_delta.get("name"):
+            existing["function"]["name"] += fn_delta["name"]
+            self.length += len(fn_delta["name"])
+        if fn_delta.get("arguments"):
+            self.add_tool_arguments(idx, fn_delta["arguments"])
+
+    def tool_call_len(self, tool_call):
+        fn = tool_call["function"]
+        return len(fn["name"]) + sum(len(part) for part in fn["arguments"])
+
+    def tool_calls_list(self):
+        ret = []
+        for idx in sorted(self.tool_calls.keys()):
+            tool_call = dict(self.tool_calls[idx])
+            fn = dict(tool_call["function"])
+            fn["arguments"] = self.join(fn["arguments"])
+            tool_call["function"] = fn
+            ret.append(tool_call)
+        return ret
+
+    def message(self, include_model=True):
+        """The accumulated message, as a fresh dict the caller is free to mutate."""
+        message = {
+            "role": "assistant",
+            "content": self.content,
+        }
+        if include_model:
+            message["model"] = self.model
+        if self.reasoning_parts:
+            message[self.reasoning_field or self.default_reasoning_field] = self.reasoning
+        if self.tool_calls:
+            message["tool_calls"] = self.tool_calls_list()
+        return message
+
+
+STREAM_TEXT_FIELDS = ("content", "reasoning_content", "reasoning", "thinking")
+
+
+def apply_stream_delta(message, delta):
+    """
+    Apply a delta produced by `StreamCheckpointWriter.delta` to a streaming message,
+    returning a new message. Text fields are appended to, `tool_calls` entries are
+    addressed by their position: an existing call has its name/arguments extended, a new
+    one is appended whole.
+    """
+    message = dict(message)
+    for key, value in delta.items():
+        if key != "tool_calls":
+            message[key] = (message.get(key) or "") + value
+            continue
+        tool_calls = list(message.get("tool_calls") or [])
+        for tc in value:
+            idx = tc["index"]
+            if idx >= len(tool_calls):
+                tool_calls.append({k: v for k, v in tc.items() if k != "index"})
+                continue
+            tool_call = dict(tool_calls[idx])
+            fn = dict(tool_call.get("function") or {})
+            fn_delta = tc.get("function") or {}
+            for k in ("name", "arguments"):
+                if fn_delta.get(k):
+                    fn[k] = (fn.get(k) or "") + fn_delta[k]
+            tool_call["function"] = fn
+            tool_calls[idx] = tool_call
+        message["tool_calls"] = tool_calls
+    return message
+
+
 class StreamCheckpointWriter:
     """
     Persists the in-flight assistant message while a response streams in.
@@ -1419,15 +1688,31 @@ class StreamCheckpointWriter:
     Writes are checkpoints, not per-chunk: a thread's history can be megabytes and the
     old per-chunk write rewrote all of it ~10x/second. Chunks accumulate in memory and
     reach the db every `interval` seconds, plus once when the stream ends.
+
+    When the threads api supports `append_stream_async`, only the first checkpoint
+    writes the whole message. Later ones append what streamed since the previous
+    checkpoint, addressed by the stream's id and the payload offset it starts at, and
+    every `compact_every` appends the message is written whole again so readers never
+    have a long chain of chunks to replay.
     """
 
-    def __init__(self, threads_api, thread_id, user=None, interval=0.25):
+    def __init__(self, threads_api, thread_id, user=None, interval=0.25, compact_every=120, hedge=None):
         self.threads_api = threads_api
         self.thread_id = thread_id
         self.user = user
         self.interval = interval
+        self.compact_every = compact_every
+        self.hedge = hedge  # (HedgeRace, attempt name) when this is one of several hedged attempts
         self.last_update = 0.0
         self.pending = None
+        self.stream_id = uuid.uuid4().hex
+        self.marks = None  # lengths already persisted, None until the first full checkpoint
+        self.offset = 0
+        self.appended = 0
+
+    @property
+    def appends(self):
+        return hasattr(self.threads_api, "append_stream_async")
 
     @property
     def enabled(self):
@@ -1439,6 +1724,8 @@ class StreamCheckpointWriter:
     @staticmethod
     def payload_len(message):
         """Size of everything a streaming assistant message can accumulate."""
+        if isinstance(message, StreamAccumulator):
+            return len(message)
         total = len(message.get("content") or "")
         for key in ["reasoning_content", "reasoning", "thinking"]:
             value = message.get(key)
@@ -1449,25 +1736,128 @@ class StreamCheckpointWriter:
             total += len(fn.get("name") or "") + len(fn.get("arguments") or "")
         return total
 
+    @staticmethod
+    def stream_marks(message):
+        """
+        The length of everything in `message` a later delta can append to, with its last
+        few characters so a field rewritten to the same length isn't mistaken for an append.
+        """
+
+        def mark(value):
+            value = value or ""
+            return len(value), value[-16:]
+
+        marks = {k: mark(message[k]) for k in STREAM_TEXT_FIELDS if isinstance(message.get(k), str)}
+        marks["tool_calls"] = [
+            (
+                tc.get("id"),
+                mark((tc.get("function") or {}).get("name")),
+                mark((tc.get("function") or {}).get("arguments")),
+            )
+            for tc in message.get("tool_calls") or []
+        ]
+        return marks
+
+    @staticmethod
+    def delta(message, marks):
+        """
+        What `message` has gained since `marks` were taken, or None when the change isn't
+        an append (a field was replaced or went away) and the message must be written whole.
+        """
+
+        def suffix(value, mark):
+            length, tail = mark
+            if len(value) < length or value[length - len(tail) : length] != tail:
+                return None
+            return value[length:]
+
+        delta = {}
+        for key in STREAM_TEXT_FIELDS:
+            value = message.get(key)
+            if not isinstance(value, str):
+                if key in marks:
+                    return None
+                continue
+            appended = suffix(value, marks.get(key, (0, "")))
+            if appended is None:
+                return None
+            if appended:
+                delta[key] = appended
+        tool_calls = message.get("tool_calls") or []
+        previous = marks.get("tool_calls") or []
+        if len(tool_calls) < len(previous):
+            return None
+        tool_deltas = []
+        for idx, tc in enumerate(tool_calls):
+            if idx >= len(previous):
+                tool_deltas.append({"index": idx, **tc})
+                continue
+            fn = tc.get("function") or {}
+            id, name_mark, arguments_mark = previous[idx]
+            name = suffix(fn.get("name") or "", name_mark)
+            arguments = suffix(fn.get("arguments") or "", arguments_mark)
+            if tc.get("id") != id or name is None or arguments is None:
+                return None
+            fn_delta = {}
+            if name:
+                fn_delta["name"] = name
+            if arguments:
+                fn_delta["arguments"] = arguments
+            if fn_delta:
+                tool_deltas.append({"index": idx, "function": fn_delta})
+        if tool_deltas:
+            delta["tool_calls"] = tool_deltas
+        return delta
+
     async def write(self, assistant_message, final=False):
         """
         Checkpoint the in-flight message. Returns True if it reached the db.
 
-        `final` forces a write regardless of the interval, so the last chunks of a
-        completed stream are never left only in memory.
+        `assistant_message` is a message dict or a `StreamAccumulator`, which is only
+        materialized when a checkpoint is actually due. `final` forces a write
+        regardless of the interval, so the last chunks of a completed stream are never
+        left only in memory.
         """
-        if not self.enabled:
-            return False
         # An empty message says nothing and would only blank out a partial that a
         # previous attempt already produced.
         if self.payload_len(assistant_message) == 0:
             return False
+        # of several hedged attempts only the first to stream anything is written
+        if self.hedge is not None and not self.hedge[0].claim(self.hedge[1]):
+            return False
+        if not self.enabled:
+            return False
         self.pending = assistant_message
         if not final and not self.due():
             return False
         self.last_update = time.time()
         self.pending = None
-        await self.threads_api.checkpoint_stream_async(self.thread_id, assistant_message, user=self.user)
+        if isinstance(assistant_message, StreamAccumulator):
+            assistant_message = assistant_message.message()
+        if not self.appends:
+            await self.threads_api.checkpoint_stream_async(self.thread_id, assistant_message, user=self.user)
+            return True
+
+        delta = None
+        if self.marks is not None and self.appended < self.compact_every:
+            delta = self.delta(assistant_message, self.marks)
+            if delta == {}:
+                return True
+        length = self.payload_len(assistant_message)
+        if delta is None:
+            await self.threads_api.checkpoint_stream_async(
+                self.thread_id,
+                {**assistant_message, "streamId": self.stream_id, "streamOffset": length},
+                user=self.user,
+            )
+            self.appended = 0
+        else:
+            await self.threads_api.append_stream_async(
+                self.thread_id, self.stream_id, self.offset, delta, user=self.user
+            )
+            self.appended += 1
+        self.marks = self.stream_marks(assistant_message)
+        self.offset = length
         return True
 
     async def flush(self):
@@ -1477,10 +1867,76 @@ class StreamCheckpointWriter:
         return await self.write(self.pending, final=True)
 
 
+class ModelIndex:
+    """
+    A provider's models by every name a request can use for them, lower-cased once when the
+    index is built instead of on every lookup. Earlier names take precedence, in the same
+    order `provider_model` used to try them: map_models ids, mapped provider model ids,
+    model ids and names, then short names (the part after the last '/').
+    """
+
+    def __init__(self, map_models, models):
+        self.aliases = {}  # {lower-cased name: provider model id}
+        for model_id, provider_model in map_models.items():
+            self.aliases.setdefault(model_id.lower(), provider_model)
+        for provider_model in map_models.values():
+            self.aliases.setdefault(provider_model.lower(), provider_model)
+        for model_id, model_info in models.items():
+            id = model_info.get("id") or model_id
+            self.aliases.setdefault(model_id.lower(), id)
+            self.aliases.setdefault(id.lower(), id)
+            name = model_info.get("name")
+            if name:
+                self.aliases.setdefault(name.lower(), id)
+        for model_id, model_info in models.items():
+            id = model_info.get("id") or model_id
+            if "/" in id:
+                self.aliases.setdefault(id.split("/")[-1].lower(), id)
+        self.infos = {}  # {lower-cased model id: model info}
+        for model_id, model_info in models.items():
+            self.infos.setdefault(model_id.lower(), model_info)
+
+    def provider_model(self, model):
+        provider_model = self.aliases.get(model.lower())
+        # if model is a full provider model id, try again with just the model name
+        if provider_model is None and "/" in model:
+            provider_model = self.aliases.get(model.split("/")[-1].lower())
+        return provider_model
+
+    def model_info(self, model):
+        return self.infos.get((self.provider_model(model) or model).lower())
+
+
 # OpenAI Providers
 class OpenAiCompatible:
     sdk = "@ai-sdk/openai-compatible"
 
+    # Assigning models or map_models drops the ModelIndex, rebuilt on the next lookup
+    @property
+    def models(self):
+        return self._models
+
+    @models.setter
+    def models(self, models):
+        self._models = models
+        self._model_index = None
+
+    @property
+    def map_models(self):
+        return self._map_models
+
+    @map_models.setter
+    def map_models(self, map_models):
+        self._map_models = map_models
+        self._model_index = None
+
+    @property
+    def model_index(self):
+        index = self._model_index
+        if index is None:
+            index = self._model_index = ModelIndex(self.map_models, self.models)
+        return index
+
     def __init__(self, **kwargs):
         required_args = ["id", "api"]
         for arg in required_args:
@@ -1565,53 +2021,14 @@ class OpenAiCompatible:
             await self.load_models()
 
     def model_info(self, model):
-        provider_model = self.provider_model(model) or model
-        for model_id, model_info in self.models.items():
-            if model_id.lower() == provider_model.lower():
-                return model_info
-        return None
+        return self.model_index.model_info(model)
 
     def model_cost(self, model):
         model_info = self.model_info(model)
         return model_info.get("cost") if model_info else None
 
     def provider_model(self, model):
-        # convert model to lowercase for case-insensitive comparison
-        model_lower = model.lower()
-
-        # if model is a map model id, return the provider model id
-        for model_id, provider_model in self.map_models.items():
-            if model_id.lower() == model_lower:
-                return provider_model
-
-        # if model is a provider model id, try again with just the model name
-        for provider_model in self.map_models.values():
-            if provider_model.lower() == model_lower:
-                return provider_model
-
-        # if model is a model id, try again with just the model id or name
-        for model_id, provider_model_info in self.models.items():
-            id = provider_model_info.get("id") or model_id
-            if model_id.lower() == model_lower or id.lower() == model_lower:
-                return id
-            name = provider_model_info.get("name")
-            if name and name.lower() == model_lower:
-                return id
-
-        # fallback to trying again with just the model short name
-        for model_id, provider_model_info in self.models.items():
-            id = provider_model_info.get("id") or model_id
-            if "/" in id:
-                model_name = id.split("/")[-1]
-                if model_name.lower() == model_lower:
-                    return id
-
-        # if model is a full provider model id, try again with just the model name
-        if "/" in model:
-            last_part = model.split("/")[-1]
-            return self.provider_model(last_part)
-
-        return None
+        return self.model_index.provider_model(model)
 
     def response_json(self, response):
         return response_json(response)
@@ -1625,11 +2042,16 @@ class OpenAiCompatible:
         interval = (g_app.limits.get("stream_checkpoint_interval") if g_app else None) or DEFAULT_LIMITS[
             "stream_checkpoint_interval"
         ]
+        compact_every = (g_app.limits.get("stream_compact_chunks") if g_app else None) or DEFAULT_LIMITS[
+            "stream_compact_chunks"
+        ]
         return StreamCheckpointWriter(
             threads_api,
             context.get("threadId") if context else None,
             user=context.get("user") if context else None,
             interval=interval,
+            compact_every=compact_every,
+            hedge=context.get("hedge") if context else None,
         )
 
     def stream_error_message(self, error, default="Streaming error"):
@@ -1638,6 +2060,17 @@ class OpenAiCompatible:
             return error.get("message") or str(error)
         return str(error) if error else default
 
+    def stream_error(self, error, default="Streaming error"):
+        """
+        The exception to raise for an error a provider reported mid-stream: an HTTPError when
+        it says what kind of failure it was, so an overloaded provider counts against it.
+        """
+        message = self.stream_error_message(error, default)
+        status = stream_error_status(error)
+        if status is None:
+            return Exception(message)
+        return HTTPError(status, error.get("type") or error.get("status") or "Stream Error", error, message=message)
+
     def to_response(self, response, chat, started_at, context=None):
         if "metadata" not in response:
             response["metadata"] = {}
@@ -1710,21 +2143,19 @@ class OpenAiCompatible:
     async def handle_stream_response(self, response, chat, started_at, context=None):
         if response.status >= 300:
             text = await response.text()
+            message = f"Failed chat completion {response.status}: {text}"
             try:
                 data = json.loads(text)
                 if "error" in data and "message" in data["error"]:
-                    raise Exception(data["error"]["message"])
+                    message = data["error"]["message"]
             except json.JSONDecodeError:
                 pass
-            raise Exception(f"Failed chat completion {response.status}: {text}")
+            raise HTTPError(response.status, response.reason, text, dict(response.headers), message=message)
 
         response_id = None
         created_time = None
         model_name = None
-        content_acc = ""
-        reasoning_acc = ""
-        reasoning_field = None
-        tool_calls_dict = {}
+        acc = StreamAccumulator(model=chat.get("model"))
         finish_reason = None
         usage_acc = {}
         writer = self.stream_writer(context)
@@ -1749,7 +2180,7 @@ class OpenAiCompatible:
                     # (e.g. OpenRouter rate-limiting). Surface it instead of ending the
                     # stream quietly, which leaves a truncated answer looking complete.
                     if chunk.get("error"):
-                        raise Exception(self.stream_error_message(chunk["error"]))
+                        raise self.stream_error(chunk["error"])
 
                     if chunk.get("id"):
                         response_id = chunk["id"]
@@ -1768,63 +2199,35 @@ class OpenAiCompatible:
                         continue
                     choice = choices[0]
                     if choice.get("error"):
-                        raise Exception(self.stream_error_message(choice["error"]))
+                        raise self.stream_error(choice["error"])
                     if choice.get("finish_reason"):
                         finish_reason = choice["finish_reason"]
+                    # time to first token, tracked by ProviderRouter
+                    if context is not None and "firstTokenAt" not in context:
+                        context["firstTokenAt"] = time.time()
 
                     delta = choice.get("delta", {})
 
                     # Content delta
                     if "content" in delta and delta["content"]:
-                        content_acc += delta["content"]
+                        acc.add_content(delta["content"])
 
                     # Reasoning / thinking delta
                     for r_key in ["reasoning_content", "reasoning", "thinking"]:
                         if r_key in delta and delta[r_key]:
-                            reasoning_acc += delta[r_key]
-                            reasoning_field = r_key
+                            acc.add_reasoning(delta[r_key], r_key)
                             break
 
                     # Tool calls delta
                     for tc in delta.get("tool_calls", []):
-                        idx = tc.get("index", 0)
-                        if idx not in tool_calls_dict:
-                            tool_calls_dict[idx] = {
-                                "id": tc.get("id") or "",
-                                "type": tc.get("type") or "function",
-                                "function": {
-                                    "name": tc.get("function", {}).get("name") or "",
-                                    "arguments": tc.get("function", {}).get("arguments") or "",
-                                },
-                            }
-                        else:
-                            existing = tool_calls_dict[idx]
-                            if tc.get("id"):
-                                existing["id"] += tc["id"]
-                            if tc.get("type"):
-                                existing["type"] = tc["type"]
-                            fn_delta = tc.get("function", {})
-                            if fn_delta.get("name"):
-                                existing["function"]["name"] += fn_delta["name"]
-                            if fn_delta.get("arguments"):
-                                existing["function"]["arguments"] += fn_delta["arguments"]
+                        acc.add_tool_call_delta(tc)
 
                     if context and should_cancel_thread(context):
                         break
 
                     # Hand every chunk to the writer: it keeps the latest in memory and
                     # only reaches the db on its checkpoint interval.
-                    assistant_msg = {
-                        "role": "assistant",
-                        "content": content_acc,
-                        "model": chat.get("model"),
-                    }
-                    if reasoning_acc:
-                        assistant_msg[reasoning_field or "reasoning_content"] = reasoning_acc
-                    if tool_calls_dict:
-                        assistant_msg["tool_calls"] = [tool_calls_dict[i] for i in sorted(tool_calls_dict.keys())]
-
-                    await writer.write(assistant_msg)
+                    await writer.write(acc)
 
         except Exception:
             # Keep whatever streamed before the failure instead of losing the tail
@@ -1837,26 +2240,9 @@ class OpenAiCompatible:
             return None
 
         # Send final thread update for the completed stream
-        assistant_msg = {
-            "role": "assistant",
-            "content": content_acc,
-            "model": chat.get("model"),
-        }
-        if reasoning_acc:
-            assistant_msg[reasoning_field or "reasoning_content"] = reasoning_acc
-        if tool_calls_dict:
-            assistant_msg["tool_calls"] = [tool_calls_dict[i] for i in sorted(tool_calls_dict.keys())]
+        await writer.write(acc, final=True)
 
-        await writer.write(assistant_msg, final=True)
-
-        message_obj = {
-            "role": "assistant",
-            "content": content_acc,
-        }
-        if reasoning_acc:
-            message_obj[reasoning_field or "reasoning_content"] = reasoning_acc
-        if tool_calls_dict:
-            message_obj["tool_calls"] = [tool_calls_dict[i] for i in sorted(tool_calls_dict.keys())]
+        message_obj = acc.message(include_model=False)
 
         choice_obj = {
             "index": 0,
@@ -1914,7 +2300,7 @@ class OpenAiCompatible:
         metadata = chat.pop("metadata", None)
 
         if not is_stream:
-            async with aiohttp.ClientSession() as session:
+            async with client_session(self.id) as session:
                 started_at = time.time()
                 async with session.post(
                     self.chat_url, headers=self.headers, data=json.dumps(chat), timeout=get_client_timeout()
@@ -1928,7 +2314,7 @@ class OpenAiCompatible:
             chat["stream_options"] = {"include_usage": True}
 
         started_at = time.time()
-        async with aiohttp.ClientSession() as session, session.post(
+        async with client_session(self.id) as session, session.post(
             self.chat_url, headers=self.headers, data=json.dumps(chat), timeout=get_client_timeout(streaming=True)
         ) as response:
             if metadata:
@@ -1985,7 +2371,7 @@ class OllamaProvider(OpenAiCompatible):
     async def get_models(self):
         ret = {}
         try:
-            async with aiohttp.ClientSession() as session:
+            async with client_session(self.id) as session:
                 _log(f"GET {self.api}/api/tags")
                 async with session.get(
                     f"{self.api}/api/tags", headers=self.headers, timeout=get_client_timeout()
@@ -2046,7 +2432,7 @@ class LMStudioProvider(OllamaProvider):
     async def get_models(self):
         ret = {}
         try:
-            async with aiohttp.ClientSession() as session:
+            async with client_session(self.id) as session:
                 _log(f"GET {self.api}/models")
                 async with session.get(
                     f"{self.api}/models", headers=self.headers, timeout=get_client_timeout()
@@ -2435,10 +2821,10 @@ async def g_exec_tool(function_name, function_args, context=None):
             func = g_app.tools[function_name]
             is_async = inspect.iscoroutinefunction(func)
             _dbg(f"Executing {'async' if is_async else 'sync'} tool '{function_name}' with args: {function_args}")
-            if is_async:
-                return g_tool_result(await func(**function_args), function_name, function_args, context)
-            else:
-                return g_tool_result(func(**function_args), function_name, function_args, context)
+            result = await g_app.tool_executor.run(
+                function_name, func, function_args, g_app.tool_options.get(function_name)
+            )
+            return g_tool_result(result, function_name, function_args, context)
         except Exception as e:
             return f"Error executing tool '{function_name}':\n{to_error_message(e)}", None
     return f"Error: Tool '{function_name}' not found", None
@@ -2480,6 +2866,162 @@ class AgentSliceYield(Exception):
         self.iterations = iterations
 
 
+def hedge_delay(model, provider, router):
+    """Seconds to wait for `provider`'s first token before hedging, None if `model` isn't hedged."""
+    hedging = (g_config or {}).get("hedging") or {}
+    if not hedging.get("enabled") and model not in (hedging.get("models") or []):
+        return None
+    if hedging.get("delay") is not None:
+        return float(hedging["delay"])
+    p95 = router.ttft_percentile(provider, model)
+    return p95 / 1000 if p95 is not None else float(hedging.get("default_delay", 2))
+
+
+def response_cache_key(name, chat):
+    """Key of `chat` sent to provider `name` in the response cache, None if it isn't cached."""
+    config = (g_config or {}).get("response_cache") or {}
+    # metadata.cache turns the cache off (false) or on (true) for a single request
+    requested = (chat.get("metadata") or {}).get("cache")
+    if g_app is None or requested is False or not (config.get("enabled") or requested is True):
+        return None
+    provider = g_handlers[name]
+    # a provider's own temperature and seed override the request's, see init_chat()
+    temperature = getattr(provider, "temperature", None)
+    seed = getattr(provider, "seed", None)
+    if not is_deterministic(
+        {
+            "temperature": chat.get("temperature") if temperature is None else temperature,
+            "seed": chat.get("seed") if seed is None else seed,
+        }
+    ):
+        return None
+    g_app.response_cache.configure(config)
+    return request_key(name, {**chat, "model": provider.provider_model(chat["model"]) or chat["model"]})
+
+
+async def replay_response(name, chat, response, context):
+    """Writes a cached response to the thread as a finished stream, when streaming was asked for."""
+    provider = g_handlers[name]
+    if not chat.get("stream", getattr(provider, "stream", False)) or not hasattr(provider, "stream_writer"):
+        return
+    message = (response.get("choices") or [{}])[0].get("message")
+    if message:
+        await provider.stream_writer(context).write(message, final=True)
+
+
+async def provider_chat(name, model, chat, context, router, admission):
+    """
+    Sends `chat` to provider `name` once its rate limits let it through, recording how it
+    went with the router. Leaves the seconds it queued for in context["queueWait"].
+
+    Deterministic requests are answered from the response cache when it's enabled. A cached
+    response cost nothing, so the usage and cost it was first charged are moved to
+    metadata.cachedUsage, where they aren't counted as spend again.
+    """
+    cache_key = response_cache_key(name, chat)
+    if cache_key is not None:
+        response = await asyncio.to_thread(g_app.response_cache.get, cache_key)
+        if response is not None:
+            _log(f"Cached response from {name} for {model}")
+            metadata = response.setdefault("metadata", {})
+            metadata["cached"] = True
+            metadata["cachedUsage"] = {k: response.pop(k) for k in ("usage", "cost") if k in response}
+            response["usage"] = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+            context["queueWait"] = 0.0
+            await replay_response(name, chat, response, context)
+            return response
+
+    priority = ProviderAdmission.priority(context)
+    async with admission.admit(name, model, chat.get("messages") or [], priority) as admitted:
+        context["queueWait"] = admitted.waited
+        context.pop("firstTokenAt", None)
+        requested_at = time.time()
+        router.started(name, model)
+        try:
+            response = await g_handlers[name].chat(chat, context=context)
+        except Exception as e:
+            router.record_failure(name, model, e)
+            raise
+        router.record_success(name, model, requested_at, context.pop("firstTokenAt", None), response)
+        admitted.settle(response)
+    if cache_key is not None and response and response.get("choices"):
+        # a copy, the caller goes on to add to the response while it's being written
+        await asyncio.to_thread(g_app.response_cache.put, cache_key, copy.deepcopy(response))
+    return response
+
+
+async def hedge_chat(model, chat, context, providers, delay, router, admission):
+    """
+    Sends `chat` to providers[0], then also to providers[1] if no token has streamed in
+    after `delay` seconds. The first attempt to stream a token (or, for providers that don't
+    stream, to respond) wins and the other is cancelled.
+
+    Returns the winner's (provider name, response, context). Each attempt gets its own copy of
+    the chat and context, so the loser leaves no trace on either.
+    """
+    race = HedgeRace()
+    tasks = {}  # {task: (name, context, launched_at)}
+    queue = list(providers)
+
+    def launch():
+        name = queue.pop(0)
+        attempt_chat = copy.deepcopy(chat)
+        attempt_chat["model"] = model
+        attempt_context = {**context, "hedge": (race, name)}
+        attempt_context.pop("queueWait", None)
+        task = asyncio.create_task(provider_chat(name, model, attempt_chat, attempt_context, router, admission))
+        tasks[task] = (name, attempt_context, time.time())
+
+    def requested_at(attempt_context, launched_at):
+        # when a loser was actually sent, None while it was still queued
+        return launched_at + attempt_context["queueWait"] if "queueWait" in attempt_context else None
+
+    launch()
+    decided = asyncio.create_task(race.decided.wait())
+    first_error = None
+    try:
+        while tasks:
+            waits = {*tasks} if decided.done() else {*tasks, decided}
+            timeout = delay if queue and race.winner is None else None
+            done, _ = await asyncio.wait(waits, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                _log(f"No first token from {providers[0]} after {delay:.2f}s, hedging with {queue[0]}")
+                launch()
+                continue
+            if race.winner is not None and len(tasks) > 1:
+                losers = [(task, entry) for task, entry in tasks.items() if entry[0] != race.winner]
+                for task, _ in losers:
+                    task.cancel()
+                    del tasks[task]
+                await asyncio.gather(*[task for task, _ in losers], return_exceptions=True)
+                router.record_hedge(model, race.winner, [(name, requested_at(c, at)) for _, (name, c, at) in losers])
+            for task in done:
+                if task not in tasks:
+                    continue
+                name, attempt_context, _ = tasks.pop(task)
+                if task.cancelled():
+                    continue
+                error = task.exception()
+                if error is not None:
+                    first_error = first_error or error
+                    continue
+                response = task.result()
+                if tasks:
+                    # responded before the other attempt streamed anything
+                    router.record_hedge(model, name, [(other, requested_at(c, at)) for other, c, at in tasks.values()])
+                for other in tasks:
+                    other.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                tasks.clear()
+                attempt_context.pop("hedge", None)
+                return name, response, attempt_context
+        raise first_error
+    finally:
+        for task in tasks:
+            task.cancel()
+        decided.cancel()
+
+
 async def g_chat_completion(chat, context=None):
     try:
         model = chat.get("model")
@@ -2492,10 +3034,13 @@ async def g_chat_completion(chat, context=None):
         if "request_id" not in context:
             context["request_id"] = str(int(time.time() * 1000))
 
-        # get first provider that has the model
+        # providers that have the model, healthiest first
+        router = g_app.router if g_app else ProviderRouter()
+        admission = g_app.admission if g_app else ProviderAdmission()
         candidate_providers = [name for name, provider in g_handlers.items() if provider.provider_model(model)]
         if len(candidate_providers) == 0:
             raise (Exception(f"Model {model} not found"))
+        candidate_providers = router.order(model, candidate_providers)
 
         # Pre-populate provider/model info in context for pre-chat filters
         if "provider" not in context and candidate_providers:
@@ -2529,11 +3074,22 @@ async def g_chat_completion(chat, context=None):
 
     attempt_round = 0
     candidate_index = 0
+    retryable = False  # whether a provider failed this round in a way that's worth retrying
 
     while attempt_round < retries:
         if candidate_index >= len(candidate_providers):
+            if not retryable:
+                # every provider turned the request down, another round would only repeat that
+                break
             candidate_index = 0
+            retryable = False
             attempt_round += 1
+            if attempt_round < retries:
+                # back off before the next round, and re-rank with what this one learned
+                await asyncio.sleep(router.retry_delay(model, candidate_providers, attempt_round - 1))
+                if should_cancel_thread(context):
+                    return None
+                candidate_providers = router.order(model, candidate_providers)
             continue
 
         name = candidate_providers[candidate_index]
@@ -2555,6 +3111,7 @@ async def g_chat_completion(chat, context=None):
             total_completion_tokens = 0
             last_prompt_tokens = 0
             accumulated_cost = 0.0
+            queue_wait = 0.0  # seconds spent waiting on provider rate limits
 
             # Tool execution loop
             for request_count in range(max_iterations):
@@ -2566,7 +3123,28 @@ async def g_chat_completion(chat, context=None):
                     last_message = messages[-1] if messages else None
                     _dbg(f"Provider {provider_name}, request {request_count}:\n{json.dumps(last_message, indent=2)}")
 
-                response = await provider.chat(current_chat, context=context)
+                # hedge with the next provider in line, unless it's being held back
+                delay = hedge_delay(model, name, router)
+                hedge_with = next((p for p in candidate_providers[candidate_index + 1 :] if p != name), None)
+                if delay is not None and hedge_with and not router.blocked(hedge_with, model):
+                    winner, response, attempt_context = await hedge_chat(
+                        model, current_chat, context, [name, hedge_with], delay, router, admission
+                    )
+                    context.update(attempt_context)
+                    if winner != name:
+                        # carry on with the provider that won, for the rest of the tool loop
+                        name = provider_name = winner
+                        provider = g_handlers[name]
+                        context["provider"] = name
+                        model_info = provider.model_info(model)
+                        context["modelCost"] = model_info.get("cost", provider.model_cost(model)) or {
+                            "input": 0,
+                            "output": 0,
+                        }
+                        context["modelInfo"] = model_info
+                else:
+                    response = await provider_chat(name, model, current_chat, context, router, admission)
+                queue_wait += context.pop("queueWait", 0)
 
                 if should_cancel_thread(context):
                     return None
@@ -2643,7 +3221,8 @@ async def g_chat_completion(chat, context=None):
                 if "usage" not in response:
                     response["usage"] = {}
 
-                if not total_completion_tokens:
+                # nothing was generated for a cached response, so there's nothing to estimate
+                if not total_completion_tokens and not response.get("metadata", {}).get("cached"):
                     choice = response.get("choices", [])[0] if response.get("choices") else {}
                     message = choice.get("message", {})
                     content_text = message.get("content") or ""
@@ -2660,6 +3239,7 @@ async def g_chat_completion(chat, context=None):
                 response["usage"].update(total_usage)
                 if accumulated_cost > 0:
                     response["cost"] = accumulated_cost
+                response.setdefault("metadata", {})["queueWait"] = int(queue_wait * 1000)
 
                 final_response = response
                 break  # Exit tool loop
@@ -2691,6 +3271,7 @@ async def g_chat_completion(chat, context=None):
                     f"Provider {provider_name} failed: {to_error_message(first_exception)} ({candidate_index + 1}/{len(candidate_providers)} x {attempt_round + 1} attempts)",
                     context,
                 )
+            retryable = retryable or not is_client_error(e)
             candidate_index += 1
             continue
 
@@ -3644,6 +4225,575 @@ def get_client_timeout(app=None, streaming=False):
     return aiohttp.ClientTimeout(total=timeout)
 
 
+class ClientSessionPool:
+    """
+    Long-lived aiohttp sessions, one per provider, so completions reuse warm keep-alive
+    connections instead of paying a new TCP+TLS handshake and discarding the socket.
+
+    A session is bound to the event loop it was created on. The CLI and the server run
+    their own loops, so a session left over from another loop is replaced, not reused.
+
+    Sessions are shared by every user of the process, so they never keep cookies: a
+    Set-Cookie received on one user's request must not be sent on another's.
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        self.sessions = {}  # {name: (loop, session)}
+
+    def limit(self, key):
+        limits = self.app.limits if self.app else DEFAULT_LIMITS
+        value = limits.get(key)
+        return DEFAULT_LIMITS[key] if value is None else value
+
+    def create_connector(self):
+        return aiohttp.TCPConnector(
+            limit=self.limit("connection_limit"),
+            limit_per_host=self.limit("connection_limit_per_host"),
+            keepalive_timeout=self.limit("keepalive_timeout"),
+            ttl_dns_cache=self.limit("dns_cache_ttl"),
+        )
+
+    def get(self, name="default"):
+        loop = asyncio.get_running_loop()
+        entry = self.sessions.get(name)
+        if entry is not None:
+            session_loop, session = entry
+            if session_loop is loop and not session.closed:
+                return session
+        session = aiohttp.ClientSession(connector=self.create_connector(), cookie_jar=aiohttp.DummyCookieJar())
+        self.sessions[name] = (loop, session)
+        return session
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        sessions = self.sessions
+        self.sessions = {}
+        for session_loop, session in sessions.values():
+            # sessions from a loop that has since gone away can't be awaited from this one
+            if session_loop is loop and not session.closed:
+                await session.close()
+
+
+class ToolExecutor:
+    """
+    Runs tools without blocking the event loop: synchronous tools on a bounded thread pool
+    (or a process pool for CPU-bound ones registered with process=True), each within the
+    concurrency limit and timeout it was registered with, and records how long they take.
+
+    A timed out tool call returns an error, but a thread can't be interrupted, so a sync
+    tool keeps its worker until it returns on its own.
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        self.threads = None
+        self.processes = None
+        self.semaphores = {}  # {name: (loop, semaphore)}
+        self.latency = {}  # {name: {calls, errors, timeouts, totalMs, maxMs}}
+
+    def limit(self, key):
+        limits = self.app.limits if self.app else DEFAULT_LIMITS
+        value = limits.get(key)
+        return DEFAULT_LIMITS[key] if value is None else value
+
+    def semaphore(self, name, concurrency):
+        # like aiohttp sessions, asyncio primitives belong to the loop they were made on
+        loop = asyncio.get_running_loop()
+        entry = self.semaphores.get(name)
+        if entry is None or entry[0] is not loop:
+            entry = (loop, asyncio.Semaphore(concurrency))
+            self.semaphores[name] = entry
+        return entry[1]
+
+    def submit(self, func, args, process=False):
+        loop = asyncio.get_running_loop()
+        if process:
+            if self.processes is None:
+                self.processes = ProcessPoolExecutor(max_workers=self.limit("tool_processes"))
+            return loop.run_in_executor(self.processes, functools.partial(func, **args))
+        if self.threads is None:
+            self.threads = ThreadPoolExecutor(max_workers=self.limit("tool_threads"), thread_name_prefix="llms-tool")
+        # carry the caller's context variables into the worker thread, as asyncio.to_thread() does
+        return loop.run_in_executor(self.threads, functools.partial(contextvars.copy_context().run, func, **args))
+
+    async def run(self, name, func, args, options=None):
+        options = options or {}
+        concurrency = options.get("concurrency")
+        timeout = options.get("timeout")
+        started = time.perf_counter()
+        outcome = None
+        try:
+            async with self.semaphore(name, concurrency) if concurrency else contextlib.nullcontext():
+                call = func(**args) if inspect.iscoroutinefunction(func) else self.submit(func, args, options.get("process"))
+                if not timeout:
+                    return await call
+                # not wait_for(), which can't tell its timeout from a TimeoutError raised by the tool
+                task = asyncio.ensure_future(call)
+                try:
+                    done, _ = await asyncio.wait([task], timeout=timeout)
+                finally:
+                    if not task.done():
+                        task.cancel()
+                if done:
+                    return task.result()
+                outcome = "timeouts"
+                raise TimeoutError(f"Tool '{name}' timed out after {timeout}s")
+        except Exception:
+            outcome = outcome or "errors"
+            raise
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            stats = self.latency.setdefault(name, {"calls": 0, "errors": 0, "timeouts": 0, "totalMs": 0.0, "maxMs": 0.0})
+            stats["calls"] += 1
+            stats["totalMs"] += elapsed
+            stats["maxMs"] = max(stats["maxMs"], elapsed)
+            if outcome:
+                stats[outcome] += 1
+
+    def stats(self):
+        return {
+            name: {**stats, "avgMs": round(stats["totalMs"] / stats["calls"], 2) if stats["calls"] else 0}
+            for name, stats in sorted(self.latency.items())
+        }
+
+    async def close(self):
+        for executor in (self.threads, self.processes):
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+        self.threads = self.processes = None
+
+
+class ProviderRouter:
+    """
+    Orders the providers that can serve a model by how they've been doing for it: an EWMA
+    of their time to first token and error rate, with a circuit breaker that holds back a
+    provider that keeps failing instead of letting it time out every request first.
+
+    A breaker opens for `circuit_cooldown` seconds, after which one request is let through
+    as a probe that closes it again, or reopens it for twice as long if it fails too. A 429
+    or 503 with a Retry-After holds a provider back for as long as it asks. Held back
+    providers are tried last rather than not at all, so a request is never refused while
+    any provider might still serve it.
+
+    Only transient failures count against a provider: 5xx, 408, 429, timeouts and connection
+    errors. Other 4xx, like a 400 for a context that's too long, are down to the request.
+    """
+
+    EWMA_ALPHA = 0.2
+    MAX_COOLDOWN_FACTOR = 16
+    TTFT_SAMPLES = 100  # recent times to first token kept for percentiles
+
+    def __init__(self, app=None):
+        self.app = app
+        self.routes = {}  # {(provider, model): {calls, errors, errorRate, ttftMs, tokensPerSec, ...}}
+
+    def limit(self, key):
+        limits = self.app.limits if self.app else DEFAULT_LIMITS
+        value = limits.get(key)
+        return DEFAULT_LIMITS[key] if value is None else value
+
+    def route(self, provider, model):
+        route = self.routes.get((provider, model))
+        if route is None:
+            route = self.routes[(provider, model)] = {
+                "calls": 0,
+                "errors": 0,
+                "clientErrors": 0,
+                "errorRate": 0.0,
+                "ttftMs": None,
+                "ttftSamples": deque(maxlen=self.TTFT_SAMPLES),
+                "tokensPerSec": None,
+                "hedgeWins": 0,
+                "hedgeLosses": 0,
+                "failures": 0,  # consecutive
+                "state": "closed",
+                "cooldown": 0,
+                "blockedUntil": 0.0,
+                "lastError": None,
+            }
+        return route
+
+    def ewma(self, current, sample):
+        return sample if current is None else current + self.EWMA_ALPHA * (sample - current)
+
+    def order(self, model, providers):
+        """providers, healthiest first. Those within 2x of the best keep their configured order."""
+        now = time.time()
+        routes = [self.routes.get((provider, model)) for provider in providers]
+        known = [route["ttftMs"] for route in routes if route and route["ttftMs"]]
+        best_ttft = min(known) if known else 1.0
+        scores = []
+        for route in routes:
+            ttft = (route and route["ttftMs"]) or best_ttft
+            error_rate = min(route["errorRate"], 0.9) if route else 0.0
+            scores.append(ttft / (1 - error_rate))
+        best = min(scores, default=1.0)
+
+        def key(i):
+            route = routes[i]
+            blocked_until = route["blockedUntil"] if route and route["blockedUntil"] > now else 0
+            return (blocked_until, int(math.log2(scores[i] / best)), i)
+
+        return [providers[i] for i in sorted(range(len(providers)), key=key)]
+
+    def started(self, provider, model):
+        route = self.route(provider, model)
+        if route["state"] == "open" and route["blockedUntil"] <= time.time():
+            # the probe holds other requests back until it reports, or its cooldown lapses again
+            route["state"] = "half-open"
+            route["blockedUntil"] = time.time() + route["cooldown"]
+
+    def record_success(self, provider, model, started_at, first_token_at, response):
+        now = time.time()
+        route = self.route(provider, model)
+        route["calls"] += 1
+        route["errorRate"] = self.ewma(route["errorRate"], 0.0)
+        if first_token_at is None:
+            # providers that don't report their first token are timed on the whole response
+            first_token_at = now
+        route["ttftMs"] = self.ewma(route["ttftMs"], (first_token_at - started_at) * 1000)
+        route["ttftSamples"].append((first_token_at - started_at) * 1000)
+        usage = (response or {}).get("usage") or {}
+        tokens = usage.get("completion_tokens") or 0
+        # a response that arrived all at once is rated on its total time
+        generating = now - first_token_at if now - first_token_at > 0.05 else now - started_at
+        if tokens and generating > 0:
+            route["tokensPerSec"] = self.ewma(route["tokensPerSec"], tokens / generating)
+        route.update(failures=0, state="closed", cooldown=0, blockedUntil=0.0)
+
+    def record_failure(self, provider, model, error):
+        now = time.time()
+        route = self.route(provider, model)
+        route["calls"] += 1
+        route["lastError"] = to_error_message(error)
+        if not is_transient_error(error):
+            # a bad request or a provider bug isn't a sign it's unhealthy, it still answered
+            route["clientErrors"] += 1
+            if route["state"] == "half-open":
+                route.update(failures=0, state="closed", cooldown=0, blockedUntil=0.0)
+            return
+        route["errors"] += 1
+        route["errorRate"] = self.ewma(route["errorRate"], 1.0)
+        route["failures"] += 1
+        if route["state"] == "half-open" or route["failures"] >= self.limit("circuit_failures"):
+            base = self.limit("circuit_cooldown")
+            cooldown = route["cooldown"] * 2 if route["state"] == "half-open" else base
+            route["cooldown"] = min(max(cooldown, base), base * self.MAX_COOLDOWN_FACTOR)
+            route["state"] = "open"
+            route["blockedUntil"] = max(route["blockedUntil"], now + route["cooldown"])
+        if isinstance(error, HTTPError) and error.status in (429, 503):
+            retry_after = retry_after_seconds(error.headers)
+            if retry_after is not None:
+                retry_after = min(retry_after, self.limit("retry_after_max"))
+                route["blockedUntil"] = max(route["blockedUntil"], now + retry_after)
+
+    def record_hedge(self, model, winner, losers):
+        """
+        A hedged request was won by `winner`. The losers, [(provider, requested_at)], hadn't
+        produced a token by then, so their time to first token is at least what they waited.
+        """
+        self.route(winner, model)["hedgeWins"] += 1
+        for loser, requested_at in losers:
+            route = self.route(loser, model)
+            route["hedgeLosses"] += 1
+            if requested_at is None:
+                continue
+            waited = (time.time() - requested_at) * 1000
+            if route["ttftMs"] is None or waited > route["ttftMs"]:
+                route["ttftMs"] = self.ewma(route["ttftMs"], waited)
+                route["ttftSamples"].append(waited)
+
+    def blocked(self, provider, model):
+        route = self.routes.get((provider, model))
+        return route is not None and route["blockedUntil"] > time.time()
+
+    def ttft_percentile(self, provider, model, percentile=95, min_samples=5):
+        """Time to first token in ms that `percentile`% of recent responses beat, if known."""
+        route = self.routes.get((provider, model))
+        if route is None or len(route["ttftSamples"]) < min_samples:
+            return None
+        samples = sorted(route["ttftSamples"])
+        return samples[min(len(samples) - 1, int(len(samples) * percentile / 100))]
+
+    def retry_delay(self, model, providers, attempt_round):
+        """Seconds to wait before another round of attempts, once every provider has failed."""
+        delay = self.limit("retry_backoff") * 2**attempt_round
+        now = time.time()
+        waits = [self.route(provider, model)["blockedUntil"] - now for provider in providers]
+        if waits and min(waits) > 0:
+            # all of them are held back, wait for the first to become available
+            delay = max(delay, min(waits))
+        return min(delay, self.limit("retry_after_max"))
+
+    def stats(self):
+        now = time.time()
+        p95s = {key: self.ttft_percentile(*key) for key in self.routes}
+        return [
+            {
+                "provider": provider,
+                "model": model,
+                "state": route["state"],
+                "calls": route["calls"],
+                "errors": route["errors"],
+                "clientErrors": route["clientErrors"],
+                "errorRate": round(route["errorRate"], 3),
+                "ttftMs": round(route["ttftMs"]) if route["ttftMs"] is not None else None,
+                "p95TtftMs": round(p95s[(provider, model)]) if p95s[(provider, model)] is not None else None,
+                "tokensPerSec": round(route["tokensPerSec"], 1) if route["tokensPerSec"] is not None else None,
+                "hedgeWins": route["hedgeWins"],
+                "hedgeLosses": route["hedgeLosses"],
+                "failures": route["failures"],
+                "retryIn": round(max(0.0, route["blockedUntil"] - now), 1),
+                "lastError": route["lastError"],
+            }
+            for (provider, model), route in sorted(self.routes.items())
+        ]
+
+
+class TokenBucket:
+    """`per_minute` requests or tokens, refilled continuously, with up to a minute's worth banked."""
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.available = float(per_minute)
+        self.updated = time.monotonic()
+
+    def wait(self, amount, now):
+        """Seconds until `amount` can be taken, 0 if it can be now."""
+        self.available = min(self.per_minute, self.available + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+        # a request bigger than the whole bucket goes through once the bucket is full
+        amount = min(amount, self.per_minute)
+        return 0 if self.available >= amount else (amount - self.available) * 60 / self.per_minute
+
+
+class AdmissionScope:
+    """The limits of a provider, or of one of its models: requests in flight, per minute and tokens per minute."""
+
+    def __init__(self):
+        self.config = None
+        self.in_flight = 0
+        self.requests = None
+        self.tokens = None
+        self.admitted = 0
+        self.wait_ms = 0.0
+        self.max_wait_ms = 0.0
+
+    def configure(self, config):
+        if config != self.config:
+            self.config = config
+            self.requests = TokenBucket(config["rpm"]) if config.get("rpm") else None
+            self.tokens = TokenBucket(config["tpm"]) if config.get("tpm") else None
+
+    def wait(self, tokens, now):
+        """Seconds until a request of `tokens` fits, math.inf while it waits on one to finish."""
+        if self.config.get("concurrency") and self.in_flight >= self.config["concurrency"]:
+            return math.inf
+        return max(
+            self.requests.wait(1, now) if self.requests else 0,
+            self.tokens.wait(tokens, now) if self.tokens else 0,
+        )
+
+    def take(self, tokens):
+        self.in_flight += 1
+        if self.requests:
+            self.requests.available -= 1
+        if self.tokens:
+            self.tokens.available -= tokens
+
+
+class Admission:
+    """A request let through by ProviderAdmission, and how long it queued for."""
+
+    def __init__(self, scopes, tokens, waited):
+        self.scopes = scopes
+        self.tokens = tokens
+        self.waited = waited
+
+    def settle(self, response):
+        """Charge the token buckets what the response says was used instead of the estimate."""
+        usage = (response or {}).get("usage") or {}
+        tokens = usage.get("total_tokens") or (usage.get("prompt_tokens") or 0) + (usage.get("completion_tokens") or 0)
+        if not tokens:
+            return
+        for scope in self.scopes:
+            if scope.tokens:
+                scope.tokens.available -= tokens - self.tokens
+        self.tokens = tokens
+
+
+class ProviderAdmission:
+    """
+    Holds provider requests in a queue until they fit within the `rate_limits` configured
+    for their provider in llms.json, so a burst of requests waits its turn instead of
+    drawing 429s that burn through retries:
+
+        "rate_limits": {"concurrency": 4, "rpm": 60, "tpm": 200000, "models": {"<model>": {...}}}
+
+    Waiting requests are let through by priority, interactive chats (0) ahead of agent
+    runs and other background work (1), then in the order they arrived. A request only
+    overtakes an earlier one when that one is held up by limits the later one isn't under.
+    """
+
+    PRIORITIES = {"interactive": 0, "background": 1}
+
+    def __init__(self, app=None):
+        self.app = app
+        self.scopes = {}  # {provider or (provider, model): AdmissionScope}
+        self.waiters = []  # [(priority, seq, scopes, tokens, future)]
+        self.seq = 0
+        self.loop = None
+        self.timer = None
+
+    def scopes_for(self, provider, model):
+        rate_limits = (((g_config or {}).get("providers") or {}).get(provider) or {}).get("rate_limits") or {}
+        model_limits = (rate_limits.get("models") or {}).get(model)
+        scopes = []
+        for key, config in ((provider, rate_limits), ((provider, model), model_limits)):
+            config = {k: v for k, v in (config or {}).items() if k in ("concurrency", "rpm", "tpm") and v}
+            if config:
+                scope = self.scopes.get(key)
+                if scope is None:
+                    scope = self.scopes[key] = AdmissionScope()
+                scope.configure(config)
+                scopes.append(scope)
+        return scopes
+
+    @classmethod
+    def priority(cls, context):
+        priority = (context or {}).get("priority")
+        if priority is None:
+            return cls.PRIORITIES["background"] if (context or {}).get("runId") else cls.PRIORITIES["interactive"]
+        return cls.PRIORITIES.get(priority, priority)
+
+    @contextlib.asynccontextmanager
+    async def admit(self, provider, model, messages, priority=0):
+        """Waits for `provider` to have room for a request with `messages`, yielding its Admission."""
+        scopes = self.scopes_for(provider, model)
+        if not scopes:
+            yield Admission(scopes, 0, 0.0)
+            return
+        tokens = count_tokens_approx(messages)
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            # like semaphores, futures belong to the loop they were made on
+            self.loop, self.waiters, self.timer = loop, [], None
+            for scope in self.scopes.values():
+                scope.in_flight = 0
+        started = time.monotonic()
+        if not self.waiters and all(scope.wait(tokens, started) == 0 for scope in scopes):
+            for scope in scopes:
+                scope.take(tokens)
+            waited = 0.0
+        else:
+            future = loop.create_future()
+            self.seq += 1
+            self.waiters.append((priority, self.seq, scopes, tokens, future))
+            self.pump()
+            try:
+                await future
+            except BaseException:
+                # cancelled while waiting, or just as it was let through
+                if future.done() and not future.cancelled():
+                    self.release(scopes)
+                else:
+                    self.pump()
+                raise
+            waited = time.monotonic() - started
+        for scope in scopes:
+            scope.admitted += 1
+            scope.wait_ms += waited * 1000
+            scope.max_wait_ms = max(scope.max_wait_ms, waited * 1000)
+        try:
+            yield Admission(scopes, tokens, waited)
+        finally:
+            self.release(scopes)
+
+    def release(self, scopes):
+        for scope in scopes:
+            scope.in_flight -= 1
+        self.pump()
+
+    def pump(self):
+        """Let through every waiting request that fits, and schedule the next look if any are rate limited."""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        now = time.monotonic()
+        retry_in = None
+        held = set()  # scopes an earlier request is waiting on, which later ones can't jump
+        waiting = []
+        for entry in sorted(self.waiters, key=lambda e: (e[0], e[1])):
+            _, _, scopes, tokens, future = entry
+            if future.done():
+                continue
+            waits = [math.inf if id(scope) in held else scope.wait(tokens, now) for scope in scopes]
+            if max(waits) == 0:
+                for scope in scopes:
+                    scope.take(tokens)
+                future.set_result(None)
+                continue
+            held.update(id(scope) for scope, wait in zip(scopes, waits) if wait > 0)
+            waiting.append(entry)
+            finite = [wait for wait in waits if 0 < wait < math.inf]
+            if finite:
+                retry_in = min(retry_in or math.inf, max(finite))
+        self.waiters = waiting
+        if retry_in is not None and self.loop is not None:
+            self.timer = self.loop.call_later(retry_in, self.pump)
+
+    def stats(self):
+        queued = {}  # {id(scope): requests waiting on it}
+        for _, _, scopes, _, future in self.waiters:
+            if not future.done():
+                for scope in scopes:
+                    queued[id(scope)] = queued.get(id(scope), 0) + 1
+        ret = []
+        for key, scope in self.scopes.items():
+            provider, model = (key, None) if isinstance(key, str) else key
+            ret.append(
+                {
+                    "provider": provider,
+                    "model": model,
+                    **scope.config,
+                    "inFlight": scope.in_flight,
+                    "queued": queued.get(id(scope), 0),
+                    "admitted": scope.admitted,
+                    "avgWaitMs": round(scope.wait_ms / scope.admitted, 1) if scope.admitted else 0,
+                    "maxWaitMs": round(scope.max_wait_ms, 1),
+                }
+            )
+        return sorted(ret, key=lambda x: (x["provider"], x["model"] or ""))
+
+
+class HedgeRace:
+    """The attempts of one hedged request, won by the first to stream a token."""
+
+    def __init__(self):
+        self.winner = None
+        self.decided = asyncio.Event()
+
+    def claim(self, name):
+        if self.winner is None:
+            self.winner = name
+            self.decided.set()
+        return self.winner == name
+
+
+@contextlib.asynccontextmanager
+async def client_session(name=None):
+    """
+    Shared keep-alive session for `name` (usually the provider id). Unlike
+    `aiohttp.ClientSession()` it isn't closed on exit, the next request reuses it.
+    """
+    if g_app is None:
+        async with aiohttp.ClientSession() as session:
+            yield session
+    else:
+        yield g_app.client_sessions.get(name or "default")
+
+
 def get_user_prefs(user: Optional[str] = None):
     user_dir = user or "default"
     if user_dir not in g_user_prefs:
@@ -3726,9 +4876,17 @@ class AppExtensions:
         self.server_add_patch = []
         self.cache_saved_filters = []
         self.startup_handlers = []
-        self.cleanup_handlers = []
+        self.client_sessions = ClientSessionPool(self)
+        # cleanup handlers run in reverse, so pooled connections close after every
+        # extension that might still be using them
+        self.tool_executor = ToolExecutor(self)
+        self.router = ProviderRouter(self)
+        self.admission = ProviderAdmission(self)
+        self.response_cache = ResponseCache(get_cache_path("responses.sqlite"))
+        self.cleanup_handlers = [self.client_sessions.close, self.tool_executor.close, self.close_response_cache]
         self.shutdown_handlers = []
         self.tools = {}
+        self.tool_options = {}  # {name: {concurrency, timeout, process}} given to register_tool
         self.tool_definitions = []
         self.tool_groups = {}
         self.index_headers = []
@@ -3808,6 +4966,9 @@ class AppExtensions:
     def get_client_timeout(self, streaming=False):
         return get_client_timeout(self, streaming=streaming)
 
+    def client_session(self, name: Optional[str] = None):
+        return client_session(name)
+
     def abspath(self, path: str):
         return path if path.startswith("$") else os.path.abspath(path)
 
@@ -3920,6 +5081,10 @@ class AppExtensions:
         """Register a handler to setup a user for the first time."""
         self.setup_user_handlers.append(handler)
 
+    async def close_response_cache(self):
+        # closing its connection checkpoints the WAL back into the database
+        await asyncio.to_thread(self.response_cache.close)
+
     async def on_request(self, request: web.Request):
         user = self.get_username(request)
         username = user or "default"
@@ -4139,6 +5304,9 @@ class ExtensionContext:
     def get_client_timeout(self, streaming=False):
         return self.app.get_client_timeout(streaming=streaming)
 
+    def client_session(self, name: Optional[str] = None):
+        return self.app.client_session(name)
+
     def enabled_auth(self) -> bool:
         return self.app.enabled_auth()
 
@@ -4442,7 +5610,20 @@ class ExtensionContext:
                 del parameters["$defs"]
         return tool_def
 
-    def register_tool(self, func: Callable, tool_def: Optional[Dict[str, Any]] = None, group: Optional[str] = None):
+    def register_tool(
+        self,
+        func: Callable,
+        tool_def: Optional[Dict[str, Any]] = None,
+        group: Optional[str] = None,
+        concurrency: Optional[int] = None,
+        timeout: Optional[float] = None,
+        process: bool = False,
+    ):
+        """
+        Sync tools run on a thread pool, or a process pool when `process` is set (the
+        function and its arguments must then be picklable). `concurrency` caps how many
+        calls of the tool run at once and `timeout` (seconds) how long a call may take.
+        """
         if tool_def is None:
             tool_def = function_to_tool_definition(func)
 
@@ -4457,6 +5638,7 @@ class ExtensionContext:
             self.log(f"Registered tool: {name}")
 
         self.app.tools[name] = func
+        self.app.tool_options[name] = {"concurrency": concurrency, "timeout": timeout, "process": process}
         self.app.tool_definitions.append(self.sanitize_tool_def(tool_def))
         if not group:
             group = "custom"
@@ -4505,6 +5687,22 @@ class ExtensionContext:
     async def exec_tool(self, name: str, args: Dict[str, Any]) -> Tuple[Optional[str], List[Dict[str, Any]]]:
         return await g_exec_tool(name, args)
 
+    def tool_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Calls, errors, timeouts and latency of each tool executed since startup."""
+        return self.app.tool_executor.stats()
+
+    def provider_routes(self) -> List[Dict[str, Any]]:
+        """Health, latency and circuit breaker state of each provider/model requested since startup."""
+        return self.app.router.stats()
+
+    def provider_limits(self) -> List[Dict[str, Any]]:
+        """Rate limits of each provider and model, with the requests in flight and queued for them."""
+        return self.app.admission.stats()
+
+    def response_cache_stats(self) -> Dict[str, Any]:
+        """Hits, misses and size of the response cache's memory and disk tiers."""
+        return self.app.response_cache.stats()
+
     def tool_result(
         self, result: Any, function_name: Optional[str] = None, function_args: Optional[Dict[str, Any]] = None
     ) -> Dict[str, Any]:
@@ -5205,6 +6403,7 @@ def cli_exec(cli_args, extra_args):
         provider_name = cli_args.check
         model_names = extra_args if len(extra_args) > 0 else None
         loop.run_until_complete(check_models(provider_name, model_names))
+        loop.run_until_complete(g_app.client_sessions.close())
         return ExitCode.SUCCESS
 
     if cli_args.serve is not None:
@@ -5858,6 +7057,9 @@ def cli_exec(cli_args, extra_args):
             if cli_args.verbose:
                 traceback.print_exc()
             return ExitCode.FAILED
+        finally:
+            loop.run_until_complete(g_app.client_sessions.close())
+            g_app.response_cache.close()
 
     handled = run_extension_cli()
     return ExitCode.SUCCESS if handled else ExitCode.UNHANDLED
@@ -0,0 +1,152 @@
+"""
+Exact-match cache of chat completion responses for deterministic requests (temperature 0
+or a fixed seed): an in-memory LRU in front of a SQLite database that keeps them between
+runs, both bounded in size and by how long an entry lives.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Per-message fields that never reach a provider, see OpenAiCompatible.process_chat()
+MESSAGE_METADATA = {"timestamp", "model", "usage", "_sequence", "streaming"}
+# Request fields that don't change what a provider answers
+REQUEST_METADATA = {"metadata", "stream", "stream_options"}
+
+
+def is_deterministic(chat):
+    return chat.get("temperature") == 0 or chat.get("seed") is not None
+
+
+def request_key(provider, chat):
+    """sha256 of the request `provider` is sent, independent of key order and metadata."""
+    request = {k: v for k, v in chat.items() if k not in REQUEST_METADATA}
+    request["messages"] = [
+        {k: v for k, v in message.items() if k not in MESSAGE_METADATA} if isinstance(message, dict) else message
+        for message in chat.get("messages") or []
+    ]
+    data = json.dumps([provider, request], sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Responses by request_key(). Entries are kept as JSON text, so every hit is a fresh copy
+    the caller is free to modify. Thread-safe, so lookups can run off the event loop.
+    """
+
+    def __init__(self, path=None, max_entries=256, max_mb=256, ttl=86400):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_mb * 1024 * 1024
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()  # {key: (expires, json)}
+        self.db = None
+        self.counts = {"memoryHits": 0, "diskHits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+    def configure(self, config):
+        """Applies the "response_cache" section of llms.json."""
+        self.max_entries = config.get("max_entries", self.max_entries)
+        self.max_bytes = config.get("max_mb", self.max_bytes / 1024 / 1024) * 1024 * 1024
+        self.ttl = config.get("ttl", self.ttl)
+
+    def connect(self):
+        if self.db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, "
+                "expires REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        return self.db
+
+    def remember(self, key, expires, text):
+        self.memory[key] = (expires, text)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def get(self, key):
+        """The cached response for key, or None if there's none that hasn't expired."""
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self.memory.move_to_end(key)
+                    self.counts["memoryHits"] += 1
+                    return json.loads(entry[1])
+                del self.memory[key]
+            if self.path:
+                with contextlib.suppress(sqlite3.Error):
+                    db = self.connect()
+                    row = db.execute("SELECT response, expires FROM responses WHERE key = ?", (key,)).fetchone()
+                    if row is not None and row[1] > now:
+                        db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                        db.commit()
+                        self.remember(key, row[1], row[0])
+                        self.counts["diskHits"] += 1
+                        return json.loads(row[0])
+                    if row is not None:
+                        db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                        db.commit()
+            self.counts["misses"] += 1
+            return None
+
+    def put(self, key, response):
+        now = time.time()
+        expires = now + self.ttl
+        text = json.dumps(response, separators=(",", ":"))
+        with self.lock:
+            self.remember(key, expires, text)
+            self.counts["writes"] += 1
+            if self.path:
+                with contextlib.suppress(sqlite3.Error):
+                    db = self.connect()
+                    db.execute(
+                        "INSERT OR REPLACE INTO responses (key, response, size, expires, accessed) VALUES (?, ?, ?, ?, ?)",
+                        (key, text, len(text), expires, now),
+                    )
+                    self.evict(db, now)
+                    db.commit()
+
+    def evict(self, db, now):
+        """Drops expired entries, then the least recently used until the database fits in max_mb."""
+        self.counts["evictions"] += db.execute("DELETE FROM responses WHERE expires <= ?", (now,)).rowcount
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in db.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall():
+            db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.memory.pop(key, None)
+            self.counts["evictions"] += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self):
+        with self.lock:
+            ret = {**self.counts, "memoryEntries": len(self.memory), "diskEntries": 0, "diskBytes": 0}
+            if self.path and os.path.exists(self.path):
+                with contextlib.suppress(sqlite3.Error):
+                    count, size = (
+                        self.connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+                    )
+                    ret.update(diskEntries=count, diskBytes=size)
+            return ret
+
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
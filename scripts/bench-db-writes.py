@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+# Simulates concurrent streams checkpointing into the app database to measure how many
+# writes/sec the single writer thread sustains with and without group commit.
+#
+# Usage: python scripts/bench-db-writes.py [streams=50] [checkpoints=40]
+#
+# Each stream writes a whole streamingMessage head and then appends stream_chunk deltas,
+# compacting back into a new head every 10 checkpoints, like StreamCheckpointWriter.
+# With LLMS_WRITE_BATCH=1 every write is its own transaction and commit.
+
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import llms.db  # noqa: E402
+from llms.extensions.app.db import AppDB  # noqa: E402
+
+
+class BenchCtx:
+    debug = False
+
+    def cache_message_inline_data(self, msg, context=None):
+        pass
+
+    def dbg(self, msg):
+        pass
+
+    def log(self, msg):
+        pass
+
+    def err(self, msg, e=None):
+        print(msg, e)
+
+
+async def stream(db, thread_id, checkpoints):
+    content = ""
+    offset = 0
+    for i in range(checkpoints):
+        delta = f"token{i} " * 4
+        if i % 10 == 0:
+            content += delta
+            offset = len(content)
+            message = {"role": "assistant", "content": content, "streamId": f"s{thread_id}", "streamOffset": offset}
+            await db.update_thread_async(thread_id, {"streamingMessage": message})
+        else:
+            await db.append_stream_chunk_async(thread_id, f"s{thread_id}", offset, {"content": delta})
+            content += delta
+            offset += len(delta)
+    await db.update_thread_async(thread_id, {"streamingMessage": None})
+
+
+async def run(streams, checkpoints, batch_size):
+    llms.db.WRITE_BATCH_SIZE = batch_size
+    tmp = tempfile.mkdtemp()
+    db = AppDB(BenchCtx(), os.path.join(tmp, "app.sqlite"))
+    try:
+        thread_ids = [await db.create_thread_async({"title": f"bench {i}", "messages": []}) for i in range(streams)]
+        started_at = time.perf_counter()
+        await asyncio.gather(*[stream(db, thread_id, checkpoints) for thread_id in thread_ids])
+        return time.perf_counter() - started_at
+    finally:
+        db.close()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def main():
+    streams = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    checkpoints = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    writes = streams * (checkpoints + 1)
+    print(f"{streams} streams x {checkpoints + 1} writes")
+    print(f"{'batch':>8} {'total ms':>10} {'writes/sec':>12}")
+    for batch_size in [1, llms.db.WRITE_BATCH_SIZE]:
+        elapsed = asyncio.run(run(streams, checkpoints, batch_size))
+        print(f"{batch_size:>8} {elapsed * 1000:>10.1f} {writes / elapsed:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+# Compares resolving model names by scanning a provider's models (as provider_model and
+# model_info used to) with the ModelIndex lookups that replaced it.
+#
+# Usage: python scripts/bench-model-lookup.py [models=5000] [lookups=2000]
+#
+# The scan's cost grows with the size of the catalogue and is worst for names that
+# don't match, which is most of them when a request is offered to every provider.
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from llms.main import ModelIndex  # noqa: E402
+
+
+def scan_provider_model(map_models, models, model):
+    model_lower = model.lower()
+    for model_id, provider_model in map_models.items():
+        if model_id.lower() == model_lower:
+            return provider_model
+    for provider_model in map_models.values():
+        if provider_model.lower() == model_lower:
+            return provider_model
+    for model_id, info in models.items():
+        id = info.get("id") or model_id
+        if model_id.lower() == model_lower or id.lower() == model_lower:
+            return id
+        name = info.get("name")
+        if name and name.lower() == model_lower:
+            return id
+    for model_id, info in models.items():
+        id = info.get("id") or model_id
+        if "/" in id and id.split("/")[-1].lower() == model_lower:
+            return id
+    if "/" in model:
+        return scan_provider_model(map_models, models, model.split("/")[-1])
+    return None
+
+
+def scan_model_info(map_models, models, model):
+    provider_model = scan_provider_model(map_models, models, model) or model
+    for model_id, info in models.items():
+        if model_id.lower() == provider_model.lower():
+            return info
+    return None
+
+
+def create_catalogue(count):
+    models = {}
+    for i in range(count):
+        id = f"vendor{i % 50}/model-{i}"
+        models[id] = {"id": id, "name": f"Vendor{i % 50} Model {i}"}
+    return models
+
+
+def lookups(models, count):
+    rng = random.Random(0)
+    ids = list(models)
+    names = []
+    for _ in range(count):
+        id = rng.choice(ids)
+        names.append(
+            rng.choice([id, id.upper(), id.split("/")[-1], models[id]["name"], f"other/{id.split('/')[-1]}", "missing"])
+        )
+    return names
+
+
+def bench(label, fn, names):
+    start = time.perf_counter()
+    for name in names:
+        fn(name)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<24} {elapsed * 1000:>10.1f} ms {elapsed / len(names) * 1e6:>10.2f} us/lookup")
+    return elapsed
+
+
+def main():
+    model_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    lookup_count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    models = create_catalogue(model_count)
+    map_models = {}
+    names = lookups(models, lookup_count)
+
+    start = time.perf_counter()
+    index = ModelIndex(map_models, models)
+    print(f"{model_count} models, {lookup_count} lookups, index built in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    for name in names[:1000]:
+        assert index.model_info(name) is scan_model_info(map_models, models, name), name
+
+    scan = bench("scan model_info", lambda name: scan_model_info(map_models, models, name), names)
+    indexed = bench("ModelIndex.model_info", index.model_info, names)
+    print(f"{scan / indexed:.0f}x faster")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+# Replays a recorded-style SSE stream through OpenAiCompatible.handle_stream_response
+# to check that accumulating a streamed answer stays linear in its size.
+#
+# Usage: python scripts/bench-stream.py [chunks=10000] [interval=0.25]
+#
+# Time per chunk should stay flat as the stream doubles in length. When it grows
+# with the stream, something is rebuilding the whole message on every chunk.
+
+import asyncio
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from llms.main import DEFAULT_LIMITS, OpenAiCompatible  # noqa: E402
+
+
+class ReplayResponse:
+    status = 200
+
+    def __init__(self, lines):
+        self.content = ReplayContent(lines)
+
+
+class ReplayContent:
+    def __init__(self, lines):
+        self.lines = lines
+
+    def __aiter__(self):
+        return self.iterate()
+
+    async def iterate(self):
+        for line in self.lines:
+            yield line
+
+
+class CheckpointCounter:
+    def __init__(self):
+        self.checkpoints = 0
+        self.bytes = 0
+
+    async def checkpoint_stream_async(self, id, message, user=None):
+        self.checkpoints += 1
+        self.bytes += len(message.get("content") or "") + len(message.get("reasoning_content") or "")
+
+
+def record_stream(chunks):
+    lines = []
+    for i in range(chunks):
+        delta = {"reasoning_content": f"step {i} "} if i < chunks // 4 else {"content": f"token{i} "}
+        chunk = {"id": "gen-bench", "model": "bench", "choices": [{"index": 0, "delta": delta}]}
+        lines.append(f"data: {json.dumps(chunk)}\n".encode())
+    usage = {"prompt_tokens": 10, "completion_tokens": chunks, "total_tokens": chunks + 10}
+    lines.append(f"data: {json.dumps({'choices': [], 'usage': usage})}\n".encode())
+    lines.append(b"data: [DONE]\n")
+    return lines
+
+
+async def replay(chunks, interval):
+    DEFAULT_LIMITS["stream_checkpoint_interval"] = interval
+    provider = OpenAiCompatible(id="bench", api="http://localhost", models={})
+    threads = CheckpointCounter()
+    provider.ctx = SimpleNamespace(threads=threads)
+    lines = record_stream(chunks)
+    started_at = time.perf_counter()
+    response = await provider.handle_stream_response(
+        ReplayResponse(lines), {"model": "bench"}, time.time(), context={"threadId": "bench"}
+    )
+    elapsed = time.perf_counter() - started_at
+    content = response["choices"][0]["message"]["content"]
+    return elapsed, threads, len(content)
+
+
+def main():
+    chunks = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    interval = float(sys.argv[2]) if len(sys.argv) > 2 else 0.25
+    print(f"{'chunks':>8} {'total ms':>10} {'us/chunk':>10} {'checkpoints':>12} {'content':>10}")
+    for n in [chunks, chunks * 2, chunks * 4]:
+        elapsed, threads, content_len = asyncio.run(replay(n, interval))
+        print(f"{n:>8} {elapsed * 1000:>10.1f} {elapsed / n * 1e6:>10.2f} {threads.checkpoints:>12} {content_len:>10}")
+
+
+if __name__ == "__main__":
+    main()
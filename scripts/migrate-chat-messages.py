@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+# Moves existing threads onto the normalized chat_message store, where the rows are the
+# conversation and thread.messages is no longer rewritten on every turn.
+#
+# Usage: python scripts/migrate-chat-messages.py [app.sqlite] [--keep-json]
+#
+# Defaults to ~/.llms/user/default/app/app.sqlite. Stop the server first. Each thread's
+# rows are brought in line with its messages JSON, which is then dropped, unless
+# --keep-json is given to only backfill the rows and leave threads in legacy mode.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from llms.extensions.app.db import AppDB  # noqa: E402
+from llms.main import home_llms_path  # noqa: E402
+
+
+class MigrateCtx:
+    debug = False
+
+    def cache_message_inline_data(self, msg, context=None):
+        pass
+
+    def dbg(self, msg):
+        pass
+
+    def log(self, msg):
+        print(msg)
+
+    def err(self, msg, e=None):
+        print(msg, e, file=sys.stderr)
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    db_path = args[0] if args else home_llms_path(os.path.join("user", "default", "app", "app.sqlite"))
+    if not os.path.exists(db_path):
+        print(f"{db_path} not found", file=sys.stderr)
+        sys.exit(1)
+
+    db = AppDB(MigrateCtx(), db_path)
+    try:
+        results = db.migrate_messages(drop_json="--keep-json" not in sys.argv)
+    finally:
+        db.close()
+    print(f"{db_path}: " + (", ".join(f"{count} {result}" for result, count in sorted(results.items())) or "nothing to migrate"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+# Rebuilds the full-text search indexes `search` queries on /threads, /requests and /media.
+#
+# Usage: python scripts/rebuild-search-index.py [user-dir]
+#
+# Defaults to ~/.llms/user/default. The indexes are built when a database is first opened
+# and kept up to date by triggers after that, so this is only needed after editing or
+# restoring a database by other means. Safe to run while the server is stopped.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from llms.extensions.app.db import AppDB  # noqa: E402
+from llms.extensions.gallery.db import GalleryDB  # noqa: E402
+from llms.main import home_llms_path  # noqa: E402
+
+
+class RebuildCtx:
+    debug = False
+    aspect_ratios = {}
+
+    def cache_message_inline_data(self, msg, context=None):
+        pass
+
+    def dbg(self, msg):
+        pass
+
+    def log(self, msg):
+        print(msg)
+
+    def err(self, msg, e=None):
+        print(msg, e, file=sys.stderr)
+
+
+def main():
+    user_dir = sys.argv[1] if len(sys.argv) > 1 else home_llms_path(os.path.join("user", "default"))
+    for name, open_db in [
+        (os.path.join("app", "app.sqlite"), AppDB),
+        (os.path.join("gallery", "gallery.sqlite"), GalleryDB),
+    ]:
+        db_path = os.path.join(user_dir, name)
+        if not os.path.exists(db_path):
+            print(f"{db_path} not found, skipped")
+            continue
+        db = open_db(RebuildCtx(), db_path)
+        try:
+            rebuilt = db.rebuild_search_index()
+        finally:
+            db.db.close()
+        print(f"{db_path}: {'rebuilt' if rebuilt else 'SQLite was built without FTS5, nothing to rebuild'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+# Recomputes each thread's cost, token counts and stats from the requests made for it.
+#
+# Usage: python scripts/repair-thread-totals.py [app.sqlite]
+#
+# Defaults to ~/.llms/user/default/app/app.sqlite. Triggers keep the totals in step with
+# requests as they're written, so this is only needed to repair databases edited by other
+# means. Threads without any requests are left as they are. Stop the server first.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from llms.extensions.app.db import AppDB  # noqa: E402
+from llms.main import home_llms_path  # noqa: E402
+
+
+class RepairCtx:
+    debug = False
+
+    def cache_message_inline_data(self, msg, context=None):
+        pass
+
+    def dbg(self, msg):
+        pass
+
+    def log(self, msg):
+        print(msg)
+
+    def err(self, msg, e=None):
+        print(msg, e, file=sys.stderr)
+
+
+def main():
+    db_path = sys.argv[1] if len(sys.argv) > 1 else home_llms_path(os.path.join("user", "default", "app", "app.sqlite"))
+    if not os.path.exists(db_path):
+        print(f"{db_path} not found", file=sys.stderr)
+        sys.exit(1)
+
+    db = AppDB(RepairCtx(), db_path)
+    try:
+        updated = db.rebuild_thread_totals()
+    finally:
+        db.close()
+    print(f"{db_path}: recomputed the totals of {updated} threads")
+
+
+if __name__ == "__main__":
+    main()
@@ -42,6 +42,21 @@ class FakeRunDb:
         self.runs[run_id].update(values)
         return 1
 
+    async def read_async(self, fn, *args, **kwargs):
+        return fn(*args, **kwargs)
+
+    async def requeue_interrupted_agent_runs_async(self):
+        return self.requeue_interrupted_agent_runs()
+
+    async def claim_agent_runs_async(self, owner, limit, lease_seconds):
+        return self.claim_agent_runs(owner, limit, lease_seconds)
+
+    async def renew_agent_run_lease_async(self, run_id, owner, lease_seconds):
+        return self.renew_agent_run_lease(run_id, owner, lease_seconds)
+
+    async def update_agent_run_async(self, run_id, values):
+        return self.update_agent_run(run_id, values)
+
     async def update_thread_async(self, thread_id, values, user=None):
         self.thread_updates.append((thread_id, values, user))
         return 1
@@ -1,11 +1,14 @@
+import asyncio
 import os
 import json
 import shutil
 import sqlite3
 import tempfile
 import unittest
+from datetime import datetime
+from types import SimpleNamespace
 
-from llms.extensions.app import install, resolve_events_config
+from llms.extensions.app import AgentScheduler, install, not_modified, resolve_events_config, thread_etag
 
 
 class EventsConfigTests(unittest.TestCase):
@@ -248,6 +251,43 @@ class TestAppDbProvider(unittest.IsolatedAsyncioTestCase):
         self.assertEqual([x["_sequence"] for x in backward], list(range(1, 51)))
         self.assertEqual(self.app_db.get_chat_message_bounds(thread_id)["messageCount"], 150)
 
+    async def test_thread_writes_publish_delta_events_to_watchers(self):
+        from llms.extensions.app import thread_events
+
+        thread_id = await self.app_db.create_thread_async(
+            {"title": "watched", "messages": [{"role": "user", "content": "hi", "timestamp": 1}]},
+            user="test_user",
+        )
+        channel = thread_events.channel(thread_id)
+        subscriber = channel.subscribe()
+        try:
+            await self.ctx.threads.append_stream_async(thread_id, "s1", 0, {"content": "He"})
+            await self.app_db.update_thread_async(
+                thread_id,
+                {
+                    "messages": [
+                        {"role": "user", "content": "hi", "timestamp": 1},
+                        {"role": "assistant", "content": "Hello", "timestamp": 2},
+                    ],
+                    "streamingMessage": None,
+                    "completedAt": datetime.now(),
+                },
+                user="test_user",
+            )
+            # the completed thread is read off the loop before it's published
+            await channel.publishing
+            events = [(name, json.loads(payload.decode().split("data: ", 1)[1]))
+                      for name, payload in subscriber.drain()]
+        finally:
+            channel.unsubscribe(subscriber)
+
+        self.assertEqual(
+            [name for name, _ in events], ["streaming-chunk", "streaming-chunk", "message-appended", "completed"]
+        )
+        self.assertEqual(events[0][1]["delta"], {"content": "He"})
+        self.assertEqual(events[2][1]["messages"], [{"role": "assistant", "content": "Hello", "timestamp": 2, "_sequence": 2}])
+        self.assertEqual(events[3][1]["id"], thread_id)
+
     def tearDown(self):
         self.app_db.close()
         import llms.extensions.app as app_mod
@@ -293,6 +333,30 @@ class TestAppDbProvider(unittest.IsolatedAsyncioTestCase):
         updated_thread = self.app_db.get_thread(thread_id, user="test_user")
         self.assertEqual(updated_thread.get("provider"), "fallback-provider")
 
+    async def test_cached_responses_record_no_spend(self):
+        chat = {"model": "test-model", "messages": [{"role": "user", "content": "Hello"}]}
+        context = {
+            "chat": chat,
+            "user": "test_user",
+            "provider": "test-provider",
+            "modelInfo": {"id": "test-model", "name": "Test Model", "cost": {"input": 3, "output": 15}},
+        }
+        for filter_fn in self.ctx.chat_request_filters:
+            await filter_fn(chat, context)
+        response = {
+            "model": "test-model",
+            "choices": [{"message": {"role": "assistant", "content": "Hi!"}}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            "metadata": {"cached": True, "cachedUsage": {"usage": {"prompt_tokens": 1000}, "cost": 0.5}},
+        }
+        for filter_fn in self.ctx.chat_response_filters:
+            await filter_fn(response, context)
+
+        requests = self.app_db.query_requests({}, user="test_user")
+        self.assertEqual([(r["cost"], r["inputTokens"], r["outputTokens"]) for r in requests], [(0, 0, 0)])
+        messages = [x["message"] for x in self.app_db.get_chat_messages(context["threadId"])]
+        self.assertEqual([m["usage"]["cost"] for m in messages], [0, 0])
+
     async def test_normalized_messages_are_append_only_and_idempotent(self):
         messages = [
             {"role": "user", "content": "one", "timestamp": 1001},
@@ -351,6 +415,53 @@ class TestAppDbProvider(unittest.IsolatedAsyncioTestCase):
         reclaimed = self.app_db.claim_agent_runs("worker-2", limit=1)
         self.assertEqual([run["id"] for run in reclaimed], [first])
 
+    async def test_agent_run_bookkeeping_awaits_the_writer(self):
+        thread_id = await self.app_db.create_thread_async(
+            {"model": "test-model", "messages": [{"role": "user", "content": "work"}]},
+            user="test_user",
+        )
+        run_id = await self.app_db.create_agent_run_async(thread_id, "test_user", "test-model")
+        claimed = await self.app_db.claim_agent_runs_async("worker-1", limit=2, lease_seconds=60)
+        self.assertEqual([run["id"] for run in claimed], [run_id])
+        self.assertEqual(await self.app_db.claim_agent_runs_async("worker-2"), [])
+        self.assertEqual(await self.app_db.renew_agent_run_lease_async(run_id, "worker-1"), 1)
+        self.assertEqual(await self.app_db.renew_agent_run_lease_async(run_id, "worker-2"), 0)
+
+        step_id = await self.app_db.create_agent_step_async(run_id, 1, "model", input={"messageCount": 1})
+        await self.app_db.update_agent_step_async(step_id, {"status": "completed"})
+        await self.app_db.create_context_snapshot_async(thread_id, run_id, 1, 1, [{"role": "system", "content": "s"}])
+        self.assertEqual(self.app_db.get_agent_steps(run_id)[0]["status"], "completed")
+        self.assertEqual(self.app_db.get_latest_context_snapshot(thread_id)["version"], 1)
+
+        self.assertEqual(await self.app_db.requeue_interrupted_agent_runs_async(), 1)
+
+    async def test_agent_scheduler_never_blocks_the_loop_on_the_writer(self):
+        thread_id = await self.app_db.create_thread_async(
+            {"model": "test-model", "messages": [{"role": "user", "content": "work"}]},
+            user="test_user",
+        )
+        run_id = await self.app_db.create_agent_run_async(thread_id, "test_user", "test-model")
+        # DbManager.run() waits for a whole group-commit batch, it must not be called on the loop
+        blocking = []
+        run = self.app_db.db.run
+        self.app_db.db.run = lambda fn: blocking.append(fn) or run(fn)
+
+        async def execute(run):
+            step_id = await self.app_db.create_agent_step_async(run["id"], 1, "model")
+            await self.app_db.update_agent_step_async(step_id, {"status": "completed"})
+            await self.app_db.update_agent_run_async(run["id"], {"status": "completed", "leaseOwner": None})
+
+        scheduler = AgentScheduler(self.app_db, execute, lambda *_: None, max_concurrency=1, poll_seconds=0.05)
+        scheduler.start()
+        try:
+            async with asyncio.timeout(2):
+                while self.app_db.get_agent_run(run_id, user="all")["status"] != "completed":
+                    await asyncio.sleep(0.01)
+        finally:
+            await scheduler.stop()
+            self.app_db.db.run = run
+        self.assertEqual(blocking, [])
+
     async def test_shutdown_preserves_threads_with_resumable_agent_runs(self):
         thread_id = await self.app_db.create_thread_async(
             {
@@ -376,5 +487,214 @@ class TestAppDbProvider(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(thread["status"], "Continuing…")
         self.assertEqual(run["status"], "queued")
 
+
+class TestNormalizedMessageStore(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.ctx = MockContext(os.path.join(self.temp_dir, "test.db"))
+        self.ctx.config["defaults"]["normalizedMessages"] = True
+        import llms.extensions.app as app_mod
+        self.original_g_db = app_mod.g_db
+        install(self.ctx)
+        self.app_db = app_mod.g_db
+
+    def tearDown(self):
+        self.app_db.close()
+        import llms.extensions.app as app_mod
+        app_mod.g_db = self.original_g_db
+        shutil.rmtree(self.temp_dir)
+
+    def contents(self, thread_id):
+        return [x["message"]["content"] for x in self.app_db.get_chat_messages(thread_id)]
+
+    async def test_rows_are_the_conversation_and_turns_are_appended(self):
+        thread_id = await self.app_db.create_thread_async(
+            {"title": "normalized", "messages": [{"role": "user", "content": "Hello", "timestamp": 1}]},
+            user="test_user",
+        )
+        self.assertIsNone(self.app_db.get_thread(thread_id, user="test_user")["messages"])
+
+        tool_call = {
+            "role": "assistant", "content": "", "timestamp": 2,
+            "tool_calls": [{"id": "call-1", "type": "function", "function": {"name": "test", "arguments": "{}"}}],
+        }
+        tool_result = {"role": "tool", "tool_call_id": "call-1", "content": "done", "timestamp": 3}
+        context = {
+            "chat": {"messages": [{"role": "user", "content": "Hello", "timestamp": 1}]},
+            "threadId": thread_id, "user": "test_user", "projectedContext": True,
+            "projectedPersistedCount": 1, "runId": None, "stepId": None,
+            "provider": "test-provider", "modelInfo": {"id": "test-model", "cost": {"input": 1, "output": 1}},
+        }
+        for filter_fn in self.ctx.chat_tool_filters:
+            await filter_fn({"messages": [{"role": "user", "content": "Hello", "timestamp": 1}, tool_call, tool_result]}, context)
+        response = {
+            "model": "test-model",
+            "choices": [{"message": {"role": "assistant", "content": "Hi!"}}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 1},
+        }
+        for filter_fn in self.ctx.chat_response_filters:
+            await filter_fn(response, context)
+
+        self.assertEqual(self.contents(thread_id), ["Hello", "", "done", "Hi!"])
+        row = self.app_db.get_thread(thread_id, user="test_user")
+        self.assertIsNone(row["messages"])
+        self.assertGreater(row["contextTokens"], 0)
+        # the tool result the response answers gets the prompt's usage
+        self.assertEqual(self.app_db.get_chat_messages(thread_id)[2]["message"]["usage"]["tokens"], 10)
+
+        thread = self.ctx.threads.get_thread(thread_id, user="test_user")
+        self.assertEqual([x["content"] for x in thread["messages"]], ["Hello", "", "done", "Hi!"])
+        self.assertEqual([x["_sequence"] for x in thread["messages"]], [1, 2, 3, 4])
+        self.assertEqual(
+            [x["id"] for x in self.app_db.query_threads({"q": "done"}, user="test_user")], [thread_id]
+        )
+
+    async def test_full_list_writes_update_edited_rows_and_truncate_starts_a_new_branch(self):
+        messages = [
+            {"role": "user", "content": "one", "timestamp": 1},
+            {"role": "assistant", "content": "two", "timestamp": 2},
+        ]
+        thread_id = await self.app_db.create_thread_async({"messages": messages}, user="test_user")
+        edited = [messages[0], {**messages[1], "content": "two (edited)", "_sequence": 2}]
+        await self.app_db.update_thread_async(thread_id, {"messages": edited}, user="test_user")
+        self.assertEqual(self.contents(thread_id), ["one", "two (edited)"])
+        self.assertNotIn("_sequence", self.app_db.get_chat_messages(thread_id)[1]["message"])
+
+        await self.app_db.update_thread_async(thread_id, {"messages": messages[:1], "truncate": True}, user="test_user")
+        self.assertEqual(self.contents(thread_id), ["one"])
+        self.assertIsNone(self.app_db.get_thread(thread_id, user="test_user")["messages"])
+
+    async def test_legacy_threads_are_migrated_from_their_json(self):
+        self.app_db.normalized_messages = False
+        messages = [
+            {"role": "user", "content": "one", "timestamp": 1},
+            {"role": "assistant", "content": "two", "timestamp": 2},
+        ]
+        thread_id = await self.app_db.create_thread_async({"messages": messages}, user="test_user")
+        # edits only ever reached the JSON copy of legacy threads
+        self.app_db.db.run(lambda conn: conn.execute(
+            "UPDATE thread SET messages=? WHERE id=?",
+            (json.dumps([messages[0], {**messages[1], "content": "two (edited)"}]), thread_id),
+        ))
+        # and rows that no longer line up with the JSON are rebuilt from it
+        rebuilt = await self.app_db.create_thread_async({"messages": messages})
+        self.app_db.db.run(lambda conn: conn.execute(
+            "UPDATE thread SET messages=? WHERE id=?", (json.dumps(messages[1:]), rebuilt)
+        ))
+
+        self.assertEqual(self.app_db.migrate_messages(), {"migrated": 1, "rewritten": 1})
+        self.assertEqual(self.app_db.migrate_messages(), {})
+        self.assertEqual(self.contents(thread_id), ["one", "two (edited)"])
+        self.assertEqual(self.contents(rebuilt), ["two"])
+        row = self.app_db.get_thread(thread_id, user="test_user")
+        self.assertEqual((row["normalized"], row["messages"]), (1, None))
+        self.assertEqual(self.app_db.get_last_message(thread_id)["content"], "two (edited)")
+
+    async def test_thread_list_previews_and_runs_are_loaded_per_page(self):
+        ids = []
+        for n in range(3):
+            ids.append(await self.app_db.create_thread_async({"messages": [
+                {"role": "user", "content": f"q{n}", "timestamp": 1},
+                {"role": "assistant", "content": "", "tool_calls": [{"id": "c1", "function": {"name": "t"}}], "timestamp": 2},
+                {"role": "tool", "tool_call_id": "c1", "content": f"r{n}", "timestamp": 3},
+            ][: n + 1]}, user="test_user"))
+        empty = await self.app_db.create_thread_async({"messages": []}, user="test_user")
+        run_id = await self.app_db.create_agent_run_async(ids[0], "test_user", "m1")
+
+        previews = self.app_db.get_thread_previews(ids)
+        self.assertEqual([previews[id]["messageCount"] for id in ids], [1, 2, 3])
+        self.assertEqual([m["content"] for m in previews[ids[0]]["messages"]], ["q0"])
+        # a trailing tool result is previewed with the call it answers
+        self.assertEqual([m["role"] for m in previews[ids[2]]["messages"]], ["assistant", "tool"])
+        self.assertEqual({k: v["id"] for k, v in self.app_db.get_active_agent_runs(ids).items()}, {ids[0]: run_id})
+
+        # keyset pages walk the default newest-first order without gaps or repeats
+        first = self.app_db.query_threads({"take": "2", "fields": "id"}, user="test_user")
+        rest = self.app_db.query_threads({"take": "2", "before": str(first[-1]["id"]), "fields": "id"}, user="test_user")
+        self.assertEqual([r["id"] for r in first + rest], sorted(ids + [empty], reverse=True))
+
+        # and any other single column, on which several threads can tie
+        await self.app_db.update_thread_async(ids[1], {"title": "b"}, user="test_user")
+        await self.app_db.update_thread_async(ids[2], {"title": "a"}, user="test_user")
+        for sort in ("title", "-title"):
+            pages, cursor = [], {}
+            while True:
+                query = {"take": "1", "sort": sort, "fields": "id,title", **cursor}
+                page = self.app_db.query_threads(query, user="test_user")
+                if not page:
+                    break
+                pages += page
+                cursor = {"before" if sort.startswith("-") else "after": str(page[-1]["id"])}
+            expected = self.app_db.query_threads({"take": "10", "sort": sort, "fields": "id,title"}, user="test_user")
+            self.assertEqual(pages, expected)
+            self.assertEqual(len(pages), 4)
+        with self.assertRaises(ValueError):
+            self.app_db.query_threads({"sort": "title,-id", "before": str(ids[0])}, user="test_user")
+
+
+    async def test_thread_version_moves_with_every_write(self):
+        thread_id = await self.app_db.create_thread_async({"messages": [
+            {"role": "user", "content": "one", "timestamp": 1},
+        ]}, user="test_user")
+        versions = [self.app_db.get_thread_version(thread_id, user="test_user")]
+
+        def moved():
+            versions.append(self.app_db.get_thread_version(thread_id, user="test_user"))
+            return versions[-1] > versions[-2]
+
+        await self.app_db.append_messages_async(thread_id, [{"role": "assistant", "content": "two", "timestamp": 2}])
+        self.assertTrue(moved())
+        await self.app_db.append_stream_chunk_async(thread_id, "s1", 0, "x")
+        self.assertTrue(moved())
+        run_id = await self.app_db.create_agent_run_async(thread_id, "test_user", "m1")
+        self.assertTrue(moved())
+        await self.app_db.update_agent_run_async(run_id, {"status": "running"})
+        self.assertTrue(moved())
+        # a stale version echoed back by a client is ignored rather than written
+        await self.app_db.update_thread_async(thread_id, {"title": "t", "version": 1}, user="test_user")
+        self.assertTrue(moved())
+        self.assertFalse(moved())
+
+        row = self.app_db.get_thread(thread_id, user="test_user")
+        etag = thread_etag(row)
+        self.assertEqual(etag, f'W/"{thread_id}.{versions[-1]}"')
+        request = SimpleNamespace(headers={"If-None-Match": f'W/"x", {etag}'})
+        self.assertEqual(not_modified(request, etag).status, 304)
+        self.assertIsNone(not_modified(SimpleNamespace(headers={}), etag))
+
+
+    async def test_import_replaces_threads_with_bulk_inserted_rows(self):
+        old = await self.app_db.create_thread_async({"title": "old", "messages": [
+            {"role": "user", "content": "stale", "timestamp": 1},
+        ]}, user="test_user")
+        self.app_db.annotate_chat_messages(old, [{"timestamp": 1}], run_id=7, step_id=8)
+        self.assertEqual(self.app_db.get_chat_messages(old)[0]["runId"], 7)
+
+        self.app_db.import_db([
+            {"id": "a", "title": "first", "createdAt": "2026-01-02 05:00:16", "user": "test_user", "messages": [
+                {"role": "user", "content": "hello world"},
+                {"role": "assistant", "content": "hi", "timestamp": 99},
+            ]},
+            {"id": "b", "title": "second", "createdAt": "2026-01-03 05:00:16", "user": "test_user"},
+        ], [
+            {"id": 1, "threadId": "a", "created": "2026-01-02 05:00:20", "user": "test_user", "model": "m1", "cost": 0.5},
+        ])
+
+        threads = self.app_db.query_threads({"sort": "id", "fields": "id,title,normalized"}, user="test_user")
+        self.assertEqual([(t["id"], t["title"], t["normalized"]) for t in threads], [(1, "first", 1), (2, "second", 1)])
+        rows = self.app_db.get_chat_messages(1)
+        self.assertEqual([(r["sequence"], r["message"]["content"]) for r in rows], [(1, "hello world"), (2, "hi")])
+        self.assertEqual(rows[1]["timestamp"], 99)
+        self.assertTrue(all(r["tokenCount"] > 0 for r in rows))
+        self.assertEqual(self.app_db.db.scalar("SELECT count(*) FROM chat_message"), 2)
+        self.assertEqual(self.app_db.query_requests({}, user="test_user")[0]["threadId"], 1)
+        self.assertEqual(self.app_db.db.scalar("SELECT sum(requests) FROM request_usage"), 1)
+        self.assertEqual([t["id"] for t in self.app_db.query_threads({"search": "hello"}, user="test_user")], [1])
+        # the triggers dropped for the import are back
+        await self.app_db.append_messages_async(2, [{"role": "user", "content": "later", "timestamp": 5}])
+        self.assertGreater(self.app_db.get_thread_version(2, user="test_user"), 0)
+        self.assertEqual([t["id"] for t in self.app_db.query_threads({"search": "later"}, user="test_user")], [2])
+
+
 if __name__ == "__main__":
     unittest.main()
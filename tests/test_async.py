@@ -8,10 +8,12 @@ import os
 import sys
 import unittest
 
+from aiohttp import web
+
 # Add parent directory to path to import llms module
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from llms.main import process_chat
+from llms.main import ClientSessionPool, process_chat
 
 
 class TestProcessChat(unittest.TestCase):
@@ -112,5 +114,99 @@ class TestAsyncHelpers(unittest.TestCase):
         self.assertEqual(result, "success")
 
 
+class TestClientSessionPool(unittest.TestCase):
+    """Test the shared keep-alive sessions used for provider requests."""
+
+    def test_session_is_reused_per_name(self):
+        """Test that requests for the same name share one open session."""
+
+        async def run_test():
+            pool = ClientSessionPool()
+            first = pool.get("openai")
+            self.assertIs(pool.get("openai"), first)
+            self.assertIsNot(pool.get("anthropic"), first)
+            await pool.close()
+            self.assertTrue(first.closed)
+            self.assertEqual(pool.sessions, {})
+
+        asyncio.run(run_test())
+
+    def test_closed_session_is_replaced(self):
+        """Test that a closed session is never handed out again."""
+
+        async def run_test():
+            pool = ClientSessionPool()
+            first = pool.get("openai")
+            await first.close()
+            second = pool.get("openai")
+            self.assertIsNot(second, first)
+            self.assertFalse(second.closed)
+            await pool.close()
+
+        asyncio.run(run_test())
+
+    def test_session_from_another_loop_is_replaced(self):
+        """Test that a session isn't reused across event loops."""
+        pool = ClientSessionPool()
+
+        async def get_session():
+            return pool.get("openai")
+
+        first = asyncio.run(get_session())
+
+        async def run_test():
+            second = pool.get("openai")
+            self.assertIsNot(second, first)
+            await pool.close()
+
+        asyncio.run(run_test())
+
+    def test_cookies_are_not_shared_between_requests(self):
+        """Test that a cookie set by one response isn't sent on the next request."""
+
+        async def run_test():
+            received = []
+
+            async def handler(request):
+                received.append(request.headers.get("Cookie"))
+                response = web.Response(text="ok")
+                response.set_cookie("session", "user-a")
+                return response
+
+            server = web.Application()
+            server.router.add_get("/", handler)
+            runner = web.AppRunner(server)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+            pool = ClientSessionPool()
+            try:
+                for _ in range(2):
+                    async with pool.get("fetch_url").get(f"http://localhost:{port}/") as response:
+                        await response.text()
+            finally:
+                await pool.close()
+                await runner.cleanup()
+            self.assertEqual(received, [None, None])
+
+        asyncio.run(run_test())
+
+    def test_connector_uses_configured_limits(self):
+        """Test that connector limits come from the app's `limits` config."""
+
+        class App:
+            limits = {"connection_limit": 7, "connection_limit_per_host": 3}
+
+        async def run_test():
+            pool = ClientSessionPool(App())
+            connector = pool.create_connector()
+            self.assertEqual(connector.limit, 7)
+            self.assertEqual(connector.limit_per_host, 3)
+            await connector.close()
+
+        asyncio.run(run_test())
+
+
 if __name__ == "__main__":
     unittest.main()
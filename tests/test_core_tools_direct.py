@@ -1,19 +1,30 @@
+import asyncio
+import contextlib
 import io
 import os
 import sys
 import tempfile
+import threading
 import unittest
 from unittest.mock import MagicMock, patch
 
+from aiohttp import web
+
 # Add project root to path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 import llms.extensions.core_tools as core_tools
+from llms.main import ClientSessionPool
 
 # Mock g_ctx
 core_tools.g_ctx = MagicMock()
 
 
+@contextlib.asynccontextmanager
+async def client_session(pool, name):
+    yield pool.get(name)
+
+
 class TestCoreToolsDirect(unittest.TestCase):
     def test_calc(self):
         # Simple list comprehension
@@ -67,23 +78,96 @@ class TestCoreToolsDirect(unittest.TestCase):
         self.assertNotIn("body { color: red; }", md)
 
     def test_fetch_url(self):
-        sample_html = b"<html><body><h1>Hello World</h1><p>Fetched content</p></body></html>"
+        sample_html = "<html><body><h1>Hello World</h1><p>Fetched content</p></body></html>"
+        long_html = "<html><body>" + "".join(f"<p>Paragraph {i}</p>" for i in range(50000)) + "</body></html>"
+        requests = []
 
-        mock_resp = MagicMock()
-        mock_resp.headers.get.return_value = "text/html; charset=utf-8"
-        mock_resp.headers.get_content_charset.return_value = "utf-8"
-        mock_resp.read.return_value = sample_html
-        mock_resp.__enter__.return_value = mock_resp
-        mock_resp.__exit__.return_value = None
+        async def page(request):
+            requests.append((request.path, request.headers.get("If-None-Match")))
+            if request.headers.get("If-None-Match") == '"v1"':
+                return web.Response(status=304, headers={"ETag": '"v1"'})
+            body = long_html if request.path == "/long" else sample_html
+            return web.Response(text=body, content_type="text/html", headers={"ETag": '"v1"'})
 
-        with patch("urllib.request.urlopen", return_value=mock_resp):
-            res = core_tools.fetch_url("https://example.com/test")
+        async def fetch_all():
+            app = web.Application()
+            app.router.add_get("/{name}", page)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            base = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+            try:
+                return [
+                    await core_tools.fetch_url(f"{base}/test"),
+                    await core_tools.fetch_url(f"{base}/test"),
+                    await core_tools.fetch_url(f"{base}/long", max_length=100),
+                    await core_tools.fetch_url(f"{base}/long", max_length=100),
+                    # only the start of the long page was read and stored
+                    max(
+                        os.path.getsize(core_tools.g_http_cache.paths(f"{base}/{name}")[1]) for name in ("test", "long")
+                    ),
+                    await core_tools.fetch_url(f"{base}/long", max_length=2000000),
+                ]
+            finally:
+                await runner.cleanup()
+
+        with tempfile.TemporaryDirectory() as tmp_dir, patch.object(core_tools, "g_ctx", None), patch.object(
+            core_tools, "g_http_cache", core_tools.HttpCache(tmp_dir)
+        ):
+            res, res_cached, res_trunc, res_trunc_cached, stored_size, res_full = asyncio.run(fetch_all())
             self.assertIn("# Hello World", res)
             self.assertIn("Fetched content", res)
+            # the second fetch was a conditional request, answered from the cache
+            self.assertEqual(res_cached, res)
+            self.assertEqual([r[1] for r in requests[:4]], [None, '"v1"', None, '"v1"'])
 
             # Test truncation
-            res_trunc = core_tools.fetch_url("https://example.com/test", max_length=10)
             self.assertIn("Truncated", res_trunc)
+            self.assertEqual(res_trunc_cached, res_trunc)
+            self.assertLess(stored_size, len(long_html) // 10)
+
+            # needing more than the stored part refetches the page in full
+            self.assertIn("Paragraph 49999", res_full)
+            self.assertEqual([r[1] for r in requests[4:]], ['"v1"', None])
+
+    def test_fetch_url_keeps_no_cookies_between_calls(self):
+        cookies = []
+
+        async def page(request):
+            cookies.append(request.headers.get("Cookie"))
+            response = web.Response(text="<p>hi</p>", content_type="text/html")
+            response.set_cookie("session", request.query["user"])
+            return response
+
+        async def fetch_all(ctx):
+            app = web.Application()
+            app.router.add_get("/", page)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            base = f"http://localhost:{site._server.sockets[0].getsockname()[1]}"
+            try:
+                with patch.object(core_tools, "g_ctx", ctx):
+                    await core_tools.fetch_url(f"{base}/?user=a")
+                    await core_tools.fetch_url(f"{base}/?user=b")
+            finally:
+                if ctx:
+                    await pool.close()
+                await runner.cleanup()
+
+        pool = ClientSessionPool()
+        ctx = MagicMock()
+        ctx.client_session = lambda name: client_session(pool, name)
+        with tempfile.TemporaryDirectory() as tmp_dir, patch.object(
+            core_tools, "g_http_cache", core_tools.HttpCache(tmp_dir)
+        ):
+            # on the shared pooled session, and on the one-off session used without an app
+            for fetch_ctx in (ctx, None):
+                cookies.clear()
+                asyncio.run(fetch_all(fetch_ctx))
+                self.assertEqual(cookies, [None, None])
 
     def test_grep_search(self):
         with tempfile.TemporaryDirectory() as tmp_dir:
@@ -120,6 +204,84 @@ class TestCoreToolsDirect(unittest.TestCase):
             res_none = core_tools.grep_search("non_existent_symbol", path=tmp_dir)
             self.assertEqual(res_none, "No matches found for 'non_existent_symbol'.")
 
+    @unittest.skipIf(sys.platform == "win32", "sandboxes use bash and ulimit")
+    def test_run_python_uses_single_use_warm_sandboxes(self):
+        pool = core_tools.SandboxPool(size=1)
+        try:
+            first = pool.run("python", "import os\nopen('state.txt', 'w').write('x')\nprint(os.listdir('.'))")
+            self.assertEqual(first["returncode"], 0)
+            self.assertIn("state.txt", first["stdout"])
+            # the next run gets the sandbox started after the first, in a fresh directory
+            second = pool.run("python", "import os, sys\nprint(sorted(os.listdir('.')))\nsys.exit(3)")
+            self.assertEqual((second["stdout"].strip(), second["returncode"]), ("['script.py']", 3))
+            error = pool.run("python", "1/0")
+            self.assertIn('File "script.py", line 1', error["stderr"])
+            self.assertEqual(pool.run("python", "while True: pass", timeout=0.5)["stderr"], "Execution timed out")
+            stats = pool.stats()["python"]
+            self.assertEqual((stats["calls"], stats["warm"], stats["timeouts"]), (4, 3, 1))
+        finally:
+            pool.close()
+        self.assertEqual(pool.idle, {})
+
+    def test_sandboxes_are_started_in_the_background(self):
+        pool = core_tools.SandboxPool(size=1)
+        started = threading.Event()
+
+        def spawn(language):
+            started.wait(5)
+            return MagicMock(**{"poll.return_value": None}), "dir"
+
+        with patch.object(pool, "spawn", spawn):
+            # refilling doesn't wait for the sandbox to start, or hold up taking one
+            pool.refill("python")
+            self.assertEqual((pool.starting["python"], pool.idle.get("python", [])), (1, []))
+            pool.refill("python")
+            self.assertEqual(pool.starting["python"], 1)
+            # a run waits for the one already booting rather than starting its own
+            threading.Timer(0.05, started.set).start()
+            sandbox, warm = pool.take("python")
+            self.assertEqual((sandbox[1], warm), ("dir", True))
+            self.assertEqual(pool.starting["python"], 0)
+        pool.executor.shutdown()
+
+    def test_compile_cache_reuses_artifacts_and_evicts_least_recently_used(self):
+        with tempfile.TemporaryDirectory() as cache_dir, tempfile.TemporaryDirectory() as build_dir:
+            cache = core_tools.CompileCache(cache_dir, max_bytes=2500)
+            with open(os.path.join(build_dir, "script.dll"), "wb") as f:
+                f.write(b"x" * 1000)
+
+            key = cache.key("csharp", "Console.WriteLine(1);", "10.0.100")
+            self.assertNotEqual(key, cache.key("csharp", "Console.WriteLine(1);", "10.0.101"))
+            self.assertIsNone(cache.get("csharp", key))
+            entry = cache.put("csharp", key, build_dir)
+            self.assertEqual(cache.get("csharp", key), entry)
+            self.assertTrue(os.path.exists(os.path.join(entry, "script.dll")))
+
+            other = cache.put("csharp", cache.key("csharp", "2", "10.0.100"), build_dir)
+            os.utime(other, (0, 0))  # used long ago
+            cache.put("csharp", cache.key("csharp", "3", "10.0.100"), build_dir)
+            self.assertFalse(os.path.exists(other))
+            self.assertTrue(os.path.exists(entry))
+            stats = cache.stats()
+            self.assertEqual((stats["entries"], stats["bytes"]), (2, 2000))
+            self.assertEqual(stats["languages"]["csharp"], {"hits": 1, "misses": 1, "evictions": 1})
+            self.assertIn("hit", cache.describe("csharp", key, True))
+
+    def test_http_cache_evicts_least_recently_used_pages(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = core_tools.HttpCache(cache_dir, max_bytes=2500)
+            info = {"contentType": "text/html", "charset": "utf-8", "expires": 0, "complete": True}
+            cache.save("https://a.test/", info, b"a" * 1000)
+            cache.save("https://b.test/", info, b"b" * 1000)
+            os.utime(cache.paths("https://a.test/")[0], (0, 0))  # used long ago
+            self.assertEqual(cache.load("https://b.test/")[1], b"b" * 1000)
+            cache.save("https://c.test/", info, b"c" * 1000)
+
+            self.assertEqual(cache.load("https://a.test/"), (None, None))
+            self.assertEqual(cache.load("https://b.test/")[1], b"b" * 1000)
+            self.assertEqual(cache.load("https://c.test/")[1], b"c" * 1000)
+            self.assertEqual((len(cache.entries()), cache.evictions), (2, 1))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the pooled reader connections DbManager uses by default, and the
+*_async reads that run on its reader threads instead of the event loop.
+"""
+
+import asyncio
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from llms.db import ConnectionPool, DbManager, create_reader_connection, db_stats
+
+
+class MockCtx:
+    debug = False
+
+    def dbg(self, msg):
+        pass
+
+    def err(self, msg, e=None):
+        pass
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "app.sqlite")
+        self.opened = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def factory(self):
+        conn = create_reader_connection(self.path)
+        self.opened.append(conn)
+        return conn
+
+    def test_connections_are_reused(self):
+        pool = ConnectionPool(self.factory, max_size=2)
+        for _ in range(10):
+            conn = pool.acquire()
+            conn.row_factory = sqlite3.Row
+            pool.release(conn)
+        self.assertEqual(len(self.opened), 1)
+        self.assertIsNone(self.opened[0].row_factory)
+        self.assertEqual(pool.stats()["acquired"], 10)
+        pool.close()
+
+    def test_waits_for_a_released_connection_when_full(self):
+        pool = ConnectionPool(self.factory, max_size=1, timeout=5)
+        conn = pool.acquire()
+        threading.Timer(0.05, pool.release, args=(conn,)).start()
+        self.assertIs(pool.acquire(), conn)
+        self.assertEqual(pool.stats()["waits"], 1)
+
+        pool.timeout = 0.01
+        with self.assertRaises(sqlite3.OperationalError):
+            pool.acquire()
+        self.assertEqual(pool.stats()["timeouts"], 1)
+        pool.close()
+
+    def test_idle_connections_above_min_size_are_closed(self):
+        pool = ConnectionPool(self.factory, min_size=1, max_size=3, idle_seconds=0)
+        conns = [pool.acquire() for _ in range(3)]
+        for conn in conns:
+            pool.release(conn)
+        stats = pool.stats()
+        self.assertEqual((stats["size"], stats["idle"], stats["closed"]), (1, 1, 2))
+        pool.close()
+
+    def test_unhealthy_idle_connection_is_replaced(self):
+        pool = ConnectionPool(self.factory, health_check_seconds=0)
+        conn = pool.acquire()
+        pool.release(conn)
+        conn.close()
+        replacement = pool.acquire()
+        self.assertIsNot(replacement, conn)
+        self.assertEqual(pool.stats()["unhealthy"], 1)
+        pool.close()
+
+
+class TestDbManagerPool(unittest.TestCase):
+    def test_queries_share_pooled_connections_and_report_stats(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            db = DbManager(MockCtx(), os.path.join(tmp, "stats.sqlite"))
+            db.run(lambda conn: conn.execute("CREATE TABLE item (id INTEGER PRIMARY KEY)"))
+            for _ in range(5):
+                db.all("SELECT * FROM item")
+                db.scalar("SELECT count(*) FROM item")
+            stats = db_stats()["stats.sqlite"]
+            self.assertEqual(stats["pool"]["opened"], 1)
+            self.assertEqual(stats["pool"]["acquired"], 10)
+            db.close()
+            self.assertNotIn("stats.sqlite", db_stats())
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+class TestAsyncReads(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.db = DbManager(MockCtx(), os.path.join(self.tmp, "app.sqlite"))
+        self.db.run(lambda conn: conn.execute("CREATE TABLE item (id INTEGER PRIMARY KEY, name TEXT)"))
+        self.db.run(lambda conn: conn.execute("INSERT INTO item (name) VALUES ('a'), ('b')"))
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    async def test_async_reads(self):
+        self.assertEqual(await self.db.all_async("SELECT name FROM item ORDER BY id"), [{"name": "a"}, {"name": "b"}])
+        self.assertEqual(await self.db.one_async("SELECT name FROM item WHERE id=?", (2,)), {"name": "b"})
+        self.assertEqual(await self.db.scalar_async("SELECT count(*) FROM item"), 2)
+        self.assertEqual(await self.db.column_async("SELECT name FROM item ORDER BY id"), ["a", "b"])
+        self.assertEqual(await self.db.dict_async("SELECT id, name FROM item"), {1: "a", 2: "b"})
+
+    async def test_slow_read_does_not_block_the_event_loop(self):
+        started, release = threading.Event(), threading.Event()
+
+        def slow_read():
+            started.set()
+            release.wait(5)
+            return self.db.scalar("SELECT count(*) FROM item"), threading.current_thread()
+
+        read = asyncio.ensure_future(self.db.read_async(slow_read))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        # the loop is still free to run other work while the read is parked
+        await asyncio.sleep(0.01)
+        self.assertFalse(read.done())
+        release.set()
+        count, thread = await read
+        self.assertEqual(count, 2)
+        self.assertIsNot(thread, threading.current_thread())
+
+
+if __name__ == "__main__":
+    unittest.main()
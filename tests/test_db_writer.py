@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the DbManager writer thread's group commit: queued writes are drained
+into one transaction, each in its own savepoint, and callbacks only run once it commits.
+"""
+
+import asyncio
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import llms.db
+from llms.db import DbManager
+
+
+class MockCtx:
+    def __init__(self):
+        self.debug = False
+        self.errors = []
+
+    def dbg(self, msg):
+        pass
+
+    def err(self, msg, e=None):
+        self.errors.append((msg, e))
+
+
+class TestGroupCommit(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.ctx = MockCtx()
+        # don't let a slow run cut a batch short on its latency budget
+        self.batch_seconds, llms.db.WRITE_BATCH_SECONDS = llms.db.WRITE_BATCH_SECONDS, 10
+        self.db = DbManager(self.ctx, os.path.join(self.tmp, "app.sqlite"))
+        self.db.run(lambda conn: conn.execute("CREATE TABLE item (id INTEGER PRIMARY KEY, name TEXT UNIQUE)"))
+
+    def tearDown(self):
+        self.db.close()
+        llms.db.WRITE_BATCH_SECONDS = self.batch_seconds
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def block_writer(self):
+        """Park the writer thread until the returned event is set, so writes queue up behind it."""
+        started, release = threading.Event(), threading.Event()
+
+        def wait(conn):
+            started.set()
+            release.wait(5)
+
+        self.db.write(wait)
+        started.wait(5)
+        return release
+
+    async def test_queued_writes_share_one_transaction(self):
+        release = self.block_writer()
+        commits = []
+        self.db.write(lambda conn: conn.set_trace_callback(lambda sql: sql == "COMMIT" and commits.append(sql)))
+        futures = [
+            asyncio.ensure_future(self.db.insert_async("item", {"name": "TEXT"}, {"name": f"item{i}"}))
+            for i in range(50)
+        ]
+        await asyncio.sleep(0)  # let every insert reach the queue
+        release.set()
+        ids = await asyncio.gather(*futures)
+        self.assertEqual(ids, list(range(1, 51)))
+        # everything queued behind the blocking task is drained into its batch
+        self.assertEqual(len(commits), 1)
+        self.assertEqual(self.db.scalar("SELECT count(*) FROM item"), 50)
+
+    async def test_failed_write_only_rolls_back_itself(self):
+        release = self.block_writer()
+        futures = [
+            asyncio.ensure_future(self.db.insert_async("item", {"name": "TEXT"}, {"name": name}))
+            for name in ["a", "a", "b"]
+        ]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        self.assertIsInstance(results[1], sqlite3.IntegrityError)
+        self.assertEqual(self.db.column("SELECT name FROM item ORDER BY id"), ["a", "b"])
+        self.assertEqual(len(self.ctx.errors), 1)
+
+    async def test_run_returns_the_result_of_fn(self):
+        def insert_two(conn):
+            conn.execute("INSERT INTO item (name) VALUES ('x')")
+            return conn.execute("INSERT INTO item (name) VALUES ('y')").lastrowid
+
+        self.assertEqual(self.db.run(insert_two), 2)
+        self.assertEqual(await self.db.run_async(lambda conn: conn.execute("SELECT count(*) FROM item").fetchone()[0]), 2)
+
+    async def test_exception_in_fn_rolls_back_its_statements(self):
+        def fail(conn):
+            conn.execute("INSERT INTO item (name) VALUES ('x')")
+            raise ValueError("nope")
+
+        with self.assertRaises(ValueError):
+            await self.db.run_async(fail)
+        self.assertEqual(self.db.scalar("SELECT count(*) FROM item"), 0)
+
+    def test_run_after_close_raises(self):
+        self.db.close()
+        with self.assertRaises(sqlite3.ProgrammingError):
+            self.db.run(lambda conn: None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the computer extension's edit tool, checking that large files, which are
+viewed and edited through mmap and a line index, give the same results as small ones.
+"""
+
+import importlib
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from llms.extensions.computer.base import ToolError
+from llms.extensions.computer.edit import EditTool20250124
+
+# the package exports the `edit` tool function under the module's name
+edit_module = importlib.import_module("llms.extensions.computer.edit")
+
+CONTENT = "".join(f"line {i}\n" for i in range(1, 301)) + "needle in line 301\nlast line"
+
+
+class TestEditTool(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    async def run_edits(self, name):
+        """Run the same edits on a new file, returning every output and the final contents."""
+        tool = EditTool20250124()
+        path = os.path.join(self.tmp.name, name)
+        Path(path).write_text(CONTENT)
+        outputs = []
+
+        async def call(**kwargs):
+            try:
+                outputs.append((await tool(path=path, **kwargs)).output)
+            except ToolError as e:
+                outputs.append(f"error: {e.message if hasattr(e, 'message') else e}")
+
+        await call(command="view", view_range=[5, 9])
+        await call(command="view", view_range=[299, -1])
+        await call(command="view", view_range=[300, 400])
+        await call(command="str_replace", old_str="needle", new_str="thread\nwith two lines")
+        await call(command="str_replace", old_str="line 1\n", new_str="first")
+        await call(command="str_replace", old_str="missing", new_str="x")
+        await call(command="insert", insert_line=3, new_str="inserted a\ninserted b")
+        await call(command="insert", insert_line=0, new_str="top")
+        await call(command="view", view_range=[1, 8])
+        await call(command="undo_edit")
+        await call(command="view", view_range=[1, 6])
+        await call(command="undo_edit")
+        await call(command="view", view_range=[300, -1])
+        with open(path, encoding="utf-8") as f:
+            return outputs, f.read()
+
+    async def test_large_files_behave_like_small_ones(self):
+        small_outputs, small_content = await self.run_edits("small.txt")
+        with patch.object(edit_module, "LARGE_FILE_BYTES", 100), patch.object(edit_module, "LINE_INDEX_BLOCK", 64):
+            large_outputs, large_content = await self.run_edits("large.txt")
+        self.assertEqual(large_content, small_content)
+        for small, large in zip(small_outputs, large_outputs):
+            small = small.replace("small.txt", "large.txt")
+            if small.startswith("Last edit"):
+                # undoing an edit to a large file shows the restored lines instead of the whole file
+                self.assertEqual(large.split(". ")[0], small.split(". ")[0])
+                self.assertIn("on a snippet of", large)
+            else:
+                self.assertEqual(large, small)
+        self.assertIn("thread\n", large_content)
+        self.assertNotIn("top", large_content)
+
+    async def test_large_file_can_be_emptied_and_restored(self):
+        tool = EditTool20250124()
+        path = os.path.join(self.tmp.name, "large.txt")
+        Path(path).write_text(CONTENT)
+        with patch.object(edit_module, "LARGE_FILE_BYTES", 100):
+            result = await tool(command="str_replace", path=path, old_str=CONTENT, new_str="")
+            self.assertIn("has been edited", result.output)
+            self.assertEqual(Path(path).read_text(), "")
+            await tool(command="undo_edit", path=path)
+        self.assertEqual(Path(path).read_text(), CONTENT)
+
+    async def test_large_file_edits_match_tabs_as_viewed(self):
+        tool = EditTool20250124()
+        path = os.path.join(self.tmp.name, "large.py")
+        Path(path).write_text(CONTENT + "\ndef f():\n\tfoo = 1\n\tif foo:\n\t\treturn  foo\n")
+        with patch.object(edit_module, "LARGE_FILE_BYTES", 100):
+            view = (await tool(command="view", path=path, view_range=[303, 305])).output
+            self.assertIn("        foo = 1", view)
+            # what the view showed is what the model sends back
+            await tool(command="str_replace", path=path, old_str="        foo = 1", new_str="        foo = 2")
+            await tool(command="str_replace", path=path, old_str="\t\treturn  foo", new_str="\t\treturn foo")
+            # starting part way into a tab, like it can in the view
+            await tool(command="str_replace", path=path, old_str="    if foo:", new_str="    if not foo:")
+            with self.assertRaises(ToolError):
+                await tool(command="str_replace", path=path, old_str="  foo = 3", new_str="x")
+        content = Path(path).read_text()
+        self.assertTrue(
+            content.endswith("def f():\n        foo = 2\n        if not foo:\n                return foo\n")
+        )
+
+    def test_line_index_follows_splices(self):
+        data = b"".join(b"row %d\n" % i for i in range(1000))
+        with patch.object(edit_module, "LINE_INDEX_BLOCK", 100):
+            index = edit_module.LineIndex.build(data)
+            self.assertEqual(index.line_count, 1001)
+            self.assertEqual(data[index.offset(data, 500) :].split(b"\n")[0], b"row 500")
+            self.assertEqual(index.line_at(data, data.index(b"row 700")), 700)
+
+            start = data.index(b"row 10\n")
+            new = data[:start] + b"a\nb\nc\n" + data[start + len(b"row 10\n") :]
+            spliced = index.spliced(start, b"row 10\n", b"a\nb\nc\n")
+            self.assertEqual(spliced.line_count, 1003)
+            for line in (5, 10, 12, 13, 500, 1000):
+                self.assertEqual(spliced.offset(new, line), edit_module.LineIndex.build(new).offset(new, line))
+
+    async def test_undo_refuses_files_changed_since_the_edit(self):
+        tool = EditTool20250124()
+        path = os.path.join(self.tmp.name, "file.txt")
+        Path(path).write_text(CONTENT)
+        await tool(command="str_replace", path=path, old_str="needle", new_str="pin")
+        Path(path).write_text("rewritten elsewhere\n")
+        with self.assertRaises(ToolError):
+            await tool(command="undo_edit", path=path)
+        self.assertEqual(Path(path).read_text(), "rewritten elsewhere\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the file search behind grep_search and the filesystem tools: .gitignore
+matching, the incrementally refreshed file index and mmap-based grep.
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from llms.filesearch import FileIndex, GitIgnore, compile_pattern, grep_file, grep_files, scan_tree, tree_files
+
+
+def write(path, text=""):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if isinstance(text, bytes):
+        with open(path, "wb") as f:
+            f.write(text)
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+class TestFileSearch(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def files(self, tree):
+        return [rel_path for rel_path, _, _ in tree_files(tree)]
+
+    def test_gitignore_patterns(self):
+        rules = GitIgnore(["# comment", "*.log", "!keep.log", "/out", "cache/", "docs/**/*.tmp", "\\#hash", ""])
+        self.assertTrue(rules.match("a/b/debug.log", False))
+        self.assertFalse(rules.match("a/keep.log", False))
+        self.assertTrue(rules.match("out", True))
+        self.assertIsNone(rules.match("src/out", True))
+        self.assertTrue(rules.match("src/cache", True))
+        self.assertIsNone(rules.match("src/cache", False))
+        self.assertTrue(rules.match("docs/a/b/x.tmp", False))
+        self.assertTrue(rules.match("#hash", False))
+        self.assertIsNone(rules.match("main.py", False))
+
+    def test_scan_applies_nested_gitignores_and_reuses_unchanged_dirs(self):
+        write(os.path.join(self.root, ".gitignore"), "*.log\ngenerated/\n")
+        write(os.path.join(self.root, "main.py"), "print(1)\n")
+        write(os.path.join(self.root, "debug.log"), "x\n")
+        write(os.path.join(self.root, "generated", "big.py"), "x\n")
+        write(os.path.join(self.root, "node_modules", "lib.js"), "x\n")
+        write(os.path.join(self.root, "pkg", ".gitignore"), "!trace.log\nsecret.txt\n")
+        write(os.path.join(self.root, "pkg", "trace.log"), "x\n")
+        write(os.path.join(self.root, "pkg", "secret.txt"), "x\n")
+        write(os.path.join(self.root, "pkg", "sub", "mod.py"), "x\n")
+
+        tree = scan_tree(self.root)
+        self.assertEqual(
+            self.files(tree), [".gitignore", "main.py", "pkg/.gitignore", "pkg/sub/mod.py", "pkg/trace.log"]
+        )
+
+        # unchanged directories are reused as they are, a changed one is listed again
+        write(os.path.join(self.root, "pkg", "sub", "new.py"), "x\n")
+        refreshed = scan_tree(self.root, previous=tree)
+        self.assertIs(refreshed[""], tree[""])
+        self.assertIs(refreshed["pkg"], tree["pkg"])
+        self.assertIn("pkg/sub/new.py", self.files(refreshed))
+
+        # editing a .gitignore rescans everything below it
+        write(os.path.join(self.root, "pkg", ".gitignore"), "sub/\n")
+        os.utime(os.path.join(self.root, "pkg", ".gitignore"), ns=(1, 1))
+        self.assertEqual(
+            self.files(scan_tree(self.root, previous=refreshed)),
+            [".gitignore", "main.py", "pkg/.gitignore", "pkg/secret.txt"],
+        )
+
+    def test_file_index_persists_between_instances(self):
+        write(os.path.join(self.root, "src", "a.py"), "x\n")
+        with tempfile.TemporaryDirectory() as index_dir:
+            FileIndex(index_dir).tree(self.root)
+            index = FileIndex(index_dir)
+            key = next(iter(os.listdir(index_dir)))
+            self.assertTrue(key.endswith(".json"))
+            self.assertEqual(self.files(index.tree(self.root)), ["src/a.py"])
+
+    def test_grep_scans_whole_files(self):
+        write(os.path.join(self.root, "a.txt"), "first line\nTODO: one\nnothing\r\nTODO two TODO\nlast TODO")
+        write(os.path.join(self.root, "bin.dat"), b"TODO\x00\x01")
+        write(os.path.join(self.root, "empty.txt"))
+        write(os.path.join(self.root, "ünï.txt"), "Grüße TODO\n")
+
+        pattern = compile_pattern("todo")
+        self.assertIsInstance(pattern.pattern, bytes)
+        path = os.path.join(self.root, "a.txt")
+        self.assertEqual(grep_file(path, pattern), [(2, "TODO: one"), (4, "TODO two TODO"), (5, "last TODO")])
+        self.assertEqual(grep_file(path, pattern, max_matches=1), [(2, "TODO: one")])
+        self.assertEqual(grep_file(path, compile_pattern(r"^todo:", is_regex=True)), [(2, "TODO: one")])
+        self.assertEqual(grep_file(path, compile_pattern("todo", case_sensitive=True)), [])
+        self.assertEqual(grep_file(os.path.join(self.root, "bin.dat"), pattern), [])
+        self.assertEqual(grep_file(os.path.join(self.root, "empty.txt"), pattern), [])
+
+        # large files are scanned through mmap
+        write(os.path.join(self.root, "big.txt"), "filler line\n" * 50000 + "TODO at the end")
+        self.assertEqual(grep_file(os.path.join(self.root, "big.txt"), pattern), [(50001, "TODO at the end")])
+
+        # non-ASCII queries are matched against the decoded text
+        unicode_pattern = compile_pattern("grüße")
+        self.assertIsInstance(unicode_pattern.pattern, str)
+        self.assertEqual(grep_file(os.path.join(self.root, "ünï.txt"), unicode_pattern), [(1, "Grüße TODO")])
+
+        # matches don't run across lines, nor find a line after the last newline
+        path = os.path.join(self.root, "lines.txt")
+        write(path, "foo\nbar\nxyz\n")
+        self.assertEqual(grep_file(path, compile_pattern("o[^z]*y", is_regex=True)), [])
+        self.assertEqual(grep_file(path, compile_pattern(r"o\s+b", is_regex=True)), [])
+        self.assertEqual(grep_file(path, compile_pattern("ar[^q]+", is_regex=True)), [(2, "bar")])
+        self.assertEqual(grep_file(path, compile_pattern("^$", is_regex=True)), [])
+        write(path, "foo\n\nbar\n")
+        self.assertEqual(grep_file(path, compile_pattern("^$", is_regex=True)), [(2, "")])
+        self.assertEqual(grep_file(path, compile_pattern(r"^\w+$", is_regex=True)), [(1, "foo"), (3, "bar")])
+
+        # once a match crosses lines the rest of the file is searched a line at a time,
+        # rather than rescanning the same span from every line
+        class Searches:
+            def __init__(self, compiled):
+                self.compiled, self.pattern, self.unbounded = compiled, compiled.pattern, 0
+
+            def search(self, data, pos=0, endpos=None):
+                self.unbounded += endpos is None
+                return self.compiled.search(data, pos, len(data) if endpos is None else endpos)
+
+        write(path, "".join(f"x {i}\n" for i in range(1000)) + "q x q\n")
+        pattern = Searches(compile_pattern("x[^q]*q", is_regex=True))
+        self.assertEqual(grep_file(path, pattern), [(1001, "q x q")])
+        self.assertEqual(pattern.unbounded, 1)
+
+        files = [f"f{i:03}.txt" for i in range(200)]
+        for i, name in enumerate(files):
+            write(os.path.join(self.root, name), f"line\nmatch {i}\n")
+        matches = grep_files(self.root, files, compile_pattern("match"), max_matches=150)
+        self.assertEqual(len(matches), 150)
+        # in the order of the files, though they're scanned in parallel
+        self.assertEqual(matches[:2], [("f000.txt", 2, "match 0"), ("f001.txt", 2, "match 1")])
+        self.assertEqual(matches[-1], ("f149.txt", 2, "match 149"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Unit tests for ModelIndex, which resolves the model names requests use to a provider's
+model id and info without scanning its models on every lookup.
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from llms.main import ModelIndex, OpenAiCompatible
+
+
+def create_provider(**kwargs):
+    return OpenAiCompatible(id="test", api="https://example.org/v1", api_key="key", **kwargs)
+
+
+class TestModelIndex(unittest.TestCase):
+    def test_resolves_ids_names_and_short_names(self):
+        provider = create_provider(
+            models={
+                "openai/gpt-5": {"id": "openai/gpt-5", "name": "GPT-5"},
+                "qwen/qwen3-coder": {"id": "qwen/qwen3-coder", "name": "Qwen3 Coder"},
+                "local-model": {"name": "Local"},
+            }
+        )
+        self.assertEqual(provider.provider_model("openai/gpt-5"), "openai/gpt-5")
+        self.assertEqual(provider.provider_model("OpenAI/GPT-5"), "openai/gpt-5")
+        self.assertEqual(provider.provider_model("gpt-5"), "openai/gpt-5")
+        self.assertEqual(provider.provider_model("Qwen3 Coder"), "qwen/qwen3-coder")
+        self.assertEqual(provider.provider_model("local-model"), "local-model")
+        self.assertEqual(provider.provider_model("local"), "local-model")
+        # a full model id from another provider falls back to its model name
+        self.assertEqual(provider.provider_model("azure/gpt-5"), "openai/gpt-5")
+        self.assertIsNone(provider.provider_model("gpt-4"))
+        self.assertIsNone(provider.provider_model("azure/gpt-4"))
+
+        self.assertEqual(provider.model_info("GPT-5")["name"], "GPT-5")
+        self.assertEqual(provider.model_info("local")["name"], "Local")
+        self.assertIsNone(provider.model_info("gpt-4"))
+
+    def test_earlier_names_take_precedence(self):
+        index = ModelIndex(
+            {"coder": "qwen/qwen3-coder"},
+            {
+                "qwen/qwen3-coder": {"id": "qwen/qwen3-coder", "name": "Qwen3 Coder"},
+                # named like another model's short name
+                "acme/coder-v2": {"id": "acme/coder-v2", "name": "gpt-5"},
+                "openai/gpt-5": {"id": "openai/gpt-5"},
+                "meta/coder": {"id": "meta/coder"},
+            },
+        )
+        # map_models ids before model ids and names, which come before short names
+        self.assertEqual(index.provider_model("coder"), "qwen/qwen3-coder")
+        self.assertEqual(index.provider_model("gpt-5"), "acme/coder-v2")
+        self.assertEqual(index.provider_model("meta/coder"), "meta/coder")
+
+    def test_reassigning_models_rebuilds_the_index(self):
+        provider = create_provider(models={"openai/gpt-5": {"id": "openai/gpt-5"}})
+        self.assertEqual(provider.provider_model("gpt-5"), "openai/gpt-5")
+        provider.models = {"openai/gpt-5-mini": {"id": "openai/gpt-5-mini"}}
+        self.assertIsNone(provider.provider_model("gpt-5"))
+        self.assertEqual(provider.provider_model("gpt-5-mini"), "openai/gpt-5-mini")
+        provider.map_models = {"mini": "openai/gpt-5-mini"}
+        self.assertEqual(provider.provider_model("mini"), "openai/gpt-5-mini")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Unit tests for ProviderAdmission, which queues provider requests until they fit within the
+concurrency, requests per minute and tokens per minute limits configured for the provider.
+"""
+
+import argparse
+import asyncio
+import importlib
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from llms.main import AppExtensions, ProviderAdmission, TokenBucket, g_chat_completion
+
+MESSAGES = [{"role": "user", "content": "Hi"}]
+
+
+class TestProviderAdmission(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.main = importlib.import_module("llms.main")
+        self.original_config = self.main.g_config
+        self.main.g_config = {"providers": {}}
+
+    def tearDown(self):
+        self.main.g_config = self.original_config
+
+    def configure(self, provider, **rate_limits):
+        self.main.g_config["providers"][provider] = {"rate_limits": rate_limits}
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(600)  # 10 a second
+        now = bucket.updated
+        self.assertEqual(bucket.wait(600, now), 0)
+        bucket.available -= 600
+        self.assertAlmostEqual(bucket.wait(5, now), 0.5)
+        self.assertAlmostEqual(bucket.wait(5, now + 0.5), 0)
+        # more than a minute's worth only waits for a full bucket
+        self.assertAlmostEqual(bucket.wait(10000, now + 0.5), 59.5)
+        self.assertEqual(bucket.wait(10000, now + 120), 0)
+
+    async def test_concurrency_and_priorities(self):
+        self.configure("p", concurrency=2)
+        admission = ProviderAdmission()
+        running = peak = 0
+
+        async def request():
+            nonlocal running, peak
+            async with admission.admit("p", "m", MESSAGES):
+                running += 1
+                peak = max(peak, running)
+                await asyncio.sleep(0.02)
+                running -= 1
+
+        await asyncio.gather(*[request() for _ in range(6)])
+        self.assertEqual(peak, 2)
+        self.assertEqual(admission.stats()[0]["admitted"], 6)
+
+        self.configure("p", concurrency=1)
+        order = []
+        release = asyncio.Event()
+
+        async def hold():
+            async with admission.admit("p", "m", MESSAGES):
+                await release.wait()
+
+        async def queued(name, context):
+            async with admission.admit("p", "m", MESSAGES, ProviderAdmission.priority(context)):
+                order.append(name)
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        waiting = [
+            asyncio.create_task(queued("agent", {"runId": "1"})),
+            asyncio.create_task(queued("chat", {})),
+            asyncio.create_task(queued("compaction", {"priority": "background"})),
+        ]
+        await asyncio.sleep(0.01)
+        self.assertEqual(admission.stats()[0]["queued"], 3)
+        release.set()
+        await asyncio.gather(holder, *waiting)
+        # interactive first, then background work in the order it arrived
+        self.assertEqual(order, ["chat", "agent", "compaction"])
+
+    async def test_rate_limits_and_queue_wait(self):
+        self.configure("p", rpm=600, models={"m": {"tpm": 100000}})
+        admission = ProviderAdmission()
+        async with admission.admit("p", "m", MESSAGES) as admitted:
+            self.assertEqual(admitted.waited, 0)
+        self.assertEqual([x["model"] for x in admission.stats()], [None, "m"])
+
+        # out of requests for now, the next waits for the bucket to refill
+        admission.scopes["p"].requests.available = 0
+        started = time.monotonic()
+        async with admission.admit("p", "m", MESSAGES) as admitted:
+            admitted.settle({"usage": {"prompt_tokens": 1000, "completion_tokens": 500}})
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+        self.assertGreaterEqual(admitted.waited, 0.09)
+        self.assertLess(admission.scopes[("p", "m")].tokens.available, 100000 - 1400)
+
+        # a cancelled request leaves the queue
+        admission.scopes["p"].requests.available = -10
+        task = asyncio.create_task(admission.admit("p", "m", MESSAGES).__aenter__())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        admission.pump()
+        self.assertEqual(admission.stats()[0]["queued"], 0)
+
+    async def test_chat_completion_reports_queue_wait(self):
+        class Provider:
+            def provider_model(self, model):
+                return model
+
+            def model_info(self, model):
+                return {}
+
+            def model_cost(self, model):
+                return None
+
+            async def chat(self, chat, context=None):
+                return {
+                    "choices": [{"message": {"role": "assistant", "content": "Hello"}}],
+                    "usage": {"prompt_tokens": 10, "completion_tokens": 2},
+                }
+
+        app = AppExtensions(argparse.Namespace(), {})
+        original_handlers = self.main.g_handlers
+        self.main.g_handlers = {"p": Provider()}
+        try:
+            self.configure("p", rpm=600)
+            response = await g_chat_completion({"model": "m", "messages": list(MESSAGES)})
+            self.assertEqual(response["metadata"]["queueWait"], 0)
+            app.admission.scopes["p"].requests.available = 0
+            response = await g_chat_completion({"model": "m", "messages": list(MESSAGES)})
+            self.assertGreaterEqual(response["metadata"]["queueWait"], 90)
+        finally:
+            self.main.g_handlers = original_handlers
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Unit tests for ProviderRouter, which orders the providers g_chat_completion tries by their
+observed latency and error rate and holds back failing ones behind a circuit breaker.
+"""
+
+import argparse
+import asyncio
+import importlib
+import os
+import sys
+import time
+import unittest
+
+import aiohttp
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from llms.main import (
+    DEFAULT_LIMITS,
+    AppExtensions,
+    HTTPError,
+    OpenAiCompatible,
+    ProviderRouter,
+    StreamCheckpointWriter,
+    g_chat_completion,
+    is_client_error,
+    is_transient_error,
+    retry_after_seconds,
+)
+
+
+class StubProvider:
+    def __init__(self, name, fail=0, error=None, first_token=None, respond=0):
+        self.name = name
+        self.fail = fail  # calls to fail before succeeding
+        self.error = error
+        self.first_token = first_token  # seconds before streaming a token, None to not stream
+        self.respond = respond  # seconds before the whole response
+        self.calls = 0
+        self.cancelled = 0
+
+    def provider_model(self, model):
+        return model
+
+    def model_info(self, model):
+        return {"id": model}
+
+    def model_cost(self, model):
+        return {"input": 0, "output": 0}
+
+    async def chat(self, chat, context=None):
+        self.calls += 1
+        if self.calls <= self.fail:
+            raise self.error or ConnectionError(f"{self.name} is down")
+        try:
+            if self.first_token is not None:
+                await asyncio.sleep(self.first_token)
+                writer = StreamCheckpointWriter(None, None, hedge=context.get("hedge"))
+                await writer.write({"role": "assistant", "content": self.name})
+            await asyncio.sleep(self.respond)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return {
+            "choices": [{"message": {"role": "assistant", "content": self.name}}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 20},
+        }
+
+
+class TestProviderRouter(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.app = AppExtensions(argparse.Namespace(), {})
+        self.app.limits = {**DEFAULT_LIMITS, "retry_backoff": 0}
+        # other tests may have rebound llms.main.g_handlers, look it up each time
+        self.main = importlib.import_module("llms.main")
+        self.original_handlers = self.main.g_handlers
+        self.main.g_handlers = {}
+        self.original_config = self.main.g_config
+        self.main.g_config = {}
+
+    def tearDown(self):
+        self.main.g_handlers = self.original_handlers
+        self.main.g_config = self.original_config
+
+    def test_orders_by_latency_and_errors_keeping_config_order_for_ties(self):
+        router = ProviderRouter()
+        providers = ["a", "b", "c"]
+        self.assertEqual(router.order("m", providers), providers)
+
+        now = time.time()
+        router.record_success("a", "m", now - 3.0, now - 2.0, None)  # 1s to first token
+        router.record_success("b", "m", now - 1.5, now - 0.9, None)  # 600ms, within 2x of a
+        self.assertEqual(router.order("m", providers), providers)
+
+        router.record_success("c", "m", now - 0.2, now - 0.1, None)  # 100ms
+        self.assertEqual(router.order("m", providers), ["c", "b", "a"])
+
+        # a route's error rate weighs on its latency
+        for _ in range(2):
+            router.record_failure("c", "m", HTTPError(500, "Internal Server Error", ""))
+        self.assertEqual(router.order("m", providers)[0], "c")
+        router.record_failure("c", "m", HTTPError(500, "Internal Server Error", ""))
+        # the third failure in a row opens the breaker, c is now only tried last
+        self.assertEqual(router.order("m", providers), ["b", "a", "c"])
+        self.assertEqual(router.stats()[2]["state"], "open")
+
+    def test_half_open_probe_closes_or_reopens_the_breaker(self):
+        router = ProviderRouter()
+        for _ in range(3):
+            router.record_failure("a", "m", HTTPError(500, "Internal Server Error", ""))
+        route = router.route("a", "m")
+        self.assertEqual((route["state"], route["cooldown"]), ("open", 30))
+
+        route["blockedUntil"] = time.time() - 1
+        router.started("a", "m")
+        self.assertEqual(route["state"], "half-open")
+        # other requests are held back while the probe is in flight
+        self.assertEqual(router.order("m", ["a", "b"]), ["b", "a"])
+        router.record_failure("a", "m", HTTPError(503, "Service Unavailable", ""))
+        self.assertEqual((route["state"], route["cooldown"]), ("open", 60))
+
+        route["blockedUntil"] = time.time() - 1
+        router.started("a", "m")
+        router.record_success("a", "m", time.time() - 0.1, None, None)
+        self.assertEqual((route["state"], route["failures"], route["blockedUntil"]), ("closed", 0, 0.0))
+
+    def test_retry_after(self):
+        self.assertEqual(retry_after_seconds({"retry-after": "12"}), 12.0)
+        self.assertAlmostEqual(retry_after_seconds({"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}), 0.0)
+        self.assertIsNone(retry_after_seconds({}))
+
+        router = ProviderRouter()
+        router.record_failure("a", "m", HTTPError(429, "Too Many Requests", "", {"Retry-After": "20"}))
+        self.assertEqual(router.route("a", "m")["state"], "closed")
+        self.assertEqual(router.order("m", ["a", "b"]), ["b", "a"])
+        self.assertAlmostEqual(router.stats()[0]["retryIn"], 20, delta=1)
+        # once every provider is held back, a retry waits for the first to be available again
+        router.record_failure("b", "m", HTTPError(503, "Service Unavailable", "", {"Retry-After": "5"}))
+        self.assertAlmostEqual(router.retry_delay("m", ["a", "b"], 0), 5, delta=1)
+
+    def test_client_errors_dont_count_against_a_provider(self):
+        self.assertTrue(is_transient_error(HTTPError(502, "Bad Gateway", "")))
+        self.assertTrue(is_transient_error(HTTPError(408, "Request Timeout", "")))
+        self.assertTrue(is_transient_error(asyncio.TimeoutError()))
+        self.assertTrue(is_transient_error(ConnectionResetError()))
+        self.assertFalse(is_transient_error(HTTPError(401, "Unauthorized", "")))
+        self.assertFalse(is_transient_error(ValueError("bad arguments")))
+
+        router = ProviderRouter()
+        for _ in range(3):
+            router.record_failure("a", "m", HTTPError(400, "Bad Request", "", message="context_length_exceeded"))
+        route = router.route("a", "m")
+        self.assertEqual(
+            (route["state"], route["errors"], route["clientErrors"], route["errorRate"]), ("closed", 0, 3, 0)
+        )
+        self.assertEqual(router.retry_delay("m", ["a"], 0), DEFAULT_LIMITS["retry_backoff"])
+
+        # a probe that's turned down still shows the provider is answering
+        for _ in range(3):
+            router.record_failure("a", "m", HTTPError(500, "Internal Server Error", ""))
+        route["blockedUntil"] = time.time() - 1
+        router.started("a", "m")
+        router.record_failure("a", "m", HTTPError(401, "Unauthorized", ""))
+        self.assertEqual((route["state"], route["blockedUntil"]), ("closed", 0.0))
+
+    def test_mid_stream_failures_count_against_a_provider(self):
+        provider = OpenAiCompatible(id="test", api="https://example.com")
+        transient = [
+            {"type": "overloaded_error", "message": "Overloaded"},
+            {"code": 502, "message": "Provider returned error"},
+            {"code": "503", "message": "upstream unavailable"},
+            {"code": 503, "status": "UNAVAILABLE", "message": "The model is overloaded."},
+            {"type": "rate_limit_error", "message": "slow down"},
+        ]
+        for error in transient:
+            ex = provider.stream_error(error)
+            self.assertIsInstance(ex, HTTPError)
+            self.assertEqual(str(ex), error["message"])
+            self.assertTrue(is_transient_error(ex), error)
+        self.assertTrue(is_client_error(provider.stream_error({"type": "invalid_request_error", "message": "bad"})))
+        self.assertFalse(is_transient_error(provider.stream_error({"message": "something went wrong"})))
+        self.assertFalse(is_transient_error(provider.stream_error("boom")))
+        self.assertTrue(is_transient_error(aiohttp.ClientPayloadError("Response payload is not completed")))
+
+        router = ProviderRouter()
+        for _ in range(3):
+            router.record_failure("a", "m", provider.stream_error(transient[0]))
+        self.assertEqual(router.route("a", "m")["state"], "open")
+
+    async def test_chat_completion_fails_fast_on_client_errors(self):
+        bad_request = HTTPError(400, "Bad Request", "", message="context_length_exceeded")
+        a = StubProvider("a", fail=100, error=bad_request)
+        b = StubProvider("b", fail=100, error=bad_request)
+        self.main.g_handlers.update({"a": a, "b": b})
+        self.app.limits["retry_backoff"] = 10
+
+        started = time.time()
+        with self.assertRaises(HTTPError):
+            await g_chat_completion({"model": "m", "messages": [{"role": "user", "content": "Hi"}]})
+        # both were tried once, without backing off for another round
+        self.assertLess(time.time() - started, 1)
+        self.assertEqual((a.calls, b.calls), (1, 1))
+        self.assertEqual(self.app.router.route("a", "m")["state"], "closed")
+
+    async def test_chat_completion_skips_a_failing_provider(self):
+        down = StubProvider("down", fail=100)
+        up = StubProvider("up")
+        self.main.g_handlers.update({"down": down, "up": up})
+
+        for _ in range(5):
+            response = await g_chat_completion({"model": "m", "messages": [{"role": "user", "content": "Hi"}]})
+            self.assertEqual(response["choices"][0]["message"]["content"], "up")
+        # after circuit_failures the breaker opened and requests went straight to "up"
+        self.assertEqual(down.calls, 3)
+        routes = {route["provider"]: route for route in self.app.router.stats()}
+        self.assertEqual(routes["down"]["state"], "open")
+        self.assertEqual((routes["up"]["calls"], routes["up"]["errors"]), (5, 0))
+
+        # a provider failing every round is retried after backing off
+        flaky = StubProvider("flaky", fail=2)
+        self.main.g_handlers = {"flaky": flaky}
+        response = await g_chat_completion({"model": "m", "messages": [{"role": "user", "content": "Hi"}]})
+        self.assertEqual(response["choices"][0]["message"]["content"], "flaky")
+        self.assertEqual(flaky.calls, 3)
+
+    async def test_hedged_requests(self):
+        chat = {"model": "m", "messages": [{"role": "user", "content": "Hi"}]}
+        slow = StubProvider("slow", respond=0.3)
+        fast = StubProvider("fast", respond=0.01)
+        self.main.g_handlers = {"slow": slow, "fast": fast}
+
+        # not hedged unless enabled
+        self.main.g_config = {"hedging": {"enabled": False, "delay": 0.05}}
+        self.assertEqual((await g_chat_completion(dict(chat)))["choices"][0]["message"]["content"], "slow")
+        self.assertEqual(fast.calls, 0)
+
+        # the hedge answered first and the slow attempt was cancelled
+        self.main.g_config = {"hedging": {"models": ["m"], "delay": 0.05}}
+        self.assertEqual((await g_chat_completion(dict(chat)))["choices"][0]["message"]["content"], "fast")
+        self.assertEqual((slow.calls, slow.cancelled, fast.calls), (2, 1, 1))
+        routes = {route["provider"]: route for route in self.app.router.stats()}
+        self.assertEqual((routes["fast"]["hedgeWins"], routes["slow"]["hedgeLosses"]), (1, 1))
+
+        # the first attempt to stream a token wins, even if the other would finish sooner
+        streaming = StubProvider("streaming", first_token=0.1, respond=0.2)
+        fast = StubProvider("fast", respond=0.15)
+        self.main.g_handlers = {"streaming": streaming, "fast": fast}
+        self.assertEqual((await g_chat_completion(dict(chat)))["choices"][0]["message"]["content"], "streaming")
+        self.assertEqual((fast.calls, fast.cancelled), (1, 1))
+        self.assertEqual(self.app.router.route("streaming", "m")["hedgeWins"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
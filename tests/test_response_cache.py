@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the response cache that answers deterministic chat completions (temperature 0
+or a fixed seed) from memory or its SQLite database instead of sending them again.
+"""
+
+import argparse
+import importlib
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from llms.main import AppExtensions, g_chat_completion
+from llms.responsecache import ResponseCache, is_deterministic, request_key
+
+
+def completion(content):
+    return {
+        "choices": [{"message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 2},
+    }
+
+
+class CountingProvider:
+    stream = False
+
+    def __init__(self):
+        self.calls = 0
+
+    def provider_model(self, model):
+        return f"vendor/{model}"
+
+    def model_info(self, model):
+        return {}
+
+    def model_cost(self, model):
+        return None
+
+    async def chat(self, chat, context=None):
+        self.calls += 1
+        return completion(f"answer {self.calls}")
+
+
+class TestResponseCache(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "cache", "responses.sqlite")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_request_key_ignores_metadata_and_key_order(self):
+        chat = {
+            "model": "m",
+            "temperature": 0,
+            "messages": [{"role": "user", "content": "Hi", "timestamp": 1}],
+            "metadata": {"threadId": "1"},
+        }
+        same = {
+            "messages": [{"content": "Hi", "role": "user", "timestamp": 2}],
+            "temperature": 0,
+            "model": "m",
+            "stream": True,
+        }
+        self.assertEqual(request_key("p", chat), request_key("p", same))
+        self.assertNotEqual(request_key("p", chat), request_key("other", chat))
+        self.assertNotEqual(request_key("p", chat), request_key("p", {**chat, "tools": [{"type": "function"}]}))
+        self.assertTrue(is_deterministic({"temperature": 0}))
+        self.assertTrue(is_deterministic({"temperature": 0.7, "seed": 42}))
+        self.assertFalse(is_deterministic({"temperature": 0.7}))
+
+    def test_memory_and_disk_tiers(self):
+        cache = ResponseCache(self.path, max_entries=1)
+        cache.put("a", completion("A"))
+        cache.put("b", completion("B"))
+        # "a" fell out of memory but is still on disk
+        self.assertEqual(list(cache.memory), ["b"])
+        self.assertEqual(cache.get("a")["choices"][0]["message"]["content"], "A")
+        self.assertEqual(cache.get("a")["choices"][0]["message"]["content"], "A")
+        self.assertIsNone(cache.get("c"))
+        stats = cache.stats()
+        self.assertEqual((stats["diskHits"], stats["memoryHits"], stats["misses"]), (1, 1, 1))
+        # hits are copies
+        cache.get("a")["choices"].clear()
+        self.assertEqual(len(cache.get("a")["choices"]), 1)
+        cache.close()
+
+        # persisted between instances
+        cache = ResponseCache(self.path)
+        self.assertEqual(cache.get("b")["choices"][0]["message"]["content"], "B")
+        self.assertEqual(cache.stats()["diskEntries"], 2)
+        cache.close()
+
+    def test_ttl_and_size_limits(self):
+        cache = ResponseCache(self.path, ttl=60)
+        cache.put("old", completion("old"))
+        cache.memory["old"] = (time.time() - 1, cache.memory["old"][1])
+        cache.connect().execute("UPDATE responses SET expires = ?", (time.time() - 1,))
+        self.assertIsNone(cache.get("old"))
+        self.assertEqual(cache.stats()["diskEntries"], 0)
+
+        # the least recently used are evicted once the database outgrows max_mb
+        size = len(str(completion("x" * 1000)))
+        cache.configure({"max_mb": size * 2.5 / 1024 / 1024})
+        for key in ["a", "b", "c"]:
+            cache.put(key, completion(key * 1000))
+            time.sleep(0.01)
+        cache.memory.clear()
+        self.assertIsNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("c"))
+        cache.close()
+
+    async def test_chat_completion_cache(self):
+        main = importlib.import_module("llms.main")
+        app = AppExtensions(argparse.Namespace(), {})
+        app.response_cache = ResponseCache(self.path)
+        provider = CountingProvider()
+        original_handlers, original_config = main.g_handlers, main.g_config
+        main.g_handlers = {"p": provider}
+        main.g_config = {"response_cache": {"enabled": True}}
+
+        def chat(**kwargs):
+            return {"model": "m", "messages": [{"role": "user", "content": "Hi"}], **kwargs}
+
+        try:
+            first = await g_chat_completion(chat(temperature=0))
+            self.assertNotIn("cached", first["metadata"])
+            second = await g_chat_completion(chat(temperature=0))
+            self.assertTrue(second["metadata"]["cached"])
+            self.assertEqual(second["choices"][0]["message"]["content"], "answer 1")
+            self.assertEqual(provider.calls, 1)
+
+            # bypassed per request, and never used for requests that aren't deterministic
+            await g_chat_completion(chat(temperature=0, metadata={"cache": False}))
+            await g_chat_completion(chat(temperature=0.7))
+            await g_chat_completion(chat(temperature=0.7))
+            self.assertEqual(provider.calls, 4)
+
+            # or asked for by a request while it's disabled
+            main.g_config = {"response_cache": {"enabled": False}}
+            await g_chat_completion(chat(seed=1))
+            await g_chat_completion(chat(seed=1, metadata={"cache": True}))
+            response = await g_chat_completion(chat(seed=1, metadata={"cache": True}))
+            self.assertTrue(response["metadata"]["cached"])
+            self.assertEqual(provider.calls, 6)
+        finally:
+            main.g_handlers, main.g_config = original_handlers, original_config
+            app.response_cache.close()
+
+    async def test_cache_hits_record_no_cost(self):
+        main = importlib.import_module("llms.main")
+        app = AppExtensions(argparse.Namespace(), {})
+        app.response_cache = ResponseCache(self.path)
+        provider = CountingProvider()
+        original_chat = provider.chat
+
+        async def chat_with_cost(chat, context=None):
+            return {**await original_chat(chat, context), "cost": 0.25}
+
+        provider.chat = chat_with_cost
+        original_handlers, original_config = main.g_handlers, main.g_config
+        main.g_handlers = {"p": provider}
+        main.g_config = {"response_cache": {"enabled": True}}
+        chat = {"model": "m", "temperature": 0, "messages": [{"role": "user", "content": "Hi"}]}
+        try:
+            first = await g_chat_completion(dict(chat))
+            self.assertEqual(first["cost"], 0.25)
+            self.assertEqual(first["usage"]["completion_tokens"], 2)
+
+            second = await g_chat_completion(dict(chat))
+            self.assertTrue(second["metadata"]["cached"])
+            self.assertNotIn("cost", second)
+            self.assertEqual((second["usage"]["prompt_tokens"], second["usage"]["completion_tokens"]), (0, 0))
+            # what it cost the first time is kept apart from the spend
+            self.assertEqual(second["metadata"]["cachedUsage"]["cost"], 0.25)
+            self.assertEqual(second["metadata"]["cachedUsage"]["usage"]["completion_tokens"], 2)
+        finally:
+            main.g_handlers, main.g_config = original_handlers, original_config
+            app.response_cache.close()
+
+    async def test_closed_by_the_app_cleanup_handlers(self):
+        app = AppExtensions(argparse.Namespace(), {})
+        app.response_cache = ResponseCache(self.path)
+        app.response_cache.put("a", completion("A"))
+        self.assertTrue(os.path.exists(self.path + "-wal"))
+        for handler in reversed(app.cleanup_handlers):
+            await handler()
+        self.assertIsNone(app.response_cache.db)
+        # the WAL was checkpointed into the database when its connection closed
+        self.assertFalse(os.path.exists(self.path + "-wal"))
+        cache = ResponseCache(self.path)
+        self.assertEqual(cache.get("a")["choices"][0]["message"]["content"], "A")
+        cache.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
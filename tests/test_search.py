@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the FTS5 indexes behind `search` on threads, requests and media, and the
+triggers that keep them in step with writes.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from llms.db import fts_query, fts_snippet
+from llms.extensions.app.db import AppDB
+from llms.extensions.gallery.db import GalleryDB
+
+
+class MockCtx:
+    debug = False
+    aspect_ratios = {"1:1": "1024x1024", "16:9": "1344x768"}
+
+    def cache_message_inline_data(self, msg, context=None):
+        pass
+
+    def dbg(self, msg):
+        pass
+
+    def err(self, msg, e=None):
+        pass
+
+
+class TestFtsHelpers(unittest.TestCase):
+    def test_query_quotes_words_and_prefixes_the_last(self):
+        self.assertEqual(fts_query('tool "calls" OR near(x'), '"tool" "calls" "OR" "near" "x"*')
+        self.assertIsNone(fts_query(" -* "))
+
+    def test_snippet_is_escaped_around_its_marks(self):
+        self.assertEqual(fts_snippet("<b>\x02tool\x03</b>"), "&lt;b&gt;<mark>tool</mark>&lt;/b&gt;")
+
+
+class TestThreadSearch(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.db = AppDB(MockCtx(), os.path.join(self.tmp, "app.sqlite"), normalized_messages=True)
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def search(self, text, user="alice"):
+        return self.db.query_threads({"search": text, "fields": "id,title"}, user=user)
+
+    async def test_titles_and_message_text_are_ranked_with_snippets(self):
+        in_message = await self.db.create_thread_async({"title": "Refactor", "messages": [
+            {"role": "user", "content": "where is the sqlite writer?", "timestamp": 1},
+            {"role": "assistant", "content": [{"type": "text", "text": "The <writer> thread commits batches"}], "timestamp": 2},
+        ]}, user="alice")
+        in_title = await self.db.create_thread_async({"title": "Writer thread design", "messages": []}, user="alice")
+        await self.db.create_thread_async({"title": "writer", "messages": []}, user="bob")
+
+        rows = self.search("writer thr")
+        self.assertEqual([row["id"] for row in rows], [in_title, in_message])
+        self.assertEqual(rows[0]["matchSequence"], 0)
+        self.assertEqual(rows[1]["matchSequence"], 2)
+        self.assertIn("<mark>thread</mark>", rows[1]["snippet"])
+        self.assertIn("&lt;", rows[1]["snippet"])
+        self.assertEqual(self.search("anything at all", user="carol"), [])
+
+    async def test_index_follows_edits_truncation_and_deletes(self):
+        thread_id = await self.db.create_thread_async({"title": "t", "messages": [
+            {"role": "user", "content": "alpha", "timestamp": 1},
+        ]}, user="alice")
+        await self.db.update_thread_async(thread_id, {"messages": [
+            {"role": "user", "content": "beta", "timestamp": 1},
+        ]}, user="alice")
+        self.assertEqual(self.search("alpha"), [])
+        self.assertEqual(len(self.search("beta")), 1)
+
+        await self.db.update_thread_async(thread_id, {"messages": [], "truncate": True, "title": "renamed"}, user="alice")
+        self.assertEqual(self.search("beta"), [])
+        self.assertEqual(len(self.search("renamed")), 1)
+
+        await self.db.delete_thread_async(thread_id, user="alice")
+        self.assertEqual(self.search("renamed"), [])
+        self.assertEqual(self.db.db.scalar("SELECT count(*) FROM thread_fts"), 0)
+
+    async def test_requests_are_searched_by_title_and_index_can_be_rebuilt(self):
+        await self.db.create_request_async({"title": "Summarize the changelog"}, user="alice")
+        await self.db.create_request_async({"title": "Plan a trip"}, user="alice")
+        self.db.db.run(lambda conn: conn.execute("DELETE FROM request_fts"))
+        self.assertTrue(self.db.rebuild_search_index())
+        rows = self.db.query_requests({"search": "changelog"}, user="alice")
+        self.assertEqual([row["title"] for row in rows], ["Summarize the changelog"])
+
+
+class TestMediaSearch(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.db = GalleryDB(MockCtx(), os.path.join(self.tmp, "gallery.sqlite"))
+
+    def tearDown(self):
+        self.db.db.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    async def test_prompts_and_captions_are_searched(self):
+        for name, prompt, caption in [
+            ("a.png", "a red fox in the snow", None),
+            ("b.png", "city at night", "neon lights reflected on a red car"),
+            ("c.png", "mountain lake", None),
+        ]:
+            self.db.db.run(lambda conn, name=name, prompt=prompt, caption=caption: conn.execute(
+                "INSERT INTO media (name, type, prompt, caption, url, user) VALUES (?, 'image', ?, ?, ?, 'alice')",
+                (name, prompt, caption, f"/~cache/{name}"),
+            ))
+        rows = self.db.query_media({"search": "red", "type": "image"}, user="alice")
+        self.assertEqual(sorted(row["name"] for row in rows), ["a.png", "b.png"])
+        self.assertTrue(all("<mark>red</mark>" in row["snippet"] for row in rows))
+
+        await self.db.update_media_async(rows[0]["id"], {"prompt": "blue", "caption": None}, user="alice")
+        self.assertEqual(len(self.db.query_media({"search": "red"}, user="alice")), 1)
+        self.assertEqual(self.db.query_media({"search": "red"}, user="bob"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
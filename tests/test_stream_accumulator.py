@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Unit tests for StreamAccumulator, which builds a streaming assistant message in
+linear time for the OpenAI-compatible, Anthropic and Google stream handlers.
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from llms.main import StreamAccumulator, StreamCheckpointWriter
+
+
+class CountingThreadsApi:
+    def __init__(self):
+        self.checkpoints = []
+
+    async def checkpoint_stream_async(self, id, message, user=None):
+        self.checkpoints.append(message)
+        return 1
+
+
+class TestStreamAccumulator(unittest.TestCase):
+    """Test incremental accumulation of streamed deltas."""
+
+    def test_content_and_reasoning_are_joined(self):
+        acc = StreamAccumulator(model="m")
+        for part in ["Hel", "lo", " world"]:
+            acc.add_content(part)
+        acc.add_reasoning("think", "reasoning")
+        acc.add_reasoning("ing", "reasoning")
+        self.assertEqual(
+            acc.message(),
+            {"role": "assistant", "content": "Hello world", "model": "m", "reasoning": "thinking"},
+        )
+        self.assertEqual(len(acc), len("Hello world") + len("thinking"))
+
+    def test_default_reasoning_field(self):
+        acc = StreamAccumulator(reasoning_field="thinking")
+        acc.add_reasoning("hmm")
+        self.assertEqual(acc.message(include_model=False), {"role": "assistant", "content": "", "thinking": "hmm"})
+
+    def test_reads_in_between_deltas_keep_accumulating(self):
+        acc = StreamAccumulator()
+        acc.add_content("a")
+        acc.add_content("b")
+        self.assertEqual(acc.content, "ab")
+        acc.add_content("c")
+        self.assertEqual(acc.content, "abc")
+        self.assertEqual(acc.content_parts, ["abc"])
+
+    def test_openai_tool_call_deltas_are_merged_in_index_order(self):
+        acc = StreamAccumulator()
+        acc.add_tool_call_delta({"index": 1, "id": "call_b", "function": {"name": "two", "arguments": '{"x"'}})
+        acc.add_tool_call_delta({"index": 0, "id": "call_a", "type": "function", "function": {"name": "one"}})
+        acc.add_tool_call_delta({"index": 1, "function": {"arguments": ": 1}"}})
+        acc.add_tool_call_delta({"index": 0, "function": {"arguments": "{}"}})
+        self.assertEqual(
+            acc.message(include_model=False)["tool_calls"],
+            [
+                {"id": "call_a", "type": "function", "function": {"name": "one", "arguments": "{}"}},
+                {"id": "call_b", "type": "function", "function": {"name": "two", "arguments": '{"x": 1}'}},
+            ],
+        )
+        self.assertEqual(len(acc), len("one{}two") + len('{"x": 1}'))
+
+    def test_tool_arguments_without_a_start_block(self):
+        acc = StreamAccumulator()
+        acc.add_tool_arguments(2, '{"a":')
+        acc.add_tool_arguments(2, "1}")
+        self.assertEqual(acc.tool_calls_list()[0]["function"], {"name": "", "arguments": '{"a":1}'})
+
+    def test_complete_tool_call_keeps_extra_fields(self):
+        acc = StreamAccumulator()
+        acc.add_tool_call(
+            0,
+            {
+                "id": "call_0",
+                "type": "function",
+                "function": {"name": "fn", "arguments": "{}"},
+                "thoughtSignature": "sig",
+            },
+        )
+        self.assertEqual(acc.tool_calls_list()[0]["thoughtSignature"], "sig")
+        self.assertEqual(len(acc), len("fn{}"))
+
+    def test_message_is_a_fresh_copy(self):
+        acc = StreamAccumulator()
+        acc.add_tool_call_delta({"index": 0, "function": {"name": "fn", "arguments": "{}"}})
+        message = acc.message()
+        message["tool_calls"][0]["function"]["arguments"] = "changed"
+        self.assertEqual(acc.tool_calls_list()[0]["function"]["arguments"], "{}")
+
+    def test_length_matches_checkpoint_payload_len(self):
+        acc = StreamAccumulator()
+        acc.add_content("answer")
+        acc.add_reasoning("why", "reasoning_content")
+        acc.add_tool_call_delta({"index": 0, "function": {"name": "fn", "arguments": '{"q": 1}'}})
+        self.assertEqual(StreamCheckpointWriter.payload_len(acc), StreamCheckpointWriter.payload_len(acc.message()))
+
+
+class TestStreamAccumulatorCheckpoints(unittest.IsolatedAsyncioTestCase):
+    """Test that the checkpoint writer only materializes the message when it writes."""
+
+    async def test_message_is_built_only_when_a_checkpoint_is_due(self):
+        api = CountingThreadsApi()
+        writer = StreamCheckpointWriter(api, "t1", interval=3600)
+        acc = StreamAccumulator(model="m")
+        built = []
+        message = acc.message
+
+        def counting_message(*args, **kwargs):
+            built.append(1)
+            return message(*args, **kwargs)
+
+        acc.message = counting_message
+        for i in range(1000):
+            acc.add_content(f"{i} ")
+            await writer.write(acc)
+        # the first chunk is due immediately, the rest fall inside the interval
+        self.assertEqual(len(built), 1)
+        await writer.write(acc, final=True)
+        self.assertEqual(len(built), 2)
+        self.assertEqual(api.checkpoints[-1]["content"], "".join(f"{i} " for i in range(1000)))
+
+    async def test_flush_writes_the_latest_state(self):
+        api = CountingThreadsApi()
+        writer = StreamCheckpointWriter(api, "t1", interval=3600)
+        acc = StreamAccumulator()
+        acc.add_content("a")
+        await writer.write(acc)
+        acc.add_content("b")
+        await writer.write(acc)
+        self.assertTrue(await writer.flush())
+        self.assertEqual(api.checkpoints[-1]["content"], "ab")
+
+    async def test_empty_accumulator_is_never_written(self):
+        api = CountingThreadsApi()
+        writer = StreamCheckpointWriter(api, "t1")
+        self.assertFalse(await writer.write(StreamAccumulator(), final=True))
+        self.assertEqual(api.checkpoints, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Unit tests for delta stream checkpoints: after the first checkpoint of a stream only
+the text streamed since the previous one is written, as an append-only `stream_chunk`
+row that readers replay onto the stored `streamingMessage`.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from llms.extensions.app.db import AppDB
+from llms.main import StreamAccumulator, StreamCheckpointWriter, ThreadApi, apply_stream_delta
+
+
+class AppendingThreadsApi:
+    """Records full checkpoints and appended deltas, and rebuilds the message from them."""
+
+    def __init__(self):
+        self.checkpoints = []
+        self.appends = []
+
+    async def checkpoint_stream_async(self, id, message, user=None):
+        self.checkpoints.append(message)
+        self.appends = []
+        return 1
+
+    async def append_stream_async(self, id, stream_id, offset, delta, user=None):
+        self.appends.append((stream_id, offset, delta))
+        return 1
+
+    def message(self):
+        message = dict(self.checkpoints[-1])
+        for stream_id, offset, delta in self.appends:
+            assert stream_id == message["streamId"] and offset == message["streamOffset"]
+            message = apply_stream_delta(message, delta)
+            message["streamOffset"] = offset + StreamCheckpointWriter.payload_len(delta)
+        return message
+
+
+class MockCtx:
+    def __init__(self):
+        self.debug = False
+        self.errors = []
+
+    def cache_message_inline_data(self, msg, context=None):
+        pass
+
+    def dbg(self, msg):
+        pass
+
+    def log(self, msg):
+        pass
+
+    def err(self, msg, e=None):
+        self.errors.append(msg)
+
+
+class TestStreamDelta(unittest.TestCase):
+    def test_text_fields_yield_their_suffix(self):
+        marks = StreamCheckpointWriter.stream_marks({"content": "Hel", "reasoning_content": "a"})
+        delta = StreamCheckpointWriter.delta({"content": "Hello", "reasoning_content": "ab"}, marks)
+        self.assertEqual(delta, {"content": "lo", "reasoning_content": "b"})
+
+    def test_tool_calls_are_extended_or_appended_by_position(self):
+        before = {"content": "", "tool_calls": [{"id": "a", "function": {"name": "f", "arguments": '{"x"'}}]}
+        after = {
+            "content": "",
+            "tool_calls": [
+                {"id": "a", "function": {"name": "f", "arguments": '{"x": 1}'}},
+                {"id": "b", "function": {"name": "g", "arguments": "{}"}, "thoughtSignature": "s"},
+            ],
+        }
+        delta = StreamCheckpointWriter.delta(after, StreamCheckpointWriter.stream_marks(before))
+        self.assertEqual(
+            delta["tool_calls"],
+            [
+                {"index": 0, "function": {"arguments": ": 1}"}},
+                {"index": 1, "id": "b", "function": {"name": "g", "arguments": "{}"}, "thoughtSignature": "s"},
+            ],
+        )
+        self.assertEqual(apply_stream_delta(before, delta), after)
+
+    def test_changes_that_are_not_appends_have_no_delta(self):
+        marks = StreamCheckpointWriter.stream_marks({"content": "abc", "reasoning": "x"})
+        self.assertIsNone(StreamCheckpointWriter.delta({"content": "ab", "reasoning": "x"}, marks))
+        self.assertIsNone(StreamCheckpointWriter.delta({"content": "abc", "thinking": "x"}, marks))
+        marks = StreamCheckpointWriter.stream_marks({"content": "", "tool_calls": [{"id": "a", "function": {}}]})
+        self.assertIsNone(StreamCheckpointWriter.delta({"content": "", "tool_calls": [{"id": "b", "function": {}}]}, marks))
+
+
+class TestDeltaCheckpoints(unittest.IsolatedAsyncioTestCase):
+    async def test_only_the_first_checkpoint_writes_the_whole_message(self):
+        api = AppendingThreadsApi()
+        writer = StreamCheckpointWriter(api, "t1", interval=0)
+        acc = StreamAccumulator(model="m")
+        for i in range(10):
+            acc.add_content(f"{i} ")
+            await writer.write(acc)
+        self.assertEqual(len(api.checkpoints), 1)
+        self.assertEqual(api.checkpoints[0]["content"], "0 ")
+        self.assertEqual(len(api.appends), 9)
+        self.assertEqual(api.appends[-1][2], {"content": "9 "})
+        self.assertEqual(api.message()["content"], acc.content)
+
+    async def test_threads_api_without_appends_gets_whole_checkpoints(self):
+        class CheckpointingThreadsApi(ThreadApi):
+            def __init__(self):
+                self.checkpoints = []
+
+            async def checkpoint_stream_async(self, id, message, user=None):
+                self.checkpoints.append(message)
+                return 1
+
+        api = CheckpointingThreadsApi()
+        writer = StreamCheckpointWriter(api, "t1", interval=0)
+        acc = StreamAccumulator(model="m")
+        for i in range(3):
+            acc.add_content(f"{i} ")
+            await writer.write(acc)
+        self.assertEqual([c["content"] for c in api.checkpoints], ["0 ", "0 1 ", "0 1 2 "])
+
+    async def test_unchanged_message_writes_nothing(self):
+        api = AppendingThreadsApi()
+        writer = StreamCheckpointWriter(api, "t1", interval=0)
+        message = {"role": "assistant", "content": "same"}
+        await writer.write(message)
+        self.assertTrue(await writer.write(message, final=True))
+        self.assertEqual((len(api.checkpoints), len(api.appends)), (1, 0))
+
+    async def test_compacts_into_a_whole_checkpoint(self):
+        api = AppendingThreadsApi()
+        writer = StreamCheckpointWriter(api, "t1", interval=0, compact_every=3)
+        acc = StreamAccumulator()
+        for i in range(8):
+            acc.add_content(str(i))
+            await writer.write(acc)
+        # whole, 3 appends, whole, 3 appends
+        self.assertEqual([c["content"] for c in api.checkpoints], ["0", "01234"])
+        self.assertEqual(api.checkpoints[-1]["streamOffset"], 5)
+        self.assertEqual(api.message()["content"], "01234567")
+
+    async def test_rewrites_the_whole_message_when_a_field_is_replaced(self):
+        api = AppendingThreadsApi()
+        writer = StreamCheckpointWriter(api, "t1", interval=0)
+        await writer.write({"role": "assistant", "content": "draft"})
+        await writer.write({"role": "assistant", "content": "final"})
+        self.assertEqual([c["content"] for c in api.checkpoints], ["draft", "final"])
+
+
+class TestStreamChunkTable(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.db = AppDB(MockCtx(), os.path.join(self.tmp, "app.sqlite"))
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    async def test_chunks_are_read_from_an_offset_and_compacted_with_streaming_message(self):
+        thread_id = await self.db.create_thread_async({"title": "t", "messages": []})
+        head = {"role": "assistant", "content": "a", "streamId": "s1", "streamOffset": 1}
+        await self.db.update_thread_async(thread_id, {"streamingMessage": head})
+        await self.db.append_stream_chunk_async(thread_id, "s1", 1, {"content": "b"})
+        await self.db.append_stream_chunk_async(thread_id, "s1", 2, {"content": "c"})
+        await self.db.append_stream_chunk_async(thread_id, "other", 0, {"content": "x"})
+
+        chunks = self.db.get_stream_chunks(thread_id, "s1", 2)
+        self.assertEqual([(c["offset"], c["delta"]) for c in chunks], [(2, {"content": "c"})])
+        self.assertEqual(len(self.db.get_stream_chunks(thread_id, "s1")), 2)
+
+        # committing the turn clears the in-flight message and its chunks
+        await self.db.update_thread_async(thread_id, {"streamingMessage": None})
+        await self.db.update_thread_async(thread_id, {"status": None})  # queued behind the delete
+        self.assertEqual(self.db.get_stream_chunks(thread_id, "s1"), [])
+        self.assertEqual(self.db.get_stream_chunks(thread_id, "other"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the in-process thread event bus that SSE watchers subscribe to.
+"""
+
+import asyncio
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from llms.extensions.app import ThreadEvents, format_sse
+
+
+def parse(payload):
+    fields = dict(line.split(": ", 1) for line in payload.decode().strip().split("\n"))
+    return fields["event"], json.loads(fields["data"])
+
+
+class TestThreadEventChannel(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.bus = ThreadEvents()
+
+    async def test_events_are_serialized_once_for_every_subscriber(self):
+        channel = self.bus.channel(1)
+        a, b = channel.subscribe(), channel.subscribe()
+        payload = self.bus.publish(1, "status-changed", {"status": "Thinking"})
+        self.assertIs(a.drain()[0][1], payload)
+        self.assertIs(b.drain()[0][1], payload)
+        self.assertEqual(parse(payload), ("status-changed", {"status": "Thinking"}))
+        self.assertIn(f"id: {channel.last_event_id}".encode(), payload)
+
+    async def test_unwatched_threads_publish_nothing(self):
+        self.assertIsNone(self.bus.publish(2, "status-changed", {"status": "x"}))
+        self.assertIsNone(self.bus.get(2))
+
+    async def test_resume_from_last_event_id(self):
+        channel = self.bus.channel(1)
+        self.bus.publish(1, "status-changed", {"n": 1})
+        last_event_id = channel.last_event_id
+        self.bus.publish(1, "status-changed", {"n": 2})
+        self.bus.publish(1, "status-changed", {"n": 3})
+        self.assertEqual([parse(p)[1]["n"] for _, p in channel.since(last_event_id)], [2, 3])
+        self.assertEqual(channel.since(channel.last_event_id), [])
+        # ids from another process, or from before what is retained, can't resume
+        self.assertIsNone(channel.since("other-1"))
+        self.assertIsNone(channel.since(f"{channel.epoch}-99"))
+
+    async def test_evicted_events_cannot_be_resumed(self):
+        channel = self.bus.channel(1)
+        channel.events = channel.events.__class__(maxlen=2)
+        self.bus.publish(1, "status-changed", {"n": 1})
+        first = channel.last_event_id
+        for n in range(2, 5):
+            self.bus.publish(1, "status-changed", {"n": n})
+        self.assertIsNone(channel.since(first))
+
+    async def test_subscriber_that_falls_behind_is_marked_for_a_snapshot(self):
+        channel = self.bus.channel(1)
+        channel.max_pending = 2
+        subscriber = channel.subscribe()
+        for n in range(3):
+            self.bus.publish(1, "status-changed", {"n": n})
+        self.assertTrue(subscriber.overflowed)
+        self.assertEqual(subscriber.drain(), [])
+
+    async def test_idle_channels_are_pruned(self):
+        channel = self.bus.channel(1)
+        subscriber = channel.subscribe()
+        self.bus.idle_seconds = 0
+        self.bus.prune()
+        self.assertIsNotNone(self.bus.get(1))
+        channel.unsubscribe(subscriber)
+        self.bus.channel(2)
+        self.assertIsNone(self.bus.get(1))
+
+    async def test_thread_changes_become_typed_events(self):
+        async def snapshot(thread_id):
+            return {"id": thread_id, "completedAt": "2026-01-01 00:00:00"}
+
+        self.bus.snapshot = snapshot
+        channel = self.bus.channel(1)
+        subscriber = channel.subscribe()
+        self.bus.publish_changes(1, {"streamingMessage": {"role": "assistant", "content": "a"}, "updatedAt": 1})
+        self.bus.publish_changes(1, {"streamingMessage": None}, appended=[{"role": "assistant", "_sequence": 4}])
+        self.bus.publish_changes(1, {"status": "Thinking", "updatedAt": 1})
+        self.bus.publish_changes(1, {"updatedAt": 1})
+        self.bus.publish_changes(1, {"completedAt": 1, "status": None})
+        await channel.publishing
+        self.assertIsNone(channel.publishing)
+        events = [parse(payload) for _, payload in subscriber.drain()]
+        self.assertEqual(
+            [name for name, _ in events],
+            ["streaming-chunk", "streaming-chunk", "message-appended", "status-changed", "completed"],
+        )
+        self.assertEqual(events[0][1]["message"], {"role": "assistant", "content": "a", "streaming": True})
+        self.assertIsNone(events[1][1]["message"])
+        self.assertEqual(events[2][1]["messages"][0]["_sequence"], 4)
+        self.assertEqual(events[3][1], {"status": "Thinking"})
+
+    async def test_snapshots_are_read_off_the_loop_and_keep_events_in_order(self):
+        read = asyncio.Event()
+
+        async def snapshot(thread_id):
+            await read.wait()
+            return {"id": thread_id, "messages": []}
+
+        self.bus.snapshot = snapshot
+        channel = self.bus.channel(1)
+        subscriber = channel.subscribe()
+        self.bus.publish_changes(1, {"messages": []}, rewritten=True)
+        self.bus.publish_changes(1, {"status": "Thinking"})
+        # publishing doesn't wait for the read, and what follows it waits its turn
+        self.assertEqual(subscriber.drain(), [])
+        read.set()
+        await channel.publishing
+        self.assertEqual([name for name, _ in subscriber.drain()], ["thread", "status-changed"])
+        self.bus.publish_changes(1, {"status": None})
+        self.assertEqual([name for name, _ in subscriber.drain()], ["status-changed"])
+
+    def test_format_sse_splits_multiline_data(self):
+        payload = format_sse("thread", {"a": 1}, "e-1", retry_ms=5000)
+        self.assertEqual(payload, b'retry: 5000\nid: e-1\nevent: thread\ndata: {"a":1}\n\n')
+
+
+if __name__ == "__main__":
+    unittest.main()
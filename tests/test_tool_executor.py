@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Unit tests for ToolExecutor, which runs synchronous tools on a thread pool so they don't
+block the event loop, within the concurrency limit and timeout they were registered with.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from llms.main import ToolExecutor
+
+
+class TestToolExecutor(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.executor = ToolExecutor()
+
+    async def asyncTearDown(self):
+        await self.executor.close()
+
+    async def test_sync_tools_run_off_the_event_loop(self):
+        def slow_tool(seconds):
+            time.sleep(seconds)
+            return threading.get_ident()
+
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        try:
+            thread_id = await self.executor.run("slow_tool", slow_tool, {"seconds": 0.2})
+        finally:
+            task.cancel()
+        self.assertNotEqual(thread_id, threading.get_ident())
+        # the loop kept running while the tool slept
+        self.assertGreater(ticks, 5)
+
+        async def async_tool(value):
+            return value * 2
+
+        self.assertEqual(await self.executor.run("async_tool", async_tool, {"value": 21}), 42)
+        self.assertEqual(self.executor.stats()["slow_tool"]["calls"], 1)
+
+    async def test_concurrency_limits_and_timeouts(self):
+        running = peak = 0
+        lock = threading.Lock()
+
+        def limited_tool():
+            nonlocal running, peak
+            with lock:
+                running += 1
+                peak = max(peak, running)
+            time.sleep(0.05)
+            with lock:
+                running -= 1
+
+        await asyncio.gather(*[
+            self.executor.run("limited_tool", limited_tool, {}, {"concurrency": 2}) for _ in range(6)
+        ])
+        self.assertEqual(peak, 2)
+
+        def stuck_tool(seconds):
+            time.sleep(seconds)
+
+        with self.assertRaises(TimeoutError):
+            await self.executor.run("stuck_tool", stuck_tool, {"seconds": 0.3}, {"timeout": 0.05})
+        stats = self.executor.stats()
+        self.assertEqual((stats["limited_tool"]["calls"], stats["limited_tool"]["errors"]), (6, 0))
+        self.assertEqual((stats["stuck_tool"]["calls"], stats["stuck_tool"]["timeouts"]), (1, 1))
+
+    async def test_a_tools_own_timeout_is_an_error(self):
+        def socket_tool():
+            raise TimeoutError("timed out reading from the socket")
+
+        async def async_socket_tool():
+            raise TimeoutError("timed out connecting")
+
+        for options in (None, {"timeout": 5}):
+            with self.assertRaisesRegex(TimeoutError, "from the socket"):
+                await self.executor.run("socket_tool", socket_tool, {}, options)
+            with self.assertRaisesRegex(TimeoutError, "connecting"):
+                await self.executor.run("async_socket_tool", async_socket_tool, {}, options)
+        stats = self.executor.stats()
+        self.assertEqual((stats["socket_tool"]["errors"], stats["socket_tool"]["timeouts"]), (2, 0))
+        self.assertEqual((stats["async_socket_tool"]["errors"], stats["async_socket_tool"]["timeouts"]), (2, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
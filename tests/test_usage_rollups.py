@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the request_usage rollup the analytics summaries read and the per-thread
+totals, which triggers keep in step with the request table.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from llms.extensions.app.db import AppDB
+
+
+class MockCtx:
+    debug = False
+
+    def cache_message_inline_data(self, msg, context=None):
+        pass
+
+    def dbg(self, msg):
+        pass
+
+    def err(self, msg, e=None):
+        raise AssertionError(f"{msg}: {e}")
+
+
+class TestUsageRollups(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.db = AppDB(MockCtx(), os.path.join(self.tmp, "app.sqlite"))
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def insert(self, created_at, user="alice", model="m1", provider="p1", cost=1.0, tokens=(10, 5), duration=100,
+               thread_id=None):
+        return self.db.db.run(lambda conn: conn.execute(
+            """INSERT INTO request (user, createdAt, model, provider, cost, inputTokens, outputTokens, duration, threadId)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (user, created_at, model, provider, cost, tokens[0], tokens[1], duration, thread_id),
+        ).lastrowid)
+
+    async def test_summaries_follow_inserts_updates_and_deletes(self):
+        first = self.insert("2026-01-31 10:00:00")
+        self.insert("2026-01-31 11:00:00", model="m2", provider=None, cost=2.0)
+        self.insert("2026-02-01 09:00:00")
+        self.insert("2026-02-01 09:30:00", user=None)
+        await self.db.create_request_async({"model": "m1", "provider": "p1", "cost": 0.5}, user="bob")
+
+        self.assertEqual(
+            [(r["date"], r["requests"], r["cost"]) for r in self.db.get_request_summary(user="alice")],
+            [("2026-01-31", 2, 3.0), ("2026-02-01", 1, 1.0)],
+        )
+        daily = self.db.get_daily_request_summary("2026-01-31", user="alice")
+        self.assertEqual(sorted(daily["modelData"]), ["m1", "m2"])
+        self.assertEqual(daily["modelData"]["m1"]["tokens"], 15)
+        self.assertEqual(list(daily["providerData"]), ["p1"])
+        self.assertEqual(self.db.get_users_list(), ["Anonymous", "alice", "bob"])
+
+        self.db.db.run(lambda conn: conn.execute("UPDATE request SET model='m2', cost=4 WHERE id=?", (first,)))
+        self.db.db.run(lambda conn: conn.execute("DELETE FROM request WHERE user IS NULL"))
+        daily = self.db.get_daily_request_summary("2026-01-31", user="alice")
+        self.assertEqual(list(daily["modelData"]), ["m2"])
+        self.assertEqual((daily["modelData"]["m2"]["count"], daily["modelData"]["m2"]["cost"]), (2, 6.0))
+        users = {u["user"]: u for u in self.db.get_users_summary()}
+        self.assertEqual(sorted(users), ["alice", "bob"])
+        self.assertEqual((users["alice"]["requests"], users["alice"]["lastActive"]), (3, "2026-02-01 09:00:00"))
+
+        # the rollup matches one recomputed from scratch
+        before = self.db.db.all("SELECT * FROM request_usage ORDER BY user, day, model, provider")
+        self.db.rebuild_usage()
+        self.assertEqual(self.db.db.all("SELECT * FROM request_usage ORDER BY user, day, model, provider"), before)
+
+    def test_month_filter_is_a_created_at_range(self):
+        self.insert("2025-12-31 23:59:59")
+        self.insert("2026-12-01 00:00:00")
+        self.insert("2026-12-31 23:59:59")
+        self.insert("2027-01-01 00:00:00")
+        rows = self.db.query_requests({"month": "2026-12"}, user="alice")
+        self.assertEqual(len(rows), 2)
+        plan = " ".join(str(r) for r in self.db.db.all(
+            "EXPLAIN QUERY PLAN SELECT * FROM request WHERE user = 'alice' AND createdAt >= '2026-12-01' AND createdAt < '2027-01-01'"
+        ))
+        self.assertIn("idx_request_user_createdat", plan)
+
+    async def test_thread_totals_add_up_its_requests(self):
+        thread_id = await self.db.create_thread_async({"title": "t", "messages": []}, user="alice")
+        await self.db.create_request_async({"threadId": thread_id, "cost": 0.5, "inputTokens": 10,
+                                            "outputTokens": 4, "duration": 2}, user="alice")
+        second = self.insert("2026-01-31 10:00:00", cost=0.25, tokens=(6, 1), duration=3, thread_id=thread_id)
+        self.insert("2026-01-31 10:00:00", cost=9)
+
+        def totals():
+            row = self.db.to_dto(self.db.get_thread(thread_id, user="alice"), ["stats"])
+            return (row["cost"], row["inputTokens"], row["outputTokens"], row["stats"])
+
+        self.assertEqual(totals(), (0.75, 16, 5, {"cost": 0.75, "inputTokens": 16, "outputTokens": 5,
+                                                  "requests": 2, "duration": 5}))
+        self.db.db.run(lambda conn: conn.execute("DELETE FROM request WHERE id=?", (second,)))
+        self.assertEqual(totals()[:3], (0.5, 10, 4))
+        await self.db.merge_thread_stats_async(thread_id, {"type": "request"})
+        self.assertEqual(totals()[3], {"cost": 0.5, "inputTokens": 10, "outputTokens": 4, "requests": 1,
+                                       "duration": 2, "type": "request"})
+
+        # a thread whose totals drifted is repaired from its requests
+        self.db.db.run(lambda conn: conn.execute("UPDATE thread SET cost=42, stats=NULL WHERE id=?", (thread_id,)))
+        self.assertEqual(self.db.rebuild_thread_totals(), 1)
+        self.assertEqual(totals(), (0.5, 10, 4, {"cost": 0.5, "inputTokens": 10, "outputTokens": 4,
+                                                 "requests": 1, "duration": 2}))
+
+
+if __name__ == "__main__":
+    unittest.main()